@@ -27,11 +27,13 @@ django_asgi_app = get_asgi_application()
 def get_websocket_urlpatterns():
     from chat.routing import websocket_urlpatterns as chat_websocket_urlpatterns
     from ai_assistant.routing import websocket_urlpatterns as ai_websocket_urlpatterns
+    from music.routing import websocket_urlpatterns as music_websocket_urlpatterns
     
     # Kết hợp tất cả các websocket patterns
     all_patterns = []
     all_patterns.extend(chat_websocket_urlpatterns)
     all_patterns.extend(ai_websocket_urlpatterns)
+    all_patterns.extend(music_websocket_urlpatterns)
     
     return all_patterns
 
@@ -204,6 +204,23 @@ else:
         },
     }
 
+# Cache dùng chung cho mọi tiến trình (gunicorn chạy nhiều worker): cờ trang chủ, khóa dựng lại,
+# ảnh chụp thư viện, ... phải thấy được từ mọi worker. LocMemCache chỉ dùng khi phát triển
+# (`manage.py check --deploy` báo lỗi music.E001 nếu dùng cache riêng từng tiến trình).
+if DEBUG:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ.get('CACHE_REDIS_URL', 'redis://:Chuongle.2003@127.0.0.1:6379/1'),
+        },
+    }
+
 
 # Cấu hình REST Framework
 REST_FRAMEWORK = {
@@ -269,6 +286,114 @@ if DEBUG:
 else:
     SITE_URL = os.environ.get('SITE_URL', 'https://spotifybackend.shop')
 
+# Cấu hình URL media: để trống MEDIA_CDN_URL thì dùng MEDIA_URL của server
+MEDIA_CDN_URL = os.environ.get('MEDIA_CDN_URL', '')
+# Khóa ký HMAC cho URL CDN (chỉ dùng khi có MEDIA_CDN_URL)
+MEDIA_URL_SIGNING_KEY = os.environ.get('MEDIA_URL_SIGNING_KEY', '')
+MEDIA_URL_SIGNATURE_TTL = int(os.environ.get('MEDIA_URL_SIGNATURE_TTL', 3600))
+
+# Trang chủ biên dịch sẵn: thời gian (giây) trước khi dựng lại ở nền và max-age cho client
+HOMEPAGE_REFRESH_INTERVAL = int(os.environ.get('HOMEPAGE_REFRESH_INTERVAL', 300))
+HOMEPAGE_CLIENT_MAX_AGE = int(os.environ.get('HOMEPAGE_CLIENT_MAX_AGE', 60))
+HOMEPAGE_BACKGROUND_REBUILD = True
+
+# Lưu snapshot danh sách bài hát của playlist sau mỗi N phiên bản chỉnh sửa
+PLAYLIST_SNAPSHOT_INTERVAL = int(os.environ.get('PLAYLIST_SNAPSHOT_INTERVAL', 50))
+
+# Pool xử lý nền của app music (ingest, chuyển mã, ...)
+MUSIC_WORKER_PROCESSES = int(os.environ.get('MUSIC_WORKER_PROCESSES', os.cpu_count() or 2))
+MUSIC_WORKER_THREADS = int(os.environ.get('MUSIC_WORKER_THREADS', 4))
+# True: chạy tác vụ ngay trong request (dùng cho test/debug)
+MUSIC_TASKS_EAGER = env.bool('MUSIC_TASKS_EAGER', default=False)
+
+# Các bản chuyển mã tạo cho mỗi bài hát: (tên chất lượng, codec, bitrate kbps)
+MUSIC_RENDITION_LADDER = [
+    ('low', 'mp3', 64),
+    ('medium', 'mp3', 128),
+    ('high', 'mp3', 256),
+    ('opus_96', 'opus', 96),
+    ('aac_128', 'aac', 128),
+]
+
+# Phát theo đoạn (HLS/DASH): các mức bitrate AAC (kbps) và độ dài mỗi đoạn (giây)
+MUSIC_STREAM_VARIANTS = [64, 128, 256]
+MUSIC_SEGMENT_DURATION = int(os.environ.get('MUSIC_SEGMENT_DURATION', 6))
+
+# Waveform tính sẵn: tần số lấy mẫu khi giải mã và số điểm của từng mức độ phân giải
+WAVEFORM_SAMPLE_RATE = 8000
+WAVEFORM_LEVELS = [2048, 512, 128]
+
+# Chuẩn hóa độ to phía client: độ to mục tiêu (LUFS) và ngưỡng true peak (dBTP) khi tính replay_gain
+LOUDNESS_TARGET_LUFS = float(os.environ.get('LOUDNESS_TARGET_LUFS', -14.0))
+LOUDNESS_TRUE_PEAK_CEILING = -1.0
+
+# Ảnh thu nhỏ cho ảnh bìa/ảnh đại diện: kích thước cạnh dài (px), định dạng (bỏ qua nếu Pillow không hỗ trợ) và chất lượng
+IMAGE_THUMBNAIL_SIZES = [64, 256, 640]
+IMAGE_THUMBNAIL_FORMATS = ['webp', 'avif']
+IMAGE_THUMBNAIL_QUALITY = 80
+
+# Hàng đợi tải xuống offline: số job chạy đồng thời (toàn hệ thống / mỗi người dùng),
+# số lần thử tối đa, thời gian chờ trước lần thử lại đầu tiên (giây, tăng gấp đôi mỗi lần) và kích thước mỗi khối sao chép
+OFFLINE_DOWNLOAD_CONCURRENCY = int(os.environ.get('OFFLINE_DOWNLOAD_CONCURRENCY', 2))
+OFFLINE_DOWNLOAD_PER_USER = 1
+OFFLINE_DOWNLOAD_MAX_ATTEMPTS = 3
+OFFLINE_DOWNLOAD_RETRY_DELAY = 30
+OFFLINE_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Số bài hát giữ trong top_song_ids của album/nghệ sĩ/thể loại
+CATALOG_TOP_SONGS = 10
+
+# Thời gian giữ số bình luận của mỗi bài hát trong cache (giây)
+COMMENT_COUNT_CACHE_TIMEOUT = 3600
+
+# Trung bình Bayes của đánh giá: số lượt đánh giá "ảo" kéo điểm về trung bình chung
+RATING_PRIOR_WEIGHT = 5
+# Thời gian giữ điểm trung bình chung của mọi bài hát trong cache (giây)
+RATING_PRIOR_CACHE_TIMEOUT = 600
+
+# Thời gian giữ tài liệu lời đồng bộ của mỗi bài hát trong cache (giây)
+LYRICS_CACHE_TIMEOUT = 3600
+
+# Tìm theo lời (music.lyrics_search): mục xuất hiện nhiều hơn LYRICS_TERM_MAX_DF lần bị bỏ qua
+# như từ dừng, số dòng ứng viên tối đa đọc từ chỉ mục và thời gian cache số lần xuất hiện (giây)
+LYRICS_TERM_MAX_DF = 20000
+LYRICS_SEARCH_MAX_CANDIDATES = 2000
+LYRICS_DF_CACHE_TIMEOUT = 3600
+
+# Chỉ mục gợi ý khi gõ (music.suggest) được dựng lại toàn bộ ở nền sau khoảng này (giây)
+SUGGEST_REBUILD_INTERVAL = 3600
+SUGGEST_BACKGROUND_REBUILD = True
+# Thời gian tối đa lần tra cứu đầu tiên của tiến trình chờ chỉ mục được dựng (giây)
+SUGGEST_COLD_WAIT = 5
+
+# Tìm kiếm tổng hợp (music.search): số kết quả mặc định mỗi mục, ngưỡng đếm số kết quả,
+# thời gian chờ tối đa các mục chạy song song (giây) và thời gian cache kết quả (giây)
+SEARCH_SECTION_LIMIT = 10
+SEARCH_COUNT_CAP = 1000
+SEARCH_TIMEOUT = 5
+# Số luồng của pool riêng cho tìm kiếm tổng hợp (mặc định bằng số mục)
+SEARCH_THREADS = 5
+SEARCH_RESULTS_CACHE_TIMEOUT = 120
+
+# Lịch sử tìm kiếm (music.search_log): ghi theo lô khi đủ số bản ghi hoặc sau khoảng thời gian (giây)
+SEARCH_LOG_BATCH_SIZE = 50
+SEARCH_LOG_FLUSH_INTERVAL = 5
+# Số bản ghi tối đa giữ trong bộ đệm khi ghi lỗi (ghi lại ở lần sau), vượt quá thì bỏ bản ghi cũ nhất
+SEARCH_LOG_MAX_BUFFER = 5000
+# Bỏ qua lượt tìm trùng với lượt ngay trước đó của cùng người dùng trong khoảng này (giây)
+SEARCH_LOG_DEDUPE_SECONDS = 300
+# Số ngày giữ lịch sử tìm kiếm và thống kê từ khóa (lệnh prune_search_history)
+SEARCH_HISTORY_RETENTION_DAYS = 180
+SEARCH_STATS_RETENTION_DAYS = 365
+
+# Thư viện người dùng (music.library): số mục mỗi trang, số bài nghe gần đây và thời gian
+# giữ ảnh chụp trong cache (giây)
+LIBRARY_PAGE_SIZE = 50
+LIBRARY_RECENT_LIMIT = 10
+LIBRARY_CACHE_TIMEOUT = 86400
+# Số ngày giữ nhật ký thay đổi thư viện; client có phiên bản cũ hơn phải tải lại toàn bộ
+LIBRARY_CHANGE_RETENTION_DAYS = 30
+
 # Cấu hình Swagger
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Spotify Chat API',
@@ -59,6 +59,8 @@ mkdir -p $APP_DIR/media $APP_DIR/static $APP_DIR/logs
 
 # 7. Migrate & Collect Static
 echo "⚙️ Migrate và collectstatic..."
+# Dừng nếu cấu hình chưa phù hợp để chạy nhiều worker (ví dụ cache không dùng chung)
+python manage.py check --deploy --fail-level ERROR
 python manage.py migrate
 python manage.py collectstatic --noinput
 
@@ -7,3 +7,4 @@ class MusicConfig(AppConfig):
     
     def ready(self):
         import music.signals  # Đăng ký signals khi app khởi động
+        import music.checks  # Kiểm tra cấu hình (cache dùng chung)
@@ -0,0 +1,408 @@
+"""
+Phân tích âm thanh: waveform và độ to (loudness).
+
+ffmpeg giải mã file một lần duy nhất; luồng âm thanh được tách đôi:
+- một nhánh qua bộ lọc ebur128 (EBU R128) để đo integrated loudness, loudness
+  range và true peak (tổng kết in ra stderr khi kết thúc);
+- một nhánh chuyển thành PCM mono 16-bit ghi ra pipe, được đọc theo từng khối
+  và gộp thành thống kê (peak, tổng bình phương) cho mỗi khung ngắn (mặc định
+  10ms), nên bộ nhớ không phụ thuộc độ dài bài hát. Sau khi giải mã xong, các
+  khung được gộp thành nhiều mức độ phân giải (WAVEFORM_LEVELS).
+
+Độ to được lưu trên Song cùng mức gain kiểu ReplayGain để client tự áp dụng khi
+phát, không mã hóa lại file. Dùng NumPy nếu có; nếu không, dùng vòng lặp Python
+thuần (chậm hơn nhiều).
+"""
+import math
+import re
+import subprocess
+import sys
+import threading
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Song, SongWaveform
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+DEFAULT_SAMPLE_RATE = 8000
+DEFAULT_LEVELS = (2048, 512, 128)
+# Độ dài mỗi khung thống kê (giây)
+FRAME_SECONDS = 0.01
+# Kích thước khối đọc từ pipe (byte, số chẵn vì mỗi mẫu 2 byte)
+READ_SIZE = 1 << 16
+
+# framelog=verbose: không in từng khung ở mức log mặc định, chỉ in phần tổng kết
+LOUDNESS_FILTER = 'ebur128=peak=true:framelog=verbose'
+DEFAULT_LOUDNESS_TARGET = -14.0
+DEFAULT_TRUE_PEAK_CEILING = -1.0
+# Dưới ngưỡng gating tuyệt đối của R128 coi như im lặng
+SILENCE_LUFS = -70.0
+
+
+def waveform_sample_rate():
+    return getattr(settings, 'WAVEFORM_SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+
+
+def waveform_levels():
+    return sorted(getattr(settings, 'WAVEFORM_LEVELS', DEFAULT_LEVELS), reverse=True)
+
+
+def _parse_db(value):
+    return None if value.endswith('inf') else float(value)
+
+
+def parse_loudness_summary(stderr):
+    """Đọc phần tổng kết của bộ lọc ebur128 từ stderr của ffmpeg"""
+    summary = stderr[stderr.rfind('Summary:'):] if 'Summary:' in stderr else ''
+    integrated = re.search(r'I:\s+(-?[\d.]+|-?inf) LUFS', summary)
+    if not integrated:
+        raise RuntimeError('Không đọc được kết quả ebur128')
+    lra = re.search(r'LRA:\s+(-?[\d.]+) LU', summary)
+    peak = re.search(r'Peak:\s+(-?[\d.]+|-?inf) dBFS', summary)
+    return {
+        'integrated_lufs': _parse_db(integrated.group(1)),
+        'loudness_range': float(lra.group(1)) if lra else None,
+        'true_peak_db': _parse_db(peak.group(1)) if peak else None,
+    }
+
+
+class PCMDecoder:
+    """
+    Giải mã file thành PCM s16le mono qua pipe (lặp để nhận từng khối byte).
+
+    Với measure_loudness=True, cùng lần giải mã đó đo độ to bằng ebur128; kết
+    quả có trong `loudness` sau khi đã đọc hết dữ liệu.
+    """
+
+    def __init__(self, file_path, sample_rate, measure_loudness=False):
+        self.file_path = file_path
+        self.sample_rate = sample_rate
+        self.measure_loudness = measure_loudness
+        self.loudness = None
+
+    def _command(self):
+        cmd = ['ffmpeg', '-hide_banner', '-nostdin', '-i', self.file_path, '-vn']
+        pcm_args = ['-ac', '1', '-ar', str(self.sample_rate), '-f', 's16le', 'pipe:1']
+        if not self.measure_loudness:
+            return cmd + ['-v', 'error'] + pcm_args
+        return cmd + [
+            '-filter_complex', f'[0:a:0]asplit=2[pcm][meter];[meter]{LOUDNESS_FILTER},anullsink',
+            '-map', '[pcm]',
+        ] + pcm_args
+
+    def __iter__(self):
+        process = subprocess.Popen(self._command(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Đọc stderr song song để ffmpeg không bị chặn khi bộ đệm stderr đầy
+        stderr_chunks = []
+        reader = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+        reader.start()
+        try:
+            while True:
+                chunk = process.stdout.read(READ_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            returncode = process.wait()
+            reader.join()
+            stderr = b''.join(stderr_chunks).decode(errors='replace')
+            if returncode != 0:
+                raise RuntimeError(f"ffmpeg lỗi: {stderr.strip()[-500:]}")
+            if self.measure_loudness:
+                self.loudness = parse_loudness_summary(stderr)
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+
+def decode_pcm(file_path, sample_rate):
+    """Giải mã file thành PCM s16le mono qua pipe, trả về từng khối byte"""
+    return iter(PCMDecoder(file_path, sample_rate))
+
+
+def measure_loudness(file_path):
+    """Chỉ đo độ to (không xuất PCM)"""
+    cmd = [
+        'ffmpeg', '-hide_banner', '-nostdin', '-i', file_path,
+        '-vn', '-af', LOUDNESS_FILTER, '-f', 'null', '-'
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg lỗi: {result.stderr.strip()[-500:]}")
+    return parse_loudness_summary(result.stderr)
+
+
+def compute_replay_gain(integrated_lufs, true_peak_db, target=None, ceiling=None):
+    """
+    Gain (dB) đưa bài hát về độ to mục tiêu, giới hạn để true peak sau khi
+    tăng gain không vượt ngưỡng (tránh méo). None nếu bài hát im lặng.
+    """
+    if integrated_lufs is None or integrated_lufs <= SILENCE_LUFS:
+        return None
+    if target is None:
+        target = getattr(settings, 'LOUDNESS_TARGET_LUFS', DEFAULT_LOUDNESS_TARGET)
+    if ceiling is None:
+        ceiling = getattr(settings, 'LOUDNESS_TRUE_PEAK_CEILING', DEFAULT_TRUE_PEAK_CEILING)
+    gain = target - integrated_lufs
+    if true_peak_db is not None:
+        gain = min(gain, ceiling - true_peak_db)
+    return round(gain, 2)
+
+
+def save_loudness(song, loudness):
+    """Lưu kết quả đo độ to và gain lên bài hát"""
+    fields = {
+        'integrated_loudness': loudness['integrated_lufs'],
+        'true_peak': loudness['true_peak_db'],
+        'loudness_range': loudness['loudness_range'],
+        'replay_gain': compute_replay_gain(loudness['integrated_lufs'], loudness['true_peak_db']),
+        'loudness_analyzed_at': timezone.now(),
+    }
+    Song.objects.filter(id=song.id).update(**fields)
+    for field, value in fields.items():
+        setattr(song, field, value)
+    return fields
+
+
+class FrameAccumulator:
+    """Gộp PCM thành thống kê theo khung: peak, tổng bình phương, số mẫu"""
+
+    def __init__(self, frame_size):
+        self.frame_size = frame_size
+        self.peaks = []
+        self.sumsq = []
+        self.counts = []
+        self.total_samples = 0
+        self._pending = b''
+
+    def feed(self, chunk):
+        data = self._pending + chunk
+        usable = len(data) - len(data) % (self.frame_size * 2)
+        self._pending = data[usable:]
+        if usable:
+            self._add(data[:usable])
+
+    def finish(self):
+        # Khung cuối có thể ngắn hơn frame_size
+        usable = len(self._pending) - len(self._pending) % 2
+        if usable:
+            self._add(self._pending[:usable])
+        self._pending = b''
+        return self
+
+    def _add(self, data):
+        if NUMPY_AVAILABLE:
+            samples = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768.0
+            self.total_samples += len(samples)
+            full = len(samples) - len(samples) % self.frame_size
+            if full:
+                frames = samples[:full].reshape(-1, self.frame_size)
+                self.peaks.extend(np.abs(frames).max(axis=1).tolist())
+                self.sumsq.extend(np.square(frames, dtype=np.float64).sum(axis=1).tolist())
+                self.counts.extend([self.frame_size] * frames.shape[0])
+            if full < len(samples):
+                rest = samples[full:]
+                self.peaks.append(float(np.abs(rest).max()))
+                self.sumsq.append(float(np.square(rest, dtype=np.float64).sum()))
+                self.counts.append(len(rest))
+            return
+
+        samples = array('h')
+        samples.frombytes(data)
+        if sys.byteorder == 'big':
+            samples.byteswap()
+        self.total_samples += len(samples)
+        for start in range(0, len(samples), self.frame_size):
+            frame = samples[start:start + self.frame_size]
+            peak = 0
+            sumsq = 0
+            for value in frame:
+                if abs(value) > peak:
+                    peak = abs(value)
+                sumsq += value * value
+            self.peaks.append(peak / 32768.0)
+            self.sumsq.append(sumsq / (32768.0 * 32768.0))
+            self.counts.append(len(frame))
+
+
+def reduce_frames(peaks, sumsq, counts, points):
+    """Gộp các khung thành `points` đoạn đều nhau: (peaks, rms), giá trị 0-1"""
+    frames = len(peaks)
+    points = min(points, frames)
+    if points == 0:
+        return [], []
+
+    if NUMPY_AVAILABLE:
+        edges = np.linspace(0, frames, points + 1).astype(np.int64)[:-1]
+        bucket_peaks = np.maximum.reduceat(np.asarray(peaks), edges)
+        bucket_sumsq = np.add.reduceat(np.asarray(sumsq), edges)
+        bucket_counts = np.add.reduceat(np.asarray(counts), edges)
+        bucket_rms = np.sqrt(bucket_sumsq / np.maximum(bucket_counts, 1))
+        return np.clip(bucket_peaks, 0, 1).tolist(), np.clip(bucket_rms, 0, 1).tolist()
+
+    bucket_peaks = []
+    bucket_rms = []
+    for index in range(points):
+        start = index * frames // points
+        end = (index + 1) * frames // points
+        bucket_peaks.append(min(max(peaks[start:end]), 1.0))
+        count = sum(counts[start:end]) or 1
+        bucket_rms.append(min(math.sqrt(sum(sumsq[start:end]) / count), 1.0))
+    return bucket_peaks, bucket_rms
+
+
+def quantize(values):
+    """Giá trị 0-1 -> byte 0-255"""
+    return bytes(min(255, max(0, int(round(value * 255)))) for value in values)
+
+
+def analyze_waveform(chunks, sample_rate, levels):
+    """Tính waveform nhiều mức từ các khối PCM s16le"""
+    accumulator = FrameAccumulator(max(1, int(sample_rate * FRAME_SECONDS)))
+    for chunk in chunks:
+        accumulator.feed(chunk)
+    accumulator.finish()
+
+    stored_levels = []
+    peaks_blob = b''
+    rms_blob = b''
+    for points in levels:
+        peaks, rms = reduce_frames(accumulator.peaks, accumulator.sumsq, accumulator.counts, points)
+        if not peaks or len(peaks) in stored_levels:
+            continue
+        stored_levels.append(len(peaks))
+        peaks_blob += quantize(peaks)
+        rms_blob += quantize(rms)
+
+    return {
+        'sample_rate': sample_rate,
+        'duration': accumulator.total_samples / sample_rate,
+        'levels': stored_levels,
+        'peaks': peaks_blob,
+        'rms': rms_blob,
+        'max_peak': max(accumulator.peaks) if accumulator.peaks else 0.0,
+    }
+
+
+def analyze_waveform_task(file_path, sample_rate=None, levels=None):
+    """Giải mã và phân tích waveform một file (chạy trên pool tiến trình)"""
+    sample_rate = sample_rate or waveform_sample_rate()
+    levels = levels or waveform_levels()
+    result = analyze_waveform(decode_pcm(file_path, sample_rate), sample_rate, levels)
+    if not result['levels']:
+        raise RuntimeError('File không có dữ liệu âm thanh')
+    return result
+
+
+def analyze_audio_task(file_path, waveform=True, loudness=True):
+    """
+    Phân tích waveform và/hoặc độ to trong một lần giải mã (chạy trên pool tiến trình).
+
+    Trả về {'waveform': ... hoặc None, 'loudness': ... hoặc None}.
+    """
+    if not waveform:
+        return {'waveform': None, 'loudness': measure_loudness(file_path) if loudness else None}
+    sample_rate = waveform_sample_rate()
+    decoder = PCMDecoder(file_path, sample_rate, measure_loudness=loudness)
+    result = analyze_waveform(decoder, sample_rate, waveform_levels())
+    if not result['levels']:
+        raise RuntimeError('File không có dữ liệu âm thanh')
+    return {'waveform': result, 'loudness': decoder.loudness}
+
+
+def save_analysis(song, result):
+    """Lưu kết quả của analyze_audio_task"""
+    saved = {}
+    if result.get('waveform'):
+        waveform = save_waveform(song, result['waveform'])
+        saved['waveform'] = {'levels': waveform.levels, 'duration': round(waveform.duration, 3)}
+    if result.get('loudness'):
+        saved['loudness'] = save_loudness(song, result['loudness'])
+        saved['loudness'].pop('loudness_analyzed_at')
+    return saved
+
+
+def waveform_cache_key(song_id):
+    return f'music:waveform:{song_id}'
+
+
+def save_waveform(song, result):
+    """Lưu kết quả phân tích vào SongWaveform và xóa bản cache cũ"""
+    waveform, _ = SongWaveform.objects.update_or_create(
+        song=song,
+        defaults={
+            'sample_rate': result['sample_rate'],
+            'duration': result['duration'],
+            'levels': result['levels'],
+            'peaks': result['peaks'],
+            'rms': result['rms'],
+            'max_peak': result['max_peak'],
+        }
+    )
+    cache.delete(waveform_cache_key(song.id))
+    return waveform
+
+
+def get_waveform_document(song_id):
+    """
+    Waveform của bài hát (mọi mức, dạng byte) từ cache, nạp từ DB nếu chưa có.
+
+    Trả về None nếu bài hát chưa được phân tích.
+    """
+    key = waveform_cache_key(song_id)
+    document = cache.get(key)
+    if document is None:
+        waveform = SongWaveform.objects.filter(song_id=song_id).first()
+        if waveform is None:
+            return None
+        document = {
+            'duration': waveform.duration,
+            'levels': waveform.levels,
+            'peaks': bytes(waveform.peaks),
+            'rms': bytes(waveform.rms),
+            'max_peak': waveform.max_peak,
+            'etag': f'{song_id}-{int(waveform.computed_at.timestamp())}',
+        }
+        cache.set(key, document, getattr(settings, 'WAVEFORM_CACHE_TIMEOUT', 86400))
+    return document
+
+
+def waveform_payload(document, points):
+    """Dữ liệu trả về cho client: dùng mức đã lưu gần nhất rồi giảm xuống `points` điểm"""
+    levels = document['levels']
+    candidates = [level for level in levels if level >= points]
+    level = min(candidates) if candidates else max(levels)
+    offset = sum(levels[:levels.index(level)])
+    peaks = [value / 255 for value in document['peaks'][offset:offset + level]]
+    rms = [value / 255 for value in document['rms'][offset:offset + level]]
+    peaks, rms = downsample(peaks, rms, points)
+    return {
+        'duration': round(document['duration'], 3),
+        'points': len(peaks),
+        'max_peak': round(document['max_peak'], 4),
+        'peaks': [round(value, 3) for value in peaks],
+        'rms': [round(value, 3) for value in rms],
+    }
+
+
+def downsample(peaks, rms, points):
+    """Giảm số điểm của một mức đã lưu (peak lấy max, RMS lấy căn trung bình bình phương)"""
+    if points >= len(peaks):
+        return peaks, rms
+    out_peaks = []
+    out_rms = []
+    total = len(peaks)
+    for index in range(points):
+        start = index * total // points
+        end = (index + 1) * total // points
+        out_peaks.append(max(peaks[start:end]))
+        out_rms.append(math.sqrt(sum(value * value for value in rms[start:end]) / (end - start)))
+    return out_peaks, out_rms
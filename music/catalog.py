@@ -0,0 +1,415 @@
+"""
+Quan hệ khóa ngoại giữa Song và Album, Artist, Genre.
+
+Các chuỗi Song.artist/album/genre vẫn là dữ liệu nhập và vẫn được trả về
+trong API như cũ; album_ref, genre_ref và artists được suy ra từ chúng:
+
+- Khi lưu bài hát (signal post_save) quan hệ được cập nhật nếu chuỗi đổi; khi
+  tạo album/nghệ sĩ/thể loại mới, các bài hát mang đúng tên đó được nối vào.
+- Dữ liệu cũ được điền bằng lệnh backfill_catalog_relations: xử lý theo lô
+  khóa chính, mỗi lô một transaction ngắn, nên chạy được khi server đang phục vụ.
+- Album, nghệ sĩ, thể loại giữ số liệu tổng hợp (CatalogCounters: số bài hát,
+  tổng lượt nghe, lượt thích, top bài hát). Số liệu được cộng dồn khi quan hệ
+  đổi (link_songs), khi phát (record_play), khi thích (record_like) và khi xóa
+  bài hát; lệnh reconcile_catalog_stats tính lại từ đầu để sửa sai lệch.
+
+So khớp tên giữ đúng ngữ nghĩa các phép nối chuỗi cũ (so sánh chính xác).
+"""
+import re
+from collections import defaultdict
+from datetime import date
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Album, Artist, Genre, Song, SongArtist
+
+# "A feat. B", "A ft. B", "A, B", "A; B" -> [A, B]; không tách "&" vì hay là tên ban nhạc
+_ARTIST_SEPARATOR_RE = re.compile(r'\s*(?:[,;]|\s(?:feat|ft|featuring)\.?\s)\s*', re.IGNORECASE)
+
+SONG_CATALOG_FIELDS = ('id', 'artist', 'album', 'genre', 'release_date', 'album_ref', 'genre_ref')
+
+COUNTER_MODELS = (Album, Artist, Genre)
+
+
+def split_artist_names(value):
+    """Tách chuỗi nghệ sĩ của bài hát thành danh sách tên (giữ thứ tự, bỏ trùng)"""
+    names = []
+    for name in _ARTIST_SEPARATOR_RE.split(value or ''):
+        name = name.strip()[:200]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def top_songs_limit():
+    return getattr(settings, 'CATALOG_TOP_SONGS', 10)
+
+
+class CatalogResolver:
+    """
+    Ánh xạ tên -> id của Album/Artist/Genre, tra cứu theo lô và ghi nhớ.
+
+    create=True: tạo album/nghệ sĩ/thể loại còn thiếu (dùng khi backfill).
+    """
+
+    def __init__(self, create=False):
+        self.create = create
+        self.genres = {}
+        self.artists = {}
+        # (tên album, chuỗi nghệ sĩ) -> id; (tên album, None) -> album đầu tiên cùng tên
+        self.albums = {}
+
+    def _load_genres(self, names):
+        missing = {name for name in names if name and name not in self.genres}
+        if not missing:
+            return
+        self.genres.update(Genre.objects.filter(name__in=missing).values_list('name', 'id'))
+        if self.create and missing - set(self.genres):
+            Genre.objects.bulk_create(
+                [Genre(name=name, description=f'Music in the {name} genre.') for name in missing - set(self.genres)],
+                ignore_conflicts=True
+            )
+            self.genres.update(Genre.objects.filter(name__in=missing).values_list('name', 'id'))
+        # Ghi nhớ cả tên chưa có để lô sau không tra lại
+        for name in missing:
+            self.genres.setdefault(name, None)
+
+    def _load_artists(self, names):
+        missing = {name for name in names if name not in self.artists}
+        if not missing:
+            return
+        # Tên nghệ sĩ không unique: lấy bản ghi cũ nhất như các phép nối cũ
+        for name, artist_id in Artist.objects.filter(name__in=missing).order_by('-id').values_list('name', 'id'):
+            self.artists[name] = artist_id
+        new = sorted(missing - set(self.artists))
+        if self.create and new:
+            for artist in Artist.objects.bulk_create([Artist(name=name) for name in new]):
+                self.artists[artist.name] = artist.id
+        for name in missing:
+            self.artists.setdefault(name, None)
+
+    def _load_albums(self, songs):
+        missing = {
+            (song.album, song.artist) for song in songs
+            if song.album and (song.album, song.artist) not in self.albums and (song.album, None) not in self.albums
+        }
+        if not missing:
+            return
+        titles = {title for title, _ in missing}
+        for album_id, title, artist in Album.objects.filter(title__in=titles).order_by('-id').values_list('id', 'title', 'artist'):
+            self.albums[(title, artist)] = album_id
+            self.albums[(title, None)] = album_id
+        if self.create:
+            today = date.today()
+            release_dates = {(song.album, song.artist): song.release_date for song in songs}
+            new = [pair for pair in sorted(missing) if (pair[0], None) not in self.albums]
+            created = Album.objects.bulk_create([
+                Album(title=title, artist=artist, release_date=release_dates.get((title, artist)) or today,
+                      description=f'Album by {artist}')
+                for title, artist in new
+            ])
+            for album in created:
+                self.albums[(album.title, album.artist)] = album.id
+                self.albums.setdefault((album.title, None), album.id)
+        for title in titles:
+            self.albums.setdefault((title, None), None)
+
+    def resolve(self, songs):
+        """{song_id: (album_id, genre_id, [artist_id, ...])} cho danh sách bài hát"""
+        artist_names = {song.id: split_artist_names(song.artist) for song in songs}
+        self._load_genres({song.genre for song in songs})
+        self._load_artists({name for names in artist_names.values() for name in names})
+        self._load_albums(songs)
+
+        result = {}
+        for song in songs:
+            album_id = None
+            if song.album:
+                album_id = self.albums.get((song.album, song.artist)) or self.albums.get((song.album, None))
+            artist_ids = []
+            for name in artist_names[song.id]:
+                artist_id = self.artists.get(name)
+                if artist_id is not None and artist_id not in artist_ids:
+                    artist_ids.append(artist_id)
+            result[song.id] = (album_id, self.genres.get(song.genre) if song.genre else None, artist_ids)
+        return result
+
+
+def link_songs(songs, resolver=None):
+    """
+    Cập nhật album_ref, genre_ref và artists của các bài hát theo chuỗi hiện tại.
+
+    Ghi bằng bulk_update/bulk_create nên không kích hoạt lại signal. Trả về số
+    bài hát có quan hệ thay đổi.
+    """
+    songs = [song for song in songs if song.pk]
+    if not songs:
+        return 0
+    resolved = (resolver or CatalogResolver()).resolve(songs)
+
+    current_links = defaultdict(list)
+    for song_id, artist_id in SongArtist.objects.filter(song__in=songs).order_by('position').values_list('song_id', 'artist_id'):
+        current_links[song_id].append(artist_id)
+
+    changed_refs = []
+    relink = []
+    # Quan hệ cũ/mới của các bài hát thay đổi, để chuyển số liệu tổng hợp
+    moves = {}
+    for song in songs:
+        album_id, genre_id, artist_ids = resolved[song.id]
+        old = _targets(song.album_ref_id, song.genre_ref_id, current_links[song.id])
+        new = _targets(album_id, genre_id, artist_ids)
+        if old != new:
+            moves[song.id] = (old, new)
+        if (song.album_ref_id, song.genre_ref_id) != (album_id, genre_id):
+            song.album_ref_id, song.genre_ref_id = album_id, genre_id
+            changed_refs.append(song)
+        if current_links[song.id] != artist_ids:
+            relink.append(song.id)
+
+    with transaction.atomic():
+        if changed_refs:
+            Song.objects.bulk_update(changed_refs, ['album_ref', 'genre_ref'])
+        if relink:
+            SongArtist.objects.filter(song_id__in=relink).delete()
+            SongArtist.objects.bulk_create([
+                SongArtist(song_id=song_id, artist_id=artist_id, position=position)
+                for song_id in relink
+                for position, artist_id in enumerate(resolved[song_id][2])
+            ])
+        if moves:
+            _move_counters(moves)
+    return len({song.id for song in changed_refs} | set(relink))
+
+
+# ---------------------------------------------------------------------------
+# Số liệu tổng hợp (CatalogCounters)
+# ---------------------------------------------------------------------------
+
+def _targets(album_id, genre_id, artist_ids):
+    """{model: {id}} các album/thể loại/nghệ sĩ mà một bài hát được tính vào"""
+    return {
+        Album: {album_id} - {None},
+        Genre: {genre_id} - {None},
+        Artist: set(artist_ids),
+    }
+
+
+def song_targets(song_id):
+    """Quan hệ hiện tại của bài hát trong DB (None nếu bài hát không tồn tại)"""
+    row = Song.objects.filter(id=song_id).values_list('album_ref_id', 'genre_ref_id').first()
+    if row is None:
+        return None
+    artist_ids = SongArtist.objects.filter(song_id=song_id).values_list('artist_id', flat=True)
+    return _targets(row[0], row[1], artist_ids)
+
+
+def _apply_delta(targets, songs=0, plays=0, likes=0):
+    """Cộng cùng một thay đổi vào mọi album/thể loại/nghệ sĩ trong targets (một UPDATE mỗi model)"""
+    changes = {}
+    if songs:
+        changes['song_count'] = F('song_count') + songs
+    if plays:
+        changes['total_plays'] = F('total_plays') + plays
+    if likes:
+        changes['total_likes'] = F('total_likes') + likes
+    if not changes:
+        return
+    for model, pks in targets.items():
+        if pks:
+            model.objects.filter(pk__in=pks).update(**changes)
+
+
+def _move_counters(moves):
+    """Chuyển số liệu của các bài hát từ quan hệ cũ sang quan hệ mới"""
+    stats = {
+        song_id: (1, play_count, likes_count)
+        for song_id, play_count, likes_count in Song.objects.filter(id__in=moves).values_list('id', 'play_count', 'likes_count')
+    }
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for song_id, (old, new) in moves.items():
+        row = stats.get(song_id, (1, 0, 0))
+        for model in COUNTER_MODELS:
+            for pk in old[model] - new[model]:
+                delta = deltas[(model, pk)]
+                for i in range(3):
+                    delta[i] -= row[i]
+            for pk in new[model] - old[model]:
+                delta = deltas[(model, pk)]
+                for i in range(3):
+                    delta[i] += row[i]
+
+    # Gom các đối tượng có cùng thay đổi vào một UPDATE
+    grouped = defaultdict(lambda: defaultdict(set))
+    for (model, pk), delta in deltas.items():
+        grouped[tuple(delta)][model].add(pk)
+    for (songs, plays, likes), targets in grouped.items():
+        _apply_delta(targets, songs=songs, plays=plays, likes=likes)
+    touched = defaultdict(set)
+    for model, pk in deltas:
+        touched[model].add(pk)
+    for model, pks in touched.items():
+        refresh_top_songs(model, pks)
+
+
+def top_songs(obj, limit=None):
+    """Các bài hát trong top_song_ids của album/nghệ sĩ/thể loại, đúng thứ tự"""
+    ids = obj.top_song_ids[:limit]
+    songs = Song.objects.in_bulk(ids)
+    return [songs[song_id] for song_id in ids if song_id in songs]
+
+
+def _songs_of(model, pk):
+    if model is Album:
+        return Song.objects.filter(album_ref_id=pk)
+    if model is Genre:
+        return Song.objects.filter(genre_ref_id=pk)
+    return Song.objects.filter(artist_links__artist_id=pk)
+
+
+def refresh_top_songs(model, pks):
+    """Tính lại top bài hát (theo lượt nghe) của các album/thể loại/nghệ sĩ"""
+    limit = top_songs_limit()
+    for pk in pks:
+        top = list(_songs_of(model, pk).order_by('-play_count', 'id').values_list('id', 'play_count')[:limit])
+        model.objects.filter(pk=pk).update(
+            top_song_ids=[song_id for song_id, _ in top],
+            top_min_plays=top[-1][1] if len(top) >= limit else 0,
+        )
+
+
+def record_play(song):
+    """Tăng lượt nghe của bài hát và của album/thể loại/nghệ sĩ chứa nó"""
+    with transaction.atomic():
+        Song.objects.filter(id=song.id).update(play_count=F('play_count') + 1)
+        play_count = Song.objects.filter(id=song.id).values_list('play_count', flat=True).first()
+        targets = song_targets(song.id)
+        if play_count is None or targets is None:
+            return None
+        song.play_count = play_count
+        _apply_delta(targets, plays=1)
+        # Chỉ tính lại top khi bài hát đang trong top hoặc vượt ngưỡng của top
+        for model, pks in targets.items():
+            if not pks:
+                continue
+            stale = [
+                pk for pk, top_ids, min_plays in
+                model.objects.filter(pk__in=pks).values_list('pk', 'top_song_ids', 'top_min_plays')
+                if song.id in top_ids or play_count > min_plays
+            ]
+            if stale:
+                refresh_top_songs(model, stale)
+    return play_count
+
+
+def record_like(song, delta):
+    """Tăng/giảm (delta = 1/-1) lượt thích của bài hát và của album/thể loại/nghệ sĩ chứa nó"""
+    with transaction.atomic():
+        queryset = Song.objects.filter(id=song.id)
+        if delta < 0:
+            # Không để lượt thích âm
+            queryset = queryset.filter(likes_count__gt=0)
+        if not queryset.update(likes_count=F('likes_count') + delta):
+            return False
+        song.likes_count = max(0, song.likes_count + delta)
+        targets = song_targets(song.id)
+        if targets:
+            _apply_delta(targets, likes=delta)
+    return True
+
+
+def remove_song_counters(song_id, targets, play_count, likes_count):
+    """Trừ số liệu của bài hát vừa bị xóa (targets lấy trước khi xóa)"""
+    _apply_delta(targets, songs=-1, plays=-play_count, likes=-likes_count)
+    for model, pks in targets.items():
+        stale = [
+            pk for pk, top_ids in model.objects.filter(pk__in=pks).values_list('pk', 'top_song_ids')
+            if song_id in top_ids
+        ]
+        if stale:
+            refresh_top_songs(model, stale)
+
+
+def reconcile_catalog_stats(models=COUNTER_MODELS, dry_run=False):
+    """
+    Tính lại số liệu tổng hợp từ bảng bài hát và sửa các bản ghi sai lệch.
+
+    Trả về {tên model: số bản ghi đã sửa}.
+    """
+    limit = top_songs_limit()
+    result = {}
+    for model in models:
+        fixed = 0
+        queryset = model.objects.annotate(
+            actual_songs=Count('songs', distinct=True),
+            actual_plays=Coalesce(Sum('songs__play_count'), 0),
+            actual_likes=Coalesce(Sum('songs__likes_count'), 0),
+        ).order_by('pk')
+        for obj in queryset:
+            top = list(_songs_of(model, obj.pk).order_by('-play_count', 'id').values_list('id', 'play_count')[:limit])
+            values = {
+                'song_count': obj.actual_songs,
+                'total_plays': obj.actual_plays,
+                'total_likes': obj.actual_likes,
+                'top_song_ids': [song_id for song_id, _ in top],
+                'top_min_plays': top[-1][1] if len(top) >= limit else 0,
+            }
+            if any(getattr(obj, name) != value for name, value in values.items()):
+                fixed += 1
+                if not dry_run:
+                    model.objects.filter(pk=obj.pk).update(**values)
+        result[model.__name__] = fixed
+    return result
+
+
+def sync_song_relations(song):
+    """Đồng bộ quan hệ của một bài hát vừa lưu (bỏ qua nếu chuỗi không đổi)"""
+    names = song.catalog_names()
+    if getattr(song, '_catalog_names', None) == names:
+        return False
+    link_songs([song])
+    song._catalog_names = names
+    return True
+
+
+def link_songs_to(instance):
+    """
+    Nối các bài hát đang mang tên của album/nghệ sĩ/thể loại vừa tạo.
+
+    So khớp chính xác trên cột có index. Bài hát ghi nhiều nghệ sĩ trong một
+    chuỗi ("A feat. B") được nối khi lưu lại hoặc khi chạy backfill_catalog_relations.
+    """
+    if isinstance(instance, Genre):
+        queryset = Song.objects.filter(genre=instance.name, genre_ref__isnull=True)
+    elif isinstance(instance, Album):
+        queryset = Song.objects.filter(album=instance.title, album_ref__isnull=True)
+    elif isinstance(instance, Artist):
+        queryset = Song.objects.filter(artist=instance.name).exclude(artist_links__artist=instance)
+    else:
+        return 0
+    return link_songs(list(queryset.only(*SONG_CATALOG_FIELDS)))
+
+
+def backfill_catalog_relations(batch_size=500, create=False, start_after=0, only_missing=False):
+    """
+    Điền quan hệ cho các bài hát hiện có, theo lô tăng dần khóa chính.
+
+    Mỗi lô là một transaction ngắn; trả về iterator (id cuối của lô, số bài
+    đã xử lý, số bài thay đổi) để có thể dừng và chạy tiếp từ start_after.
+    """
+    resolver = CatalogResolver(create=create)
+    last_id = start_after
+    while True:
+        queryset = Song.objects.filter(id__gt=last_id)
+        if only_missing:
+            queryset = queryset.filter(album_ref__isnull=True, genre_ref__isnull=True, artist_links__isnull=True)
+        songs = list(queryset.order_by('id').only(*SONG_CATALOG_FIELDS)[:batch_size])
+        if not songs:
+            return
+        with transaction.atomic():
+            changed = link_songs(songs, resolver)
+        last_id = songs[-1].id
+        yield last_id, len(songs), changed
@@ -0,0 +1,325 @@
+"""
+Import kho nhạc từ thư mục (music_sample/<thể loại>/<file>).
+
+- Đọc metadata (music.metadata) và tính SHA-256 nội dung song song trên pool
+  tiến trình, mỗi file chỉ được mutagen phân tích một lần.
+- Loại bài trùng theo nội dung (Song.content_hash), kể cả khi file đổi tên.
+- Ghi Genre/Artist/Album/Song theo lô bằng bulk_create thay vì get_or_create
+  từng bản ghi.
+- File audio/ảnh bìa được sao chép vào storage trước giao dịch ghi lô; nếu giao
+  dịch lỗi (rollback) thì các file đó bị xóa lại, không để lại file mồ côi.
+- Lưu checkpoint (JSON) sau mỗi lô: chạy lại sẽ bỏ qua các file đã import và
+  chưa thay đổi (so sánh kích thước, mtime).
+"""
+import json
+import os
+import time
+from datetime import date
+
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from .catalog import link_songs, split_artist_names
+from .lyrics_search import index_song_lyrics
+from .metadata import MUTAGEN_AVAILABLE, read_audio_metadata
+from .models import Album, Artist, Genre, Song
+from .workers import get_thread_pool, is_eager, map_in_processes
+
+AUDIO_EXTENSIONS = ('.mp3', '.flac', '.m4a', '.mp4', '.ogg', '.opus', '.wav', '.aac')
+UNKNOWN_ARTIST = 'Unknown Artist'
+UNKNOWN_ALBUM = 'Unknown Album'
+CHECKPOINT_NAME = '.catalog_import.json'
+
+
+def genre_from_dir(dir_name):
+    return dir_name.replace('_', ' ').title()
+
+
+# ---------------------------------------------------------------------------
+# Tác vụ chạy trên pool tiến trình (không truy vấn DB)
+# ---------------------------------------------------------------------------
+
+def read_catalog_file(path):
+    """Tính hash và đọc metadata (một lần phân tích) của một file audio"""
+    try:
+        metadata = read_audio_metadata(path, with_hash=True, include_cover=True)
+        if metadata.duration is None:
+            return {'path': path, 'error': 'Không nhận dạng được định dạng audio'}
+        info = metadata.as_dict(include_cover=True)
+        info.update(
+            path=path, hash=metadata.content_hash, duration=metadata.duration or 0,
+            cover_extension=metadata.cover_extension
+        )
+        return info
+    except Exception as e:
+        return {'path': path, 'error': str(e)}
+
+
+# ---------------------------------------------------------------------------
+# Điều phối
+# ---------------------------------------------------------------------------
+
+class ImportStats:
+    """Số liệu của một lần import"""
+
+    def __init__(self, total_files=0):
+        self.total_files = total_files
+        self.processed = 0
+        self.skipped = 0
+        self.created = 0
+        self.duplicates = 0
+        self.errors = 0
+        self.bytes = 0
+        self.started_at = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    @property
+    def files_per_second(self):
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def megabytes_per_second(self):
+        return self.bytes / (1024 * 1024) / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'total_files': self.total_files,
+            'processed': self.processed,
+            'skipped': self.skipped,
+            'created': self.created,
+            'duplicates': self.duplicates,
+            'errors': self.errors,
+            'elapsed': round(self.elapsed, 3),
+            'files_per_second': round(self.files_per_second, 1),
+        }
+
+
+class CatalogImporter:
+    """
+    Import thư mục nhạc vào DB.
+
+    uploaded_by: người dùng đứng tên các bài hát được tạo
+    checkpoint_path: file JSON lưu tiến độ (mặc định <root>/.catalog_import.json)
+    on_progress: hàm nhận ImportStats, được gọi sau mỗi lô
+    """
+
+    def __init__(self, root, uploaded_by, batch_size=500, checkpoint_path=None, on_progress=None, on_error=None):
+        if not MUTAGEN_AVAILABLE:
+            raise RuntimeError('Cần cài đặt mutagen để import kho nhạc')
+        self.root = os.path.abspath(root)
+        self.uploaded_by = uploaded_by
+        self.batch_size = max(batch_size, 1)
+        self.checkpoint_path = checkpoint_path or os.path.join(self.root, CHECKPOINT_NAME)
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.checkpoint = self._load_checkpoint()
+
+    # -- checkpoint --------------------------------------------------------
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('root') == self.root:
+                return data.get('files', {})
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    def _save_checkpoint(self):
+        tmp_path = f'{self.checkpoint_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'root': self.root, 'files': self.checkpoint}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    # -- quét thư mục ------------------------------------------------------
+
+    def scan(self):
+        """Danh sách (đường dẫn tương đối, thể loại theo thư mục, size, mtime_ns)"""
+        entries = []
+        for dir_path, dir_names, file_names in os.walk(self.root):
+            dir_names.sort()
+            rel_dir = os.path.relpath(dir_path, self.root)
+            genre = '' if rel_dir == '.' else genre_from_dir(rel_dir.split(os.sep)[0])
+            for name in sorted(file_names):
+                if not name.lower().endswith(AUDIO_EXTENSIONS):
+                    continue
+                full_path = os.path.join(dir_path, name)
+                stat = os.stat(full_path)
+                entries.append((os.path.relpath(full_path, self.root), genre, stat.st_size, stat.st_mtime_ns))
+        return entries
+
+    def _is_unchanged(self, rel_path, size, mtime_ns):
+        done = self.checkpoint.get(rel_path)
+        return done is not None and done[0] == size and done[1] == mtime_ns
+
+    # -- ghi DB theo lô ----------------------------------------------------
+
+    def _upsert_genres(self, names):
+        names = {name for name in names if name}
+        existing = set(Genre.objects.filter(name__in=names).values_list('name', flat=True))
+        Genre.objects.bulk_create(
+            [Genre(name=name, description=f'Music in the {name} genre.') for name in names - existing],
+            ignore_conflicts=True
+        )
+
+    def _upsert_artists(self, names):
+        names = {name for value in names for name in split_artist_names(value)}
+        existing = set(Artist.objects.filter(name__in=names).values_list('name', flat=True))
+        Artist.objects.bulk_create([Artist(name=name) for name in sorted(names - existing)])
+
+    def _upsert_albums(self, pairs):
+        pairs = {pair for pair in pairs if pair[0]}
+        titles = {title for title, _ in pairs}
+        existing = set(Album.objects.filter(title__in=titles).values_list('title', 'artist'))
+        today = date.today()
+        Album.objects.bulk_create([
+            Album(title=title, artist=artist, release_date=today, description=f'Album by {artist}')
+            for title, artist in sorted(pairs - existing)
+        ])
+
+    def _store_files(self, items):
+        """Sao chép file audio và ảnh bìa vào storage (song song trên pool luồng)"""
+        audio_field = Song._meta.get_field('audio_file')
+        cover_field = Song._meta.get_field('cover_image')
+
+        def store(item):
+            with open(item['path'], 'rb') as f:
+                name = audio_field.storage.save(
+                    audio_field.generate_filename(None, os.path.basename(item['path'])), File(f)
+                )
+            cover_name = None
+            if item['cover']:
+                cover_name = cover_field.storage.save(
+                    cover_field.generate_filename(None, f"{item['hash'][:16]}{item['cover_extension']}"),
+                    ContentFile(item['cover'])
+                )
+            return name, cover_name
+
+        if is_eager():
+            results = []
+            for item in items:
+                try:
+                    results.append(store(item))
+                except Exception:
+                    self._delete_files(results)
+                    raise
+            return results
+        futures = [get_thread_pool().submit(store, item) for item in items]
+        results = []
+        error = None
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            # Một file lỗi: xóa các file đã sao chép của lô rồi báo lỗi
+            self._delete_files(results)
+            raise error
+        return results
+
+    def _delete_files(self, stored):
+        """Xóa các file đã sao chép vào storage nhưng không được ghi vào DB"""
+        audio_storage = Song._meta.get_field('audio_file').storage
+        cover_storage = Song._meta.get_field('cover_image').storage
+        for audio_name, cover_name in stored:
+            audio_storage.delete(audio_name)
+            if cover_name:
+                cover_storage.delete(cover_name)
+
+    def _import_batch(self, batch, stats):
+        paths = [os.path.join(self.root, rel_path) for rel_path, _, _, _ in batch]
+        results = list(map_in_processes(read_catalog_file, paths, chunksize=8))
+
+        items = []
+        for (rel_path, dir_genre, size, mtime_ns), info in zip(batch, results):
+            stats.processed += 1
+            stats.bytes += size
+            if 'error' in info:
+                stats.errors += 1
+                if self.on_error:
+                    self.on_error(rel_path, info['error'])
+                continue
+            info.update(
+                rel_path=rel_path,
+                size=size,
+                mtime_ns=mtime_ns,
+                title=info['title'] or os.path.splitext(os.path.basename(rel_path))[0],
+                artist=info['artist'] or UNKNOWN_ARTIST,
+                album=info['album'] or UNKNOWN_ALBUM,
+                genre=dir_genre or info['genre'] or '',
+            )
+            items.append(info)
+
+        # Loại trùng nội dung trong lô và với các bài đã có
+        existing = dict(
+            Song.objects.filter(content_hash__in={item['hash'] for item in items}).values_list('content_hash', 'id')
+        )
+        new_items = []
+        seen = set()
+        for item in items:
+            if item['hash'] in existing or item['hash'] in seen:
+                stats.duplicates += 1
+                self.checkpoint[item['rel_path']] = [item['size'], item['mtime_ns'], existing.get(item['hash'])]
+                continue
+            seen.add(item['hash'])
+            new_items.append(item)
+
+        if new_items:
+            stored = self._store_files(new_items)
+            try:
+                self._write_batch(new_items, stored, stats)
+            except Exception:
+                # Giao dịch đã rollback: không để lại file mồ côi trong storage
+                self._delete_files(stored)
+                raise
+
+        self._save_checkpoint()
+
+    def _write_batch(self, new_items, stored, stats):
+        with transaction.atomic():
+            self._upsert_genres(item['genre'] for item in new_items)
+            self._upsert_artists(item['artist'] for item in new_items)
+            self._upsert_albums((item['album'], item['artist']) for item in new_items)
+            songs = Song.objects.bulk_create([
+                Song(
+                    title=item['title'][:200],
+                    artist=item['artist'][:200],
+                    album=item['album'][:200],
+                    genre=item['genre'][:100],
+                    duration=item['duration'],
+                    lyrics=item['lyrics'] or '',
+                    uploaded_by=self.uploaded_by,
+                    audio_file=audio_name,
+                    cover_image=cover_name,
+                    content_hash=item['hash'],
+                )
+                for item, (audio_name, cover_name) in zip(new_items, stored)
+            ])
+            # bulk_create không gửi post_save: nối quan hệ danh mục cho cả lô
+            link_songs(songs)
+            index_song_lyrics([song.pk for song in songs if song.lyrics])
+        stats.created += len(songs)
+        for item, song in zip(new_items, songs):
+            self.checkpoint[item['rel_path']] = [item['size'], item['mtime_ns'], song.pk]
+
+    def run(self):
+        entries = self.scan()
+        stats = ImportStats(total_files=len(entries))
+        pending = []
+        for entry in entries:
+            if self._is_unchanged(entry[0], entry[2], entry[3]):
+                stats.skipped += 1
+            else:
+                pending.append(entry)
+
+        for start in range(0, len(pending), self.batch_size):
+            self._import_batch(pending[start:start + self.batch_size], stats)
+            if self.on_progress:
+                self.on_progress(stats)
+        return stats
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Các backend chỉ giữ dữ liệu trong bộ nhớ của từng tiến trình
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """Cờ stale, khóa dựng lại và nhật ký thay đổi trong cache phải dùng chung giữa các worker"""
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if settings.DEBUG or backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Error(
+        f'Cache mặc định ({backend}) không dùng chung giữa các tiến trình',
+        hint='Cấu hình CACHES dùng Redis (CACHE_REDIS_URL) khi chạy nhiều worker',
+        obj='CACHES',
+        id='music.E001',
+    )]
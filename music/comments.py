@@ -0,0 +1,147 @@
+"""
+Tải cây bình luận của bài hát với số truy vấn cố định.
+
+- Bình luận gốc được phân trang theo cursor (mới nhất trước): một truy vấn.
+- Trả lời của cả trang được lấy trong một truy vấn theo root_id, sắp theo
+  materialized path (thứ tự duyệt cây), mỗi luồng tối đa replies_limit trả lời
+  (ROW_NUMBER theo luồng); cây được dựng trong bộ nhớ.
+- "Xem thêm trả lời" đọc tiếp một luồng từ sau path của trả lời cuối đã tải.
+- Số bình luận của bài hát được giữ trong cache, xóa khi có bình luận mới/bị xóa.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+from rest_framework.pagination import CursorPagination
+
+from .models import Comment
+
+DEFAULT_REPLIES_LIMIT = 3
+
+
+class CommentCursorPagination(CursorPagination):
+    """Phân trang bình luận gốc theo cursor (ổn định khi có bình luận mới)"""
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+def comment_count_key(song_id):
+    return f'music:comment_count:{song_id}'
+
+
+def comment_count(song_id):
+    """Tổng số bình luận (kể cả trả lời) của bài hát, lấy từ cache nếu có"""
+    return cache.get_or_set(
+        comment_count_key(song_id),
+        lambda: Comment.objects.filter(song_id=song_id).count(),
+        getattr(settings, 'COMMENT_COUNT_CACHE_TIMEOUT', 3600)
+    )
+
+
+def invalidate_comment_count(song_id):
+    cache.delete(comment_count_key(song_id))
+
+
+def build_tree(roots, replies):
+    """
+    Gắn trả lời vào bình luận cha (thuộc tính tree_replies), trả về roots.
+
+    replies phải sắp theo path để cha luôn đứng trước con.
+    """
+    nodes = {}
+    for comment in roots:
+        comment.tree_replies = []
+        nodes[comment.id] = comment
+    for reply in replies:
+        reply.tree_replies = []
+        parent = nodes.get(reply.parent_id)
+        if parent is not None:
+            parent.tree_replies.append(reply)
+            nodes[reply.id] = reply
+    return roots
+
+
+def attach_replies(roots, replies_limit=DEFAULT_REPLIES_LIMIT):
+    """
+    Tải tối đa replies_limit trả lời đầu tiên của mỗi luồng (một truy vấn).
+
+    Mỗi bình luận gốc có thêm thread_size (tổng số trả lời trong luồng) và
+    replies_cursor (path của trả lời cuối đã tải, None nếu đã tải hết).
+    """
+    roots = list(roots)
+    for root in roots:
+        root.thread_size = 0
+        root.replies_cursor = None
+    if not roots:
+        return roots
+
+    replies = []
+    if replies_limit > 0:
+        replies = list(
+            Comment.objects.filter(root_id__in=[root.id for root in roots])
+            .select_related('user')
+            .annotate(
+                position=Window(RowNumber(), partition_by=[F('root_id')], order_by=F('path').asc()),
+                thread_size=Window(Count('id'), partition_by=[F('root_id')]),
+            )
+            .filter(position__lte=replies_limit)
+            .order_by('root_id', 'path')
+        )
+    else:
+        sizes = dict(
+            Comment.objects.filter(root_id__in=[root.id for root in roots])
+            .values('root_id').annotate(total=Count('id')).values_list('root_id', 'total')
+        )
+        for root in roots:
+            root.thread_size = sizes.get(root.id, 0)
+
+    by_root = {root.id: root for root in roots}
+    loaded = {}
+    for reply in replies:
+        root = by_root[reply.root_id]
+        root.thread_size = reply.thread_size
+        loaded[root.id] = reply.path
+    for root in roots:
+        if root.thread_size > replies_limit:
+            root.replies_cursor = loaded.get(root.id, '')
+    return build_tree(roots, replies)
+
+
+def load_comment_page(song, request, replies_limit=DEFAULT_REPLIES_LIMIT):
+    """Một trang bình luận gốc của bài hát kèm cây trả lời, trả về (paginator, roots)"""
+    paginator = CommentCursorPagination()
+    queryset = Comment.objects.filter(song=song, parent__isnull=True).select_related('user')
+    # Không truyền view: thứ tự cố định, không để OrderingFilter của view thay đổi
+    roots = paginator.paginate_queryset(queryset, request)
+    return paginator, attach_replies(roots, replies_limit)
+
+
+def load_more_replies(comment, after='', limit=20):
+    """
+    Các trả lời tiếp theo (thuộc cây con của comment) sau path after, theo thứ tự duyệt cây.
+
+    Trả về (danh sách trả lời, cursor tiếp theo hoặc None).
+    """
+    replies = list(
+        Comment.objects.filter(
+            root_id=comment.root_id or comment.id,
+            path__startswith=f'{comment.path}.',
+            path__gt=after or '',
+        )
+        .select_related('user')
+        .order_by('path')[:limit + 1]
+    )
+    has_more = len(replies) > limit
+    replies = replies[:limit]
+    # Trả lời có cha nằm trong cùng lô được lồng vào cha; các trả lời còn lại
+    # gắn vào bình luận đã tải trước đó (theo trường parent)
+    top = []
+    nodes = {}
+    for reply in replies:
+        reply.tree_replies = []
+        parent = nodes.get(reply.parent_id)
+        (parent.tree_replies if parent is not None else top).append(reply)
+        nodes[reply.id] = reply
+    return top, (replies[-1].path if has_more else None)
@@ -0,0 +1,26 @@
+"""
+WebSocket consumers cho app music
+"""
+import json
+from channels.generic.websocket import AsyncWebsocketConsumer
+from .offline import notification_group
+
+
+class MusicNotificationConsumer(AsyncWebsocketConsumer):
+    """Thông báo đẩy cho người dùng (ví dụ: tải xuống offline hoàn tất)"""
+
+    async def connect(self):
+        self.user = self.scope["user"]
+        if not self.user.is_authenticated:
+            await self.close(code=4001)
+            return
+        self.group_name = notification_group(self.user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if getattr(self, 'group_name', None):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def music_notification(self, event):
+        await self.send(text_data=json.dumps({'event': event['event'], 'data': event['data']}))
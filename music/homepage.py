@@ -0,0 +1,159 @@
+"""
+Tài liệu trang chủ đã biên dịch sẵn (JSON) lưu trong cache.
+
+Trang chủ giống nhau cho mọi người dùng nên được dựng một lần thành bytes JSON
+kèm ETag, sau đó phục vụ trực tiếp từ cache. Tài liệu được dựng lại ở nền khi
+dữ liệu thay đổi (signals đánh dấu "stale") hoặc khi quá hạn làm mới, và có thể
+dựng theo lịch bằng lệnh `python manage.py rebuild_homepage`.
+
+Cờ stale và khóa dựng lại nằm trong cache dùng chung (CACHES) nên thay đổi ở một
+worker được mọi worker thấy. Lượt nghe/lượt thích đổi liên tục nên không đánh dấu
+stale; phần xếp hạng theo lượt nghe được cập nhật theo HOMEPAGE_REFRESH_INTERVAL.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connections
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+logger = logging.getLogger(__name__)
+
+HOMEPAGE_CACHE_KEY = 'music:homepage:document'
+HOMEPAGE_STALE_KEY = 'music:homepage:stale'
+HOMEPAGE_LOCK_KEY = 'music:homepage:rebuild-lock'
+
+
+def _refresh_interval():
+    return getattr(settings, 'HOMEPAGE_REFRESH_INTERVAL', 300)
+
+
+def build_homepage_payload():
+    """Truy vấn dữ liệu trang chủ và serialize thành dict"""
+    from .models import Album, Genre, Playlist, Song
+    from .serializers import AlbumSerializer, PlaylistSerializer, SongSerializer
+
+    # Top 5 bài hát cho mỗi thể loại trong một truy vấn (thay vì mỗi thể loại một truy vấn)
+    genre_names = list(Genre.objects.values_list('name', flat=True)[:6])
+    ranked_songs = Song.objects.filter(genre__in=genre_names).select_related('uploaded_by').annotate(
+        genre_rank=Window(
+            expression=RowNumber(),
+            partition_by=[F('genre')],
+            order_by=F('play_count').desc(),
+        )
+    ).filter(genre_rank__lte=5).order_by('genre', 'genre_rank')
+
+    songs_by_genre = {name: [] for name in genre_names}
+    for song in ranked_songs:
+        songs_by_genre[song.genre].append(song)
+    featured_by_genre = {
+        name: SongSerializer(songs, many=True).data
+        for name, songs in songs_by_genre.items()
+    }
+
+    # Album mới phát hành
+    one_month_ago = timezone.now().date() - timedelta(days=30)
+    new_albums = Album.objects.filter(release_date__gte=one_month_ago).order_by('-release_date')[:8]
+
+    # Playlist được yêu thích
+    popular_playlists = Playlist.objects.filter(is_public=True).select_related('user').annotate(
+        followers_count=Count('followers')
+    ).order_by('-followers_count')[:8]
+
+    # Top bài hát được nghe nhiều
+    top_songs = Song.objects.select_related('uploaded_by').order_by('-play_count')[:10]
+
+    return {
+        'featured_by_genre': featured_by_genre,
+        'new_albums': AlbumSerializer(new_albums, many=True).data,
+        'popular_playlists': PlaylistSerializer(popular_playlists, many=True).data,
+        'top_songs': SongSerializer(top_songs, many=True).data
+    }
+
+
+def compile_homepage():
+    """Dựng tài liệu trang chủ, lưu vào cache và trả về tài liệu"""
+    payload = build_homepage_payload()
+    body = json.dumps(payload, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    document = {
+        'body': body,
+        'etag': '"%s"' % hashlib.sha1(body).hexdigest(),
+        'built_at': time.time(),
+    }
+    # Xóa cờ stale trước khi ghi để thay đổi xảy ra trong lúc dựng vẫn được đánh dấu lại
+    cache.delete(HOMEPAGE_STALE_KEY)
+    cache.set(HOMEPAGE_CACHE_KEY, document, timeout=None)
+    return document
+
+
+def _rebuild_in_background():
+    try:
+        close_old_connections()
+        compile_homepage()
+    except Exception as e:
+        logger.error(f"Lỗi khi dựng lại trang chủ: {str(e)}")
+    finally:
+        connections.close_all()
+        cache.delete(HOMEPAGE_LOCK_KEY)
+
+
+def schedule_rebuild():
+    """Dựng lại trang chủ ở nền; bỏ qua nếu đã có một lượt dựng đang chạy"""
+    if not cache.add(HOMEPAGE_LOCK_KEY, True, timeout=60):
+        return False
+    if not getattr(settings, 'HOMEPAGE_BACKGROUND_REBUILD', True):
+        _rebuild_in_background()
+        return True
+    threading.Thread(target=_rebuild_in_background, name='homepage-rebuild', daemon=True).start()
+    return True
+
+
+def mark_homepage_stale():
+    """Đánh dấu tài liệu trang chủ cần dựng lại (gọi từ signals, không truy vấn DB)"""
+    cache.set(HOMEPAGE_STALE_KEY, True, timeout=None)
+
+
+def _compile_when_cold():
+    """
+    Cache trống (khởi động lần đầu, cache bị xóa): chỉ một request giữ khóa và dựng,
+    các request khác chờ bản đó thay vì cùng dựng một lúc.
+    """
+    deadline = time.monotonic() + getattr(settings, 'HOMEPAGE_COLD_WAIT', 10)
+    while True:
+        if cache.add(HOMEPAGE_LOCK_KEY, True, timeout=60):
+            try:
+                return compile_homepage()
+            finally:
+                cache.delete(HOMEPAGE_LOCK_KEY)
+        if time.monotonic() >= deadline:
+            # Bên giữ khóa dựng quá lâu: tự dựng để không trả lỗi
+            return compile_homepage()
+        time.sleep(0.05)
+        document = cache.get(HOMEPAGE_CACHE_KEY)
+        if document is not None:
+            return document
+
+
+def get_homepage_document():
+    """
+    Lấy tài liệu trang chủ từ cache.
+
+    Chỉ khi cache trống hoàn toàn mới dựng đồng bộ (một request dựng, các request
+    khác chờ); các trường hợp còn lại trả về bản hiện có và dựng lại ở nền nếu đã cũ.
+    """
+    document = cache.get(HOMEPAGE_CACHE_KEY)
+    if document is None:
+        return _compile_when_cold()
+
+    expired = time.time() - document['built_at'] > _refresh_interval()
+    if expired or cache.get(HOMEPAGE_STALE_KEY):
+        schedule_rebuild()
+    return document
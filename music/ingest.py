@@ -0,0 +1,272 @@
+"""
+Pipeline xử lý file audio sau khi upload.
+
+File upload được ghi thẳng vào storage, sau đó một IngestJob chạy các bước:
+- metadata:  đọc tag/thời lượng, lấy ảnh bìa nhúng nếu chưa có (bắt buộc)
+- transcode: chuyển sang MP3 nếu file gốc không phải MP3 (bắt buộc)
+- analysis:  waveform và độ to (EBU R128, gain kiểu ReplayGain) trong một lần
+             giải mã (không bắt buộc)
+- renditions: tạo các bản chuyển mã theo MUSIC_RENDITION_LADDER (không bắt buộc)
+- segments:  chia đoạn fMP4 cho HLS/DASH theo MUSIC_STREAM_VARIANTS (không bắt buộc)
+
+Các bước nặng chạy song song trên pool tiến trình (music.workers); việc ghi kết
+quả vào DB do luồng điều phối đảm nhận. Bài hát được đánh dấu `is_ready` ngay
+khi các bước bắt buộc hoàn thành, không cần chờ các bước tùy chọn.
+"""
+import logging
+import os
+import subprocess
+import tempfile
+
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .audio_analysis import analyze_audio_task, save_analysis
+from .models import IngestJob, Song
+from .renditions import save_renditions, submit_renditions
+from .streaming import save_package, submit_packaging
+from .metadata import read_audio_metadata
+from .workers import run_in_background, run_in_process
+
+logger = logging.getLogger(__name__)
+
+# (tên bước, bắt buộc để phát được)
+INGEST_STAGES = (
+    ('metadata', True),
+    ('transcode', True),
+    ('analysis', False),
+    ('renditions', False),
+    ('segments', False),
+)
+
+# Các trường có thể lấy từ metadata trong file
+METADATA_FIELDS = ('title', 'artist', 'album', 'genre', 'duration', 'lyrics')
+
+ALLOWED_AUDIO_EXTENSIONS = ('.mp3', '.flac', '.wav', '.m4a', '.mp4', '.aac', '.ogg', '.opus')
+
+
+# ---------------------------------------------------------------------------
+# Tác vụ chạy trên pool tiến trình (không truy vấn DB)
+# ---------------------------------------------------------------------------
+
+def extract_metadata_task(file_path):
+    """Đọc metadata (tag, thời lượng, hash nội dung) từ file audio"""
+    metadata = read_audio_metadata(file_path, with_hash=True, include_cover=True)
+    return dict(metadata.as_dict(include_cover=True), cover_extension=metadata.cover_extension)
+
+
+def transcode_task(file_path, output_format='mp3', bitrate='192k'):
+    """Chuyển mã file audio, trả về đường dẫn file tạm đầu ra"""
+    fd, output_path = tempfile.mkstemp(suffix=f'.{output_format}', prefix='ingest_')
+    os.close(fd)
+    cmd = [
+        'ffmpeg', '-v', 'error', '-nostdin', '-y', '-i', file_path,
+        '-vn', '-map_metadata', '0', '-b:a', bitrate, output_path
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise RuntimeError(f"ffmpeg lỗi: {result.stderr.strip()[-500:]}")
+    return output_path
+
+
+def needs_transcode(file_name):
+    return os.path.splitext(file_name)[1].lower() != '.mp3'
+
+
+# ---------------------------------------------------------------------------
+# Điều phối (chạy trên pool luồng, có truy vấn DB)
+# ---------------------------------------------------------------------------
+
+def _set_stage(job, name, **fields):
+    stage = job.stages.setdefault(name, {})
+    stage.update(fields)
+    job.save(update_fields=['stages', 'updated_at'])
+
+
+def _apply_metadata(job, song, metadata):
+    """Điền metadata vào các trường người dùng chưa nhập"""
+    updated = []
+    for field in METADATA_FIELDS:
+        value = metadata.get(field)
+        if not value or field in job.provided_fields:
+            continue
+        if field == 'duration':
+            value = int(value)
+        elif isinstance(value, str):
+            value = value.strip()[:Song._meta.get_field(field).max_length or None]
+        if value and getattr(song, field) != value:
+            setattr(song, field, value)
+            updated.append(field)
+    # Hash của file gốc, dùng chung với catalog import để phát hiện bài trùng
+    if metadata.get('content_hash') and song.content_hash != metadata['content_hash']:
+        song.content_hash = metadata['content_hash']
+        updated.append('content_hash')
+    # Ảnh bìa nhúng trong file, nếu người dùng không tải ảnh riêng
+    if metadata.get('cover') and not song.cover_image:
+        song.cover_image.save(
+            f"{metadata['content_hash'][:16]}{metadata['cover_extension']}", ContentFile(metadata['cover']), save=False
+        )
+        updated.append('cover_image')
+    if updated:
+        song.save(update_fields=updated)
+    result = {field: metadata.get(field) for field in METADATA_FIELDS if field != 'lyrics'}
+    result['cover_image'] = song.cover_image.name or None
+    return result
+
+
+def _apply_transcode(job, song, output_path):
+    """Thay file gốc bằng file đã chuyển mã"""
+    old_name = song.audio_file.name
+    storage = song.audio_file.storage
+    base_name = os.path.splitext(os.path.basename(old_name))[0]
+    try:
+        with open(output_path, 'rb') as output:
+            song.audio_file.save(f'{base_name}.mp3', File(output), save=False)
+        song.save(update_fields=['audio_file'])
+    finally:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+    if old_name and old_name != song.audio_file.name:
+        # Các bước khác có thể vẫn đang đọc file gốc, chỉ xóa khi job kết thúc
+        job.obsolete_files.append((storage, old_name))
+    return {'audio_file': song.audio_file.name}
+
+
+def _apply_analysis(job, song, result):
+    return save_analysis(song, result)
+
+
+def _apply_renditions(job, song, futures):
+    saved, errors = save_renditions(song, futures)
+    if errors and not saved:
+        raise RuntimeError('; '.join(f'{quality}: {error}' for quality, error in errors.items()))
+    return {'renditions': saved, 'errors': errors}
+
+
+def _apply_segments(job, song, futures):
+    package, errors = save_package(song, futures)
+    if package is None:
+        raise RuntimeError('; '.join(f'{bitrate}k: {error}' for bitrate, error in errors.items()))
+    return {'version': package.version, 'variants': [v['name'] for v in package.variants], 'errors': errors}
+
+
+STAGE_TASKS = {
+    'metadata': (extract_metadata_task, _apply_metadata),
+    'transcode': (transcode_task, _apply_transcode),
+    'analysis': (analyze_audio_task, _apply_analysis),
+    # Bước nhiều lệnh ffmpeg: tự gửi từng bản lên pool, xem _submit_stage
+    'renditions': (submit_renditions, _apply_renditions),
+    'segments': (submit_packaging, _apply_segments),
+}
+
+# Các bước tự phân tán công việc lên pool thay vì chạy như một tác vụ đơn
+FANOUT_STAGES = ('renditions', 'segments')
+
+
+def _submit_stage(name, source_path):
+    task, _ = STAGE_TASKS[name]
+    if name in FANOUT_STAGES:
+        return task(source_path)
+    return run_in_process(task, source_path)
+
+
+def _finish_stage(job, song, name, future):
+    """Chờ kết quả một bước và ghi vào DB, trả về True nếu thành công"""
+    _, apply = STAGE_TASKS[name]
+    try:
+        result = apply(job, song, future.result())
+    except Exception as e:
+        logger.error(f"Ingest #{job.id} bước {name} lỗi: {str(e)}")
+        _set_stage(job, name, status='FAILED', error=str(e), finished_at=timezone.now().isoformat())
+        return False
+    _set_stage(job, name, status='COMPLETED', result=result, finished_at=timezone.now().isoformat())
+    return True
+
+
+def claim_ingest_job(job_id, retry_failed=False, stale_before=None):
+    """
+    Chuyển job sang RUNNING bằng một UPDATE có điều kiện; False nếu tiến trình khác đã nhận.
+
+    Nhận được job PENDING, job FAILED nếu retry_failed, và job RUNNING không cập
+    nhật từ trước stale_before (bị gián đoạn).
+    """
+    claimable = Q(status='PENDING')
+    if retry_failed:
+        claimable |= Q(status='FAILED')
+    if stale_before is not None:
+        claimable |= Q(status='RUNNING', updated_at__lt=stale_before)
+    return IngestJob.objects.filter(claimable, id=job_id).update(
+        status='RUNNING', error='', finished_at=None, updated_at=timezone.now()
+    ) == 1
+
+
+def run_ingest_job(job_id, retry_failed=False, stale_before=None):
+    """Nhận rồi chạy tất cả các bước của một IngestJob; None nếu job đã được tiến trình khác nhận"""
+    if not claim_ingest_job(job_id, retry_failed, stale_before):
+        return None
+    job = IngestJob.objects.select_related('song').get(id=job_id)
+    song = job.song
+    if not song.audio_file:
+        job.status = 'FAILED'
+        job.error = 'Bài hát không có file audio'
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at', 'updated_at'])
+        return job
+
+    source_path = song.audio_file.path
+    job.obsolete_files = []
+    job.stages = {name: {'status': 'PENDING', 'required': required} for name, required in INGEST_STAGES}
+    job.save(update_fields=['stages', 'updated_at'])
+
+    # Gửi tất cả các bước lên pool tiến trình cùng lúc; chúng chỉ đọc file gốc
+    futures = {}
+    for name, _ in INGEST_STAGES:
+        if name == 'transcode' and not needs_transcode(source_path):
+            _set_stage(job, name, status='SKIPPED')
+            continue
+        futures[name] = _submit_stage(name, source_path)
+        _set_stage(job, name, status='RUNNING', started_at=timezone.now().isoformat())
+
+    # Bước bắt buộc trước, để bài hát phát được sớm nhất có thể
+    required_ok = True
+    for name, required in INGEST_STAGES:
+        if required and name in futures:
+            required_ok = _finish_stage(job, song, name, futures[name]) and required_ok
+
+    if required_ok:
+        Song.objects.filter(id=song.id).update(is_ready=True)
+        song.is_ready = True
+
+    for name, required in INGEST_STAGES:
+        if not required and name in futures:
+            _finish_stage(job, song, name, futures[name])
+
+    for storage, name in job.obsolete_files:
+        storage.delete(name)
+
+    job.status = 'COMPLETED' if required_ok else 'FAILED'
+    if not required_ok:
+        job.error = 'Một hoặc nhiều bước bắt buộc thất bại'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at', 'updated_at'])
+    return job
+
+
+def start_ingest(song, user=None, provided_fields=None):
+    """Tạo IngestJob cho bài hát và đưa vào hàng đợi sau khi transaction commit"""
+    if song.is_ready:
+        song.is_ready = False
+        song.save(update_fields=['is_ready'])
+    job = IngestJob.objects.create(
+        song=song,
+        created_by=user,
+        provided_fields=sorted(provided_fields or []),
+        stages={name: {'status': 'PENDING', 'required': required} for name, required in INGEST_STAGES},
+    )
+    transaction.on_commit(lambda: run_in_background(run_ingest_job, job.id))
+    return job
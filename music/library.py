@@ -0,0 +1,143 @@
+"""
+Thư viện nhạc của người dùng: playlist sở hữu, bài hát yêu thích, nghe gần đây.
+
+- Mỗi thay đổi (thích/bỏ thích, xóa bài hát đã thích, sửa/xóa playlist hoặc người
+  cộng tác, nghe một bài) là một bản ghi (mục, id) trong bảng library_changes,
+  dùng chung cho mọi tiến trình; id của bản ghi mới nhất là phiên bản thư viện
+  của người dùng. Signals ghi thay đổi sau khi giao dịch commit. Phiên bản mới
+  nhất được chép vào cache để đọc thư viện không phải hỏi DB.
+- Ảnh chụp (snapshot) thư viện chỉ gồm danh sách id của từng mục, cache theo
+  phiên bản: chỉ dựng lại (3 truy vấn) khi phiên bản đổi. Bên gọi nạp bản ghi
+  theo id (toàn bộ hoặc theo trang).
+- Đồng bộ từng phần (since=<phiên bản>): nhật ký cho biết id nào đã đổi, ảnh
+  chụp hiện tại cho biết id đó được thêm/sửa hay đã bị xóa. Nhật ký quá dài hoặc
+  đã bị xóa (cũ hơn LIBRARY_CHANGE_RETENTION_DAYS ngày) thì client phải tải lại
+  toàn bộ.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import LibraryChange, Playlist, SongPlayHistory
+
+SECTIONS = ('playlists', 'favorites', 'recent')
+# Số thay đổi tối đa trả về dạng từng phần; nhiều hơn thì tải lại toàn bộ
+MAX_DELTA_CHANGES = 200
+# Thời gian giữ phiên bản mới nhất trong cache (giây), hết hạn thì đọc lại từ DB
+VERSION_CACHE_TIMEOUT = 60
+
+
+def _version_key(user_id):
+    return f'music:library:version:{user_id}'
+
+
+def _snapshot_key(user_id):
+    return f'music:library:snapshot:{user_id}'
+
+
+def _timeout():
+    return getattr(settings, 'LIBRARY_CACHE_TIMEOUT', 86400)
+
+
+def get_version(user_id):
+    """Id của thay đổi mới nhất trong thư viện (0 nếu chưa có)"""
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        version = LibraryChange.objects.filter(user_id=user_id).aggregate(version=Max('id'))['version'] or 0
+        cache.set(_version_key(user_id), version, VERSION_CACHE_TIMEOUT)
+    return version
+
+
+def _log_change(user_id, section, object_id):
+    change = LibraryChange.objects.create(user_id=user_id, section=section, object_id=object_id)
+    cache.set(_version_key(user_id), change.id, VERSION_CACHE_TIMEOUT)
+
+
+def record_change(user_id, section, object_id=None):
+    """
+    Ghi thay đổi của thư viện sau khi giao dịch commit (gọi từ signals).
+
+    object_id=None: không biết id nào đổi (ví dụ xóa hết yêu thích), client tải lại mục đó.
+    """
+    transaction.on_commit(lambda: _log_change(user_id, section, object_id))
+
+
+def prune_changes(user_id, version):
+    """Xóa nhật ký thay đổi quá hạn của người dùng (luôn giữ thay đổi mới nhất = version)"""
+    days = getattr(settings, 'LIBRARY_CHANGE_RETENTION_DAYS', 30)
+    return LibraryChange.objects.filter(
+        user_id=user_id, id__lt=version, created_at__lt=timezone.now() - timedelta(days=days)
+    ).delete()[0]
+
+
+def _recent_song_ids(user_id):
+    limit = getattr(settings, 'LIBRARY_RECENT_LIMIT', 10)
+    song_ids = []
+    rows = SongPlayHistory.objects.filter(user_id=user_id).order_by('-played_at').values_list(
+        'song_id', flat=True
+    )[:limit * 5]
+    for song_id in rows:
+        if song_id not in song_ids:
+            song_ids.append(song_id)
+            if len(song_ids) == limit:
+                break
+    return song_ids
+
+
+def build_snapshot(user_id):
+    """{mục: [id, ...]}: playlist mới nhất trước, yêu thích mới thêm trước, nghe gần đây"""
+    favorites = get_user_model().favorite_songs.through.objects.filter(user_id=user_id)
+    return {
+        'playlists': list(Playlist.objects.filter(user_id=user_id).values_list('id', flat=True)),
+        'favorites': list(favorites.order_by('-id').values_list('song_id', flat=True)),
+        'recent': _recent_song_ids(user_id),
+    }
+
+
+def get_snapshot(user_id):
+    """Ảnh chụp thư viện kèm 'version', dựng lại khi phiên bản đã đổi"""
+    version = get_version(user_id)
+    snapshot = cache.get(_snapshot_key(user_id))
+    if snapshot is None or snapshot['version'] != version:
+        prune_changes(user_id, version)
+        snapshot = build_snapshot(user_id)
+        snapshot['version'] = version
+        cache.set(_snapshot_key(user_id), snapshot, _timeout())
+    return snapshot
+
+
+def get_delta(user_id, since, snapshot):
+    """
+    Các thay đổi từ phiên bản since tới snapshot['version']:
+    {mục: {'changed': [id còn trong mục], 'removed': [id đã bị xóa]}} ('recent' chỉ
+    có mặt nếu đổi, khi đó client thay cả danh sách). None nếu phải tải lại toàn bộ.
+    """
+    current = snapshot['version']
+    if since > current:
+        return None
+    # Thay đổi since phải còn trong nhật ký: các thay đổi sau nó chưa bị xóa
+    changes = list(
+        LibraryChange.objects.filter(user_id=user_id, id__gte=since, id__lte=current)
+        .order_by('id').values_list('id', 'section', 'object_id')[:MAX_DELTA_CHANGES + 2]
+    )
+    if not changes or changes[0][0] != since or len(changes) > MAX_DELTA_CHANGES + 1:
+        return None
+    changed = {}
+    for _, section, object_id in changes[1:]:
+        if object_id is None and section != 'recent':
+            return None
+        changed.setdefault(section, set()).add(object_id)
+
+    delta = {}
+    for section in ('playlists', 'favorites'):
+        ids = changed.get(section, set())
+        present = [pk for pk in snapshot[section] if pk in ids]
+        delta[section] = {'changed': present, 'removed': sorted(ids - set(present))}
+    if 'recent' in changed:
+        delta['recent'] = snapshot['recent']
+    return delta
@@ -0,0 +1,243 @@
+"""
+Lời bài hát đồng bộ (LRC).
+
+- parse_lrc đọc LRC chuẩn (nhiều timestamp trên một dòng, thẻ [offset:]) và
+  Enhanced LRC (thời điểm từng từ dạng <mm:ss.xx>).
+- Nhập lời bằng bulk_create (một lệnh xóa + một lệnh chèn cho cả lô bài hát).
+- Mỗi bài hát có một tài liệu lời gọn trong cache: các mảng thời điểm, lời và
+  thời điểm từng từ; tra cứu dòng đang phát bằng tìm kiếm nhị phân trên mảng
+  thời điểm, chỉ trả về vài dòng quanh vị trí phát.
+"""
+import re
+from bisect import bisect_right
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import LyricLine, Song
+
+# [mm:ss], [mm:ss.x], [mm:ss.xx], [mm:ss.xxx] hoặc [mm:ss:xx]
+_TIME = r'(\d+):(\d{1,2})(?:[.:](\d{1,3}))?'
+LINE_TIME_RE = re.compile(r'\[' + _TIME + r'\]')
+WORD_TIME_RE = re.compile(r'<' + _TIME + r'>')
+TAG_RE = re.compile(r'^\[([a-zA-Z]+):(.*)\]$')
+
+
+def _seconds(minutes, seconds, fraction):
+    value = int(minutes) * 60 + int(seconds)
+    if fraction:
+        value += int(fraction) / 10 ** len(fraction)
+    return value
+
+
+def _parse_words(text, shift):
+    """Tách '<00:01.00>Xin <00:01.50>chào' thành (lời không thẻ, [[thời điểm, từ], ...])"""
+    parts = WORD_TIME_RE.split(text)
+    if len(parts) == 1:
+        return text.strip(), []
+    # parts = [phần trước thẻ đầu, phút, giây, phần lẻ, từ, phút, giây, phần lẻ, từ, ...]
+    words = []
+    for i in range(1, len(parts), 4):
+        word = parts[i + 3]
+        if word.strip():
+            words.append([round(max(_seconds(*parts[i:i + 3]) - shift, 0), 3), word])
+    plain = parts[0] + ''.join(parts[i + 3] for i in range(1, len(parts), 4))
+    return ' '.join(plain.split()), words
+
+
+def parse_lrc(text):
+    """
+    Phân tích văn bản LRC/Enhanced LRC.
+
+    Trả về (tags, lines): tags là các thẻ thông tin ({'ar': ..., 'ti': ...}),
+    lines là danh sách (thời điểm, lời, từ) sắp theo thời điểm; từ là
+    [[thời điểm, từ], ...] (rỗng nếu không phải Enhanced LRC).
+    """
+    tags = {}
+    entries = []
+    if not text:
+        return tags, entries
+
+    raw_lines = text.splitlines()
+    for raw in raw_lines:
+        match = TAG_RE.match(raw.strip())
+        if match:
+            tags[match.group(1).lower()] = match.group(2).strip()
+    try:
+        # offset dương: lời hiện sớm hơn (mili giây)
+        shift = int(tags.get('offset', 0)) / 1000
+    except ValueError:
+        shift = 0
+
+    for raw in raw_lines:
+        line = raw.strip()
+        times = []
+        position = 0
+        while True:
+            match = LINE_TIME_RE.match(line, position)
+            if not match:
+                break
+            times.append(_seconds(*match.groups()))
+            position = match.end()
+        if not times:
+            continue
+        lyric, words = _parse_words(line[position:], shift)
+        for time in times:
+            entries.append((round(max(time - shift, 0), 3), lyric, words))
+
+    entries.sort(key=lambda entry: entry[0])
+    return tags, entries
+
+
+def format_lrc_time(seconds):
+    """Định dạng giây thành mm:ss.xx (như LyricLine.format_timestamp)"""
+    return f"{int(seconds // 60):02d}:{seconds % 60:05.2f}"
+
+
+def _line_objects(song_id, entries):
+    return [
+        LyricLine(song_id=song_id, timestamp=timestamp, text=lyric, words=words)
+        for timestamp, lyric, words in entries
+    ]
+
+
+def import_lyrics_bulk(items, batch_size=1000):
+    """
+    Nhập lời đồng bộ cho nhiều bài hát: items là [(song_id, văn bản LRC), ...].
+
+    Lời cũ của các bài hát này bị thay thế; Song.lyrics được cập nhật thành lời
+    không có thời điểm. Trả về {song_id: số dòng}.
+    """
+    parsed = {}
+    for song_id, text in items:
+        parsed[song_id] = parse_lrc(text)[1]
+    if not parsed:
+        return {}
+
+    lines = []
+    with transaction.atomic():
+        song_ids = list(Song.objects.filter(id__in=list(parsed)).values_list('id', flat=True))
+        # LyricLine không có quan hệ/signal phụ thuộc nên đây là một lệnh DELETE duy nhất
+        LyricLine.objects.filter(song_id__in=song_ids).delete()
+        for song_id in song_ids:
+            lines.extend(_line_objects(song_id, parsed[song_id]))
+        LyricLine.objects.bulk_create(lines, batch_size=batch_size)
+        for song_id in song_ids:
+            plain = '\n'.join(lyric for _, lyric, _ in parsed[song_id])
+            # update(): lời không ảnh hưởng các signal của Song
+            Song.objects.filter(id=song_id).update(lyrics=plain)
+        # bulk_create/update() không gửi signal: đánh chỉ mục tìm kiếm lời cho cả lô
+        from .lyrics_search import write_postings
+        write_postings({
+            song_id: [(lyric, timestamp) for timestamp, lyric, _ in parsed[song_id]]
+            for song_id in song_ids
+        })
+    cache.delete_many([lyrics_cache_key(song_id) for song_id in song_ids])
+    return {song_id: len(parsed[song_id]) for song_id in song_ids}
+
+
+def import_lyrics(song_id, text):
+    """Nhập lời đồng bộ cho một bài hát, trả về số dòng (None nếu bài hát không tồn tại)"""
+    return import_lyrics_bulk([(song_id, text)]).get(song_id)
+
+
+# ---------------------------------------------------------------------------
+# Tài liệu lời trong cache và tra cứu theo thời điểm
+# ---------------------------------------------------------------------------
+
+def lyrics_cache_key(song_id):
+    return f'music:lyrics:{song_id}'
+
+
+def build_lyrics_documents(song_ids):
+    """
+    {song_id: {'t': [thời điểm], 'l': [lời], 'w': [từ hoặc None]}} của các bài hát (một truy vấn)
+    """
+    rows = {song_id: ([], [], []) for song_id in song_ids}
+    lines = LyricLine.objects.filter(song_id__in=list(rows)).order_by('song_id', 'timestamp', 'id').values_list(
+        'song_id', 'timestamp', 'text', 'words'
+    )
+    for song_id, timestamp, text, line_words in lines:
+        times, texts, words = rows[song_id]
+        times.append(timestamp)
+        texts.append(text)
+        words.append(line_words or None)
+    documents = {}
+    for song_id, (times, texts, words) in rows.items():
+        documents[song_id] = {'t': times, 'l': texts}
+        if any(words):
+            documents[song_id]['w'] = words
+    return documents
+
+
+def build_lyrics_document(song_id):
+    return build_lyrics_documents([song_id])[song_id]
+
+
+def get_lyrics_document(song_id):
+    return cache.get_or_set(
+        lyrics_cache_key(song_id),
+        lambda: build_lyrics_document(song_id),
+        getattr(settings, 'LYRICS_CACHE_TIMEOUT', 3600)
+    )
+
+
+def get_lyrics_documents(song_ids):
+    """Như get_lyrics_document cho nhiều bài hát: các tài liệu chưa có trong cache được dựng trong một truy vấn"""
+    keys = {lyrics_cache_key(song_id): song_id for song_id in song_ids}
+    cached = cache.get_many(list(keys))
+    documents = {keys[key]: document for key, document in cached.items()}
+    missing = [song_id for song_id in song_ids if song_id not in documents]
+    if missing:
+        built = build_lyrics_documents(missing)
+        cache.set_many(
+            {lyrics_cache_key(song_id): document for song_id, document in built.items()},
+            getattr(settings, 'LYRICS_CACHE_TIMEOUT', 3600)
+        )
+        documents.update(built)
+    return documents
+
+
+def invalidate_lyrics(song_id):
+    cache.delete(lyrics_cache_key(song_id))
+
+
+def active_index(document, position):
+    """Chỉ số dòng đang hiển thị tại position (giây), -1 nếu trước dòng đầu tiên"""
+    return bisect_right(document['t'], position) - 1
+
+
+def document_line(document, index, position=None):
+    line = {
+        'index': index,
+        'timestamp': document['t'][index],
+        'text': document['l'][index],
+    }
+    words = document['w'][index] if 'w' in document else None
+    if words:
+        line['words'] = words
+        if position is not None:
+            line['word_index'] = bisect_right([word[0] for word in words], position) - 1
+    return line
+
+
+def lyrics_window(document, position, before=1, after=3):
+    """
+    Các dòng quanh vị trí phát: dòng đang hiển thị, before dòng trước và after dòng sau.
+
+    next_timestamp là thời điểm dòng kế tiếp bắt đầu (client hẹn lần tra cứu sau).
+    """
+    times = document['t']
+    index = active_index(document, position)
+    start = max(index - before, 0)
+    stop = min(index + after + 1, len(times))
+    return {
+        'index': index,
+        'next_timestamp': times[index + 1] if index + 1 < len(times) else None,
+        'total_lines': len(times),
+        'lines': [
+            document_line(document, i, position if i == index else None)
+            for i in range(start, stop)
+        ],
+    }
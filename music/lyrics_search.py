@@ -0,0 +1,226 @@
+"""
+Tìm bài hát theo một câu trong lời ("nghe được một câu, tìm bài").
+
+- Lời của mỗi bài hát (các dòng LyricLine nếu có, ngược lại Song.lyrics) được
+  tách thành từ đã bỏ dấu tiếng Việt ("Không" -> "khong", "đâu" -> "dau") và
+  ghi vào bảng chỉ mục ngược lyric_postings kèm số dòng, vị trí trong dòng và
+  thời điểm của dòng. Ngoài từ đơn, mỗi cặp từ liền nhau ("khong ve") cũng là
+  một mục: tiếng Việt có ít âm tiết nên từ đơn rất phổ biến, cặp từ chọn lọc
+  hơn nhiều khi tìm cụm từ.
+- Truy vấn đọc danh sách vị trí của mục hiếm nhất trước, rồi chỉ đọc các mục
+  còn lại trong những bài hát đó; khớp cụm từ (các cặp từ nối tiếp nhau trong
+  cùng một dòng) hoặc khớp mọi từ trong cùng một dòng được kiểm tra trong bộ nhớ.
+- Số lần xuất hiện của mỗi mục được đếm tối đa LYRICS_TERM_MAX_DF + 1 bản ghi và
+  cache LYRICS_DF_CACHE_TIMEOUT giây. Mục phổ biến hơn ngưỡng (từ dừng như "em",
+  "anh") bị bỏ qua khi còn mục khác chọn lọc hơn; mục hiếm nhất chỉ đọc tối đa
+  LYRICS_SEARCH_MAX_CANDIDATES dòng, ưu tiên bài hát nhiều lượt nghe.
+- Kết quả gồm bài hát, dòng lời khớp đầu tiên và thời điểm của dòng đó để
+  client tua thẳng tới.
+"""
+import hashlib
+import re
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .lyrics import get_lyrics_documents
+from .models import LyricPosting, Song
+
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 10
+WORD_RE = re.compile(r'\w+')
+
+
+def fold(text):
+    """Chữ thường, bỏ dấu (kể cả đ -> d) để tìm kiếm không phân biệt dấu"""
+    text = unicodedata.normalize('NFD', text.casefold().replace('đ', 'd'))
+    return ''.join(char for char in text if unicodedata.category(char) != 'Mn')
+
+
+def tokenize(text):
+    return [term for term in WORD_RE.findall(fold(text or '')) if len(term) <= MAX_TERM_LENGTH]
+
+
+def index_terms(words):
+    """(mục, vị trí) của một dòng: từng từ và từng cặp từ liền nhau (vị trí của từ đầu)"""
+    for position, word in enumerate(words):
+        yield word, position
+    for position in range(len(words) - 1):
+        yield f'{words[position]} {words[position + 1]}', position
+
+
+def _source_lines(songs, documents):
+    """{song_id: [(lời, thời điểm hoặc None), ...]}: dòng đồng bộ nếu có, ngược lại Song.lyrics"""
+    result = {}
+    for song_id, lyrics in songs:
+        document = documents.get(song_id)
+        if document and document['t']:
+            result[song_id] = list(zip(document['l'], document['t']))
+        else:
+            result[song_id] = [(line.strip(), None) for line in (lyrics or '').splitlines() if line.strip()]
+    return result
+
+
+def index_song_lyrics(song_ids, batch_size=2000):
+    """Đánh chỉ mục lại lời của các bài hát (thay toàn bộ bản ghi cũ), trả về số bản ghi"""
+    song_ids = list(song_ids)
+    if not song_ids:
+        return 0
+    songs = list(Song.objects.filter(id__in=song_ids).values_list('id', 'lyrics'))
+    lines = _source_lines(songs, get_lyrics_documents([song_id for song_id, _ in songs]))
+    # Bài hát không còn tồn tại: chỉ xóa bản ghi cũ
+    lines.update({song_id: [] for song_id in song_ids if song_id not in lines})
+    return write_postings(lines, batch_size)
+
+
+def write_postings(lines, batch_size=2000):
+    """Ghi chỉ mục từ {song_id: [(lời, thời điểm hoặc None), ...]} đã có sẵn trong bộ nhớ"""
+    postings = [
+        LyricPosting(song_id=song_id, line_no=line_no, position=position, term=term, timestamp=timestamp)
+        for song_id, song_lines in lines.items()
+        for line_no, (text, timestamp) in enumerate(song_lines)
+        for term, position in index_terms(tokenize(text)[:32767])
+    ]
+    # savepoint=False: khi được gọi trong giao dịch của import_lyrics_bulk thì dùng luôn giao dịch đó
+    with transaction.atomic(savepoint=False):
+        LyricPosting.objects.filter(song_id__in=list(lines)).delete()
+        LyricPosting.objects.bulk_create(postings, batch_size=batch_size)
+    return len(postings)
+
+
+def rebuild_lyrics_index(batch_size=200):
+    """Đánh chỉ mục lại mọi bài hát có lời, theo lô; trả về (số bài hát, số bản ghi)"""
+    songs = 0
+    postings = 0
+    ids = Song.objects.exclude(lyrics='').order_by('id').values_list('id', flat=True)
+    synced = Song.objects.filter(lyric_lines__isnull=False).distinct().order_by('id').values_list('id', flat=True)
+    song_ids = sorted(set(ids) | set(synced))
+    for start in range(0, len(song_ids), batch_size):
+        batch = song_ids[start:start + batch_size]
+        postings += index_song_lyrics(batch)
+        songs += len(batch)
+    return songs, postings
+
+
+def query_terms(words, phrase):
+    """
+    Các (mục, độ lệch) cần tìm: cụm từ dùng các cặp từ liền nhau (độ lệch so với
+    cặp đầu tiên), còn lại dùng từ đơn (độ lệch không dùng tới).
+    """
+    if phrase and len(words) > 1:
+        return [(term, position) for term, position in index_terms(words) if ' ' in term]
+    return [(word, 0) for word in dict.fromkeys(words)]
+
+
+def _matches(positions, terms, phrase):
+    if not phrase:
+        return all(term in positions for term, _ in terms)
+    first_term, first_offset = terms[0]
+    return any(
+        all(start - first_offset + offset in positions.get(term, ()) for term, offset in terms)
+        for start in positions.get(first_term, ())
+    )
+
+
+def _frequency_key(term):
+    return f'music:lyrics:df:{hashlib.md5(term.encode()).hexdigest()}'
+
+
+def term_frequencies(terms):
+    """
+    {mục: số bản ghi}, đếm tối đa LYRICS_TERM_MAX_DF + 1 bản ghi mỗi mục (có cache).
+
+    Mục chưa xuất hiện (0) không được cache để lời vừa đánh chỉ mục tìm được ngay.
+    """
+    cap = getattr(settings, 'LYRICS_TERM_MAX_DF', 20000)
+    keys = {term: _frequency_key(term) for term in terms}
+    cached = cache.get_many(list(keys.values()))
+    frequencies = {}
+    for term, key in keys.items():
+        if key in cached:
+            frequencies[term] = cached[key]
+            continue
+        frequencies[term] = LyricPosting.objects.filter(term=term).values('pk')[:cap + 1].count()
+        if frequencies[term]:
+            cache.set(key, frequencies[term], getattr(settings, 'LYRICS_DF_CACHE_TIMEOUT', 3600))
+    return frequencies
+
+
+def search_lyrics(query, phrase=True, limit=20):
+    """
+    Tìm bài hát có dòng lời chứa query.
+
+    phrase=True: các từ phải liền nhau đúng thứ tự; False: đủ các từ trong cùng
+    một dòng. Trả về [{'song_id', 'line_no', 'timestamp', 'matches'}, ...],
+    bài hát có nhiều dòng khớp hơn đứng trước.
+    """
+    words = tokenize(query)[:MAX_QUERY_TERMS]
+    if not words:
+        return []
+    terms = query_terms(words, phrase)
+    frequencies = term_frequencies({term for term, _ in terms})
+    if not all(frequencies.values()):
+        # Có mục không xuất hiện trong lời nào
+        return []
+    max_df = getattr(settings, 'LYRICS_TERM_MAX_DF', 20000)
+    selective = [(term, offset) for term, offset in terms if frequencies[term] <= max_df]
+    # Bỏ qua mục quá phổ biến (kết quả gần đúng với các mục đó); nếu mọi mục đều phổ biến thì giữ mục ít nhất
+    terms = selective or [min(terms, key=lambda item: frequencies[item[0]])]
+    unique = {term for term, _ in terms}
+    rarest = min(unique, key=lambda term: frequencies[term])
+
+    # (song_id, line_no) -> {mục: {vị trí}}
+    lines = {}
+    timestamps = {}
+    rare_postings = LyricPosting.objects.filter(term=rarest)
+    if frequencies[rarest] <= max_df:
+        # Danh sách đã bị chặn bởi ngưỡng: sắp theo độ phổ biến của bài hát trước khi cắt
+        rare_postings = rare_postings.order_by('-song__play_count', 'song_id', 'line_no')
+    else:
+        rare_postings = rare_postings.order_by('song_id', 'line_no')
+    candidates = getattr(settings, 'LYRICS_SEARCH_MAX_CANDIDATES', 2000)
+    for song_id, line_no, position, timestamp in rare_postings.values_list(
+        'song_id', 'line_no', 'position', 'timestamp'
+    )[:candidates]:
+        lines.setdefault((song_id, line_no), {}).setdefault(rarest, set()).add(position)
+        timestamps[(song_id, line_no)] = timestamp
+    others = unique - {rarest}
+    if others and lines:
+        # Chỉ đọc các mục còn lại trong những bài hát ứng viên
+        postings = LyricPosting.objects.filter(
+            term__in=others, song_id__in={song_id for song_id, _ in lines}
+        ).values_list('song_id', 'line_no', 'position', 'term')
+        for song_id, line_no, position, term in postings:
+            positions = lines.get((song_id, line_no))
+            if positions is not None:
+                positions.setdefault(term, set()).add(position)
+
+    hits = {}
+    for key in sorted(lines):
+        if not _matches(lines[key], terms, phrase):
+            continue
+        song_id, line_no = key
+        if song_id in hits:
+            hits[song_id]['matches'] += 1
+        else:
+            hits[song_id] = {
+                'song_id': song_id, 'line_no': line_no, 'timestamp': timestamps[key], 'matches': 1,
+            }
+    results = sorted(hits.values(), key=lambda hit: (-hit['matches'], hit['song_id']))
+    return results[:limit]
+
+
+def attach_lyric_lines(hits, songs):
+    """Thêm lời của dòng khớp (hits[i]['line']) từ tài liệu lời trong cache / Song.lyrics"""
+    by_id = {song.id: song for song in songs}
+    documents = get_lyrics_documents([hit['song_id'] for hit in hits if hit['timestamp'] is not None])
+    lines = _source_lines(
+        [(hit['song_id'], by_id[hit['song_id']].lyrics) for hit in hits if hit['song_id'] in by_id],
+        documents,
+    )
+    for hit in hits:
+        song_lines = lines.get(hit['song_id'], [])
+        hit['line'] = song_lines[hit['line_no']][0] if hit['line_no'] < len(song_lines) else ''
+    return hits
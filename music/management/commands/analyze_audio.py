@@ -0,0 +1,87 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from music.models import Song, SongWaveform
+from music.audio_analysis import analyze_audio_task, save_analysis
+from music.workers import run_in_process
+from music import workers
+import os
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Phân tích waveform và độ to (EBU R128, replay gain) cho các bài hát trên pool tiến trình, '
+        'mỗi bài chỉ giải mã một lần'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--song-ids', nargs='+', type=int, help='Chỉ xử lý các bài hát này')
+        parser.add_argument(
+            '--only',
+            choices=['waveform', 'loudness'],
+            help='Chỉ tính một loại dữ liệu (mặc định: cả hai)'
+        )
+        parser.add_argument('--force', action='store_true', help='Tính lại cả các bài đã có dữ liệu')
+        parser.add_argument('--limit', type=int, default=None, help='Số bài hát tối đa')
+        parser.add_argument('--batch-size', type=int, default=50, help='Số bài hát gửi lên pool cùng lúc')
+
+    def handle(self, *args, **options):
+        want_waveform = options['only'] in (None, 'waveform')
+        want_loudness = options['only'] in (None, 'loudness')
+
+        songs = Song.objects.exclude(audio_file='').order_by('id')
+        if options['song_ids']:
+            songs = songs.filter(id__in=options['song_ids'])
+        if not options['force']:
+            missing = Q()
+            if want_waveform:
+                missing |= Q(waveform__isnull=True)
+            if want_loudness:
+                missing |= Q(loudness_analyzed_at__isnull=True)
+            songs = songs.filter(missing)
+        if options['limit']:
+            songs = songs[:options['limit']]
+        songs = list(songs)
+
+        if not songs:
+            self.stdout.write('Không có bài hát nào cần xử lý')
+            return
+
+        has_waveform = set(
+            SongWaveform.objects.filter(song_id__in=[song.id for song in songs]).values_list('song_id', flat=True)
+        )
+
+        self.stdout.write(f'Đang phân tích {len(songs)} bài hát...')
+        start_time = time.perf_counter()
+        completed = 0
+        failed = 0
+        batch_size = max(options['batch_size'], 1)
+        try:
+            for start in range(0, len(songs), batch_size):
+                pending = []
+                for song in songs[start:start + batch_size]:
+                    if not os.path.exists(song.audio_file.path):
+                        self.stdout.write(self.style.WARNING(f'Bài hát #{song.id}: không tìm thấy file audio'))
+                        failed += 1
+                        continue
+                    waveform = want_waveform and (options['force'] or song.id not in has_waveform)
+                    loudness = want_loudness and (options['force'] or song.loudness_analyzed_at is None)
+                    pending.append((song, run_in_process(
+                        analyze_audio_task, song.audio_file.path, waveform=waveform, loudness=loudness
+                    )))
+
+                for song, future in pending:
+                    try:
+                        save_analysis(song, future.result())
+                        completed += 1
+                    except Exception as e:
+                        failed += 1
+                        self.stdout.write(self.style.WARNING(f'Bài hát #{song.id}: {str(e)}'))
+                self.stdout.write(f'  Đã xử lý {min(start + batch_size, len(songs))}/{len(songs)}')
+        finally:
+            workers.shutdown()
+
+        elapsed = time.perf_counter() - start_time
+        self.stdout.write(self.style.SUCCESS(
+            f'Hoàn thành {completed} bài hát, {failed} bài hát có lỗi trong {elapsed:.1f}s'
+        ))
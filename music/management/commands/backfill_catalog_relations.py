@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from music.catalog import backfill_catalog_relations
+from music.models import Song
+import time
+
+
+class Command(BaseCommand):
+    help = 'Điền album_ref, genre_ref và nghệ sĩ của bài hát từ các chuỗi artist/album/genre (theo lô, chạy được khi server đang phục vụ)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Số bài hát mỗi lô (mỗi lô một transaction)')
+        parser.add_argument('--start-after', type=int, default=0, help='Tiếp tục từ sau id bài hát này')
+        parser.add_argument(
+            '--create-missing',
+            action='store_true',
+            help='Tạo album/nghệ sĩ/thể loại chưa có thay vì để trống quan hệ'
+        )
+        parser.add_argument('--only-missing', action='store_true', help='Chỉ xử lý bài hát chưa có quan hệ nào')
+        parser.add_argument('--sleep', type=float, default=0, help='Nghỉ giữa các lô (giây) để giảm tải DB')
+
+    def handle(self, *args, **options):
+        total = Song.objects.filter(id__gt=options['start_after']).count()
+        self.stdout.write(f'{total} bài hát cần kiểm tra')
+        processed = 0
+        changed = 0
+        batches = backfill_catalog_relations(
+            batch_size=max(options['batch_size'], 1),
+            create=options['create_missing'],
+            start_after=options['start_after'],
+            only_missing=options['only_missing'],
+        )
+        for last_id, batch_processed, batch_changed in batches:
+            processed += batch_processed
+            changed += batch_changed
+            self.stdout.write(f'  Đã xử lý {processed}/{total} (id cuối {last_id}), cập nhật {changed}')
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        unresolved = Song.objects.exclude(album='').filter(album_ref__isnull=True).count()
+        self.stdout.write(f'Bài hát có album chưa khớp: {unresolved}')
+        self.stdout.write(self.style.SUCCESS(f'Hoàn thành: {processed} bài hát, {changed} bài hát được cập nhật quan hệ'))
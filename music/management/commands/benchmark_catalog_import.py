@@ -0,0 +1,122 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.core.files import File as DjangoFile
+from django.db import transaction
+from django.test.utils import override_settings
+from music.models import Genre, Album, Song
+from music.catalog_import import CatalogImporter
+from music import workers
+from mutagen.mp3 import MP3
+from mutagen.id3 import ID3, TIT2, TPE1, TALB
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import time
+
+User = get_user_model()
+
+# Một frame MPEG-1 Layer III 128 kbps, 44.1 kHz (417 byte)
+MP3_FRAME = b'\xff\xfb\x90\x00' + b'\x00' * 413
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'So sánh import kho nhạc kiểu cũ (tuần tự) và CatalogImporter trên cây thư mục giả lập (tự rollback)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=1000, help='Số file giả lập')
+        parser.add_argument('--genres', type=int, default=5, help='Số thư mục thể loại')
+        parser.add_argument('--frames', type=int, default=400, help='Số frame MP3 mỗi file (~38 frame/giây)')
+
+    def _build_tree(self, root, files, genres, frames):
+        audio = MP3_FRAME * frames
+        for i in range(files):
+            genre_dir = os.path.join(root, f'genre_{i % genres}')
+            os.makedirs(genre_dir, exist_ok=True)
+            path = os.path.join(genre_dir, f'track_{i:06d}.mp3')
+            with open(path, 'wb') as f:
+                # Thêm số thứ tự để mỗi file có nội dung khác nhau
+                f.write(audio + i.to_bytes(4, 'big'))
+            tags = ID3()
+            tags.add(TIT2(encoding=3, text=f'Track {i}'))
+            tags.add(TPE1(encoding=3, text=f'Artist {i % 50}'))
+            tags.add(TALB(encoding=3, text=f'Album {i % 200}'))
+            tags.save(path)
+
+    def _legacy_import(self, root, admin):
+        # Cách cũ của read_music_metadata: MP3() + ID3() và get_or_create cho từng file
+        for genre_dir in sorted(os.listdir(root)):
+            genre_path = os.path.join(root, genre_dir)
+            if not os.path.isdir(genre_path):
+                continue
+            genre_name = genre_dir.replace('_', ' ').title()
+            Genre.objects.get_or_create(name=genre_name, defaults={'description': f'Music in the {genre_name} genre.'})
+            for filename in sorted(os.listdir(genre_path)):
+                file_path = os.path.join(genre_path, filename)
+                audio = MP3(file_path)
+                tags = ID3(file_path)
+                title = str(tags['TIT2'])
+                artist = str(tags['TPE1'])
+                album_name = str(tags['TALB'])
+                Album.objects.get_or_create(
+                    title=album_name, artist=artist,
+                    defaults={'release_date': datetime.now().date(), 'description': f'Album by {artist}'}
+                )
+                song, created = Song.objects.get_or_create(
+                    title=title, artist=artist, album=album_name,
+                    defaults={'duration': int(audio.info.length), 'genre': genre_name, 'uploaded_by': admin}
+                )
+                if created:
+                    with open(file_path, 'rb') as f:
+                        song.audio_file.save(filename, DjangoFile(f), save=True)
+
+    def _run(self, func):
+        media_root = tempfile.mkdtemp(prefix='bench_media_')
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                with transaction.atomic():
+                    start = time.perf_counter()
+                    result = func()
+                    elapsed = time.perf_counter() - start
+                    created = Song.objects.filter(audio_file__startswith='songs/').count()
+                    raise _Rollback(elapsed, created, result)
+        except _Rollback as rollback:
+            return rollback.args
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+    def handle(self, *args, **options):
+        files = options['files']
+        root = tempfile.mkdtemp(prefix='bench_catalog_')
+        checkpoint = os.path.join(tempfile.mkdtemp(prefix='bench_checkpoint_'), 'checkpoint.json')
+        try:
+            self._build_tree(root, files, options['genres'], options['frames'])
+            self.stdout.write(f'Đã tạo {files} file trong {options["genres"]} thư mục thể loại')
+
+            admin = User.objects.filter(is_superuser=True).first() or User.objects.order_by('id').first()
+            if admin is None:
+                self.stdout.write(self.style.ERROR('Cần ít nhất một người dùng'))
+                return
+
+            legacy_s, legacy_created, _ = self._run(lambda: self._legacy_import(root, admin))
+            importer_s, _, stats = self._run(
+                lambda: CatalogImporter(root, admin, checkpoint_path=checkpoint).run()
+            )
+            # Chạy lại với checkpoint: không còn file nào cần xử lý
+            resume_s, _, resume_stats = self._run(
+                lambda: CatalogImporter(root, admin, checkpoint_path=checkpoint).run()
+            )
+        finally:
+            workers.shutdown()
+            shutil.rmtree(root, ignore_errors=True)
+            shutil.rmtree(os.path.dirname(checkpoint), ignore_errors=True)
+
+        self.stdout.write(f'  Cách cũ:         {legacy_s:8.2f} s ({files / legacy_s:8.1f} file/s), {legacy_created} bài hát')
+        self.stdout.write(f'  CatalogImporter: {importer_s:8.2f} s ({files / importer_s:8.1f} file/s), {stats.created} bài hát')
+        self.stdout.write(f'  Chạy lại (checkpoint): {resume_s:8.2f} s, bỏ qua {resume_stats.skipped} file')
+        if importer_s > 0:
+            self.stdout.write(self.style.SUCCESS(f'Nhanh hơn {legacy_s / importer_s:.1f} lần'))
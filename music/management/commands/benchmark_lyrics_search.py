@@ -0,0 +1,101 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from music.models import Song
+from music.lyrics_search import index_song_lyrics, search_lyrics
+import random
+import time
+
+User = get_user_model()
+
+SYLLABLES = (
+    'anh em yêu thương nhớ mãi người ơi đêm nay trời mưa gió lạnh lòng buồn vui bước chân '
+    'trên con đường xa xôi hạnh phúc ngày mai sẽ về bên nhau mình cùng hát khúc ca tình '
+    'đầu tiên dịu dàng ánh trăng soi giấc mơ đời còn dài biển xanh sóng vỗ không bao giờ quên'
+).split()
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'So sánh tìm theo lời bằng quét icontains và bằng chỉ mục lyric_postings trên dữ liệu giả lập (tự rollback)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=5000, help='Số bài hát giả lập')
+        parser.add_argument('--lines', type=int, default=40, help='Số dòng lời mỗi bài hát')
+        parser.add_argument('--queries', type=int, default=20, help='Số câu truy vấn')
+        parser.add_argument('--seed', type=int, default=1, help='Seed sinh dữ liệu')
+
+    def _measure(self, func, *args):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            result = func(*args)
+            elapsed = (time.perf_counter() - start) * 1000
+        return result, elapsed, len(queries)
+
+    def _scan(self, phrase):
+        # Cách không có chỉ mục: quét toàn bộ cột lyrics (phân biệt dấu, không có thời điểm dòng)
+        return list(Song.objects.filter(lyrics__icontains=phrase).values_list('id', flat=True)[:20])
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        song_count = options['songs']
+        line_count = options['lines']
+
+        try:
+            with transaction.atomic():
+                owner = User.objects.create(username='bench_lyrics_owner', email='bench_lyrics_owner@example.com')
+                lyrics = [
+                    '\n'.join(
+                        ' '.join(rng.choice(SYLLABLES) for _ in range(rng.randint(5, 10)))
+                        for _ in range(line_count)
+                    )
+                    for _ in range(song_count)
+                ]
+                songs = Song.objects.bulk_create([
+                    Song(title=f'Bench {i}', artist='Bench', duration=180, uploaded_by=owner, lyrics=text)
+                    for i, text in enumerate(lyrics)
+                ], batch_size=1000)
+
+                start = time.perf_counter()
+                postings = 0
+                for offset in range(0, len(songs), 500):
+                    postings += index_song_lyrics([song.pk for song in songs[offset:offset + 500]])
+                build_ms = (time.perf_counter() - start) * 1000
+                self.stdout.write(
+                    f'{song_count} bài hát x {line_count} dòng: {postings} từ trong chỉ mục, '
+                    f'dựng trong {build_ms / 1000:.1f} s'
+                )
+
+                # Truy vấn là 3-4 từ liền nhau lấy từ một dòng có thật
+                phrases = []
+                for _ in range(options['queries']):
+                    words = rng.choice(rng.choice(lyrics).splitlines()).split()
+                    start_word = rng.randint(0, max(len(words) - 4, 0))
+                    phrases.append(' '.join(words[start_word:start_word + rng.randint(3, 4)]))
+
+                totals = {'scan': [0.0, 0], 'index': [0.0, 0]}
+                found = 0
+                for phrase in phrases:
+                    _, scan_ms, scan_queries = self._measure(self._scan, phrase)
+                    hits, index_ms, index_queries = self._measure(search_lyrics, phrase)
+                    totals['scan'][0] += scan_ms
+                    totals['scan'][1] += scan_queries
+                    totals['index'][0] += index_ms
+                    totals['index'][1] += index_queries
+                    found += bool(hits)
+
+                count = len(phrases)
+                scan_ms = totals['scan'][0] / count
+                index_ms = totals['index'][0] / count
+                self.stdout.write(f'  Quét icontains: {scan_ms:8.2f} ms/truy vấn, {totals["scan"][1] / count:.1f} truy vấn')
+                self.stdout.write(f'  Chỉ mục:        {index_ms:8.2f} ms/truy vấn, {totals["index"][1] / count:.1f} truy vấn')
+                self.stdout.write(f'  {found}/{count} câu tìm thấy bài hát (kèm số dòng và thời điểm)')
+                if index_ms > 0:
+                    self.stdout.write(self.style.SUCCESS(f'Nhanh hơn {scan_ms / index_ms:.1f} lần'))
+                raise _Rollback()
+        except _Rollback:
+            pass
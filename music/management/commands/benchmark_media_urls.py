@@ -0,0 +1,94 @@
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.conf import settings
+from music.models import Song
+from music.serializers import SongSerializer
+from music.media_urls import MediaURLResolver
+import time
+
+
+class Command(BaseCommand):
+    help = 'Đo thời gian dựng URL media khi serialize danh sách bài hát (không truy vấn DB)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=1000, help='Số bài hát giả lập')
+        parser.add_argument('--repeat', type=int, default=5, help='Số lần lặp mỗi phép đo')
+
+    def _build_songs(self, count):
+        songs = []
+        for i in range(count):
+            song = Song(
+                id=i + 1,
+                title=f'Bài hát {i}',
+                artist=f'Nghệ sĩ {i % 50}',
+                album=f'Album {i % 100}',
+                genre='Pop',
+                duration=200,
+            )
+            song.audio_file.name = f'songs/bai hat {i}.mp3'
+            song.cover_image.name = f'covers/bia_{i}.jpg'
+            songs.append(song)
+        return songs
+
+    def _legacy_urls(self, request, songs):
+        # Cách cũ: build_absolute_uri + storage.url cho từng trường
+        result = []
+        for song in songs:
+            result.append((
+                request.build_absolute_uri(song.audio_file.url),
+                request.build_absolute_uri(song.cover_image.url),
+                request.build_absolute_uri(f'/api/v1/music/songs/{song.id}/download/'),
+                request.build_absolute_uri(f'/api/v1/music/songs/{song.id}/stream/'),
+            ))
+        return result
+
+    def _resolver_urls(self, request, songs):
+        resolver = MediaURLResolver(request)
+        result = []
+        for song in songs:
+            result.append((
+                resolver.file_url(song.audio_file),
+                resolver.file_url(song.cover_image),
+                resolver.api_url(f'/api/v1/music/songs/{song.id}/download/'),
+                resolver.api_url(f'/api/v1/music/songs/{song.id}/stream/'),
+            ))
+        return result
+
+    def _measure(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1000
+
+    def handle(self, *args, **options):
+        count = options['songs']
+        repeat = options['repeat']
+        host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS and settings.ALLOWED_HOSTS[0] != '*' else 'localhost'
+        factory = RequestFactory(HTTP_HOST=host)
+        songs = self._build_songs(count)
+
+        legacy_ms = self._measure(lambda: self._legacy_urls(factory.get('/'), songs), repeat)
+        resolver_ms = self._measure(lambda: self._resolver_urls(factory.get('/'), songs), repeat)
+
+        # Chỉ serialize các trường URL để kết quả không phụ thuộc vào truy vấn comments/rating
+        serializer_fields = ('audio_file', 'cover_image', 'download_url', 'stream_url')
+
+        def serialize():
+            serializer = SongSerializer(songs, many=True, context={'request': factory.get('/')})
+            child = serializer.child
+            for name in list(child.fields):
+                if name not in serializer_fields:
+                    child.fields.pop(name)
+            return serializer.data
+
+        serializer_ms = self._measure(serialize, repeat)
+
+        self.stdout.write(f'Số bài hát: {count}, lặp: {repeat} (lấy lần nhanh nhất)')
+        self.stdout.write(f'  build_absolute_uri từng trường: {legacy_ms:.2f} ms')
+        self.stdout.write(f'  MediaURLResolver:               {resolver_ms:.2f} ms')
+        self.stdout.write(f'  SongSerializer (trường URL):    {serializer_ms:.2f} ms')
+        if resolver_ms > 0:
+            self.stdout.write(self.style.SUCCESS(f'Nhanh hơn {legacy_ms / resolver_ms:.1f} lần'))
@@ -0,0 +1,92 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from music.models import Playlist, CollaboratorRole
+from music.permissions import PlaylistACL
+import time
+
+User = get_user_model()
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'So sánh kiểm tra quyền playlist kiểu cũ và PlaylistACL trên dữ liệu giả lập (tự rollback)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--playlists', type=int, default=50, help='Số playlist collaborative')
+        parser.add_argument('--collaborators', type=int, default=300, help='Số cộng tác viên mỗi playlist')
+
+    def _legacy_check(self, user, playlists):
+        # Cách cũ: tải toàn bộ collaborators và truy vấn CollaboratorRole cho từng playlist
+        accessible = 0
+        editable = 0
+        for playlist in playlists:
+            if playlist.is_public or user == playlist.user or (
+                playlist.is_collaborative and user in playlist.collaborators.all()
+            ):
+                accessible += 1
+            try:
+                if CollaboratorRole.objects.get(playlist=playlist, user=user).can_edit:
+                    editable += 1
+            except CollaboratorRole.DoesNotExist:
+                pass
+        return accessible, editable
+
+    def _acl_check(self, user, playlists):
+        acl = PlaylistACL(user)
+        accessible = len(acl.filter_accessible(playlists))
+        editable = sum(1 for playlist in playlists if acl.can_edit(playlist))
+        return accessible, editable
+
+    def _measure(self, func, *args):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            result = func(*args)
+            elapsed = (time.perf_counter() - start) * 1000
+        return result, elapsed, len(queries)
+
+    def handle(self, *args, **options):
+        playlist_count = options['playlists']
+        collaborator_count = options['collaborators']
+
+        try:
+            with transaction.atomic():
+                owner = User.objects.create(username='bench_acl_owner', email='bench_acl_owner@example.com')
+                users = User.objects.bulk_create([
+                    User(username=f'bench_acl_{i}', email=f'bench_acl_{i}@example.com', password='!')
+                    for i in range(collaborator_count)
+                ])
+                playlists = Playlist.objects.bulk_create([
+                    Playlist(name=f'Bench {i}', user=owner, is_public=False, is_collaborative=True)
+                    for i in range(playlist_count)
+                ])
+                CollaboratorRole.objects.bulk_create([
+                    CollaboratorRole(
+                        playlist=playlist, user=user, added_by=owner,
+                        role='EDITOR' if index % 2 == 0 else 'VIEWER'
+                    )
+                    for playlist in playlists
+                    for index, user in enumerate(users)
+                ], batch_size=2000)
+
+                # Kiểm tra với cộng tác viên cuối cùng (trường hợp xấu nhất khi duyệt danh sách)
+                probe = users[-1]
+                playlists = list(Playlist.objects.filter(id__in=[p.id for p in playlists]).select_related('user'))
+
+                legacy, legacy_ms, legacy_queries = self._measure(self._legacy_check, probe, playlists)
+                acl, acl_ms, acl_queries = self._measure(self._acl_check, probe, playlists)
+
+                self.stdout.write(
+                    f'{playlist_count} playlist x {collaborator_count} cộng tác viên'
+                )
+                self.stdout.write(f'  Cách cũ:     {legacy_ms:8.2f} ms, {legacy_queries} truy vấn, kết quả {legacy}')
+                self.stdout.write(f'  PlaylistACL: {acl_ms:8.2f} ms, {acl_queries} truy vấn, kết quả {acl}')
+                if acl_ms > 0:
+                    self.stdout.write(self.style.SUCCESS(f'Nhanh hơn {legacy_ms / acl_ms:.1f} lần'))
+                raise _Rollback()
+        except _Rollback:
+            pass
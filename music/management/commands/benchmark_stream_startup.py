@@ -0,0 +1,119 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIRequestFactory, force_authenticate
+from music.models import SongStreamPackage
+from music.streaming import segment_path
+from music.views import SongStreamView, SongHLSView, SongSegmentView
+import statistics
+import time
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'So sánh độ trễ bắt đầu phát giữa API stream (Range) và HLS: thời gian phía server '
+        'để trả đủ dữ liệu cho N giây đầu của bài hát'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--song-id', type=int, help='Bài hát đã chia đoạn (mặc định: bài đầu tiên có gói HLS)')
+        parser.add_argument('--startup-seconds', type=float, default=6, help='Số giây âm thanh cần có trước khi phát')
+        parser.add_argument('--runs', type=int, default=20, help='Số lần đo')
+
+    def _read(self, response, limit=None):
+        """Đọc nội dung response (dừng khi đủ limit byte), trả về số byte"""
+        if not getattr(response, 'streaming', False):
+            return len(response.content)
+        total = 0
+        try:
+            for chunk in response.streaming_content:
+                total += len(chunk)
+                if limit is not None and total >= limit:
+                    break
+        finally:
+            response.close()
+        return total
+
+    def _range_startup(self, factory, user, song, needed_bytes):
+        # Player tải từ byte 0 và bắt đầu phát khi bộ đệm đủ N giây
+        request = factory.get(f'/api/v1/music/songs/{song.id}/stream/', HTTP_RANGE='bytes=0-')
+        force_authenticate(request, user=user)
+        response = SongStreamView.as_view()(request, song_id=song.id)
+        return 1, self._read(response, needed_bytes)
+
+    def _hls_startup(self, factory, user, song, package, startup_seconds):
+        # master -> media playlist mức thấp nhất -> init -> các đoạn đầu đủ N giây
+        requests_count = 0
+        total = 0
+        for variant in (None, package.variants[0]['name']):
+            request = factory.get(f'/api/v1/music/songs/{song.id}/hls/')
+            force_authenticate(request, user=user)
+            response = SongHLSView.as_view()(request, song_id=song.id, variant=variant)
+            total += self._read(response)
+            requests_count += 1
+
+        variant = package.variants[0]
+        filenames = [variant['init']]
+        buffered = 0
+        for name, length in variant['segments']:
+            filenames.append(name)
+            buffered += length
+            if buffered >= startup_seconds:
+                break
+        for filename in filenames:
+            request = factory.get(segment_path(package, variant['name'], filename))
+            response = SongSegmentView.as_view()(
+                request, song_id=song.id, version=package.version, variant=variant['name'], filename=filename
+            )
+            total += self._read(response)
+            requests_count += 1
+        return requests_count, total
+
+    def _measure(self, func, runs):
+        timings = []
+        result = None
+        for _ in range(runs):
+            start = time.perf_counter()
+            result = func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return result, statistics.median(timings)
+
+    def handle(self, *args, **options):
+        packages = SongStreamPackage.objects.select_related('song')
+        if options['song_id']:
+            packages = packages.filter(song_id=options['song_id'])
+        package = packages.order_by('song_id').first()
+        if package is None:
+            raise CommandError('Không có bài hát nào đã chia đoạn (chạy package_songs trước)')
+        song = package.song
+
+        user = User.objects.order_by('id').first()
+        if user is None:
+            raise CommandError('Cần ít nhất một người dùng để xác thực request')
+
+        host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS and settings.ALLOWED_HOSTS[0] != '*' else 'localhost'
+        factory = APIRequestFactory(HTTP_HOST=host)
+        startup_seconds = options['startup_seconds']
+        runs = options['runs']
+
+        duration = package.duration or song.duration or 1
+        needed_bytes = int(song.audio_file.size / duration * startup_seconds)
+
+        (range_requests, range_bytes), range_ms = self._measure(
+            lambda: self._range_startup(factory, user, song, needed_bytes), runs
+        )
+        (hls_requests, hls_bytes), hls_ms = self._measure(
+            lambda: self._hls_startup(factory, user, song, package, startup_seconds), runs
+        )
+
+        self.stdout.write(f'Bài hát #{song.id} "{song.title}", {startup_seconds:g} giây đầu, trung vị {runs} lần đo')
+        self.stdout.write(f'  Range (file gốc): {range_ms:8.2f} ms, {range_requests} request, {range_bytes} byte')
+        self.stdout.write(
+            f'  HLS ({package.variants[0]["name"]}):     {hls_ms:8.2f} ms, {hls_requests} request, {hls_bytes} byte'
+        )
+        if range_bytes:
+            self.stdout.write(self.style.SUCCESS(
+                f'HLS tải {hls_bytes / range_bytes * 100:.0f}% lượng dữ liệu so với Range để bắt đầu phát'
+            ))
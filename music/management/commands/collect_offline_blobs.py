@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+from django.utils import timezone
+from music.models import OfflineBlob
+from music.offline import collect_offline_blobs
+from datetime import timedelta
+
+
+class Command(BaseCommand):
+    help = 'Dọn các file offline dùng chung (OfflineBlob) không còn bản tải xuống nào tham chiếu'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-minutes',
+            type=int,
+            default=60,
+            help='Chỉ dọn blob đã hết tham chiếu lâu hơn số phút này'
+        )
+        parser.add_argument('--repair', action='store_true', help='Tính lại ref_count từ các bản tải xuống trước khi dọn')
+        parser.add_argument('--dry-run', action='store_true', help='Chỉ liệt kê, không xóa')
+
+    def handle(self, *args, **options):
+        grace = max(options['grace_minutes'], 0)
+        if options['dry_run']:
+            cutoff = timezone.now() - timedelta(minutes=grace)
+            candidates = OfflineBlob.objects.filter(ref_count__lte=0, released_at__lt=cutoff).aggregate(
+                count=Count('id'), size=Sum('size')
+            )
+            self.stdout.write(
+                f"Sẽ dọn {candidates['count']} blob ({(candidates['size'] or 0) / (1024 * 1024):.1f} MB)"
+            )
+            return
+
+        stats = collect_offline_blobs(grace_minutes=grace, repair=options['repair'])
+        totals = OfflineBlob.objects.aggregate(count=Count('id'), size=Sum('size'), refs=Sum('ref_count'))
+        self.stdout.write(f"Bản tải xuống hết hạn: {stats['expired']}")
+        if options['repair']:
+            self.stdout.write(f"Blob được sửa ref_count: {stats['repaired']}")
+        self.stdout.write(
+            f"Còn lại {totals['count']} blob ({(totals['size'] or 0) / (1024 * 1024):.1f} MB) "
+            f"cho {totals['refs'] or 0} bản tải xuống"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã dọn {stats['deleted']} blob, giải phóng {stats['bytes_freed'] / (1024 * 1024):.1f} MB"
+        ))
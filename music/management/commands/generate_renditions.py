@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q
+from music.models import Song
+from music.renditions import get_ladder, submit_renditions, save_renditions
+from music import workers
+import os
+
+
+class Command(BaseCommand):
+    help = 'Tạo các bản chuyển mã (rendition ladder) cho kho nhạc hiện có'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--song-ids', nargs='+', type=int, help='Chỉ xử lý các bài hát này')
+        parser.add_argument('--quality', nargs='+', help='Chỉ tạo các mức chất lượng này')
+        parser.add_argument('--force', action='store_true', help='Tạo lại cả các bản đã có')
+        parser.add_argument('--limit', type=int, default=None, help='Số bài hát tối đa')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10,
+            help='Số bài hát gửi lên pool cùng lúc (mỗi bài gồm nhiều lệnh ffmpeg song song)'
+        )
+
+    def handle(self, *args, **options):
+        ladder = get_ladder()
+        if options['quality']:
+            ladder = [entry for entry in ladder if entry[0] in options['quality']]
+        if not ladder:
+            self.stdout.write(self.style.ERROR('Không có mức chất lượng nào hợp lệ'))
+            return
+        qualities = [entry[0] for entry in ladder]
+
+        songs = Song.objects.filter(is_ready=True).exclude(audio_file='').order_by('id')
+        if options['song_ids']:
+            songs = songs.filter(id__in=options['song_ids'])
+        if not options['force']:
+            # Bỏ qua các bài đã có đủ các bản cần tạo
+            songs = songs.annotate(
+                existing=Count('renditions', filter=Q(renditions__quality__in=qualities))
+            ).filter(existing__lt=len(qualities))
+        if options['limit']:
+            songs = songs[:options['limit']]
+        songs = list(songs.prefetch_related('renditions'))
+
+        if not songs:
+            self.stdout.write('Không có bài hát nào cần xử lý')
+            return
+
+        self.stdout.write(f'Đang tạo {len(qualities)} mức chất lượng cho {len(songs)} bài hát...')
+        completed = 0
+        failed = 0
+        batch_size = max(options['batch_size'], 1)
+        try:
+            for start in range(0, len(songs), batch_size):
+                batch = songs[start:start + batch_size]
+                # Gửi cả lô lên pool trước rồi mới chờ kết quả để các tiến trình luôn bận
+                pending = []
+                for song in batch:
+                    if not os.path.exists(song.audio_file.path):
+                        self.stdout.write(self.style.WARNING(f'Bài hát #{song.id}: không tìm thấy file audio'))
+                        failed += 1
+                        continue
+                    existing = {r.quality for r in song.renditions.all()}
+                    song_ladder = ladder if options['force'] else [e for e in ladder if e[0] not in existing]
+                    pending.append((song, submit_renditions(song.audio_file.path, song_ladder)))
+
+                for song, future in pending:
+                    saved, errors = save_renditions(song, future.result())
+                    if errors:
+                        failed += 1
+                        self.stdout.write(self.style.WARNING(
+                            f'Bài hát #{song.id}: lỗi {", ".join(sorted(errors))}'
+                        ))
+                    else:
+                        completed += 1
+                self.stdout.write(f'  Đã xử lý {min(start + batch_size, len(songs))}/{len(songs)}')
+        finally:
+            workers.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f'Hoàn thành {completed} bài hát, {failed} bài hát có lỗi'))
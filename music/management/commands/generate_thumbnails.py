@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand
+from music.thumbnails import (
+    THUMBNAIL_FIELDS, get_formats, get_sizes, needs_thumbnails, save_thumbnails, submit_thumbnails
+)
+from music import workers
+
+MODEL_NAMES = {model.__name__.lower(): model for model in THUMBNAIL_FIELDS}
+
+
+class Command(BaseCommand):
+    help = 'Tạo ảnh thu nhỏ (WebP/AVIF) cho ảnh bìa và ảnh đại diện hiện có'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--models',
+            nargs='+',
+            choices=sorted(MODEL_NAMES),
+            help='Chỉ xử lý các model này (mặc định: tất cả)'
+        )
+        parser.add_argument('--force', action='store_true', help='Tạo lại cả các ảnh đã có')
+        parser.add_argument('--limit', type=int, default=None, help='Số bản ghi tối đa mỗi model')
+        parser.add_argument('--batch-size', type=int, default=50, help='Số ảnh gửi lên pool cùng lúc')
+
+    def handle(self, *args, **options):
+        formats = get_formats()
+        if not formats:
+            self.stdout.write(self.style.ERROR('Pillow không hỗ trợ định dạng ảnh thu nhỏ nào được cấu hình'))
+            return
+        sizes = get_sizes()
+        self.stdout.write(f"Định dạng: {', '.join(formats)}; kích thước: {', '.join(map(str, sizes))}")
+
+        models = [MODEL_NAMES[name] for name in options['models']] if options['models'] else list(THUMBNAIL_FIELDS)
+        batch_size = max(options['batch_size'], 1)
+        completed = 0
+        failed = 0
+        source_bytes = 0
+        # Tổng dung lượng theo kích thước của định dạng đầu tiên, để so với ảnh gốc
+        thumbnail_bytes = {size: 0 for size in sizes}
+        try:
+            for model in models:
+                image_field, _ = THUMBNAIL_FIELDS[model]
+                queryset = model.objects.exclude(**{image_field: ''}).exclude(**{f'{image_field}__isnull': True})
+                instances = [
+                    instance for instance in queryset.order_by('pk')
+                    if options['force'] or needs_thumbnails(instance)
+                ]
+                if options['limit']:
+                    instances = instances[:options['limit']]
+                if not instances:
+                    continue
+                self.stdout.write(f'{model.__name__}: {len(instances)} ảnh')
+
+                for start in range(0, len(instances), batch_size):
+                    pending = []
+                    for instance in instances[start:start + batch_size]:
+                        try:
+                            source_name = getattr(instance, image_field).name
+                            pending.append((instance, source_name, submit_thumbnails(instance)))
+                        except Exception as e:
+                            failed += 1
+                            self.stdout.write(self.style.WARNING(f'{model.__name__} #{instance.pk}: {str(e)}'))
+
+                    for instance, source_name, future in pending:
+                        try:
+                            result = future.result()
+                            save_thumbnails(instance, source_name, result)
+                        except Exception as e:
+                            failed += 1
+                            self.stdout.write(self.style.WARNING(f'{model.__name__} #{instance.pk}: {str(e)}'))
+                            continue
+                        completed += 1
+                        source_bytes += result['source_bytes']
+                        for size, content in result['images'][formats[0]].items():
+                            thumbnail_bytes[size] += len(content)
+                    self.stdout.write(f'  Đã xử lý {min(start + batch_size, len(instances))}/{len(instances)}')
+        finally:
+            workers.shutdown()
+
+        if completed:
+            self.stdout.write(f'Ảnh gốc: {source_bytes / 1024:.1f} KB')
+            for size in sizes:
+                ratio = thumbnail_bytes[size] / source_bytes * 100 if source_bytes else 0
+                self.stdout.write(
+                    f'  {size}px ({formats[0]}): {thumbnail_bytes[size] / 1024:.1f} KB ({ratio:.1f}% ảnh gốc)'
+                )
+        self.stdout.write(self.style.SUCCESS(f'Hoàn thành {completed} ảnh, {failed} ảnh có lỗi'))
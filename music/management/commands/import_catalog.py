@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from music.catalog_import import CatalogImporter
+from music import workers
+import os
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Import kho nhạc từ thư mục <root>/<thể loại>/<file> (song song, loại trùng, có checkpoint)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('root', nargs='?', default='music_sample', help='Thư mục gốc của kho nhạc')
+        parser.add_argument('--batch-size', type=int, default=500, help='Số file mỗi lô ghi DB')
+        parser.add_argument('--checkpoint', help='File checkpoint (mặc định <root>/.catalog_import.json)')
+        parser.add_argument('--restart', action='store_true', help='Bỏ checkpoint cũ, quét lại toàn bộ')
+        parser.add_argument('--user', help='Username đứng tên các bài hát (mặc định: superuser đầu tiên)')
+
+    def _get_user(self, username):
+        if username:
+            user = User.objects.filter(username=username).first()
+            if not user:
+                raise CommandError(f'Không tìm thấy người dùng {username}')
+            return user
+        admin = User.objects.filter(is_superuser=True).first()
+        if not admin:
+            admin = User.objects.create_superuser(
+                username='admin',
+                email='admin@example.com',
+                password='admin123'
+            )
+            self.stdout.write(self.style.SUCCESS('Created admin user'))
+        return admin
+
+    def _report(self, stats):
+        done = stats.processed + stats.skipped
+        self.stdout.write(
+            f'  {done}/{stats.total_files} file | tạo {stats.created}, trùng {stats.duplicates}, '
+            f'lỗi {stats.errors} | {stats.files_per_second:.1f} file/s, {stats.megabytes_per_second:.1f} MB/s'
+        )
+
+    def _error(self, path, error):
+        self.stdout.write(self.style.ERROR(f'Error processing {path}: {error}'))
+
+    def handle(self, *args, **options):
+        root = options['root']
+        if not os.path.isdir(root):
+            raise CommandError(f'Không tìm thấy thư mục {root}')
+
+        importer = CatalogImporter(
+            root,
+            uploaded_by=self._get_user(options['user']),
+            batch_size=options['batch_size'],
+            checkpoint_path=options['checkpoint'],
+            on_progress=self._report,
+            on_error=self._error,
+        )
+        if options['restart']:
+            importer.checkpoint = {}
+
+        self.stdout.write(self.style.SUCCESS(f'Starting to import {root}...'))
+        try:
+            stats = importer.run()
+        finally:
+            workers.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Hoàn thành: {stats.total_files} file, tạo {stats.created} bài hát, bỏ qua {stats.skipped} '
+            f'(checkpoint), trùng {stats.duplicates}, lỗi {stats.errors} trong {stats.elapsed:.1f}s '
+            f'({stats.files_per_second:.1f} file/s)'
+        ))
@@ -0,0 +1,91 @@
+from django.core.management.base import BaseCommand, CommandError
+from music.lyrics import import_lyrics_bulk, parse_lrc
+from music.models import LyricLine, Song
+import os
+
+
+class Command(BaseCommand):
+    help = (
+        'Nhập lời đồng bộ từ các file .lrc trong thư mục. File được ghép với bài hát theo tên '
+        '<id>.lrc, theo thẻ [ar:]/[ti:] hoặc theo tên "<nghệ sĩ> - <tên bài>.lrc"'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('root', help='Thư mục chứa file .lrc (quét cả thư mục con)')
+        parser.add_argument('--batch-size', type=int, default=200, help='Số bài hát mỗi lô ghi DB')
+        parser.add_argument('--skip-existing', action='store_true', help='Bỏ qua bài hát đã có lời đồng bộ')
+        parser.add_argument('--dry-run', action='store_true', help='Chỉ ghép file với bài hát, không ghi DB')
+
+    def _lrc_files(self, root):
+        for dirpath, _, filenames in os.walk(root):
+            for filename in sorted(filenames):
+                if filename.lower().endswith('.lrc'):
+                    yield os.path.join(dirpath, filename)
+
+    def _match(self, path, text, by_name):
+        stem = os.path.splitext(os.path.basename(path))[0].strip()
+        if stem.isdigit():
+            return int(stem)
+        tags = parse_lrc(text)[0]
+        if tags.get('ar') and tags.get('ti'):
+            song_id = by_name.get((tags['ar'].lower(), tags['ti'].lower()))
+            if song_id:
+                return song_id
+        if ' - ' in stem:
+            artist, title = stem.split(' - ', 1)
+            return by_name.get((artist.strip().lower(), title.strip().lower()))
+        return None
+
+    def handle(self, *args, **options):
+        root = options['root']
+        if not os.path.isdir(root):
+            raise CommandError(f'Không tìm thấy thư mục {root}')
+
+        # Tra cứu (nghệ sĩ, tên bài) -> id một lần cho cả thư mục
+        by_name = {}
+        for song_id, artist, title in Song.objects.values_list('id', 'artist', 'title').order_by('id'):
+            by_name.setdefault((artist.lower(), title.lower()), song_id)
+        existing = set()
+        if options['skip_existing']:
+            existing = set(LyricLine.objects.values_list('song_id', flat=True).distinct())
+
+        batch_size = max(options['batch_size'], 1)
+        imported = 0
+        lines = 0
+        unmatched = 0
+        batch = {}
+
+        def flush():
+            nonlocal imported, lines
+            if batch and not options['dry_run']:
+                result = import_lyrics_bulk(list(batch.items()))
+                imported += len(result)
+                lines += sum(result.values())
+            elif batch:
+                imported += len(batch)
+            batch.clear()
+
+        for path in self._lrc_files(root):
+            try:
+                with open(path, encoding='utf-8-sig', errors='replace') as f:
+                    text = f.read()
+            except OSError as e:
+                self.stdout.write(self.style.WARNING(f'{path}: {str(e)}'))
+                continue
+            song_id = self._match(path, text, by_name)
+            if song_id is None:
+                unmatched += 1
+                self.stdout.write(self.style.WARNING(f'Không tìm thấy bài hát cho {path}'))
+                continue
+            if song_id in existing:
+                continue
+            batch[song_id] = text
+            if len(batch) >= batch_size:
+                flush()
+                self.stdout.write(f'  Đã nhập {imported} bài hát')
+        flush()
+
+        verb = 'Ghép được' if options['dry_run'] else 'Đã nhập lời cho'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {imported} bài hát ({lines} dòng), {unmatched} file không ghép được'
+        ))
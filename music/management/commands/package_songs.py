@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from music.models import Song
+from music.streaming import submit_packaging, save_package
+from music import workers
+import os
+
+
+class Command(BaseCommand):
+    help = 'Chia đoạn HLS/DASH cho các bài hát chưa có gói phát theo đoạn'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--song-ids', nargs='+', type=int, help='Chỉ xử lý các bài hát này')
+        parser.add_argument('--force', action='store_true', help='Chia đoạn lại cả các bài đã có gói')
+        parser.add_argument('--limit', type=int, default=None, help='Số bài hát tối đa')
+        parser.add_argument('--batch-size', type=int, default=10, help='Số bài hát gửi lên pool cùng lúc')
+
+    def handle(self, *args, **options):
+        songs = Song.objects.filter(is_ready=True).exclude(audio_file='').order_by('id')
+        if options['song_ids']:
+            songs = songs.filter(id__in=options['song_ids'])
+        if not options['force']:
+            songs = songs.filter(stream_package__isnull=True)
+        if options['limit']:
+            songs = songs[:options['limit']]
+        songs = list(songs)
+
+        if not songs:
+            self.stdout.write('Không có bài hát nào cần xử lý')
+            return
+
+        self.stdout.write(f'Đang chia đoạn {len(songs)} bài hát...')
+        completed = 0
+        failed = 0
+        batch_size = max(options['batch_size'], 1)
+        try:
+            for start in range(0, len(songs), batch_size):
+                pending = []
+                for song in songs[start:start + batch_size]:
+                    if not os.path.exists(song.audio_file.path):
+                        self.stdout.write(self.style.WARNING(f'Bài hát #{song.id}: không tìm thấy file audio'))
+                        failed += 1
+                        continue
+                    pending.append((song, submit_packaging(song.audio_file.path)))
+
+                for song, future in pending:
+                    package, errors = save_package(song, future.result())
+                    if package is None or errors:
+                        failed += 1
+                        self.stdout.write(self.style.WARNING(
+                            f'Bài hát #{song.id}: lỗi {", ".join(f"{b}k" for b in sorted(errors))}'
+                        ))
+                    else:
+                        completed += 1
+                self.stdout.write(f'  Đã xử lý {min(start + batch_size, len(songs))}/{len(songs)}')
+        finally:
+            workers.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(f'Hoàn thành {completed} bài hát, {failed} bài hát có lỗi'))
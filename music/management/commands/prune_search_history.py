@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from music.search_log import flush_search_log, prune_search_history
+
+
+class Command(BaseCommand):
+    help = 'Xóa lịch sử tìm kiếm và thống kê từ khóa quá hạn theo từng lô'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Số ngày giữ lịch sử (mặc định SEARCH_HISTORY_RETENTION_DAYS)')
+        parser.add_argument('--stats-days', type=int, help='Số ngày giữ thống kê (mặc định SEARCH_STATS_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Số bản ghi xóa mỗi lần')
+        parser.add_argument('--dry-run', action='store_true', help='Chỉ đếm số bản ghi quá hạn, không xóa')
+
+    def handle(self, *args, **options):
+        flush_search_log()
+        history, stats = prune_search_history(
+            days=options['days'],
+            stats_days=options['stats_days'],
+            batch_size=max(options['batch_size'], 1),
+            dry_run=options['dry_run'],
+        )
+        verb = 'Sẽ xóa' if options['dry_run'] else 'Đã xóa'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {history} lượt tìm kiếm và {stats} bản ghi thống kê từ khóa'
+        ))
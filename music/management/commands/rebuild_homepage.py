@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from music.homepage import compile_homepage
+import time
+
+
+class Command(BaseCommand):
+    help = 'Dựng lại tài liệu trang chủ trong cache (chạy theo lịch cron hoặc lặp liên tục với --interval)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=0,
+            help='Lặp lại sau mỗi N giây (mặc định chỉ chạy một lần)'
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+
+        while True:
+            start = time.perf_counter()
+            document = compile_homepage()
+            elapsed = (time.perf_counter() - start) * 1000
+            self.stdout.write(self.style.SUCCESS(
+                f"Đã dựng trang chủ ({len(document['body'])} bytes, ETag {document['etag']}) trong {elapsed:.1f} ms"
+            ))
+            if interval <= 0:
+                break
+            time.sleep(interval)
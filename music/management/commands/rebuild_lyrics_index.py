@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from music.lyrics_search import rebuild_lyrics_index
+
+
+class Command(BaseCommand):
+    help = 'Đánh chỉ mục lại lời của mọi bài hát cho tìm kiếm theo lời'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Số bài hát mỗi lô')
+
+    def handle(self, *args, **options):
+        songs, postings = rebuild_lyrics_index(max(options['batch_size'], 1))
+        self.stdout.write(self.style.SUCCESS(f'Đã đánh chỉ mục {songs} bài hát ({postings} từ)'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from music.catalog import COUNTER_MODELS, reconcile_catalog_stats
+
+MODEL_NAMES = {model.__name__.lower(): model for model in COUNTER_MODELS}
+
+
+class Command(BaseCommand):
+    help = 'Tính lại số bài hát, lượt nghe, lượt thích và top bài hát của album/nghệ sĩ/thể loại'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--models',
+            nargs='+',
+            choices=sorted(MODEL_NAMES),
+            help='Chỉ đối soát các model này (mặc định: tất cả)'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Chỉ đếm số bản ghi sai lệch, không sửa')
+
+    def handle(self, *args, **options):
+        models = [MODEL_NAMES[name] for name in options['models']] if options['models'] else list(COUNTER_MODELS)
+        result = reconcile_catalog_stats(models, dry_run=options['dry_run'])
+        for name, fixed in result.items():
+            self.stdout.write(f'{name}: {fixed} bản ghi sai lệch')
+        verb = 'Phát hiện' if options['dry_run'] else 'Đã sửa'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {sum(result.values())} bản ghi'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from music.ratings import reconcile_song_ratings
+
+
+class Command(BaseCommand):
+    help = 'Tính lại số lượt đánh giá, tổng điểm và phân bố số sao của bài hát từ bảng ratings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Số bài hát cập nhật mỗi lần')
+        parser.add_argument('--dry-run', action='store_true', help='Chỉ đếm số bài hát sai lệch, không sửa')
+
+    def handle(self, *args, **options):
+        fixed = reconcile_song_ratings(max(options['batch_size'], 1), dry_run=options['dry_run'])
+        verb = 'Phát hiện' if options['dry_run'] else 'Đã sửa'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {fixed} bài hát sai lệch'))
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from datetime import timedelta
+from music.models import IngestJob
+from music.ingest import run_ingest_job
+from music import workers
+
+
+class Command(BaseCommand):
+    help = 'Chạy lại các tiến trình ingest còn dang dở (sau khi khởi động lại server) hoặc bị lỗi'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retry-failed',
+            action='store_true',
+            help='Chạy lại cả các job đã thất bại'
+        )
+        parser.add_argument(
+            '--stale-minutes',
+            type=int,
+            default=30,
+            help='Job RUNNING không cập nhật quá N phút được coi là bị gián đoạn'
+        )
+
+    def handle(self, *args, **options):
+        statuses = ['PENDING']
+        if options['retry_failed']:
+            statuses.append('FAILED')
+
+        stale_before = timezone.now() - timedelta(minutes=options['stale_minutes'])
+        jobs = IngestJob.objects.filter(status__in=statuses) | IngestJob.objects.filter(
+            status='RUNNING', updated_at__lt=stale_before
+        )
+        job_ids = list(jobs.order_by('created_at').values_list('id', flat=True))
+
+        if not job_ids:
+            self.stdout.write('Không có job nào cần xử lý')
+            return
+
+        self.stdout.write(f'Đang xử lý {len(job_ids)} job...')
+        completed = 0
+        skipped = 0
+        try:
+            for job_id in job_ids:
+                job = run_ingest_job(job_id, retry_failed=options['retry_failed'], stale_before=stale_before)
+                if job is None:
+                    # Web server hoặc một lệnh khác đã nhận job này
+                    skipped += 1
+                elif job.status == 'COMPLETED':
+                    completed += 1
+                else:
+                    self.stdout.write(self.style.WARNING(f'Job #{job_id} thất bại: {job.error}'))
+        finally:
+            workers.shutdown()
+
+        if skipped:
+            self.stdout.write(f'Bỏ qua {skipped} job đã được tiến trình khác nhận')
+        self.stdout.write(self.style.SUCCESS(f'Hoàn thành {completed}/{len(job_ids) - skipped} job'))
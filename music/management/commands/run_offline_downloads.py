@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+from music.models import OfflineDownload
+from music.offline import dispatch_downloads, requeue_stale_downloads
+from music import workers
+import time
+
+
+class Command(BaseCommand):
+    help = 'Chạy hàng đợi tải xuống offline (sau khi khởi động lại server, hoặc như một worker riêng)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stale-minutes',
+            type=int,
+            default=30,
+            help='Job DOWNLOADING không cập nhật quá N phút được coi là bị gián đoạn'
+        )
+        parser.add_argument('--retry-failed', action='store_true', help='Đưa cả các job đã thất bại vào lại hàng đợi')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Chu kỳ kiểm tra hàng đợi (giây)')
+        parser.add_argument('--forever', action='store_true', help='Chạy liên tục thay vì dừng khi hàng đợi trống')
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_downloads(options['stale_minutes'])
+        if requeued:
+            self.stdout.write(f'Đưa lại {requeued} job bị gián đoạn vào hàng đợi')
+        if options['retry_failed']:
+            retried = OfflineDownload.objects.filter(status='FAILED', is_active=True).update(
+                status='PENDING', attempts=0, progress=0, bytes_done=0, next_attempt_at=None, updated_at=timezone.now()
+            )
+            self.stdout.write(f'Thử lại {retried} job đã thất bại')
+
+        active = Q(status='DOWNLOADING') | Q(status='PENDING', is_active=True)
+        try:
+            while True:
+                dispatch_downloads()
+                pending = OfflineDownload.objects.filter(active).count()
+                if not pending and not options['forever']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            workers.shutdown()
+
+        completed = OfflineDownload.objects.filter(status='COMPLETED').count()
+        failed = OfflineDownload.objects.filter(status='FAILED').count()
+        self.stdout.write(self.style.SUCCESS(f'Hàng đợi trống: {completed} hoàn tất, {failed} thất bại'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max, Q
+from music.models import Playlist
+from music.playlists import take_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Lưu snapshot danh sách bài hát cho các playlist đã thay đổi kể từ snapshot gần nhất'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--playlist',
+            type=int,
+            help='Chỉ lưu snapshot cho playlist có ID này'
+        )
+
+    def handle(self, *args, **options):
+        playlists = Playlist.objects.annotate(last_snapshot_version=Max('snapshots__version')).filter(
+            Q(last_snapshot_version__isnull=True) | Q(last_snapshot_version__lt=F('version'))
+        )
+        if options.get('playlist'):
+            playlists = playlists.filter(id=options['playlist'])
+
+        created = 0
+        for playlist_id in playlists.values_list('id', flat=True).iterator():
+            with transaction.atomic():
+                # Khóa playlist để snapshot khớp với bản ghi lịch sử cuối cùng
+                playlist = Playlist.objects.select_for_update().get(id=playlist_id)
+                take_snapshot(playlist)
+            created += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Đã lưu {created} snapshot playlist'))
@@ -0,0 +1,108 @@
+"""
+Bộ dựng URL cho các trường media (audio, ảnh bìa, ...) dùng chung cho các serializer nhạc.
+
+Mỗi request chỉ tính phần gốc tuyệt đối (scheme + host) một lần và ghi nhớ
+tiền tố URL của từng storage backend, thay vì gọi `request.build_absolute_uri`
+và `storage.url` cho từng trường của từng đối tượng.
+"""
+import hashlib
+import hmac
+import time
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.encoding import filepath_to_uri
+
+_REQUEST_ATTR = '_music_media_url_resolver'
+
+
+class MediaURLResolver:
+    """Tạo URL tuyệt đối cho file media và endpoint API trong phạm vi một request"""
+
+    def __init__(self, request=None):
+        if request is not None:
+            self.base_url = request.build_absolute_uri('/').rstrip('/')
+        else:
+            self.base_url = settings.SITE_URL.rstrip('/')
+
+        self.cdn_url = (getattr(settings, 'MEDIA_CDN_URL', '') or '').rstrip('/')
+        self.signing_key = getattr(settings, 'MEDIA_URL_SIGNING_KEY', '') or ''
+        ttl = int(getattr(settings, 'MEDIA_URL_SIGNATURE_TTL', 3600))
+        # Làm tròn thời điểm hết hạn theo cửa sổ TTL để URL ổn định (cache được ở CDN)
+        now = int(time.time())
+        self.expires = (now // ttl + 2) * ttl if ttl > 0 else 0
+
+        # id(storage) -> tiền tố URL tuyệt đối, hoặc None nếu phải gọi storage.url()
+        self._storage_prefixes: Dict[int, Optional[str]] = {}
+
+    @classmethod
+    def for_request(cls, request=None) -> 'MediaURLResolver':
+        """Lấy resolver đã ghi nhớ trên request (hoặc tạo mới nếu chưa có)"""
+        if request is None:
+            return cls()
+        # Gắn vào HttpRequest gốc để DRF Request và các serializer lồng nhau dùng chung
+        target = getattr(request, '_request', request)
+        resolver = getattr(target, _REQUEST_ATTR, None)
+        if resolver is None:
+            resolver = cls(request)
+            try:
+                setattr(target, _REQUEST_ATTR, resolver)
+            except AttributeError:
+                pass
+        return resolver
+
+    def absolute(self, path: str) -> str:
+        """Chuyển đường dẫn tương đối thành URL tuyệt đối"""
+        if path.startswith(('http://', 'https://', '//')):
+            return path
+        if not path.startswith('/'):
+            path = '/' + path
+        return f"{self.base_url}{path}"
+
+    def api_url(self, path: str) -> str:
+        """URL tuyệt đối cho endpoint API (download, stream, ...)"""
+        return self.absolute(path)
+
+    def file_url(self, field_file: Any) -> Optional[str]:
+        """URL tuyệt đối cho một FieldFile, hoặc None nếu trường trống"""
+        if not field_file:
+            return None
+        return self.storage_url(field_file.storage, field_file.name)
+
+    def storage_url(self, storage: Any, name: str) -> str:
+        """URL tuyệt đối cho file `name` trong `storage`"""
+        prefix = self._prefix_for(storage)
+        if prefix is None:
+            url = self.absolute(storage.url(name))
+        else:
+            url = prefix + filepath_to_uri(name).lstrip('/')
+        if self.signing_key and self.cdn_url:
+            url = self._sign(url)
+        return url
+
+    def _prefix_for(self, storage: Any) -> Optional[str]:
+        key = id(storage)
+        if key in self._storage_prefixes:
+            return self._storage_prefixes[key]
+
+        prefix: Optional[str] = None
+        if self.cdn_url:
+            prefix = f"{self.cdn_url}/"
+        elif isinstance(storage, FileSystemStorage):
+            base_url = storage.base_url or '/'
+            if not base_url.endswith('/'):
+                base_url += '/'
+            prefix = self.absolute(base_url)
+        # Các backend khác (S3, ...) có thể ký URL theo từng file nên vẫn gọi storage.url()
+
+        self._storage_prefixes[key] = prefix
+        return prefix
+
+    def _sign(self, url: str) -> str:
+        """Ký URL CDN bằng HMAC-SHA256 với thời điểm hết hạn chung của request"""
+        path = url[len(self.cdn_url):] if url.startswith(self.cdn_url) else url
+        payload = f"{path}:{self.expires}".encode()
+        signature = hmac.new(self.signing_key.encode(), payload, hashlib.sha256).hexdigest()
+        separator = '&' if '?' in url else '?'
+        return f"{url}{separator}expires={self.expires}&sig={signature}"
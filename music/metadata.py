@@ -0,0 +1,264 @@
+"""
+Lớp trích xuất metadata dùng chung cho mọi đường upload/import.
+
+- Mỗi file chỉ được mutagen mở một lần, chỉ đọc vùng tag và header của stream
+  (thời lượng lấy từ header, không giải mã audio).
+- Tag của MP3 (ID3), MP4/M4A, FLAC/OGG/Opus (Vorbis comment) được chuẩn hóa
+  về một dataclass AudioMetadata.
+- Kết quả được ghi nhớ theo (đường dẫn, kích thước, mtime) nên lần đọc lặp lại
+  chỉ tốn một lệnh stat; file bị sửa/ghi đè thì khóa đổi và được phân tích lại.
+- SHA-256 nội dung (đọc toàn bộ file) chỉ tính khi bên gọi cần (with_hash=True,
+  để chống trùng) và được lưu cùng kết quả trong cache.
+- Cache không chứa ảnh bìa, chỉ có cover_mime cho biết file có ảnh bìa nhúng;
+  ảnh được đọc lại từ tag của file khi bên gọi cần (include_cover=True).
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import subprocess
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+try:
+    import mutagen
+    from mutagen.flac import Picture
+    from mutagen.id3 import ID3, TCON
+    from mutagen.mp4 import MP4Cover, MP4Tags
+    MUTAGEN_AVAILABLE = True
+except ImportError:
+    MUTAGEN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1 << 20
+METADATA_CACHE_VERSION = 2
+
+# Khóa tag của từng định dạng, theo thứ tự ưu tiên
+VORBIS_KEYS = {
+    'title': ('title',),
+    'artist': ('artist', 'albumartist'),
+    'album': ('album',),
+    'genre': ('genre',),
+    'year': ('date', 'year', 'originaldate'),
+    'lyrics': ('lyrics', 'unsyncedlyrics'),
+}
+MP4_KEYS = {
+    'title': ('\xa9nam',),
+    'artist': ('\xa9ART', 'aART'),
+    'album': ('\xa9alb',),
+    'genre': ('\xa9gen',),
+    'year': ('\xa9day',),
+    'lyrics': ('\xa9lyr',),
+}
+ID3_KEYS = {
+    'title': ('TIT2',),
+    'artist': ('TPE1', 'TPE2'),
+    'album': ('TALB',),
+    'year': ('TDRC', 'TYER', 'TDOR'),
+}
+
+_YEAR_RE = re.compile(r'(\d{4})')
+
+
+@dataclass
+class AudioMetadata:
+    """Metadata đã chuẩn hóa của một file audio"""
+    title: Optional[str] = None
+    artist: Optional[str] = None
+    album: Optional[str] = None
+    genre: Optional[str] = None
+    year: Optional[int] = None
+    duration: Optional[int] = None
+    lyrics: Optional[str] = None
+    cover: Optional[bytes] = field(default=None, repr=False)
+    cover_mime: Optional[str] = None
+    content_hash: Optional[str] = None
+
+    def as_dict(self, include_cover=False) -> Dict[str, Any]:
+        data = asdict(self)
+        if not include_cover:
+            data.pop('cover')
+        return data
+
+    @property
+    def cover_extension(self):
+        return '.png' if self.cover_mime == 'image/png' else '.jpg'
+
+
+def file_sha256(path):
+    """SHA-256 nội dung file (đọc tuần tự theo khối, không giải mã)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def metadata_cache_key(path, size, mtime_ns):
+    path_hash = hashlib.md5(os.path.abspath(path).encode()).hexdigest()
+    return f'music:audio_metadata:v{METADATA_CACHE_VERSION}:{path_hash}:{size}:{mtime_ns}'
+
+
+# ---------------------------------------------------------------------------
+# Chuẩn hóa tag
+# ---------------------------------------------------------------------------
+
+def _clean(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else None
+        if value is None:
+            return None
+    value = str(value).replace('\x00', '').strip()
+    return value or None
+
+
+def _parse_year(value):
+    match = _YEAR_RE.search(value or '')
+    return int(match.group(1)) if match else None
+
+
+def _first(tags, keys):
+    for key in keys:
+        try:
+            value = _clean(tags.get(key))
+        except (KeyError, ValueError):
+            value = None
+        if value:
+            return value
+    return None
+
+
+def _read_id3(tags, result):
+    for name, keys in ID3_KEYS.items():
+        value = _first(tags, keys)
+        if name == 'year':
+            result.year = _parse_year(value)
+        else:
+            setattr(result, name, value)
+
+    genre_frame = tags.get('TCON')
+    if genre_frame is not None:
+        # TCON.genres chuyển các mã số kiểu "(17)" thành tên thể loại
+        result.genre = _clean(genre_frame.genres)
+
+    for frame in tags.getall('USLT'):
+        lyrics = _clean(frame.text)
+        if lyrics:
+            result.lyrics = lyrics
+            break
+
+    pictures = tags.getall('APIC')
+    if pictures:
+        # Ưu tiên ảnh bìa trước (type 3), sau đó ảnh đầu tiên
+        picture = next((p for p in pictures if p.type == 3), pictures[0])
+        result.cover = picture.data
+        result.cover_mime = picture.mime or 'image/jpeg'
+
+
+def _read_mp4(tags, result):
+    for name, keys in MP4_KEYS.items():
+        value = _first(tags, keys)
+        setattr(result, name, _parse_year(value) if name == 'year' else value)
+    if not result.genre and tags.get('gnre'):
+        # Mã thể loại ID3v1 (+1) cũ
+        result.genre = _clean(TCON(text=[str(tags['gnre'][0] - 1)]).genres)
+
+    covers = tags.get('covr')
+    if covers:
+        result.cover = bytes(covers[0])
+        result.cover_mime = 'image/png' if covers[0].imageformat == MP4Cover.FORMAT_PNG else 'image/jpeg'
+
+
+def _read_vorbis(audio, tags, result):
+    for name, keys in VORBIS_KEYS.items():
+        value = _first(tags, keys)
+        setattr(result, name, _parse_year(value) if name == 'year' else value)
+
+    # FLAC lưu ảnh trong block PICTURE, Ogg lưu trong comment base64
+    pictures = list(getattr(audio, 'pictures', None) or [])
+    if not pictures:
+        for encoded in tags.get('metadata_block_picture', []):
+            try:
+                pictures.append(Picture(base64.b64decode(encoded)))
+            except Exception:
+                continue
+    if pictures:
+        picture = next((p for p in pictures if p.type == 3), pictures[0])
+        result.cover = picture.data
+        result.cover_mime = picture.mime or 'image/jpeg'
+
+
+def _probe_duration(path):
+    """Thời lượng từ container (ffprobe) khi mutagen không xác định được"""
+    try:
+        cmd = ['ffprobe', '-i', path, '-show_entries', 'format=duration', '-v', 'quiet', '-of', 'json']
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        return int(float(json.loads(result.stdout)['format']['duration']))
+    except Exception:
+        return None
+
+
+def parse_audio_metadata(path) -> AudioMetadata:
+    """Đọc tag và header của file (một lần mở bằng mutagen, không dùng cache)"""
+    result = AudioMetadata()
+    if MUTAGEN_AVAILABLE:
+        try:
+            audio = mutagen.File(path)
+        except Exception as e:
+            logger.warning(f"Không đọc được metadata của {path}: {str(e)}")
+            audio = None
+        if audio is not None:
+            if audio.info is not None and getattr(audio.info, 'length', None):
+                result.duration = int(audio.info.length)
+            tags = audio.tags
+            if isinstance(tags, ID3):
+                _read_id3(tags, result)
+            elif isinstance(tags, MP4Tags):
+                _read_mp4(tags, result)
+            elif tags is not None:
+                _read_vorbis(audio, tags, result)
+    if result.duration is None:
+        result.duration = _probe_duration(path)
+    return result
+
+
+def read_audio_metadata(path, content_hash=None, use_cache=True, with_hash=False, include_cover=False) -> AudioMetadata:
+    """
+    Metadata của file audio, ghi nhớ theo (đường dẫn, kích thước, mtime).
+
+    content_hash: SHA-256 đã tính sẵn (nếu có) để khỏi đọc lại file
+    with_hash: tính SHA-256 nội dung nếu cache chưa có
+    include_cover: đọc kèm ảnh bìa nhúng (không lưu trong cache)
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return AudioMetadata()
+    key = metadata_cache_key(path, stat.st_size, stat.st_mtime_ns)
+    result = None
+    if use_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            result = AudioMetadata(**cached)
+            if include_cover and result.cover_mime:
+                result.cover = parse_audio_metadata(path).cover
+
+    changed = result is None
+    if result is None:
+        result = parse_audio_metadata(path)
+    if not result.content_hash and (content_hash or with_hash):
+        result.content_hash = content_hash or file_sha256(path)
+        changed = True
+    if use_cache and changed:
+        cache.set(key, result.as_dict(), getattr(settings, 'AUDIO_METADATA_CACHE_TIMEOUT', 7 * 86400))
+    if not include_cover:
+        result.cover = None
+    return result
@@ -0,0 +1,90 @@
+# Generated by Django 5.0.1 on 2025-05-12 09:30
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_positions(apps, schema_editor):
+    """Đánh số vị trí cho các bài hát hiện có theo thứ tự được thêm vào"""
+    PlaylistItem = apps.get_model('music', 'PlaylistItem')
+    batch = []
+    current_playlist = None
+    position = 0
+    for item in PlaylistItem.objects.order_by('playlist_id', 'id').only('id', 'playlist_id').iterator():
+        if item.playlist_id != current_playlist:
+            current_playlist = item.playlist_id
+            position = 0
+        item.position = position
+        position += 1
+        batch.append(item)
+        if len(batch) >= 1000:
+            PlaylistItem.objects.bulk_update(batch, ['position'])
+            batch = []
+    if batch:
+        PlaylistItem.objects.bulk_update(batch, ['position'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0005_song_is_approved'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Bảng playlists_songs đã tồn tại (M2M tự động), chỉ cập nhật state để dùng model trung gian
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='PlaylistItem',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('playlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='music.playlist')),
+                        ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='playlist_items', to='music.song')),
+                    ],
+                    options={
+                        'db_table': 'playlists_songs',
+                        'ordering': ['position', 'id'],
+                        'unique_together': {('playlist', 'song')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='playlist',
+                    name='songs',
+                    field=models.ManyToManyField(related_name='playlists', through='music.PlaylistItem', to='music.song'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='playlistitem',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='playlistitem',
+            name='added_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='added_playlist_items', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='playlistitem',
+            name='added_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='playlistedithistory',
+            name='action',
+            field=models.CharField(choices=[('CREATE', 'Tạo mới'), ('UPDATE_INFO', 'Cập nhật thông tin'), ('ADD_SONG', 'Thêm bài hát'), ('REMOVE_SONG', 'Xóa bài hát'), ('ADD_COLLABORATOR', 'Thêm cộng tác viên'), ('REMOVE_COLLABORATOR', 'Xóa cộng tác viên'), ('CHANGE_ROLE', 'Thay đổi vai trò'), ('RESTORE', 'Khôi phục'), ('BULK_EDIT', 'Chỉnh sửa hàng loạt')], max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='playlistitem',
+            index=models.Index(fields=['playlist', 'position'], name='playlist_item_position_idx'),
+        ),
+        migrations.RunPython(populate_positions, migrations.RunPython.noop),
+    ]
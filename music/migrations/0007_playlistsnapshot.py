@@ -0,0 +1,32 @@
+# Generated by Django 5.0.1 on 2026-10-19 14:33
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0006_playlistitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaylistSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('last_history_id', models.BigIntegerField(default=0)),
+                ('song_ids', models.BinaryField()),
+                ('songs_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('playlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='music.playlist')),
+            ],
+            options={
+                'db_table': 'playlist_snapshots',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['playlist', 'created_at'], name='playlist_snapshot_time_idx')],
+            },
+        ),
+    ]
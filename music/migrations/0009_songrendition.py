@@ -0,0 +1,33 @@
+# Generated by Django 5.0.1 on 2026-10-19 14:41
+
+import django.db.models.deletion
+import music.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0008_ingestjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quality', models.CharField(max_length=20)),
+                ('codec', models.CharField(choices=[('mp3', 'MP3'), ('aac', 'AAC'), ('opus', 'Opus')], max_length=10)),
+                ('bitrate', models.PositiveIntegerField(help_text='kbps')),
+                ('file', models.FileField(max_length=255, upload_to=music.models.rendition_upload_path)),
+                ('file_size', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='music.song')),
+            ],
+            options={
+                'db_table': 'song_renditions',
+                'ordering': ['song', 'bitrate'],
+                'unique_together': {('song', 'quality')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.1 on 2026-10-19 14:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0009_songrendition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongStreamPackage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.CharField(max_length=40)),
+                ('storage_prefix', models.CharField(max_length=255)),
+                ('segment_duration', models.FloatField()),
+                ('duration', models.FloatField(default=0)),
+                ('variants', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('song', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stream_package', to='music.song')),
+            ],
+            options={
+                'db_table': 'song_stream_packages',
+            },
+        ),
+    ]
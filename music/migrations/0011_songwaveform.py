@@ -0,0 +1,31 @@
+# Generated by Django 5.0.1 on 2026-10-19 14:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0010_songstreampackage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongWaveform',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sample_rate', models.PositiveIntegerField()),
+                ('duration', models.FloatField(default=0)),
+                ('levels', models.JSONField(default=list)),
+                ('peaks', models.BinaryField()),
+                ('rms', models.BinaryField()),
+                ('max_peak', models.FloatField(default=0)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('song', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='waveform', to='music.song')),
+            ],
+            options={
+                'db_table': 'song_waveforms',
+            },
+        ),
+    ]
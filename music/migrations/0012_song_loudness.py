@@ -0,0 +1,38 @@
+# Generated by Django 5.0.1 on 2026-10-19 14:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0011_songwaveform'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='integrated_loudness',
+            field=models.FloatField(blank=True, help_text='LUFS', null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='loudness_analyzed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='loudness_range',
+            field=models.FloatField(blank=True, help_text='LU', null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='replay_gain',
+            field=models.FloatField(blank=True, help_text='Gain (dB) đưa bài hát về LOUDNESS_TARGET_LUFS', null=True),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='true_peak',
+            field=models.FloatField(blank=True, help_text='dBTP', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-19 14:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0012_song_loudness'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.1 on 2026-10-19 14:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0013_song_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='cover_thumbnails',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='image_thumbnails',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='image_thumbnails',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='cover_thumbnails',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='cover_thumbnails',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
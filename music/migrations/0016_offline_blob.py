@@ -0,0 +1,46 @@
+# Generated by Django 5.0.1 on 2026-10-19 15:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0015_offline_download_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OfflineBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(max_length=255, upload_to='offline/blobs/')),
+                ('size', models.BigIntegerField(default=0)),
+                ('content_type', models.CharField(default='audio/mpeg', max_length=50)),
+                ('quality', models.CharField(blank=True, max_length=20)),
+                ('source_name', models.CharField(max_length=255)),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('released_at', models.DateTimeField(blank=True, null=True)),
+                ('song', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='offline_blobs', to='music.song')),
+            ],
+            options={
+                'db_table': 'offline_blobs',
+            },
+        ),
+        migrations.AddField(
+            model_name='offlinedownload',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='downloads', to='music.offlineblob'),
+        ),
+        migrations.AddIndex(
+            model_name='offlineblob',
+            index=models.Index(fields=['song', 'quality'], name='offline_blob_source_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offlineblob',
+            index=models.Index(fields=['ref_count', 'released_at'], name='offline_blob_gc_idx'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.0.1 on 2026-10-19 15:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0016_offline_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongArtist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'song_artists',
+                'ordering': ['position'],
+            },
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='album_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='songs', to='music.album'),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='genre_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='songs', to='music.genre'),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['title', 'artist'], name='album_title_artist_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['artist'], name='album_artist_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='artist',
+            index=models.Index(fields=['name'], name='artist_name_idx'),
+        ),
+        migrations.AddField(
+            model_name='songartist',
+            name='artist',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='song_links', to='music.artist'),
+        ),
+        migrations.AddField(
+            model_name='songartist',
+            name='song',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='artist_links', to='music.song'),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='artists',
+            field=models.ManyToManyField(blank=True, related_name='songs', through='music.SongArtist', to='music.artist'),
+        ),
+        migrations.AddIndex(
+            model_name='songartist',
+            index=models.Index(fields=['artist', 'song'], name='song_artist_artist_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='songartist',
+            constraint=models.UniqueConstraint(fields=('song', 'artist'), name='unique_song_artist'),
+        ),
+    ]
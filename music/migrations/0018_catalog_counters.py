@@ -0,0 +1,110 @@
+# Generated by Django 5.0.1 on 2026-10-19 15:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0017_catalog_relations'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='song_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='top_min_plays',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='top_song_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='total_likes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='total_plays',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='song_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='top_min_plays',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='top_song_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='total_likes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='total_plays',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='song_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='top_min_plays',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='top_song_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='total_likes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='total_plays',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['-total_plays', '-song_count'], name='album_popularity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='artist',
+            index=models.Index(fields=['-total_plays', '-song_count'], name='artist_popularity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='genre',
+            index=models.Index(fields=['-total_plays', '-song_count'], name='genre_popularity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['album_ref', '-play_count'], name='song_album_plays_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['genre_ref', '-play_count'], name='song_genre_plays_idx'),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.0.1 on 2026-10-19 15:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_comment_tree(apps, schema_editor):
+    """Tính root, path, depth và reply_count cho các bình luận hiện có"""
+    Comment = apps.get_model('music', 'Comment')
+    parents = dict(Comment.objects.values_list('id', 'parent_id'))
+    reply_counts = {}
+    for parent_id in parents.values():
+        if parent_id:
+            reply_counts[parent_id] = reply_counts.get(parent_id, 0) + 1
+    paths = {}
+
+    def chain(comment_id):
+        # Danh sách id từ gốc tới bình luận (không đệ quy để tránh luồng quá sâu)
+        ids = []
+        while comment_id is not None and comment_id not in paths:
+            ids.append(comment_id)
+            comment_id = parents.get(comment_id)
+        prefix = paths[comment_id] if comment_id is not None else []
+        for current in reversed(ids):
+            prefix = prefix + [current]
+            paths[current] = prefix
+        return paths[ids[0]] if ids else prefix
+
+    batch = []
+    for comment in Comment.objects.order_by('id').only('id').iterator():
+        ids = chain(comment.id)
+        comment.root_id = ids[0] if len(ids) > 1 else None
+        comment.depth = len(ids) - 1
+        comment.path = '.'.join(str(i).zfill(10) for i in ids)[:255]
+        comment.reply_count = reply_counts.get(comment.id, 0)
+        batch.append(comment)
+        if len(batch) >= 1000:
+            Comment.objects.bulk_update(batch, ['root', 'depth', 'path', 'reply_count'])
+            batch = []
+    if batch:
+        Comment.objects.bulk_update(batch, ['root', 'depth', 'path', 'reply_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0018_catalog_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0, help_text='Số trả lời trực tiếp'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='root',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thread', to='music.comment'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['song', 'parent', '-created_at', '-id'], name='comment_song_roots_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['root', 'path'], name='comment_thread_path_idx'),
+        ),
+        migrations.RunPython(populate_comment_tree, migrations.RunPython.noop),
+    ]
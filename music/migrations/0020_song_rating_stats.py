@@ -0,0 +1,79 @@
+# Generated by Django 5.0.1 on 2026-10-19 15:18
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def populate_rating_stats(apps, schema_editor):
+    """Tính tổng hợp đánh giá cho các bài hát hiện có từ bảng ratings"""
+    Song = apps.get_model('music', 'Song')
+    Rating = apps.get_model('music', 'Rating')
+    fields = ['rating_count', 'rating_sum'] + [f'rating_{value}' for value in range(1, 6)]
+    rows = Rating.objects.values('song_id').annotate(
+        rating_count=Count('id'),
+        rating_sum=Sum('rating'),
+        **{f'rating_{value}': Count('id', filter=Q(rating=value)) for value in range(1, 6)}
+    )
+    batch = []
+    for row in rows:
+        song = Song(id=row['song_id'])
+        for name in fields:
+            setattr(song, name, row[name] or 0)
+        batch.append(song)
+        if len(batch) >= 500:
+            Song.objects.bulk_update(batch, fields)
+            batch = []
+    if batch:
+        Song.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0019_comment_tree'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['-rating_count'], name='song_rating_count_idx'),
+        ),
+        migrations.RunPython(populate_rating_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.1 on 2026-10-19 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0020_song_rating_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lyricline',
+            name='words',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddIndex(
+            model_name='lyricline',
+            index=models.Index(fields=['song', 'timestamp'], name='lyric_song_time_idx'),
+        ),
+    ]
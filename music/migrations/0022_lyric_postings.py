@@ -0,0 +1,29 @@
+# Generated by Django 5.0.1 on 2026-10-19 15:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0021_lyric_words'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LyricPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=129)),
+                ('line_no', models.PositiveIntegerField(help_text='Thứ tự dòng lời trong bài hát')),
+                ('position', models.PositiveSmallIntegerField(help_text='Vị trí của từ trong dòng')),
+                ('timestamp', models.FloatField(blank=True, null=True)),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lyric_postings', to='music.song')),
+            ],
+            options={
+                'db_table': 'lyric_postings',
+                'indexes': [models.Index(fields=['term', 'song', 'line_no'], name='lyric_posting_term_idx')],
+            },
+        ),
+    ]
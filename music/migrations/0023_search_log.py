@@ -0,0 +1,44 @@
+# Generated by Django 5.0.1 on 2026-10-19 15:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0022_lyric_postings'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchQueryStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.CharField(max_length=255)),
+                ('display', models.CharField(max_length=255)),
+                ('day', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'search_query_stats',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='searchhistory',
+            index=models.Index(fields=['user', '-timestamp'], name='search_history_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchhistory',
+            index=models.Index(fields=['timestamp'], name='search_history_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchquerystats',
+            index=models.Index(fields=['day', '-count'], name='search_stats_day_count_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='searchquerystats',
+            constraint=models.UniqueConstraint(fields=('query', 'day'), name='search_stats_query_day_uniq'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.1 on 2026-10-19 16:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0024_catalog_relations_backfill'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SuggestChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=10)),
+                ('object_id', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'db_table': 'suggest_changes',
+            },
+        ),
+    ]
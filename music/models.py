@@ -1,6 +1,9 @@
 from django.db import models
 from django.conf import settings
 from django.utils import timezone
+from array import array
+import os
+import sys
 
 User = settings.AUTH_USER_MODEL
 
@@ -11,6 +14,8 @@ class Song(models.Model):
     duration = models.IntegerField()  # seconds
     audio_file = models.FileField(upload_to='songs/%Y/%m/%d/')
     cover_image = models.ImageField(upload_to='covers/%Y/%m/%d/', null=True, blank=True)
+    # Ảnh thu nhỏ của cover_image, xem music.thumbnails
+    cover_thumbnails = models.JSONField(default=dict, blank=True)
     genre = models.CharField(max_length=100, blank=True)
     likes_count = models.IntegerField(default=0)
     play_count = models.IntegerField(default=0)
@@ -19,21 +24,197 @@ class Song(models.Model):
     lyrics = models.TextField(blank=True)
     release_date = models.DateField(null=True, blank=True)
     is_approved = models.BooleanField(default=True, help_text="Đánh dấu bài hát đã được phê duyệt")
+    is_ready = models.BooleanField(default=True, help_text="Bài hát đã xử lý xong các bước bắt buộc và có thể phát")
+
+    # Độ to đo theo EBU R128; client áp dụng replay_gain khi phát thay vì mã hóa lại file
+    integrated_loudness = models.FloatField(null=True, blank=True, help_text="LUFS")
+    true_peak = models.FloatField(null=True, blank=True, help_text="dBTP")
+    loudness_range = models.FloatField(null=True, blank=True, help_text="LU")
+    replay_gain = models.FloatField(null=True, blank=True, help_text="Gain (dB) đưa bài hát về LOUDNESS_TARGET_LUFS")
+    loudness_analyzed_at = models.DateTimeField(null=True, blank=True)
+
+    # SHA-256 nội dung file audio gốc, dùng để loại bài trùng khi import
+    content_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+
+    # Quan hệ suy ra từ các chuỗi artist/album/genre ở trên, xem music.catalog
+    album_ref = models.ForeignKey('Album', on_delete=models.SET_NULL, null=True, blank=True, related_name='songs')
+    genre_ref = models.ForeignKey('Genre', on_delete=models.SET_NULL, null=True, blank=True, related_name='songs')
+    artists = models.ManyToManyField('Artist', through='SongArtist', related_name='songs', blank=True)
+
+    # Tổng hợp đánh giá, cập nhật cùng lúc với bảng ratings (xem music.ratings)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
+    # Tổng hợp đánh giá chỉ được ghi bằng UPDATE với biểu thức F (music.ratings):
+    # save() không chỉ định update_fields không ghi đè các cột này bằng giá trị cũ
+    RATING_FIELDS = ('rating_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5')
+
+    # Các trường hiển thị trên trang chủ (music.homepage); lượt nghe, lượt thích và
+    # tổng hợp đánh giá đổi liên tục nên không nằm trong danh sách này
+    HOMEPAGE_FIELDS = (
+        'title', 'artist', 'album', 'duration', 'audio_file', 'cover_image', 'cover_thumbnails', 'genre',
+        'uploaded_by_id', 'release_date', 'is_ready', 'integrated_loudness', 'true_peak', 'replay_gain',
+    )
     
     class Meta:
         db_table = 'songs'
         ordering = ['-created_at']
+        indexes = [
+            # Top bài hát của album/thể loại (catalog.refresh_top_songs)
+            models.Index(fields=['album_ref', '-play_count'], name='song_album_plays_idx'),
+            models.Index(fields=['genre_ref', '-play_count'], name='song_genre_plays_idx'),
+            models.Index(fields=['-rating_count'], name='song_rating_count_idx'),
+            # Nối bài hát theo tên khi tạo album/nghệ sĩ/thể loại (catalog.link_songs_to)
+            models.Index(fields=['artist'], name='song_artist_idx'),
+            models.Index(fields=['album'], name='song_album_idx'),
+            models.Index(fields=['genre'], name='song_genre_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.artist}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Giá trị lúc đọc: chỉ đồng bộ lại quan hệ danh mục khi các chuỗi này đổi
+        instance._catalog_names = instance.catalog_names()
+        # ... và chỉ đánh chỉ mục lại lời bài hát khi lời đổi
+        instance._loaded_lyrics = instance.__dict__.get('lyrics')
+        # ... và chỉ dựng lại trang chủ khi các trường hiển thị trên trang chủ đổi
+        instance._homepage_values = instance.homepage_values()
+        return instance
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        if update_fields is None:
+            values = [value for value in values if value[0].attname not in self.RATING_FIELDS]
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+
+    def catalog_names(self):
+        return tuple(self.__dict__.get(name) for name in ('artist', 'album', 'genre'))
+
+    def homepage_values(self):
+        return tuple(self.__dict__.get(name) for name in self.HOMEPAGE_FIELDS)
+
+class IngestJob(models.Model):
+    """Tiến trình xử lý file audio sau khi upload (metadata, chuyển mã, phân tích âm lượng)"""
+    STATUS_CHOICES = (
+        ('PENDING', 'Đang chờ'),
+        ('RUNNING', 'Đang xử lý'),
+        ('COMPLETED', 'Hoàn thành'),
+        ('FAILED', 'Thất bại'),
+    )
+
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='ingest_jobs')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='ingest_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    # Trạng thái từng bước: {"metadata": {"status": "COMPLETED", "result": {...}, "error": null}, ...}
+    stages = models.JSONField(default=dict)
+    # Các trường người dùng đã nhập, không bị metadata trong file ghi đè
+    provided_fields = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'ingest_jobs'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='ingest_job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Ingest #{self.id} ({self.status}) for song {self.song_id}"
+
+def rendition_upload_path(instance, filename):
+    """Lưu bản chuyển mã cạnh file gốc: songs/2024/01/01/renditions/<file>"""
+    source_dir = os.path.dirname(instance.song.audio_file.name or '') or 'songs'
+    return f"{source_dir}/renditions/{filename}"
+
+class SongRendition(models.Model):
+    """Một bản chuyển mã của bài hát ở một mức chất lượng (codec + bitrate)"""
+    CODEC_CHOICES = (
+        ('mp3', 'MP3'),
+        ('aac', 'AAC'),
+        ('opus', 'Opus'),
+    )
+
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='renditions')
+    quality = models.CharField(max_length=20)
+    codec = models.CharField(max_length=10, choices=CODEC_CHOICES)
+    bitrate = models.PositiveIntegerField(help_text="kbps")
+    file = models.FileField(upload_to=rendition_upload_path, max_length=255)
+    file_size = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'song_renditions'
+        ordering = ['song', 'bitrate']
+        unique_together = ('song', 'quality')
+
+    def __str__(self):
+        return f"{self.song_id} {self.quality} ({self.codec} {self.bitrate}k)"
+
+class SongStreamPackage(models.Model):
+    """Bài hát đã chia đoạn cho HLS/DASH (fMP4, nhiều mức bitrate)"""
+    song = models.OneToOneField(Song, on_delete=models.CASCADE, related_name='stream_package')
+    # Thay đổi khi file nguồn hoặc cấu hình chia đoạn thay đổi; nằm trong URL đoạn
+    # nên mỗi URL luôn trỏ tới cùng một nội dung (cache vĩnh viễn được)
+    version = models.CharField(max_length=40)
+    # Thư mục trong storage chứa các đoạn của phiên bản hiện tại
+    storage_prefix = models.CharField(max_length=255)
+    segment_duration = models.FloatField()
+    duration = models.FloatField(default=0)
+    # [{"name": "128k", "bitrate": 128, "init": "init.mp4", "segments": [["seg_00000.m4s", 6.0], ...]}, ...]
+    variants = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'song_stream_packages'
+
+    def __str__(self):
+        return f"Stream package {self.version} for song {self.song_id}"
+
+    def get_variant(self, name):
+        return next((variant for variant in self.variants if variant['name'] == name), None)
+
+class SongWaveform(models.Model):
+    """Dữ liệu waveform tính sẵn của bài hát ở nhiều độ phân giải
+
+    Mỗi mức lưu peak và RMS của từng đoạn dưới dạng byte 0-255 (uint8), các mức
+    nối liền nhau theo thứ tự trong `levels`.
+    """
+    song = models.OneToOneField(Song, on_delete=models.CASCADE, related_name='waveform')
+    sample_rate = models.PositiveIntegerField()
+    duration = models.FloatField(default=0)
+    # Số điểm của từng mức, giảm dần (ví dụ [2048, 512, 128])
+    levels = models.JSONField(default=list)
+    peaks = models.BinaryField()
+    rms = models.BinaryField()
+    # Peak lớn nhất của cả bài (0-1)
+    max_peak = models.FloatField(default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'song_waveforms'
+
+    def __str__(self):
+        return f"Waveform {self.levels} for song {self.song_id}"
+
 class Playlist(models.Model):
     name = models.CharField(max_length=200)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='playlists')
-    songs = models.ManyToManyField(Song, related_name='playlists')
+    songs = models.ManyToManyField(Song, through='PlaylistItem', related_name='playlists')
     description = models.TextField(blank=True)
     is_public = models.BooleanField(default=True)
     cover_image = models.ImageField(upload_to='playlist_covers/', null=True, blank=True)
+    cover_thumbnails = models.JSONField(default=dict, blank=True)
     followers = models.ManyToManyField(User, related_name='followed_playlists', blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -42,6 +223,9 @@ class Playlist(models.Model):
     is_collaborative = models.BooleanField(default=False, help_text="Playlist có thể được chỉnh sửa bởi nhiều người cộng tác")
     collaborators = models.ManyToManyField(User, through='CollaboratorRole', related_name='collaborative_playlists', through_fields=('playlist', 'user'))
 
+    # Số phiên bản, tăng sau mỗi lần chỉnh sửa danh sách bài hát
+    version = models.PositiveIntegerField(default=0)
+
     class Meta:
         db_table = 'playlists'
         ordering = ['-created_at']
@@ -49,30 +233,38 @@ class Playlist(models.Model):
     def __str__(self):
         return f"{self.name} by {self.user.username}"
 
-    def can_access(self, user):
-        if self.is_public:
-            return True
-        return user == self.user or (self.is_collaborative and user in self.collaborators.all())
+    def can_access(self, user, acl=None):
+        """Kiểm tra quyền xem playlist (truyền acl để dùng lại kết quả đã nạp theo lô)"""
+        from .permissions import PlaylistACL
+        return (acl or PlaylistACL(user)).can_access(self)
     
-    def can_edit(self, user):
-        """Kiểm tra xem người dùng có quyền chỉnh sửa playlist không"""
-        # Chủ sở hữu luôn có quyền chỉnh sửa
-        if user == self.user:
-            return True
-        
-        # Admin luôn có quyền chỉnh sửa
-        if user.is_admin:
-            return True
-        
-        # Kiểm tra xem người dùng có phải là người cộng tác có quyền chỉnh sửa không
-        if self.is_collaborative:
-            try:
-                role = CollaboratorRole.objects.get(playlist=self, user=user)
-                return role.can_edit
-            except CollaboratorRole.DoesNotExist:
-                return False
-                
-        return False
+    def can_edit(self, user, acl=None):
+        """Kiểm tra xem người dùng có quyền chỉnh sửa playlist không
+
+        Chủ sở hữu, admin và cộng tác viên có vai trò EDITOR được chỉnh sửa.
+        """
+        from .permissions import PlaylistACL
+        return (acl or PlaylistACL(user)).can_edit(self)
+
+class PlaylistItem(models.Model):
+    """Bài hát trong playlist kèm vị trí (bảng trung gian của Playlist.songs)"""
+    playlist = models.ForeignKey(Playlist, on_delete=models.CASCADE, related_name='items')
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='playlist_items')
+    position = models.PositiveIntegerField(default=0)
+    added_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='added_playlist_items')
+    added_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # Giữ tên bảng của quan hệ M2M cũ để không phải sao chép dữ liệu
+        db_table = 'playlists_songs'
+        unique_together = ('playlist', 'song')
+        ordering = ['position', 'id']
+        indexes = [
+            models.Index(fields=['playlist', 'position'], name='playlist_item_position_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.playlist_id}#{self.position}: {self.song_id}"
 
 class CollaboratorRole(models.Model):
     """Model để lưu trữ vai trò của người cộng tác trong playlist"""
@@ -110,6 +302,7 @@ class PlaylistEditHistory(models.Model):
         ('REMOVE_COLLABORATOR', 'Xóa cộng tác viên'),
         ('CHANGE_ROLE', 'Thay đổi vai trò'),
         ('RESTORE', 'Khôi phục'),
+        ('BULK_EDIT', 'Chỉnh sửa hàng loạt'),
     )
     
     playlist = models.ForeignKey(Playlist, on_delete=models.CASCADE, related_name='edit_history')
@@ -145,6 +338,46 @@ class PlaylistEditHistory(models.Model):
             related_user=related_user
         )
 
+class PlaylistSnapshot(models.Model):
+    """Ảnh chụp danh sách bài hát của playlist tại một phiên bản, lưu dạng mảng song_id nén"""
+    playlist = models.ForeignKey(Playlist, on_delete=models.CASCADE, related_name='snapshots')
+    version = models.PositiveIntegerField()
+    # ID bản ghi PlaylistEditHistory cuối cùng đã được tính vào snapshot
+    last_history_id = models.BigIntegerField(default=0)
+    song_ids = models.BinaryField()
+    songs_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'playlist_snapshots'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['playlist', 'created_at'], name='playlist_snapshot_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"Snapshot v{self.version} of playlist {self.playlist_id} at {self.created_at}"
+
+    @staticmethod
+    def pack_song_ids(song_ids):
+        """Nén danh sách song_id thành mảng int64 little-endian"""
+        packed = array('q', song_ids)
+        if sys.byteorder == 'big':
+            packed.byteswap()
+        return packed.tobytes()
+
+    @staticmethod
+    def unpack_song_ids(data):
+        """Giải nén mảng song_id"""
+        packed = array('q')
+        packed.frombytes(bytes(data))
+        if sys.byteorder == 'big':
+            packed.byteswap()
+        return packed.tolist()
+
+    def get_song_ids(self):
+        return self.unpack_song_ids(self.song_ids)
+
 class Message(models.Model):
     MESSAGE_TYPES = (
         ('TEXT', 'Text Message'),
@@ -208,41 +441,161 @@ class SongPlayHistory(models.Model):
         db_table = 'song_play_history'
         ordering = ['-played_at']
 
-class Album(models.Model):
+class CatalogCounters(models.Model):
+    """
+    Số liệu tổng hợp của album/nghệ sĩ/thể loại, cập nhật dần khi phát, thích,
+    thêm bài hát (xem music.catalog) và đối soát bằng lệnh reconcile_catalog_stats.
+    """
+    song_count = models.PositiveIntegerField(default=0)
+    total_plays = models.BigIntegerField(default=0)
+    total_likes = models.BigIntegerField(default=0)
+    # Id các bài hát nhiều lượt nghe nhất và lượt nghe của bài cuối danh sách
+    # (0 khi danh sách chưa đủ): bài có ít lượt nghe hơn không cần xét lại
+    top_song_ids = models.JSONField(default=list, blank=True)
+    top_min_plays = models.BigIntegerField(default=0)
+
+    # Chỉ được ghi bằng UPDATE (biểu thức F, music.catalog): save() không chỉ định
+    # update_fields (sửa thông tin trong trang quản trị) không ghi đè bằng giá trị cũ
+    COUNTER_FIELDS = ('song_count', 'total_plays', 'total_likes', 'top_song_ids', 'top_min_plays')
+
+    class Meta:
+        abstract = True
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        if update_fields is None:
+            values = [value for value in values if value[0].attname not in self.COUNTER_FIELDS]
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+
+
+class Album(CatalogCounters):
     title = models.CharField(max_length=200)
     artist = models.CharField(max_length=200)
     release_date = models.DateField()
     cover_image = models.ImageField(upload_to='album_covers/%Y/%m/%d/', null=True, blank=True)
+    cover_thumbnails = models.JSONField(default=dict, blank=True)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         db_table = 'albums'
         ordering = ['-release_date']
+        indexes = [
+            models.Index(fields=['title', 'artist'], name='album_title_artist_idx'),
+            models.Index(fields=['artist'], name='album_artist_idx'),
+            models.Index(fields=['-total_plays', '-song_count'], name='album_popularity_idx'),
+        ]
 
-class Genre(models.Model):
+class Genre(CatalogCounters):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to='genre_images/', null=True, blank=True)
+    image_thumbnails = models.JSONField(default=dict, blank=True)
     
     class Meta:
         db_table = 'genres'
+        indexes = [
+            models.Index(fields=['-total_plays', '-song_count'], name='genre_popularity_idx'),
+        ]
 
 class SearchHistory(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     query = models.CharField(max_length=255)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Không dùng auto_now_add: bulk_create của music.search_log giữ thời điểm tìm kiếm trong bộ đệm
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Lịch sử của một người dùng (SearchHistoryView, gợi ý bài hát)
+            models.Index(fields=['user', '-timestamp'], name='search_history_user_idx'),
+            # Xóa bản ghi cũ theo lô (prune_search_history)
+            models.Index(fields=['timestamp'], name='search_history_time_idx'),
+        ]
+
+
+class SearchQueryStats(models.Model):
+    """Số lượt tìm theo từ khóa (đã chuẩn hóa) mỗi ngày, cộng dồn khi ghi lịch sử (xem music.search_log)"""
+    query = models.CharField(max_length=255)
+    # Cách viết gần nhất của từ khóa, để hiển thị
+    display = models.CharField(max_length=255)
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'search_query_stats'
+        constraints = [
+            models.UniqueConstraint(fields=['query', 'day'], name='search_stats_query_day_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['day', '-count'], name='search_stats_day_count_idx'),
+        ]
+
+class SuggestChange(models.Model):
+    """Nhật ký thay đổi của chỉ mục gợi ý (xem music.suggest): id tăng dần là số phiên bản"""
+    kind = models.CharField(max_length=10)
+    object_id = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = 'suggest_changes'
+
+class LibraryChange(models.Model):
+    """Nhật ký thay đổi thư viện của người dùng (xem music.library): id tăng dần là số phiên bản"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='library_changes')
+    section = models.CharField(max_length=10)
+    # None: không biết id nào đổi, client tải lại cả mục
+    object_id = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'library_changes'
+        indexes = [
+            models.Index(fields=['user', 'id'], name='library_change_user_idx'),
+        ]
 
 class Comment(models.Model):
+    # Mỗi đoạn của path là id 10 chữ số; 23 đoạn vừa 255 ký tự
+    PATH_STEP = 10
+    MAX_DEPTH = 22
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='comments')
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
 
+    # Cây bình luận (xem music.comments): bình luận gốc của luồng, đường dẫn
+    # id từ gốc tới bình luận này (sắp theo path = thứ tự duyệt cây) và độ sâu
+    root = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='thread')
+    path = models.CharField(max_length=255, blank=True, default='')
+    depth = models.PositiveSmallIntegerField(default=0)
+    reply_count = models.PositiveIntegerField(default=0, help_text="Số trả lời trực tiếp")
+
     class Meta:
         db_table = 'comments'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['song', 'parent', '-created_at', '-id'], name='comment_song_roots_idx'),
+            models.Index(fields=['root', 'path'], name='comment_thread_path_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        parent = None
+        if creating and self.parent_id:
+            parent = Comment.objects.only('id', 'parent_id', 'root_id', 'path', 'depth').get(pk=self.parent_id)
+            if parent.depth >= self.MAX_DEPTH:
+                # Luồng quá sâu: trả lời vào cùng cấp với bình luận cha
+                parent = Comment.objects.only('id', 'parent_id', 'root_id', 'path', 'depth').get(pk=parent.parent_id)
+                self.parent_id = parent.id
+            self.root_id = parent.root_id or parent.id
+            self.depth = parent.depth + 1
+        super().save(*args, **kwargs)
+        if creating:
+            segment = str(self.pk).zfill(self.PATH_STEP)
+            self.path = f'{parent.path}.{segment}' if parent else segment
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+            if parent:
+                Comment.objects.filter(pk=parent.pk).update(reply_count=models.F('reply_count') + 1)
 
 class Rating(models.Model):
     RATING_CHOICES = [
@@ -262,15 +615,27 @@ class Rating(models.Model):
         db_table = 'ratings'
         unique_together = ['user', 'song']  # Một user chỉ đánh giá một bài hát một lần
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Giá trị lúc đọc: để signal trừ đúng đánh giá cũ khi sửa/xóa
+        instance._loaded_rating = (instance.__dict__.get('song_id'), instance.__dict__.get('rating'))
+        return instance
+
 class LyricLine(models.Model):
     """Model lưu trữ từng dòng lời bài hát đồng bộ với thời gian"""
     song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='lyric_lines')
     timestamp = models.FloatField(help_text="Thời điểm hiển thị lời (tính bằng giây)")
     text = models.TextField()
+    # Enhanced LRC: [[thời điểm (giây), từ], ...], rỗng với LRC thường
+    words = models.JSONField(default=list, blank=True)
     
     class Meta:
         db_table = 'lyric_lines'
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['song', 'timestamp'], name='lyric_song_time_idx'),
+        ]
         
     def __str__(self):
         return f"[{self.format_timestamp()}] {self.text[:30]}"
@@ -281,18 +646,58 @@ class LyricLine(models.Model):
         seconds = self.timestamp % 60
         return f"{minutes:02d}:{seconds:05.2f}"
 
-class Artist(models.Model):
+class LyricPosting(models.Model):
+    """
+    Chỉ mục ngược của lời bài hát (xem music.lyrics_search): mỗi bản ghi là một
+    từ đã bỏ dấu tại một vị trí trong một dòng lời.
+    """
+    # Một từ hoặc một cặp từ liền nhau ("khong ve")
+    term = models.CharField(max_length=129)
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='lyric_postings')
+    line_no = models.PositiveIntegerField(help_text="Thứ tự dòng lời trong bài hát")
+    position = models.PositiveSmallIntegerField(help_text="Vị trí của từ trong dòng")
+    # Thời điểm của dòng lời đồng bộ, None với lời không đồng bộ
+    timestamp = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'lyric_postings'
+        indexes = [
+            models.Index(fields=['term', 'song', 'line_no'], name='lyric_posting_term_idx'),
+        ]
+
+class Artist(CatalogCounters):
     """Model cho nghệ sĩ"""
     name = models.CharField(max_length=200)
     bio = models.TextField(blank=True)
     image = models.ImageField(upload_to='artist_images/', null=True, blank=True)
+    image_thumbnails = models.JSONField(default=dict, blank=True)
     
     class Meta:
         db_table = 'artists'
+        indexes = [
+            models.Index(fields=['name'], name='artist_name_idx'),
+            models.Index(fields=['-total_plays', '-song_count'], name='artist_popularity_idx'),
+        ]
         
     def __str__(self):
         return self.name
 
+class SongArtist(models.Model):
+    """Nghệ sĩ thể hiện bài hát (theo thứ tự trong chuỗi Song.artist)"""
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='artist_links')
+    artist = models.ForeignKey(Artist, on_delete=models.CASCADE, related_name='song_links')
+    position = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        db_table = 'song_artists'
+        ordering = ['position']
+        constraints = [
+            models.UniqueConstraint(fields=['song', 'artist'], name='unique_song_artist'),
+        ]
+        indexes = [
+            models.Index(fields=['artist', 'song'], name='song_artist_artist_idx'),
+        ]
+
 class Queue(models.Model):
     """Model lưu trữ hàng đợi phát nhạc của người dùng"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='queue')
@@ -350,6 +755,35 @@ class UserRecommendation(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.song.title} ({self.score})"
 
+class OfflineBlob(models.Model):
+    """
+    Một file nghe offline dùng chung, định danh theo SHA-256 nội dung.
+
+    Các OfflineDownload tham chiếu tới blob thay vì giữ bản sao riêng; blob bị
+    xóa khi ref_count về 0 (xem music.offline.collect_offline_blobs).
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='offline/blobs/', max_length=255)
+    size = models.BigIntegerField(default=0)
+    content_type = models.CharField(max_length=50, default='audio/mpeg')
+    # Nguồn tạo ra blob, để lần tải sau của bài hát không cần sao chép lại
+    song = models.ForeignKey(Song, on_delete=models.SET_NULL, null=True, blank=True, related_name='offline_blobs')
+    quality = models.CharField(max_length=20, blank=True)
+    source_name = models.CharField(max_length=255)
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    released_at = models.DateTimeField(null=True, blank=True)  # Lần cuối ref_count về 0
+
+    class Meta:
+        db_table = 'offline_blobs'
+        indexes = [
+            models.Index(fields=['song', 'quality'], name='offline_blob_source_idx'),
+            models.Index(fields=['ref_count', 'released_at'], name='offline_blob_gc_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.ref_count} refs)"
+
 class OfflineDownload(models.Model):
     """Model lưu trữ thông tin các bài hát đã được tải xuống để nghe offline"""
     STATUS_CHOICES = (
@@ -365,14 +799,28 @@ class OfflineDownload(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     progress = models.IntegerField(default=0)  # Tiến độ tải xuống (0-100)
     local_path = models.CharField(max_length=500, blank=True, null=True)  # Đường dẫn lưu trữ cục bộ
+    blob = models.ForeignKey(OfflineBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='downloads')
     download_time = models.DateTimeField(auto_now_add=True)  # Thời điểm tải xuống
     expiry_time = models.DateTimeField(null=True, blank=True)  # Thời điểm hết hạn (nếu có)
     is_active = models.BooleanField(default=True)  # Trạng thái còn khả dụng hay không
+    # Hàng đợi tải xuống (xem music.offline)
+    quality = models.CharField(max_length=20, blank=True)  # Mức chất lượng (rendition), trống = file gốc
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    bytes_done = models.BigIntegerField(default=0)
+    bytes_total = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         db_table = 'offline_downloads'
         ordering = ['-download_time']
         unique_together = ['user', 'song']  # Mỗi người dùng chỉ tải một bài hát một lần
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='offline_download_queue_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.song.title} ({self.get_status_display()})"
@@ -386,9 +834,11 @@ class OfflineDownload(models.Model):
             return False
             
         if self.expiry_time and self.expiry_time < timezone.now():
+            from .offline import release_download
             self.status = 'EXPIRED'
             self.is_active = False
-            self.save()
+            self.save(update_fields=['status', 'is_active', 'updated_at'])
+            release_download(self)
             return False
             
         return True
\ No newline at end of file
@@ -0,0 +1,469 @@
+"""
+Hàng đợi tải xuống offline.
+
+Hàng đợi chính là các bản ghi OfflineDownload (status PENDING), nên không mất
+job khi khởi động lại server (xem lệnh run_offline_downloads).
+
+- dispatch_downloads() nhận job đến hạn, giới hạn số job chạy đồng thời toàn
+  hệ thống (OFFLINE_DOWNLOAD_CONCURRENCY) và của mỗi người dùng
+  (OFFLINE_DOWNLOAD_PER_USER), rồi chạy job trên pool luồng của music.workers.
+- File được sao chép theo khối (hoặc chuyển mã bằng ffmpeg nếu chọn mức chất
+  lượng chưa có rendition), tiến độ thật được ghi vào DB.
+- Lỗi được thử lại với thời gian chờ tăng dần, tối đa OFFLINE_DOWNLOAD_MAX_ATTEMPTS lần.
+- Khi xong (hoặc thất bại hẳn), người dùng nhận thông báo qua WebSocket
+  (music.consumers.MusicNotificationConsumer).
+- Mỗi nội dung chỉ lưu một lần (OfflineBlob, theo SHA-256); các bản tải xuống
+  chỉ tham chiếu tới blob. Blob hết tham chiếu được dọn bởi collect_offline_blobs
+  (lệnh collect_offline_blobs), nên dung lượng tăng theo kho nhạc chứ không
+  theo số người dùng.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, ProtectedError, Q
+from django.utils import timezone
+
+from .metadata import file_sha256
+from .models import OfflineBlob, OfflineDownload, SongRendition
+from .renditions import CODECS, get_ladder
+from .utils import verify_offline_song
+from .workers import is_eager, run_in_background
+
+logger = logging.getLogger(__name__)
+
+_dispatch_lock = threading.Lock()
+
+# Ghi tiến độ vào DB tối đa mỗi khoảng này (giây)
+PROGRESS_INTERVAL = 0.5
+_FFMPEG_TIME_RE = re.compile(r'^out_time_us=(\d+)$')
+# Muxer ffmpeg cho từng codec (file tạm .part không cho ffmpeg đoán định dạng từ đuôi)
+TRANSCODE_FORMATS = {'mp3': 'mp3', 'aac': 'mp4', 'opus': 'ogg'}
+
+
+class DownloadCancelled(Exception):
+    """Người dùng đã xóa bản tải xuống trong lúc đang xử lý"""
+
+
+def notification_group(user_id):
+    return f'music_user_{user_id}'
+
+
+def notify_user(user_id, event, payload):
+    """Gửi thông báo tới các kết nối WebSocket của người dùng (bỏ qua nếu không có channel layer)"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(
+            notification_group(user_id),
+            {'type': 'music.notification', 'event': event, 'data': payload}
+        )
+    except Exception as e:
+        logger.warning(f"Không gửi được thông báo tới user {user_id}: {str(e)}")
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+# ---------------------------------------------------------------------------
+# Hàng đợi
+# ---------------------------------------------------------------------------
+
+def enqueue_download(download, quality=None):
+    """Đưa bản tải xuống vào hàng đợi (sau khi transaction commit)"""
+    if download.pk:
+        release_download(download)
+    download.status = 'PENDING'
+    download.progress = 0
+    download.bytes_done = 0
+    download.bytes_total = 0
+    download.attempts = 0
+    download.error = ''
+    download.next_attempt_at = None
+    download.is_active = True
+    if quality is not None:
+        download.quality = quality
+    download.save()
+    transaction.on_commit(dispatch_downloads)
+    return download
+
+
+def _claim(download_id):
+    """Chuyển job từ PENDING sang DOWNLOADING; False nếu luồng khác đã nhận"""
+    return OfflineDownload.objects.filter(id=download_id, status='PENDING', is_active=True).update(
+        status='DOWNLOADING', started_at=timezone.now(), error='', updated_at=timezone.now()
+    ) == 1
+
+
+def dispatch_downloads():
+    """Nhận các job đến hạn trong giới hạn đồng thời và chạy chúng trên pool luồng"""
+    claimed = []
+    with _dispatch_lock:
+        concurrency = _setting('OFFLINE_DOWNLOAD_CONCURRENCY', 2)
+        per_user = _setting('OFFLINE_DOWNLOAD_PER_USER', 1)
+        running = dict(
+            OfflineDownload.objects.filter(status='DOWNLOADING')
+            .values_list('user_id').annotate(count=Count('id')).values_list('user_id', 'count')
+        )
+        slots = concurrency - sum(running.values())
+        if slots <= 0:
+            return 0
+
+        now = timezone.now()
+        due = (
+            OfflineDownload.objects.filter(status='PENDING', is_active=True)
+            .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+            .order_by('download_time', 'id')
+            .values_list('id', 'user_id')
+        )
+        for download_id, user_id in due.iterator():
+            if len(claimed) >= slots:
+                break
+            if running.get(user_id, 0) >= per_user:
+                continue
+            if _claim(download_id):
+                running[user_id] = running.get(user_id, 0) + 1
+                claimed.append(download_id)
+
+    for download_id in claimed:
+        run_in_background(run_download_job, download_id)
+    return len(claimed)
+
+
+def _schedule_retry(delay):
+    """Gọi lại dispatch khi đến hạn thử lại (trong tiến trình hiện tại)"""
+    if is_eager() or delay <= 0:
+        dispatch_downloads()
+        return
+    timer = threading.Timer(delay, dispatch_downloads)
+    timer.daemon = True
+    timer.start()
+
+
+# ---------------------------------------------------------------------------
+# Thực thi một job
+# ---------------------------------------------------------------------------
+
+class _ProgressWriter:
+    """Ghi tiến độ vào DB có giới hạn tần suất; phát hiện job bị hủy"""
+
+    def __init__(self, download, total):
+        self.download = download
+        self.total = total
+        self.last_write = 0.0
+        self.last_percent = -1
+        OfflineDownload.objects.filter(id=download.id).update(
+            bytes_total=total, bytes_done=0, progress=0, updated_at=timezone.now()
+        )
+
+    def update(self, done):
+        percent = min(int(done * 100 / self.total), 99) if self.total else 0
+        now = time.monotonic()
+        if percent == self.last_percent or now - self.last_write < PROGRESS_INTERVAL:
+            return
+        updated = OfflineDownload.objects.filter(id=self.download.id, is_active=True).update(
+            bytes_done=done, progress=percent, updated_at=timezone.now()
+        )
+        if not updated:
+            raise DownloadCancelled()
+        self.last_write = now
+        self.last_percent = percent
+
+
+def _select_source(download):
+    """
+    Nguồn của bản tải xuống: (storage, tên file, khóa nguồn, (codec, bitrate) nếu phải chuyển mã).
+
+    Khóa nguồn xác định nội dung đầu ra, dùng để tìm blob đã có mà không cần sao chép lại.
+    """
+    song = download.song
+    if download.quality:
+        rendition = SongRendition.objects.filter(song=song, quality=download.quality).first()
+        if rendition and rendition.file:
+            return rendition.file.storage, rendition.file.name, rendition.file.name, None
+        ladder = {quality: (codec, bitrate) for quality, codec, bitrate in get_ladder()}
+        if download.quality not in ladder:
+            raise ValueError(f'Mức chất lượng không hợp lệ: {download.quality}')
+        if not song.audio_file:
+            raise ValueError('Bài hát không có file audio')
+        codec, bitrate = ladder[download.quality]
+        source_name = f'{song.audio_file.name}@{codec}/{bitrate}k'
+        return song.audio_file.storage, song.audio_file.name, source_name, (codec, bitrate)
+    if not song.audio_file:
+        raise ValueError('Bài hát không có file audio')
+    return song.audio_file.storage, song.audio_file.name, song.audio_file.name, None
+
+
+def _copy_chunked(storage, name, target_path, progress):
+    """Sao chép theo khối và tính SHA-256 cùng lúc, trả về (kích thước, hash)"""
+    chunk_size = _setting('OFFLINE_DOWNLOAD_CHUNK_SIZE', 1024 * 1024)
+    digest = hashlib.sha256()
+    done = 0
+    with storage.open(name, 'rb') as source, open(target_path, 'wb') as target:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            target.write(chunk)
+            digest.update(chunk)
+            done += len(chunk)
+            progress.update(done)
+    return done, digest.hexdigest()
+
+
+def _transcode(source_path, codec, bitrate, target_path, progress):
+    """Chuyển mã bằng ffmpeg, tiến độ tính theo thời gian đã xử lý (mili giây)"""
+    spec = CODECS[codec]
+    cmd = [
+        'ffmpeg', '-v', 'error', '-nostdin', '-y', '-i', source_path, '-vn', '-map_metadata', '0',
+        *spec['args'], '-b:a', f'{bitrate}k', '-f', TRANSCODE_FORMATS[codec],
+        '-progress', 'pipe:1', '-nostats', target_path
+    ]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        for line in process.stdout:
+            match = _FFMPEG_TIME_RE.match(line.strip())
+            if match:
+                progress.update(int(match.group(1)) // 1000)
+        stderr = process.stderr.read()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg lỗi: {stderr.strip()[-500:]}")
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    return os.path.getsize(target_path), file_sha256(target_path)
+
+
+# ---------------------------------------------------------------------------
+# Blob dùng chung (OfflineBlob) và đếm tham chiếu
+# ---------------------------------------------------------------------------
+
+def blob_path(sha256, extension):
+    return f'offline/blobs/{sha256[:2]}/{sha256}{extension}'
+
+
+def blob_local_path(blob):
+    try:
+        return blob.file.path
+    except NotImplementedError:
+        return blob.file.name
+
+
+def find_blob(song_id, quality, source_name):
+    """Blob đã tạo từ đúng nguồn này (nếu file vẫn còn trong storage)"""
+    blob = OfflineBlob.objects.filter(song_id=song_id, quality=quality, source_name=source_name).first()
+    if blob and blob.file.storage.exists(blob.file.name):
+        return blob
+    return None
+
+
+def store_blob(temp_path, sha256, size, extension, song_id, quality, source_name):
+    """Lưu file tạm thành blob theo hash; dùng lại blob cùng nội dung nếu đã có"""
+    blob = OfflineBlob.objects.filter(sha256=sha256).first()
+    if blob is not None:
+        return blob
+    storage = OfflineBlob._meta.get_field('file').storage
+    name = blob_path(sha256, extension)
+    if not storage.exists(name):
+        with open(temp_path, 'rb') as f:
+            name = storage.save(name, File(f))
+    try:
+        with transaction.atomic():
+            return OfflineBlob.objects.create(
+                sha256=sha256, file=name, size=size,
+                content_type=mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                song_id=song_id, quality=quality, source_name=source_name,
+                # ref_count = 0 cho tới khi acquire_blob; released_at để GC dọn nếu không ai dùng
+                released_at=timezone.now(),
+            )
+    except IntegrityError:
+        # Job khác vừa tạo blob cùng nội dung
+        return OfflineBlob.objects.get(sha256=sha256)
+
+
+def acquire_blob(download_id, blob):
+    """
+    Gắn blob vào bản tải xuống và tăng ref_count.
+
+    Trả về False nếu blob vừa bị GC xóa; ném DownloadCancelled nếu bản tải xuống đã bị hủy.
+    """
+    with transaction.atomic():
+        if not OfflineBlob.objects.filter(id=blob.id).update(ref_count=F('ref_count') + 1, released_at=None):
+            return False
+        now = timezone.now()
+        updated = OfflineDownload.objects.filter(id=download_id, is_active=True).update(
+            blob=blob, status='COMPLETED', progress=100, local_path=blob_local_path(blob),
+            bytes_done=blob.size, bytes_total=blob.size, finished_at=now, updated_at=now
+        )
+        if not updated:
+            transaction.set_rollback(True)
+            raise DownloadCancelled()
+    return True
+
+
+def release_blob(blob_id):
+    """Giảm ref_count của blob (một tham chiếu vừa bị bỏ)"""
+    OfflineBlob.objects.filter(id=blob_id).update(ref_count=F('ref_count') - 1, released_at=timezone.now())
+
+
+def release_download(download):
+    """Bỏ tham chiếu của bản tải xuống tới blob (khi xóa, hết hạn hoặc tải lại)"""
+    blob_id = OfflineDownload.objects.filter(id=download.id).values_list('blob_id', flat=True).first()
+    if blob_id is None:
+        return False
+    with transaction.atomic():
+        # Điều kiện blob_id: chỉ một lời gọi giảm ref_count dù bị gọi đồng thời
+        if not OfflineDownload.objects.filter(id=download.id, blob_id=blob_id).update(blob=None, local_path=None):
+            return False
+        release_blob(blob_id)
+    download.blob = None
+    download.local_path = None
+    return True
+
+
+def expire_downloads():
+    """Đánh dấu EXPIRED các bản tải xuống quá hạn và bỏ tham chiếu tới blob"""
+    expired = list(OfflineDownload.objects.filter(
+        status='COMPLETED', is_active=True, expiry_time__lt=timezone.now()
+    ))
+    for download in expired:
+        OfflineDownload.objects.filter(id=download.id).update(
+            status='EXPIRED', is_active=False, updated_at=timezone.now()
+        )
+        release_download(download)
+    return len(expired)
+
+
+def collect_offline_blobs(grace_minutes=60, repair=False):
+    """
+    Dọn các blob không còn được tham chiếu quá grace_minutes phút.
+
+    repair=True: tính lại ref_count từ các bản tải xuống trước khi dọn.
+    Trả về {'expired', 'repaired', 'deleted', 'bytes_freed'}.
+    """
+    stats = {'expired': expire_downloads(), 'repaired': 0, 'deleted': 0, 'bytes_freed': 0}
+    if repair:
+        for blob in OfflineBlob.objects.annotate(actual=Count('downloads')).exclude(ref_count=F('actual')):
+            OfflineBlob.objects.filter(id=blob.id).update(
+                ref_count=blob.actual, released_at=blob.released_at or timezone.now()
+            )
+            stats['repaired'] += 1
+
+    cutoff = timezone.now() - timedelta(minutes=grace_minutes)
+    for blob in OfflineBlob.objects.filter(ref_count__lte=0, released_at__lt=cutoff):
+        try:
+            # Điều kiện ref_count: không xóa blob vừa được acquire
+            deleted, _ = OfflineBlob.objects.filter(id=blob.id, ref_count__lte=0).delete()
+        except ProtectedError:
+            logger.warning(f"Blob {blob.sha256} còn bản tải xuống tham chiếu, cần chạy với repair")
+            continue
+        if deleted:
+            blob.file.storage.delete(blob.file.name)
+            stats['deleted'] += 1
+            stats['bytes_freed'] += blob.size
+    return stats
+
+
+def run_download_job(download_id):
+    """Chạy một job đã được nhận (status DOWNLOADING)"""
+    download = OfflineDownload.objects.select_related('song').get(id=download_id)
+    temp_path = None
+    try:
+        storage, name, source_name, transcode = _select_source(download)
+        blob = find_blob(download.song_id, download.quality, source_name)
+        if blob is None or not acquire_blob(download_id, blob):
+            if transcode is None:
+                extension = os.path.splitext(name)[1]
+                temp_path = _temp_path(extension)
+                progress = _ProgressWriter(download, storage.size(name))
+                size, sha256 = _copy_chunked(storage, name, temp_path, progress)
+            else:
+                codec, bitrate = transcode
+                extension = f".{CODECS[codec]['ext']}"
+                temp_path = _temp_path(extension)
+                # Tổng là thời lượng (mili giây) vì không biết trước kích thước file đầu ra
+                progress = _ProgressWriter(download, (download.song.duration or 0) * 1000)
+                size, sha256 = _transcode(download.song.audio_file.path, codec, bitrate, temp_path, progress)
+            if not verify_offline_song(temp_path):
+                raise RuntimeError('File tải xuống không hợp lệ')
+            blob = store_blob(temp_path, sha256, size, extension, download.song_id, download.quality, source_name)
+            if not acquire_blob(download_id, blob):
+                raise RuntimeError('Blob vừa bị dọn, thử lại')
+    except DownloadCancelled:
+        logger.info(f"Tải xuống #{download_id} đã bị hủy")
+        _finish(download_id, status='FAILED', error='Đã hủy')
+        dispatch_downloads()
+        return None
+    except Exception as e:
+        logger.warning(f"Tải xuống #{download_id} lỗi: {str(e)}")
+        _handle_failure(download, str(e))
+        return None
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    notify_user(download.user_id, 'offline_download.completed', {
+        'download_id': download_id,
+        'song_id': download.song_id,
+        'status': 'COMPLETED',
+        'bytes': blob.size,
+        'sha256': blob.sha256,
+    })
+    dispatch_downloads()
+    return blob
+
+
+def _temp_path(extension):
+    fd, path = tempfile.mkstemp(suffix=extension, prefix='offline_')
+    os.close(fd)
+    return path
+
+
+def _finish(download_id, **fields):
+    now = timezone.now()
+    OfflineDownload.objects.filter(id=download_id).update(finished_at=now, updated_at=now, **fields)
+
+
+def _handle_failure(download, error):
+    attempts = download.attempts + 1
+    max_attempts = _setting('OFFLINE_DOWNLOAD_MAX_ATTEMPTS', 3)
+    if attempts < max_attempts:
+        delay = _setting('OFFLINE_DOWNLOAD_RETRY_DELAY', 30) * 2 ** (attempts - 1)
+        OfflineDownload.objects.filter(id=download.id).update(
+            status='PENDING', attempts=attempts, error=error, progress=0, bytes_done=0,
+            next_attempt_at=timezone.now() + timedelta(seconds=delay), updated_at=timezone.now()
+        )
+        _schedule_retry(delay)
+        return
+
+    _finish(download.id, status='FAILED', attempts=attempts, error=error, progress=0)
+    notify_user(download.user_id, 'offline_download.failed', {
+        'download_id': download.id,
+        'song_id': download.song_id,
+        'status': 'FAILED',
+        'error': error,
+    })
+    dispatch_downloads()
+
+
+def requeue_stale_downloads(stale_minutes=30):
+    """Đưa các job DOWNLOADING bị gián đoạn (server khởi động lại) về hàng đợi"""
+    stale_before = timezone.now() - timedelta(minutes=stale_minutes)
+    return OfflineDownload.objects.filter(status='DOWNLOADING', updated_at__lt=stale_before).update(
+        status='PENDING', progress=0, bytes_done=0, next_attempt_at=None, updated_at=timezone.now()
+    )
@@ -0,0 +1,105 @@
+"""
+Kiểm tra quyền truy cập/chỉnh sửa playlist theo lô.
+
+PlaylistACL nạp vai trò cộng tác của một người dùng cho cả danh sách playlist
+bằng một truy vấn duy nhất và ghi nhớ kết quả trong suốt request, thay vì tải
+toàn bộ danh sách cộng tác viên hoặc truy vấn CollaboratorRole cho từng playlist.
+"""
+from django.db.models import Exists, OuterRef, Q, QuerySet
+
+from .models import CollaboratorRole
+
+_REQUEST_ATTR = '_music_playlist_acl'
+
+ROLE_OWNER = 'OWNER'
+ROLE_EDITOR = 'EDITOR'
+ROLE_VIEWER = 'VIEWER'
+
+
+class PlaylistACL:
+    """Quyền của một người dùng trên các playlist"""
+
+    def __init__(self, user):
+        self.user = user
+        self.is_authenticated = bool(user and user.is_authenticated)
+        self.is_admin = self.is_authenticated and bool(getattr(user, 'is_admin', False))
+        # playlist_id -> vai trò cộng tác ('EDITOR', 'VIEWER') hoặc None
+        self._roles = {}
+
+    @classmethod
+    def for_request(cls, request):
+        """Lấy ACL đã ghi nhớ trên request cho người dùng hiện tại"""
+        target = getattr(request, '_request', request)
+        acl = getattr(target, _REQUEST_ATTR, None)
+        if acl is None or acl.user != request.user:
+            acl = cls(request.user)
+            setattr(target, _REQUEST_ATTR, acl)
+        return acl
+
+    def _needs_role(self, playlist):
+        return (
+            self.is_authenticated
+            and playlist.is_collaborative
+            and playlist.user_id != self.user.pk
+            and playlist.pk not in self._roles
+        )
+
+    def prefetch(self, playlists):
+        """Nạp vai trò cho các playlist chưa có trong bộ nhớ bằng một truy vấn"""
+        missing = {playlist.pk for playlist in playlists if self._needs_role(playlist)}
+        if not missing:
+            return
+        for playlist_id in missing:
+            self._roles[playlist_id] = None
+        rows = CollaboratorRole.objects.filter(user=self.user, playlist_id__in=missing).values_list('playlist_id', 'role')
+        for playlist_id, role in rows:
+            self._roles[playlist_id] = role
+
+    def role(self, playlist):
+        """Vai trò của người dùng trên playlist: OWNER, EDITOR, VIEWER hoặc None"""
+        if not self.is_authenticated:
+            return None
+        if playlist.user_id == self.user.pk:
+            return ROLE_OWNER
+        if not playlist.is_collaborative:
+            return None
+        if playlist.pk not in self._roles:
+            self.prefetch([playlist])
+        return self._roles.get(playlist.pk)
+
+    def can_access(self, playlist):
+        if playlist.is_public:
+            return True
+        return self.role(playlist) is not None
+
+    def can_edit(self, playlist):
+        if self.is_admin:
+            return True
+        return self.role(playlist) in (ROLE_OWNER, ROLE_EDITOR)
+
+    def filter_accessible(self, playlists):
+        """Lọc danh sách playlist mà người dùng được xem (một truy vấn cho cả danh sách)"""
+        playlists = list(playlists)
+        self.prefetch([playlist for playlist in playlists if not playlist.is_public])
+        return [playlist for playlist in playlists if self.can_access(playlist)]
+
+
+def accessible_playlists_q(user):
+    """Điều kiện Q cho các playlist người dùng được xem"""
+    if not (user and user.is_authenticated):
+        return Q(is_public=True)
+    is_collaborator = Exists(CollaboratorRole.objects.filter(playlist=OuterRef('pk'), user=user))
+    return Q(is_public=True) | Q(user=user) | (Q(is_collaborative=True) & Q(is_collaborator))
+
+
+def filter_accessible(user, playlists, request=None):
+    """
+    Lọc playlist người dùng được xem.
+
+    Với QuerySet, điều kiện được đưa vào SQL (không tải dữ liệu); với danh sách
+    đã tải, dùng PlaylistACL (ghi nhớ theo request nếu có).
+    """
+    if isinstance(playlists, QuerySet):
+        return playlists.filter(accessible_playlists_q(user))
+    acl = PlaylistACL.for_request(request) if request is not None else PlaylistACL(user)
+    return acl.filter_accessible(playlists)
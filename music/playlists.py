@@ -0,0 +1,313 @@
+"""
+Chỉnh sửa danh sách bài hát của playlist theo lô.
+
+Một lô (patch) gồm các thao tác `add`, `remove`, `move`, được áp dụng trong một
+transaction duy nhất: xóa bằng một câu DELETE, thêm bằng `bulk_create`, cập nhật
+vị trí bằng `bulk_update`, tăng `Playlist.version` và ghi đúng một bản ghi
+`PlaylistEditHistory` cho cả lô.
+
+Cứ mỗi PLAYLIST_SNAPSHOT_INTERVAL phiên bản, danh sách bài hát được lưu thành
+`PlaylistSnapshot`. Khôi phục về một thời điểm chỉ cần snapshot gần nhất trước
+thời điểm đó và phát lại các thao tác trong lịch sử kể từ snapshot.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Playlist, PlaylistItem, PlaylistEditHistory, PlaylistSnapshot, Song
+
+MAX_PLAYLIST_SONGS = 1000
+MAX_OPERATIONS_PER_BATCH = 1000
+
+OPERATION_TYPES = ('add', 'remove', 'move')
+
+
+class PlaylistEditError(Exception):
+    """Lỗi dữ liệu khi chỉnh sửa playlist (trả về 400)"""
+
+
+class PlaylistSongNotFound(PlaylistEditError):
+    """Bài hát cần thêm không tồn tại hoặc không có file audio (trả về 404)"""
+
+    def __init__(self, song_ids):
+        super().__init__(f'Không tìm thấy bài hát hoặc bài hát không có file audio: {song_ids}')
+        self.song_ids = song_ids
+
+
+class PlaylistVersionConflict(PlaylistEditError):
+    """Phiên bản client gửi lên không khớp với phiên bản hiện tại (trả về 409)"""
+
+    def __init__(self, current_version):
+        super().__init__(f'Playlist đã được cập nhật (phiên bản hiện tại: {current_version})')
+        self.current_version = current_version
+
+
+def _clamp_position(position, length):
+    if position is None or position > length:
+        return length
+    return max(position, 0)
+
+
+def normalize_operations(operations):
+    """Kiểm tra và chuẩn hóa danh sách thao tác từ request"""
+    if not isinstance(operations, list) or not operations:
+        raise PlaylistEditError('Cần cung cấp danh sách thao tác (operations)')
+    if len(operations) > MAX_OPERATIONS_PER_BATCH:
+        raise PlaylistEditError(f'Tối đa {MAX_OPERATIONS_PER_BATCH} thao tác mỗi lần chỉnh sửa')
+
+    normalized = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise PlaylistEditError(f'Thao tác #{index} không hợp lệ')
+        op = operation.get('op')
+        if op not in OPERATION_TYPES:
+            raise PlaylistEditError(f'Thao tác #{index}: op phải là một trong {", ".join(OPERATION_TYPES)}')
+        try:
+            song_id = int(operation.get('song_id'))
+        except (TypeError, ValueError):
+            raise PlaylistEditError(f'Thao tác #{index}: song_id không hợp lệ')
+
+        item = {'op': op, 'song_id': song_id}
+        if op in ('add', 'move'):
+            position = operation.get('position')
+            if position is None and op == 'move':
+                raise PlaylistEditError(f'Thao tác #{index}: move cần có position')
+            if position is not None:
+                try:
+                    position = int(position)
+                except (TypeError, ValueError):
+                    raise PlaylistEditError(f'Thao tác #{index}: position không hợp lệ')
+                item['position'] = position
+        normalized.append(item)
+    return normalized
+
+
+def snapshot_interval():
+    return max(int(getattr(settings, 'PLAYLIST_SNAPSHOT_INTERVAL', 50)), 1)
+
+
+def apply_operations(song_ids, operations, strict=True):
+    """
+    Áp dụng các thao tác lên danh sách song_id theo thứ tự (không truy vấn DB).
+
+    Thêm bài hát đã có hoặc xóa bài hát không có trong playlist được bỏ qua để
+    có thể gửi lại cùng một patch một cách an toàn. Với strict=False, di chuyển
+    bài hát không có trong danh sách cũng được bỏ qua (dùng khi phát lại lịch sử).
+    Trả về (danh sách mới, các thao tác thực sự được áp dụng).
+    """
+    order = list(song_ids)
+    present = set(order)
+    applied = []
+
+    for operation in operations:
+        op = operation['op']
+        song_id = operation['song_id']
+
+        if op == 'add':
+            if song_id in present:
+                continue
+            position = _clamp_position(operation.get('position'), len(order))
+            order.insert(position, song_id)
+            present.add(song_id)
+            applied.append({'op': 'add', 'song_id': song_id, 'position': position})
+        elif op == 'remove':
+            if song_id not in present:
+                continue
+            order.remove(song_id)
+            present.discard(song_id)
+            applied.append({'op': 'remove', 'song_id': song_id})
+        else:
+            if song_id not in present:
+                if not strict:
+                    continue
+                raise PlaylistEditError(f'Bài hát {song_id} không có trong playlist')
+            current = order.index(song_id)
+            order.pop(current)
+            position = _clamp_position(operation.get('position'), len(order))
+            order.insert(position, song_id)
+            if position != current:
+                applied.append({'op': 'move', 'song_id': song_id, 'position': position})
+
+    return order, applied
+
+
+def _replace_operations(current, target):
+    """Các thao tác biến danh sách current thành target"""
+    target_set = set(target)
+    current_set = set(current)
+    operations = [{'op': 'remove', 'song_id': song_id} for song_id in current if song_id not in target_set]
+    for position, song_id in enumerate(target):
+        op = 'move' if song_id in current_set else 'add'
+        operations.append({'op': op, 'song_id': song_id, 'position': position})
+    return operations
+
+
+def take_snapshot(playlist, song_ids=None, last_history_id=None):
+    """Lưu snapshot danh sách bài hát hiện tại của playlist"""
+    if song_ids is None:
+        song_ids = list(
+            PlaylistItem.objects.filter(playlist=playlist).order_by('position', 'id').values_list('song_id', flat=True)
+        )
+    if last_history_id is None:
+        last_history_id = PlaylistEditHistory.objects.filter(playlist=playlist).order_by('-id').values_list(
+            'id', flat=True
+        ).first() or 0
+    return PlaylistSnapshot.objects.create(
+        playlist=playlist,
+        version=playlist.version,
+        last_history_id=last_history_id,
+        song_ids=PlaylistSnapshot.pack_song_ids(song_ids),
+        songs_count=len(song_ids),
+    )
+
+
+def edit_playlist_songs(playlist, user, operations=None, expected_version=None, details=None,
+                        require_audio=True, action=None, target_song_ids=None):
+    """
+    Áp dụng một lô thao tác lên playlist trong một transaction.
+
+    Nếu truyền target_song_ids, các thao tác được tính (sau khi khóa playlist)
+    để đưa playlist về đúng danh sách đó. Trả về dict gồm version mới, số bài
+    hát và các thao tác đã áp dụng.
+    """
+    if target_song_ids is None:
+        operations = normalize_operations(operations)
+    if expected_version is not None:
+        try:
+            expected_version = int(expected_version)
+        except (TypeError, ValueError):
+            raise PlaylistEditError('version không hợp lệ')
+
+    with transaction.atomic():
+        # Khóa playlist để các lô chỉnh sửa đồng thời được xếp hàng
+        locked = Playlist.objects.select_for_update().get(pk=playlist.pk)
+        if expected_version is not None and expected_version != locked.version:
+            raise PlaylistVersionConflict(locked.version)
+
+        items = list(
+            PlaylistItem.objects.filter(playlist=locked).only('id', 'song_id', 'position').order_by('position', 'id')
+        )
+        items_by_song = {item.song_id: item for item in items}
+        old_order = [item.song_id for item in items]
+
+        if target_song_ids is not None:
+            operations = _replace_operations(old_order, target_song_ids)
+        new_order, applied = apply_operations(old_order, operations)
+        if not applied:
+            return {'version': locked.version, 'songs_count': len(items), 'applied': []}
+
+        if len(new_order) > MAX_PLAYLIST_SONGS:
+            raise PlaylistEditError(f'Playlist đã đạt giới hạn tối đa {MAX_PLAYLIST_SONGS} bài hát')
+
+        added_ids = [song_id for song_id in new_order if song_id not in items_by_song]
+        if added_ids:
+            songs = Song.objects.filter(id__in=added_ids)
+            if require_audio:
+                songs = songs.exclude(audio_file='')
+            valid_ids = set(songs.values_list('id', flat=True))
+            missing = [song_id for song_id in added_ids if song_id not in valid_ids]
+            if missing:
+                raise PlaylistSongNotFound(missing)
+
+        kept = set(new_order)
+        removed_ids = [song_id for song_id in items_by_song if song_id not in kept]
+        if removed_ids:
+            PlaylistItem.objects.filter(playlist=locked, song_id__in=removed_ids).delete()
+
+        now = timezone.now()
+        to_create = []
+        to_update = []
+        for position, song_id in enumerate(new_order):
+            item = items_by_song.get(song_id)
+            if item is None:
+                to_create.append(PlaylistItem(
+                    playlist=locked, song_id=song_id, position=position, added_by=user, added_at=now
+                ))
+            elif item.position != position:
+                item.position = position
+                to_update.append(item)
+
+        if to_create:
+            PlaylistItem.objects.bulk_create(to_create)
+        if to_update:
+            PlaylistItem.objects.bulk_update(to_update, ['position'], batch_size=500)
+
+        # Playlist chưa từng được chỉnh sửa qua service: lưu trạng thái ban đầu làm mốc phát lại
+        if locked.version == 0:
+            take_snapshot(locked, old_order)
+
+        locked.version += 1
+        locked.save(update_fields=['version', 'updated_at'])
+
+        # Lô chỉ gồm một thao tác thêm/xóa vẫn ghi theo loại cũ để tương thích với chức năng khôi phục
+        related_song_id = None
+        if action is None:
+            action = 'BULK_EDIT'
+            if len(applied) == 1 and applied[0]['op'] in ('add', 'remove'):
+                action = 'ADD_SONG' if applied[0]['op'] == 'add' else 'REMOVE_SONG'
+                related_song_id = applied[0]['song_id']
+
+        history_details = dict(details or {})
+        history_details.update({'operations': applied, 'version': locked.version})
+        history = PlaylistEditHistory.objects.create(
+            playlist=locked,
+            user=user,
+            action=action,
+            details=history_details,
+            related_song_id=related_song_id,
+        )
+
+        if locked.version % snapshot_interval() == 0:
+            take_snapshot(locked, new_order, last_history_id=history.id)
+
+    playlist.version = locked.version
+    return {'version': locked.version, 'songs_count': len(new_order), 'applied': applied}
+
+
+def _history_operations(entry):
+    """Thao tác trên danh sách bài hát được ghi trong một bản ghi lịch sử"""
+    details = entry.details if isinstance(entry.details, dict) else {}
+    operations = details.get('operations')
+    if operations:
+        return operations
+    # Bản ghi cũ (trước khi có service) chỉ có related_song
+    if entry.action in ('ADD_SONG', 'REMOVE_SONG') and entry.related_song_id:
+        return [{'op': 'add' if entry.action == 'ADD_SONG' else 'remove', 'song_id': entry.related_song_id}]
+    return []
+
+
+def song_ids_at(playlist, at):
+    """
+    Danh sách song_id của playlist tại thời điểm `at`.
+
+    Đọc snapshot gần nhất trước `at` rồi phát lại các bản ghi lịch sử sau snapshot
+    đó; số bản ghi phải phát lại bị chặn bởi PLAYLIST_SNAPSHOT_INTERVAL.
+    """
+    snapshot = PlaylistSnapshot.objects.filter(playlist=playlist, created_at__lte=at).order_by(
+        '-created_at', '-id'
+    ).first()
+    if snapshot is None:
+        raise PlaylistEditError('Không có snapshot nào của playlist trước thời điểm này')
+
+    order = snapshot.get_song_ids()
+    entries = PlaylistEditHistory.objects.filter(
+        playlist=playlist, id__gt=snapshot.last_history_id, timestamp__lte=at
+    ).order_by('id').only('id', 'action', 'details', 'related_song_id')
+    for entry in entries:
+        order, _ = apply_operations(order, _history_operations(entry), strict=False)
+    return order, snapshot
+
+
+def restore_playlist_to(playlist, user, at, details=None):
+    """Khôi phục danh sách bài hát của playlist về trạng thái tại thời điểm `at`"""
+    target, snapshot = song_ids_at(playlist, at)
+    # Bỏ qua các bài hát đã bị xóa khỏi hệ thống
+    existing = set(Song.objects.filter(id__in=target).values_list('id', flat=True))
+    target = [song_id for song_id in target if song_id in existing]
+
+    restore_details = dict(details or {})
+    restore_details.update({'restored_to': at.isoformat(), 'snapshot_version': snapshot.version})
+    return edit_playlist_songs(
+        playlist, user, target_song_ids=target, details=restore_details,
+        require_audio=False, action='RESTORE'
+    )
@@ -0,0 +1,159 @@
+"""
+Tổng hợp đánh giá của bài hát (số lượt, tổng điểm, số lượt theo từng mức sao).
+
+- Các cột rating_* của Song được cộng/trừ bằng một câu UPDATE với biểu thức F
+  mỗi khi thêm, sửa, xóa Rating (xem signals), không cần quét bảng ratings.
+- Điểm trung bình và điểm Bayes tính từ các cột này; điểm Bayes kéo bài hát ít
+  lượt đánh giá về trung bình chung (lưu trong cache) để xếp hạng công bằng hơn.
+- save() đầy đủ của Song bỏ qua các cột này (Song.RATING_FIELDS) nên không
+  ghi đè lượt đánh giá vừa được cộng bằng giá trị cũ trong instance.
+- Lệnh reconcile_song_ratings tính lại từ bảng ratings khi số liệu lệch
+  (ví dụ sau khi sửa Rating bằng queryset.update()).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Q, Sum, Value
+from django.db.models.functions import Cast
+
+from .models import Rating, Song
+
+RATING_VALUES = (1, 2, 3, 4, 5)
+RATING_FIELDS = list(Song.RATING_FIELDS)
+RATING_PRIOR_CACHE_KEY = 'music:rating_prior'
+# Điểm trung bình chung khi chưa có đánh giá nào
+DEFAULT_PRIOR_MEAN = 3.0
+
+
+def _is_valid(value):
+    return value in RATING_VALUES
+
+
+def apply_rating_change(song_id, old=None, new=None):
+    """
+    Cập nhật tổng hợp của một bài hát khi đánh giá đổi từ old sang new.
+
+    old=None: đánh giá mới; new=None: đánh giá bị xóa. Một câu UPDATE duy nhất.
+    """
+    if old == new or song_id is None:
+        return 0
+    changes = {}
+    if _is_valid(old):
+        changes['rating_count'] = F('rating_count') - 1
+        changes['rating_sum'] = F('rating_sum') - old
+        changes[f'rating_{old}'] = F(f'rating_{old}') - 1
+    if _is_valid(new):
+        changes['rating_count'] = (changes.get('rating_count') or F('rating_count')) + 1
+        changes['rating_sum'] = (changes.get('rating_sum') or F('rating_sum')) + new
+        changes[f'rating_{new}'] = F(f'rating_{new}') + 1
+    if not changes:
+        return 0
+    return Song.objects.filter(id=song_id).update(**changes)
+
+
+def record_rating_saved(rating, created):
+    """Cộng đánh giá vừa lưu vào tổng hợp (trừ giá trị cũ nếu là sửa)"""
+    loaded = getattr(rating, '_loaded_rating', None)
+    current = (rating.song_id, rating.rating)
+    with transaction.atomic():
+        if created or loaded is None:
+            apply_rating_change(rating.song_id, new=rating.rating)
+        elif loaded != current:
+            old_song_id, old_value = loaded
+            if old_song_id == rating.song_id:
+                apply_rating_change(rating.song_id, old_value, rating.rating)
+            else:
+                apply_rating_change(old_song_id, old=old_value)
+                apply_rating_change(rating.song_id, new=rating.rating)
+    rating._loaded_rating = current
+
+
+def record_rating_deleted(rating):
+    """Trừ đánh giá vừa xóa khỏi tổng hợp (theo giá trị đã lưu trong DB)"""
+    song_id, value = getattr(rating, '_loaded_rating', None) or (rating.song_id, rating.rating)
+    apply_rating_change(song_id, old=value)
+
+
+def rating_average(song):
+    if not song.rating_count:
+        return None
+    return round(song.rating_sum / song.rating_count, 2)
+
+
+def rating_histogram(song):
+    return {str(value): getattr(song, f'rating_{value}') for value in RATING_VALUES}
+
+
+def prior_weight():
+    # Tối thiểu 1 để biểu thức không chia cho 0 với bài hát chưa có đánh giá
+    return max(getattr(settings, 'RATING_PRIOR_WEIGHT', 5), 1)
+
+
+def prior_mean():
+    """Điểm trung bình của mọi đánh giá (tính từ các cột tổng hợp, có cache)"""
+    def compute():
+        totals = Song.objects.aggregate(total=Sum('rating_sum'), count=Sum('rating_count'))
+        if not totals['count']:
+            return DEFAULT_PRIOR_MEAN
+        return totals['total'] / totals['count']
+
+    return cache.get_or_set(
+        RATING_PRIOR_CACHE_KEY, compute, getattr(settings, 'RATING_PRIOR_CACHE_TIMEOUT', 600)
+    )
+
+
+def bayesian_score_expression(mean=None, weight=None):
+    """Biểu thức (weight * mean + rating_sum) / (weight + rating_count) để annotate/sắp xếp"""
+    mean = prior_mean() if mean is None else mean
+    weight = prior_weight() if weight is None else weight
+    return (
+        (Cast('rating_sum', FloatField()) + Value(float(weight * mean)))
+        / (Cast('rating_count', FloatField()) + Value(float(weight)))
+    )
+
+
+def top_rated_songs(queryset=None, min_ratings=1, limit=20):
+    """Bài hát điểm Bayes cao nhất (không truy vấn bảng ratings)"""
+    queryset = Song.objects.all() if queryset is None else queryset
+    return (
+        queryset.filter(rating_count__gte=max(min_ratings, 1))
+        .annotate(bayesian_rating=bayesian_score_expression())
+        .order_by('-bayesian_rating', '-rating_count', 'id')[:limit]
+    )
+
+
+def reconcile_song_ratings(batch_size=500, dry_run=False):
+    """
+    Tính lại tổng hợp đánh giá của mọi bài hát từ bảng ratings.
+
+    Trả về số bài hát có số liệu sai lệch (đã sửa nếu không dry_run).
+    """
+    actual = {
+        row['song_id']: row
+        for row in Rating.objects.values('song_id').annotate(
+            rating_count=Count('id'),
+            rating_sum=Sum('rating'),
+            **{f'rating_{value}': Count('id', filter=Q(rating=value)) for value in RATING_VALUES}
+        )
+    }
+    empty = {name: 0 for name in RATING_FIELDS}
+    fixed = 0
+    batch = []
+    for song in Song.objects.only('id', *RATING_FIELDS).order_by('id').iterator(chunk_size=batch_size):
+        expected = actual.get(song.id, empty)
+        if all(getattr(song, name) == (expected[name] or 0) for name in RATING_FIELDS):
+            continue
+        fixed += 1
+        if dry_run:
+            continue
+        for name in RATING_FIELDS:
+            setattr(song, name, expected[name] or 0)
+        batch.append(song)
+        if len(batch) >= batch_size:
+            Song.objects.bulk_update(batch, RATING_FIELDS)
+            batch = []
+    if batch:
+        Song.objects.bulk_update(batch, RATING_FIELDS)
+    if fixed and not dry_run:
+        cache.delete(RATING_PRIOR_CACHE_KEY)
+    return fixed
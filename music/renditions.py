@@ -0,0 +1,191 @@
+"""
+Bậc chuyển mã (rendition ladder) cho bài hát.
+
+Mỗi bài hát được chuyển mã thành nhiều bản ở các mức bitrate/codec khác nhau
+(cấu hình MUSIC_RENDITION_LADDER), lưu cạnh file gốc. Các lệnh ffmpeg chạy song
+song trên pool tiến trình (music.workers). API stream chọn bản phù hợp theo tham
+số `quality` hoặc băng thông client báo lên.
+"""
+import logging
+import os
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+
+from .models import SongRendition
+from .workers import gather, run_in_process
+
+logger = logging.getLogger(__name__)
+
+# Tham số ffmpeg, phần mở rộng và MIME type theo codec
+CODECS = {
+    'mp3': {'ext': 'mp3', 'args': ['-c:a', 'libmp3lame'], 'content_type': 'audio/mpeg'},
+    'aac': {'ext': 'm4a', 'args': ['-c:a', 'aac', '-movflags', '+faststart'], 'content_type': 'audio/mp4'},
+    'opus': {'ext': 'opus', 'args': ['-c:a', 'libopus'], 'content_type': 'audio/ogg'},
+}
+
+DEFAULT_LADDER = (
+    ('low', 'mp3', 64),
+    ('medium', 'mp3', 128),
+    ('high', 'mp3', 256),
+)
+
+# Chỉ dùng tối đa 80% băng thông client báo lên để tránh giật khi mạng dao động
+BANDWIDTH_HEADROOM = 0.8
+
+ORIGINAL_QUALITY = 'original'
+
+
+def get_ladder():
+    """Danh sách (quality, codec, bitrate) đang cấu hình"""
+    ladder = getattr(settings, 'MUSIC_RENDITION_LADDER', DEFAULT_LADDER)
+    return [tuple(entry) for entry in ladder if entry[1] in CODECS]
+
+
+def encode_rendition_task(source_path, codec, bitrate):
+    """Chuyển mã một bản (chạy trên pool tiến trình), trả về đường dẫn file tạm"""
+    spec = CODECS[codec]
+    fd, output_path = tempfile.mkstemp(suffix=f".{spec['ext']}", prefix='rendition_')
+    os.close(fd)
+    cmd = [
+        'ffmpeg', '-v', 'error', '-nostdin', '-y', '-i', source_path,
+        '-vn', '-map_metadata', '0', *spec['args'], '-b:a', f'{bitrate}k', output_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True)
+    except Exception:
+        os.remove(output_path)
+        raise
+    if result.returncode != 0:
+        os.remove(output_path)
+        raise RuntimeError(f"ffmpeg lỗi: {result.stderr.strip()[-500:]}")
+    return output_path
+
+
+def submit_renditions(source_path, ladder=None):
+    """
+    Gửi tất cả các bản chuyển mã lên pool tiến trình cùng lúc.
+
+    Trả về một Future, kết quả là dict {(quality, codec, bitrate): Future}.
+    """
+    futures = {
+        entry: run_in_process(encode_rendition_task, source_path, entry[1], entry[2])
+        for entry in (ladder if ladder is not None else get_ladder())
+    }
+    return gather(futures)
+
+
+def save_renditions(song, futures):
+    """
+    Lưu các bản chuyển mã đã xong vào storage và DB.
+
+    Trả về (danh sách quality đã lưu, dict {quality: lỗi}).
+    """
+    saved = []
+    errors = {}
+    base_name = os.path.splitext(os.path.basename(song.audio_file.name))[0]
+    for (quality, codec, bitrate), future in futures.items():
+        try:
+            output_path = future.result()
+        except Exception as e:
+            logger.error(f"Chuyển mã {quality} cho bài hát {song.id} lỗi: {str(e)}")
+            errors[quality] = str(e)
+            continue
+        try:
+            rendition = SongRendition.objects.filter(song=song, quality=quality).first()
+            old_name = rendition.file.name if rendition else None
+            if rendition is None:
+                rendition = SongRendition(song=song, quality=quality)
+            rendition.codec = codec
+            rendition.bitrate = bitrate
+            with open(output_path, 'rb') as output:
+                rendition.file.save(f"{base_name}_{quality}.{CODECS[codec]['ext']}", File(output), save=False)
+            rendition.file_size = rendition.file.size
+            rendition.save()
+            if old_name and old_name != rendition.file.name:
+                rendition.file.storage.delete(old_name)
+            saved.append(quality)
+        except Exception as e:
+            logger.error(f"Lưu bản chuyển mã {quality} cho bài hát {song.id} lỗi: {str(e)}")
+            errors[quality] = str(e)
+        finally:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+    return saved, errors
+
+
+def generate_renditions(song, ladder=None):
+    """Tạo (hoặc tạo lại) các bản chuyển mã cho một bài hát, chờ đến khi xong"""
+    return save_renditions(song, submit_renditions(song.audio_file.path, ladder).result())
+
+
+def parse_bandwidth(request):
+    """
+    Băng thông client (kbps) từ tham số `bandwidth` (kbps) hoặc header
+    Client Hints `Downlink` (Mbps). Trả về None nếu không có.
+    """
+    value = request.query_params.get('bandwidth') if hasattr(request, 'query_params') else request.GET.get('bandwidth')
+    try:
+        if value:
+            return max(int(float(value)), 0)
+        downlink = request.META.get('HTTP_DOWNLINK')
+        if downlink:
+            return max(int(float(downlink) * 1000), 0)
+    except ValueError:
+        pass
+    return None
+
+
+class RenditionUnavailable(Exception):
+    """Chưa có bản chuyển mã nào không vượt quá chất lượng client yêu cầu (trả về 409)"""
+
+    def __init__(self, quality):
+        super().__init__(f'Chưa có bản chất lượng {quality} hoặc thấp hơn cho bài hát này')
+        self.quality = quality
+
+
+def select_rendition(song, quality=None, bandwidth=None, codec=None):
+    """
+    Chọn bản chuyển mã để phát.
+
+    - quality: tên chất lượng trong ladder ('low', 'medium', ...); 'original'
+      hoặc không truyền (và không có bandwidth) thì phát file gốc. Nếu bản đó
+      chưa có thì dùng bản thấp hơn gần nhất cùng codec, không bao giờ lùi về
+      file gốc (có thể lớn hơn nhiều); không có bản nào thì RenditionUnavailable.
+    - bandwidth: kbps, chọn bản bitrate cao nhất vừa với băng thông.
+    - codec: chỉ chọn trong codec client hỗ trợ (mặc định mp3).
+
+    Trả về SongRendition hoặc None (phát file gốc).
+    """
+    if quality == ORIGINAL_QUALITY or (not quality and bandwidth is None):
+        return None
+
+    renditions = list(song.renditions.all())
+    if quality:
+        exact = next((r for r in renditions if r.quality == quality), None)
+        if exact is not None:
+            return exact
+        target = {name: (ladder_codec, bitrate) for name, ladder_codec, bitrate in get_ladder()}.get(quality)
+        lower = sorted(
+            (r for r in renditions if target and r.codec == target[0] and r.bitrate <= target[1]),
+            key=lambda r: r.bitrate
+        )
+        if not lower:
+            raise RenditionUnavailable(quality)
+        return lower[-1]
+
+    candidates = sorted(
+        (r for r in renditions if r.codec == (codec or 'mp3')),
+        key=lambda r: r.bitrate
+    )
+    if not candidates:
+        return None
+    budget = bandwidth * BANDWIDTH_HEADROOM
+    fitting = [r for r in candidates if r.bitrate <= budget]
+    return fitting[-1] if fitting else candidates[0]
+
+
+def rendition_content_type(rendition):
+    return CODECS.get(rendition.codec, {}).get('content_type', 'application/octet-stream')
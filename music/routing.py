@@ -0,0 +1,10 @@
+"""
+WebSocket URL routing cho app music
+"""
+from django.urls import re_path
+from . import consumers
+
+websocket_urlpatterns = [
+    # Đường dẫn hỗ trợ token query parameter (token=<JWT_TOKEN>)
+    re_path(r'ws/music/notifications/$', consumers.MusicNotificationConsumer.as_asgi()),
+]
@@ -0,0 +1,179 @@
+"""
+Tìm kiếm tổng hợp: bài hát, nghệ sĩ, album, playlist công khai và lời bài hát.
+
+- Mỗi mục chỉ lấy tối đa `limit` kết quả phổ biến nhất; số kết quả là ước lượng
+  bị chặn trên (đếm tối đa SEARCH_COUNT_CAP bản ghi) thay vì count() trên toàn
+  bộ bảng, nên thời gian và kích thước phản hồi không phụ thuộc vào cỡ kho nhạc.
+- Các mục được tìm song song trên pool luồng riêng của tìm kiếm (SEARCH_THREADS
+  luồng, không dùng chung với tác vụ nền của music.workers nên không phải xếp
+  hàng sau chuyển mã/tải offline), chờ tối đa SEARCH_TIMEOUT giây; mục bị lỗi/quá
+  hạn trả về rỗng, bị hủy nếu chưa chạy và không được cache. Trong một giao dịch
+  đang mở thì tìm tuần tự (luồng khác không thấy dữ liệu chưa commit).
+- Mục lyrics dùng search_lyrics, vốn chỉ đọc tối đa LYRICS_SEARCH_MAX_CANDIDATES
+  dòng ứng viên từ chỉ mục.
+- Kết quả (danh sách id và số lượng, không phải dữ liệu đã serialize) được cache
+  SEARCH_RESULTS_CACHE_TIMEOUT giây theo từ khóa, nên từ khóa phổ biến chỉ truy
+  vấn DB một lần mỗi chu kỳ; bên gọi nạp lại bản ghi theo id để số liệu luôn mới.
+"""
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+
+from .lyrics_search import search_lyrics
+from .models import Album, Artist, Playlist, Song
+from .workers import is_eager
+
+logger = logging.getLogger(__name__)
+
+SECTIONS = ('songs', 'artists', 'albums', 'playlists', 'lyrics')
+MAX_LIMIT = 50
+MAX_QUERY_LENGTH = 100
+
+
+def _songs(query):
+    return Song.objects.filter(
+        Q(title__icontains=query) | Q(artist__icontains=query) | Q(album__icontains=query)
+    ).order_by('-play_count', 'id')
+
+
+def _artists(query):
+    return Artist.objects.filter(name__icontains=query).order_by('-total_plays', 'id')
+
+
+def _albums(query):
+    return Album.objects.filter(
+        Q(title__icontains=query) | Q(artist__icontains=query)
+    ).order_by('-total_plays', 'id')
+
+
+def _playlists(query):
+    return Playlist.objects.filter(
+        Q(name__icontains=query) | Q(description__icontains=query), is_public=True
+    ).order_by('-updated_at', 'id')
+
+
+QUERYSETS = {
+    'songs': _songs,
+    'artists': _artists,
+    'albums': _albums,
+    'playlists': _playlists,
+}
+
+
+def count_capped(queryset, cap):
+    """(số bản ghi, chính xác?): đếm tối đa cap + 1 bản ghi bằng subquery có LIMIT"""
+    count = queryset.order_by().values('pk')[:cap + 1].count()
+    return min(count, cap), count <= cap
+
+
+def search_section(section, query, limit):
+    """{'ids', 'count', 'exact'} của một mục (mục lyrics có thêm 'hits')"""
+    cap = getattr(settings, 'SEARCH_COUNT_CAP', 1000)
+    if section == 'lyrics':
+        # Kết quả tìm theo lời đã được xếp hạng trong bộ nhớ: lấy tới cap rồi cắt
+        hits = search_lyrics(query, limit=cap + 1)
+        return {
+            'ids': [hit['song_id'] for hit in hits[:limit]],
+            'hits': hits[:limit],
+            'count': min(len(hits), cap),
+            'exact': len(hits) <= cap,
+        }
+    queryset = QUERYSETS[section](query)
+    ids = list(queryset.values_list('pk', flat=True)[:limit])
+    if len(ids) < limit:
+        # Trang đầu chưa đầy: đã biết chính xác số kết quả, không cần đếm
+        return {'ids': ids, 'count': len(ids), 'exact': True}
+    count, exact = count_capped(queryset, cap)
+    return {'ids': ids, 'count': count, 'exact': exact}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_search_pool():
+    """Pool luồng riêng cho các mục tìm kiếm"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'SEARCH_THREADS', None) or len(SECTIONS),
+                thread_name_prefix='music-search',
+            )
+        return _pool
+
+
+def _search_section_task(section, query, limit):
+    # Như một request: giữ kết nối DB của luồng theo CONN_MAX_AGE
+    close_old_connections()
+    try:
+        return search_section(section, query, limit)
+    finally:
+        close_old_connections()
+
+
+def _failed_section(section, error):
+    """Mục rỗng thay cho mục lỗi/quá hạn (cùng khóa như kết quả của search_section)"""
+    logger.error(f"Lỗi khi tìm kiếm mục {section}: {str(error) or type(error).__name__}")
+    result = {'ids': [], 'count': 0, 'exact': False}
+    if section == 'lyrics':
+        result['hits'] = []
+    return result
+
+
+def _cache_key(query, sections, limit):
+    raw = '|'.join([query.casefold(), ','.join(sections), str(limit)])
+    return f'music:search:{hashlib.md5(raw.encode()).hexdigest()}'
+
+
+def search_catalog(query, sections=SECTIONS, limit=10):
+    """
+    Tìm song song các mục trong sections, trả về {mục: {'ids', 'count', 'exact'}}.
+
+    Bên gọi nạp bản ghi theo 'ids' (giữ thứ tự) để serialize.
+    """
+    query = ' '.join(query.split())[:MAX_QUERY_LENGTH]
+    sections = [section for section in SECTIONS if section in sections]
+    limit = min(max(limit, 1), MAX_LIMIT)
+    if not query or not sections:
+        return {}
+    key = _cache_key(query, sections, limit)
+    results = cache.get(key)
+    if results is not None:
+        return results
+
+    if is_eager() or connection.in_atomic_block:
+        # Luồng khác không thấy dữ liệu chưa commit của giao dịch hiện tại: tìm tuần tự,
+        # mỗi mục trong một savepoint để mục lỗi không làm hỏng giao dịch của bên gọi
+        results = {}
+        complete = True
+        for section in sections:
+            try:
+                with transaction.atomic():
+                    results[section] = search_section(section, query, limit)
+            except Exception as e:
+                results[section] = _failed_section(section, e)
+                complete = False
+    else:
+        pool = get_search_pool()
+        futures = {section: pool.submit(_search_section_task, section, query, limit) for section in sections}
+        deadline = time.monotonic() + getattr(settings, 'SEARCH_TIMEOUT', 5)
+        results = {}
+        complete = True
+        for section, future in futures.items():
+            try:
+                results[section] = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except Exception as e:
+                future.cancel()
+                results[section] = _failed_section(section, e)
+                complete = False
+    if complete:
+        cache.set(key, results, getattr(settings, 'SEARCH_RESULTS_CACHE_TIMEOUT', 120))
+    return results
@@ -0,0 +1,210 @@
+"""
+Ghi lịch sử tìm kiếm theo lô và thống kê từ khóa.
+
+- Lượt tìm kiếm được đưa vào bộ đệm của tiến trình thay vì INSERT ngay; bộ đệm
+  được ghi bằng bulk_create khi đủ SEARCH_LOG_BATCH_SIZE bản ghi hoặc sau
+  SEARCH_LOG_FLUSH_INTERVAL giây (trên pool luồng nền).
+- Lần ghi lỗi (DB tạm thời không ghi được) đưa các bản ghi trở lại bộ đệm để
+  lần sau ghi lại; bộ đệm giữ tối đa SEARCH_LOG_MAX_BUFFER bản ghi, vượt quá thì
+  bỏ các bản ghi cũ nhất. Bộ đệm của tiến trình bị mất nếu tiến trình bị kill.
+- Lặp lại đúng từ khóa vừa tìm (gõ lại, phân trang, đổi bộ lọc) trong
+  SEARCH_LOG_DEDUPE_SECONDS không được ghi thêm; từ khóa cuối của mỗi người dùng
+  nằm trong cache dùng chung (CACHES, Redis ở production) nên áp dụng được cho
+  mọi tiến trình.
+- Mỗi lần ghi cộng dồn vào bảng search_query_stats (từ khóa đã chuẩn hóa, ngày):
+  nguồn cho từ khóa phổ biến/xu hướng mà không cần quét bảng lịch sử.
+- prune_search_history xóa lịch sử và thống kê quá hạn theo từng lô.
+"""
+import atexit
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .lyrics_search import fold
+from .models import SearchHistory, SearchQueryStats
+from .workers import is_eager, run_in_background
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_buffer = []
+_timer = None
+
+
+def normalize_query(query):
+    """Khóa thống kê: chữ thường, bỏ dấu, gộp khoảng trắng"""
+    return ' '.join(fold(query).split())[:255]
+
+
+def _last_query_key(user_id):
+    return f'music:search:last:{user_id}'
+
+
+def log_search(user, query):
+    """
+    Ghi nhận một lượt tìm kiếm của người dùng đã đăng nhập (không truy vấn DB).
+
+    Trả về False nếu bị bỏ qua vì trùng với lượt tìm ngay trước đó.
+    """
+    query = (query or '').strip()[:255]
+    normalized = normalize_query(query)
+    if not normalized or not user.is_authenticated:
+        return False
+    key = _last_query_key(user.pk)
+    if cache.get(key) == normalized:
+        return False
+    cache.set(key, normalized, getattr(settings, 'SEARCH_LOG_DEDUPE_SECONDS', 300))
+
+    with _lock:
+        _buffer.append((user.pk, query, normalized, timezone.now()))
+        full = len(_buffer) >= getattr(settings, 'SEARCH_LOG_BATCH_SIZE', 50)
+        if not full:
+            _start_timer()
+    if full:
+        run_in_background(flush_search_log)
+    return True
+
+
+def _start_timer():
+    # Gọi khi đang giữ _lock
+    global _timer
+    if _timer is None and not is_eager():
+        _timer = threading.Timer(getattr(settings, 'SEARCH_LOG_FLUSH_INTERVAL', 5), _flush_on_timer)
+        _timer.daemon = True
+        _timer.start()
+
+
+def _flush_on_timer():
+    global _timer
+    with _lock:
+        _timer = None
+    run_in_background(flush_search_log)
+
+
+def _take_buffer():
+    global _buffer
+    with _lock:
+        entries, _buffer = _buffer, []
+    return entries
+
+
+def _requeue(entries):
+    """Đưa các bản ghi chưa ghi được trở lại đầu bộ đệm (giữ tối đa SEARCH_LOG_MAX_BUFFER bản ghi)"""
+    global _buffer
+    limit = getattr(settings, 'SEARCH_LOG_MAX_BUFFER', 5000)
+    with _lock:
+        _buffer = entries + _buffer
+        dropped = max(len(_buffer) - limit, 0)
+        if dropped:
+            _buffer = _buffer[dropped:]
+        _start_timer()
+    if dropped:
+        logger.error(f"Bộ đệm lịch sử tìm kiếm đầy, bỏ {dropped} bản ghi cũ nhất")
+
+
+def flush_search_log():
+    """Ghi bộ đệm vào SearchHistory và cộng dồn thống kê, trả về số bản ghi đã ghi"""
+    entries = _take_buffer()
+    if not entries:
+        return 0
+    try:
+        with transaction.atomic():
+            SearchHistory.objects.bulk_create([
+                SearchHistory(user_id=user_id, query=query, timestamp=timestamp)
+                for user_id, query, _, timestamp in entries
+            ])
+            _record_stats(entries)
+    except Exception as e:
+        logger.error(f"Lỗi khi ghi lịch sử tìm kiếm: {str(e)}")
+        _requeue(entries)
+        return 0
+    return len(entries)
+
+
+def _record_stats(entries):
+    # (từ khóa, ngày) -> [số lượt, cách viết gần nhất]
+    totals = {}
+    for _, query, normalized, timestamp in entries:
+        total = totals.setdefault((normalized, timezone.localdate(timestamp)), [0, query])
+        total[0] += 1
+        total[1] = query
+
+    missing = []
+    for (normalized, day), (count, display) in totals.items():
+        updated = SearchQueryStats.objects.filter(query=normalized, day=day).update(
+            count=F('count') + count, display=display
+        )
+        if not updated:
+            missing.append(SearchQueryStats(query=normalized, day=day, count=count, display=display))
+    if not missing:
+        return
+    try:
+        with transaction.atomic():
+            SearchQueryStats.objects.bulk_create(missing)
+    except IntegrityError:
+        # Tiến trình khác vừa tạo cùng (từ khóa, ngày): cộng vào bản ghi đó
+        for stats in missing:
+            updated = SearchQueryStats.objects.filter(query=stats.query, day=stats.day).update(
+                count=F('count') + stats.count, display=stats.display
+            )
+            if not updated:
+                stats.save()
+
+
+def discard_user_buffer(user_id):
+    """Bỏ các lượt tìm chưa ghi của người dùng (khi người dùng xóa lịch sử)"""
+    global _buffer
+    with _lock:
+        _buffer = [entry for entry in _buffer if entry[0] != user_id]
+    cache.delete(_last_query_key(user_id))
+
+
+def popular_queries(days=7, limit=10):
+    """Từ khóa được tìm nhiều nhất trong days ngày gần đây (days=None: mọi thời điểm)"""
+    queryset = SearchQueryStats.objects.all()
+    if days:
+        queryset = queryset.filter(day__gt=timezone.localdate() - timedelta(days=days))
+    rows = queryset.values('query').annotate(total=Sum('count')).order_by('-total', 'query')[:limit]
+    displays = dict(
+        SearchQueryStats.objects.filter(query__in=[row['query'] for row in rows])
+        .order_by('query', 'day').values_list('query', 'display')
+    )
+    return [
+        {'query': displays.get(row['query'], row['query']), 'normalized': row['query'], 'count': row['total']}
+        for row in rows
+    ]
+
+
+def prune_search_history(days=None, stats_days=None, batch_size=5000, dry_run=False):
+    """
+    Xóa lịch sử tìm kiếm cũ hơn days ngày và thống kê cũ hơn stats_days ngày, theo lô.
+
+    Trả về (số bản ghi lịch sử, số bản ghi thống kê) đã xóa (hoặc sẽ xóa nếu dry_run).
+    """
+    days = days or getattr(settings, 'SEARCH_HISTORY_RETENTION_DAYS', 180)
+    stats_days = stats_days or getattr(settings, 'SEARCH_STATS_RETENTION_DAYS', 365)
+    history = SearchHistory.objects.filter(timestamp__lt=timezone.now() - timedelta(days=days))
+    stats = SearchQueryStats.objects.filter(day__lt=timezone.localdate() - timedelta(days=stats_days))
+    if dry_run:
+        return history.count(), stats.count()
+
+    deleted = []
+    for queryset in (history, stats):
+        total = 0
+        while True:
+            # Mỗi lô một giao dịch ngắn, không khóa cả bảng
+            ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            total += queryset.model.objects.filter(pk__in=ids).delete()[0]
+        deleted.append(total)
+    return tuple(deleted)
+
+
+atexit.register(flush_search_log)
@@ -2,10 +2,17 @@ from rest_framework import serializers
 from .models import (
     Song, Playlist, Album, Genre, Rating, Comment, SongPlayHistory, 
     SearchHistory, UserActivity, LyricLine, Artist, Queue, QueueItem, UserStatus, Message, CollaboratorRole, PlaylistEditHistory,
-    UserRecommendation, OfflineDownload
+    UserRecommendation, OfflineDownload, PlaylistItem, IngestJob, SongRendition, SongStreamPackage
 )
+from .media_urls import MediaURLResolver
+from .metadata import read_audio_metadata
+from .thumbnails import THUMBNAIL_FIELDS, get_thumbnails
+from .catalog import top_songs
+from .comments import comment_count
+from .ratings import rating_average, rating_histogram
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.db.models import Count
 import os
 
 User = get_user_model()
@@ -28,6 +35,37 @@ class BaseModelSerializer(serializers.ModelSerializer):
                 validated_data[user_field] = user
         return validated_data
 
+class MediaURLMixin:
+    """Mixin dựng URL media/API qua MediaURLResolver dùng chung cho cả request"""
+
+    @property
+    def media_urls(self):
+        resolver = self.context.get('media_urls')
+        if resolver is None:
+            resolver = MediaURLResolver.for_request(self.context.get('request'))
+            # Lưu vào context để các serializer con (many=True, lồng nhau) dùng lại
+            self.context['media_urls'] = resolver
+        return resolver
+
+    def build_media_url(self, field_file):
+        """URL tuyệt đối cho trường file, None nếu trống"""
+        return self.media_urls.file_url(field_file)
+
+    def build_api_url(self, path):
+        """URL tuyệt đối cho endpoint API"""
+        return self.media_urls.api_url(path)
+
+    def build_thumbnail_urls(self, obj):
+        """{định dạng: {kích thước: URL}} ảnh thu nhỏ của ảnh bìa/ảnh đại diện, None nếu chưa tạo"""
+        thumbnails = get_thumbnails(obj)
+        if not thumbnails:
+            return None
+        storage = getattr(obj, THUMBNAIL_FIELDS[type(obj)][0]).storage
+        return {
+            fmt: {size: self.media_urls.storage_url(storage, name) for size, name in by_size.items()}
+            for fmt, by_size in thumbnails.items()
+        }
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -40,39 +78,35 @@ class UserProfileSerializer(serializers.ModelSerializer):
         fields = ('id', 'username', 'email', 'first_name', 'last_name', 'avatar', 'bio')
         read_only_fields = ('id',)
 
-class SongBasicSerializer(serializers.ModelSerializer):
+class SongBasicSerializer(MediaURLMixin, serializers.ModelSerializer):
     """Basic serializer for Song model when referenced in other serializers"""
     cover_image = serializers.SerializerMethodField()
+    cover_thumbnails = serializers.SerializerMethodField()
     
     class Meta:
         model = Song
-        fields = ('id', 'title', 'artist', 'cover_image', 'duration')
+        fields = ('id', 'title', 'artist', 'cover_image', 'cover_thumbnails', 'duration', 'replay_gain')
         
     def get_cover_image(self, obj):
-        if obj.cover_image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.cover_image.url)
-            # Nếu không có request, sử dụng SITE_URL từ settings
-            return f"{settings.SITE_URL}{obj.cover_image.url}"
-        return None
+        return self.build_media_url(obj.cover_image)
 
-class PlaylistBasicSerializer(serializers.ModelSerializer):
+    def get_cover_thumbnails(self, obj):
+        return self.build_thumbnail_urls(obj)
+
+class PlaylistBasicSerializer(MediaURLMixin, serializers.ModelSerializer):
     """Basic serializer for Playlist model when referenced in other serializers"""
     cover_image = serializers.SerializerMethodField()
+    cover_thumbnails = serializers.SerializerMethodField()
     
     class Meta:
         model = Playlist
-        fields = ('id', 'name', 'is_public', 'cover_image')
+        fields = ('id', 'name', 'is_public', 'cover_image', 'cover_thumbnails')
         
     def get_cover_image(self, obj):
-        if obj.cover_image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.cover_image.url)
-            # Nếu không có request, sử dụng SITE_URL từ settings
-            return f"{settings.SITE_URL}{obj.cover_image.url}"
-        return None
+        return self.build_media_url(obj.cover_image)
+
+    def get_cover_thumbnails(self, obj):
+        return self.build_thumbnail_urls(obj)
 
 class UserBasicSerializer(serializers.ModelSerializer):
     """Basic user serializer for referencing in music models"""
@@ -80,33 +114,28 @@ class UserBasicSerializer(serializers.ModelSerializer):
         model = User
         fields = ('id', 'username', 'avatar')
 
-class ArtistSerializer(serializers.ModelSerializer):
+class ArtistSerializer(MediaURLMixin, serializers.ModelSerializer):
     """Serializer for Artist model"""
     image = serializers.SerializerMethodField()
+    image_thumbnails = serializers.SerializerMethodField()
     
     class Meta:
         model = Artist
-        fields = ('id', 'name', 'bio', 'image')
+        fields = ('id', 'name', 'bio', 'image', 'image_thumbnails')
         
     def get_image(self, obj):
-        if obj.image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.image.url)
-            # Nếu không có request, sử dụng SITE_URL từ settings
-            return f"{settings.SITE_URL}{obj.image.url}"
-        return None
+        return self.build_media_url(obj.image)
+
+    def get_image_thumbnails(self, obj):
+        return self.build_thumbnail_urls(obj)
 
 class ArtistDetailSerializer(serializers.ModelSerializer):
     """Serializer for Artist model with full detail and write operations"""
-    songs_count = serializers.SerializerMethodField()
+    songs_count = serializers.IntegerField(source='song_count', read_only=True)
     
     class Meta:
         model = Artist
         fields = ('id', 'name', 'bio', 'image', 'songs_count')
-        
-    def get_songs_count(self, obj):
-        return Song.objects.filter(artist=obj.name).count()
 
 class GenreBasicSerializer(serializers.ModelSerializer):
     """Basic serializer for Genre model"""
@@ -120,18 +149,24 @@ class AlbumBasicSerializer(serializers.ModelSerializer):
         model = Album
         fields = ('id', 'title', 'artist', 'cover_image', 'release_date')
 
-class SongSerializer(BaseModelSerializer):
+class SongSerializer(MediaURLMixin, BaseModelSerializer):
     uploaded_by = UserBasicSerializer(read_only=True)
     audio_file = serializers.SerializerMethodField()
     cover_image = serializers.SerializerMethodField()
+    cover_thumbnails = serializers.SerializerMethodField()
     download_url = serializers.SerializerMethodField()
     stream_url = serializers.SerializerMethodField()
+    rating_average = serializers.SerializerMethodField()
+    rating_histogram = serializers.SerializerMethodField()
     
     class Meta:
         model = Song
         fields = ('id', 'title', 'artist', 'album', 'duration', 'audio_file', 
-                 'cover_image', 'genre', 'likes_count', 'play_count', 
-                 'uploaded_by', 'created_at', 'release_date', 'download_url', 'stream_url')
+                 'cover_image', 'cover_thumbnails', 'genre', 'likes_count', 'play_count', 
+                 'uploaded_by', 'created_at', 'release_date', 'download_url', 'stream_url',
+                 'is_ready', 'integrated_loudness', 'true_peak', 'replay_gain',
+                 'rating_count', 'rating_average', 'rating_histogram')
+        read_only_fields = ('is_ready', 'integrated_loudness', 'true_peak', 'replay_gain', 'rating_count')
     
     def create(self, validated_data):
         # Đảm bảo uploaded_by được thêm vào validated_data nếu chưa có
@@ -144,118 +179,139 @@ class SongSerializer(BaseModelSerializer):
         return Song.objects.create(**validated_data)
                  
     def get_audio_file(self, obj):
-        if obj.audio_file:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.audio_file.url)
-            # Nếu không có request, sử dụng SITE_URL từ settings
-            return f"{settings.SITE_URL}{obj.audio_file.url}"
-        return None
+        return self.build_media_url(obj.audio_file)
         
     def get_cover_image(self, obj):
-        if obj.cover_image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.cover_image.url)
-            # Nếu không có request, sử dụng SITE_URL từ settings
-            return f"{settings.SITE_URL}{obj.cover_image.url}"
-        return None
+        return self.build_media_url(obj.cover_image)
+
+    def get_cover_thumbnails(self, obj):
+        return self.build_thumbnail_urls(obj)
 
     def get_download_url(self, obj):
         if obj.audio_file:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(f'/api/v1/music/songs/{obj.id}/download/')
-            # Nếu không có request, sử dụng SITE_URL từ settings
-            return f"{settings.SITE_URL}/api/v1/music/songs/{obj.id}/download/"
+            return self.build_api_url(f'/api/v1/music/songs/{obj.id}/download/')
         return None
 
     def get_stream_url(self, obj):
         if obj.audio_file:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(f'/api/v1/music/songs/{obj.id}/stream/')
-            # Nếu không có request, sử dụng SITE_URL từ settings
-            return f"{settings.SITE_URL}/api/v1/music/songs/{obj.id}/stream/"
+            return self.build_api_url(f'/api/v1/music/songs/{obj.id}/stream/')
         return None
 
-class SongDetailSerializer(serializers.ModelSerializer):
+    def get_rating_average(self, obj):
+        return rating_average(obj)
+
+    def get_rating_histogram(self, obj):
+        return rating_histogram(obj)
+
+class SongRenditionSerializer(MediaURLMixin, serializers.ModelSerializer):
+    """Một bản chuyển mã của bài hát, kèm URL stream chọn đúng bản này"""
+    stream_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = SongRendition
+        fields = ('quality', 'codec', 'bitrate', 'file_size', 'stream_url')
+
+    def get_stream_url(self, obj):
+        return self.build_api_url(f'/api/v1/music/songs/{obj.song_id}/stream/?quality={obj.quality}')
+
+class SongDetailSerializer(MediaURLMixin, serializers.ModelSerializer):
     uploaded_by = UserBasicSerializer(read_only=True)
     comments_count = serializers.SerializerMethodField()
     audio_file = serializers.SerializerMethodField()
     cover_image = serializers.SerializerMethodField()
+    cover_thumbnails = serializers.SerializerMethodField()
     download_url = serializers.SerializerMethodField()
     stream_url = serializers.SerializerMethodField()
+    renditions = SongRenditionSerializer(many=True, read_only=True)
+    hls_url = serializers.SerializerMethodField()
+    dash_url = serializers.SerializerMethodField()
+    album_id = serializers.IntegerField(source='album_ref_id', read_only=True)
+    genre_id = serializers.IntegerField(source='genre_ref_id', read_only=True)
+    artist_ids = serializers.SerializerMethodField()
+    rating_average = serializers.SerializerMethodField()
+    rating_histogram = serializers.SerializerMethodField()
     
     class Meta:
         model = Song
         fields = ('id', 'title', 'artist', 'album', 'duration', 'audio_file', 
-                 'cover_image', 'genre', 'likes_count', 'play_count', 
+                 'cover_image', 'cover_thumbnails', 'genre', 'likes_count', 'play_count', 
                  'uploaded_by', 'created_at', 'lyrics', 'release_date', 'comments_count',
-                 'download_url', 'stream_url')
+                 'download_url', 'stream_url', 'renditions', 'hls_url', 'dash_url',
+                 'integrated_loudness', 'true_peak', 'loudness_range', 'replay_gain',
+                 'album_id', 'genre_id', 'artist_ids',
+                 'rating_count', 'rating_average', 'rating_histogram')
                  
     def get_comments_count(self, obj):
-        return obj.comments.count()
+        return comment_count(obj.id)
+
+    def get_rating_average(self, obj):
+        return rating_average(obj)
+
+    def get_rating_histogram(self, obj):
+        return rating_histogram(obj)
+
+    def get_artist_ids(self, obj):
+        return [link.artist_id for link in obj.artist_links.all()]
         
     def get_audio_file(self, obj):
-        if obj.audio_file:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.audio_file.url)
-            # Nếu không có request, sử dụng SITE_URL từ settings
-            return f"{settings.SITE_URL}{obj.audio_file.url}"
-        return None
+        return self.build_media_url(obj.audio_file)
         
     def get_cover_image(self, obj):
-        if obj.cover_image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.cover_image.url)
-            # Nếu không có request, sử dụng SITE_URL từ settings
-            return f"{settings.SITE_URL}{obj.cover_image.url}"
-        return None
+        return self.build_media_url(obj.cover_image)
+
+    def get_cover_thumbnails(self, obj):
+        return self.build_thumbnail_urls(obj)
 
     def get_download_url(self, obj):
         if obj.audio_file:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(f'/api/v1/music/songs/{obj.id}/download/')
-            # Nếu không có request, sử dụng SITE_URL từ settings
-            return f"{settings.SITE_URL}/api/v1/music/songs/{obj.id}/download/"
+            return self.build_api_url(f'/api/v1/music/songs/{obj.id}/download/')
         return None
 
     def get_stream_url(self, obj):
         if obj.audio_file:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(f'/api/v1/music/songs/{obj.id}/stream/')
-            # Nếu không có request, sử dụng SITE_URL từ settings
-            return f"{settings.SITE_URL}/api/v1/music/songs/{obj.id}/stream/"
+            return self.build_api_url(f'/api/v1/music/songs/{obj.id}/stream/')
         return None
 
-class PlaylistSerializer(serializers.ModelSerializer):
+    def _has_stream_package(self, obj):
+        # Ghi nhớ trên đối tượng để hls_url và dash_url chỉ tốn một truy vấn
+        if not hasattr(obj, '_has_stream_package'):
+            obj._has_stream_package = SongStreamPackage.objects.filter(song_id=obj.id).exists()
+        return obj._has_stream_package
+
+    def get_hls_url(self, obj):
+        if self._has_stream_package(obj):
+            return self.build_api_url(f'/api/v1/music/songs/{obj.id}/hls/master.m3u8')
+        return None
+
+    def get_dash_url(self, obj):
+        if self._has_stream_package(obj):
+            return self.build_api_url(f'/api/v1/music/songs/{obj.id}/dash/manifest.mpd')
+        return None
+
+class PlaylistSerializer(MediaURLMixin, serializers.ModelSerializer):
     user = UserBasicSerializer(read_only=True)
     is_collaborative = serializers.BooleanField(read_only=True)
     collaborators_count = serializers.SerializerMethodField()
     cover_image = serializers.SerializerMethodField()
+    cover_thumbnails = serializers.SerializerMethodField()
     cover_image_upload = serializers.ImageField(write_only=True, required=False)
 
     class Meta:
         model = Playlist
-        fields = ['id', 'name', 'user', 'description', 'is_public', 'cover_image', 'cover_image_upload',
+        fields = ['id', 'name', 'user', 'description', 'is_public', 'cover_image', 'cover_thumbnails', 'cover_image_upload',
                   'created_at', 'updated_at', 'is_collaborative', 'collaborators_count']
         read_only_fields = ['user', 'created_at', 'updated_at', 'collaborators_count']
 
     def get_collaborators_count(self, obj):
-        return obj.collaborators.count()
+        # Dùng số đã annotate sẵn (collaborators_total) nếu có để tránh một truy vấn mỗi playlist
+        total = getattr(obj, 'collaborators_total', None)
+        return obj.collaborators.count() if total is None else total
         
     def get_cover_image(self, obj):
-        if obj.cover_image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.cover_image.url)
-            return f"{settings.SITE_URL}{obj.cover_image.url}"
-        return None
+        return self.build_media_url(obj.cover_image)
+
+    def get_cover_thumbnails(self, obj):
+        return self.build_thumbnail_urls(obj)
 
     def validate_cover_image_upload(self, value):
         if value:
@@ -293,9 +349,30 @@ class PlaylistSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
+class IngestJobSerializer(serializers.ModelSerializer):
+    """Trạng thái xử lý file audio sau khi upload"""
+    song_id = serializers.IntegerField(read_only=True)
+    song_title = serializers.CharField(source='song.title', read_only=True)
+    is_ready = serializers.BooleanField(source='song.is_ready', read_only=True)
+
+    class Meta:
+        model = IngestJob
+        fields = ('id', 'song_id', 'song_title', 'is_ready', 'status', 'stages', 'error',
+                  'created_at', 'updated_at', 'finished_at')
+        read_only_fields = fields
+
+class PlaylistItemSerializer(serializers.ModelSerializer):
+    """Bài hát trong playlist kèm vị trí"""
+    song = SongSerializer(read_only=True)
+
+    class Meta:
+        model = PlaylistItem
+        fields = ('position', 'song', 'added_by', 'added_at')
+        read_only_fields = fields
+
 class PlaylistDetailSerializer(serializers.ModelSerializer):
     user = UserBasicSerializer(read_only=True)
-    songs = SongSerializer(many=True, read_only=True)
+    songs = serializers.SerializerMethodField()
     followers_count = serializers.SerializerMethodField()
     is_collaborative = serializers.BooleanField(read_only=True)
     collaborators = serializers.SerializerMethodField()
@@ -304,8 +381,15 @@ class PlaylistDetailSerializer(serializers.ModelSerializer):
         model = Playlist
         fields = ['id', 'name', 'user', 'description', 'is_public', 'cover_image', 
                   'songs', 'created_at', 'updated_at', 'followers_count', 
-                  'is_collaborative', 'collaborators']
-        read_only_fields = ['user', 'created_at', 'updated_at', 'followers_count']
+                  'is_collaborative', 'collaborators', 'version']
+        read_only_fields = ['user', 'created_at', 'updated_at', 'followers_count', 'version']
+
+    def get_songs(self, obj):
+        """Danh sách bài hát theo thứ tự trong playlist"""
+        songs = Song.objects.filter(playlist_items__playlist=obj).select_related(
+            'uploaded_by'
+        ).order_by('playlist_items__position', 'playlist_items__id')
+        return SongSerializer(songs, many=True, context=self.context).data
 
     def get_followers_count(self, obj):
         return obj.followers.count()
@@ -349,15 +433,6 @@ class CollaboratorRoleCreateSerializer(serializers.ModelSerializer):
         if user == playlist.user:
             raise serializers.ValidationError(
                 "Không thể thêm chủ sở hữu playlist làm cộng tác viên")
-                
-    def get_cover_image(self, obj):
-        if obj.cover_image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.cover_image.url)
-            # Nếu không có request, sử dụng SITE_URL từ settings
-            return f"{settings.SITE_URL}{obj.cover_image.url}"
-        return None
 
 class UserActivitySerializer(serializers.ModelSerializer):
     song = SongBasicSerializer(read_only=True)
@@ -382,11 +457,33 @@ class CommentSerializer(BaseModelSerializer):
         return super().create(validated_data)
     
     def get_replies(self, obj):
-        if obj.parent is None:  # Chỉ lấy replies cho comment gốc
+        if obj.parent_id is None:  # Chỉ lấy replies cho comment gốc
             replies = obj.replies.all()
             return CommentSerializer(replies, many=True, context=self.context).data
         return []
 
+class CommentTreeSerializer(serializers.ModelSerializer):
+    """Bình luận kèm cây trả lời đã dựng sẵn bởi music.comments (không truy vấn thêm)"""
+    user = UserBasicSerializer(read_only=True)
+    replies = serializers.SerializerMethodField()
+    thread_size = serializers.SerializerMethodField()
+    replies_cursor = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Comment
+        fields = ('id', 'user', 'song', 'parent', 'content', 'created_at', 'depth', 'reply_count',
+                  'replies', 'thread_size', 'replies_cursor')
+        read_only_fields = fields
+
+    def get_replies(self, obj):
+        return CommentTreeSerializer(getattr(obj, 'tree_replies', []), many=True, context=self.context).data
+
+    def get_thread_size(self, obj):
+        return getattr(obj, 'thread_size', None) if obj.parent_id is None else None
+
+    def get_replies_cursor(self, obj):
+        return getattr(obj, 'replies_cursor', None) if obj.parent_id is None else None
+
 class RatingSerializer(BaseModelSerializer):
     user = UserBasicSerializer(read_only=True)
     
@@ -399,57 +496,51 @@ class RatingSerializer(BaseModelSerializer):
         validated_data = self.ensure_user_in_validated_data(validated_data)
         return super().create(validated_data)
 
-class AlbumSerializer(serializers.ModelSerializer):
-    songs_count = serializers.SerializerMethodField()
+class AlbumSerializer(MediaURLMixin, serializers.ModelSerializer):
+    songs_count = serializers.IntegerField(source='song_count', read_only=True)
     cover_image = serializers.SerializerMethodField()
+    cover_thumbnails = serializers.SerializerMethodField()
     
     class Meta:
         model = Album
-        fields = ('id', 'title', 'artist', 'release_date', 'cover_image', 'description', 'created_at', 'songs_count')
+        fields = ('id', 'title', 'artist', 'release_date', 'cover_image', 'cover_thumbnails', 'description', 'created_at', 'songs_count')
     
-    def get_songs_count(self, obj):
-        return Song.objects.filter(album=obj.title).count()
-        
     def get_cover_image(self, obj):
-        if obj.cover_image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.cover_image.url)
-            # Nếu không có request, sử dụng SITE_URL từ settings
-            return f"{settings.SITE_URL}{obj.cover_image.url}"
-        return None
+        return self.build_media_url(obj.cover_image)
 
-class AlbumDetailSerializer(serializers.ModelSerializer):
+    def get_cover_thumbnails(self, obj):
+        return self.build_thumbnail_urls(obj)
+
+class AlbumDetailSerializer(MediaURLMixin, serializers.ModelSerializer):
     songs = serializers.SerializerMethodField()
     cover_image = serializers.SerializerMethodField()
+    cover_thumbnails = serializers.SerializerMethodField()
     
     class Meta:
         model = Album
-        fields = ('id', 'title', 'artist', 'release_date', 'cover_image', 'description', 'created_at', 'songs')
+        fields = ('id', 'title', 'artist', 'release_date', 'cover_image', 'cover_thumbnails', 'description', 'created_at', 'songs')
     
     def get_songs(self, obj):
-        songs = Song.objects.filter(album=obj.title)
+        songs = obj.songs.all()
         context = self.context
         return SongSerializer(songs, many=True, context=context).data
     
     def get_cover_image(self, obj):
-        if obj.cover_image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.cover_image.url)
-            # Nếu không có request, sử dụng SITE_URL từ settings
-            return f"{settings.SITE_URL}{obj.cover_image.url}"
-        return None
+        return self.build_media_url(obj.cover_image)
 
-class GenreSerializer(serializers.ModelSerializer):
-    songs_count = serializers.SerializerMethodField()
+    def get_cover_thumbnails(self, obj):
+        return self.build_thumbnail_urls(obj)
+
+class GenreSerializer(MediaURLMixin, serializers.ModelSerializer):
+    songs_count = serializers.IntegerField(source='song_count', read_only=True)
+    image_thumbnails = serializers.SerializerMethodField()
     
     class Meta:
         model = Genre
-        fields = ('id', 'name', 'description', 'image', 'songs_count')
+        fields = ('id', 'name', 'description', 'image', 'image_thumbnails', 'songs_count')
     
-    def get_songs_count(self, obj):
-        return Song.objects.filter(genre=obj.name).count()
+    def get_image_thumbnails(self, obj):
+        return self.build_thumbnail_urls(obj)
 
 class GenreDetailSerializer(serializers.ModelSerializer):
     top_songs = serializers.SerializerMethodField()
@@ -460,21 +551,16 @@ class GenreDetailSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'description', 'image', 'top_songs', 'top_artists')
     
     def get_top_songs(self, obj):
-        songs = Song.objects.filter(genre=obj.name).order_by('-play_count')[:10]
-        return SongSerializer(songs, many=True).data
+        return SongSerializer(top_songs(obj, 10), many=True).data
         
     def get_top_artists(self, obj):
-        # Lấy nghệ sĩ nổi bật trong thể loại này
-        artists = {}
-        for song in Song.objects.filter(genre=obj.name):
-            if song.artist in artists:
-                artists[song.artist] += 1
-            else:
-                artists[song.artist] = 1
-        
-        # Trả về tên nghệ sĩ
-        top_artists = sorted(artists.items(), key=lambda x: x[1], reverse=True)[:5]
-        return [{'name': artist[0], 'songs_count': artist[1]} for artist in top_artists]
+        # Lấy nghệ sĩ nổi bật trong thể loại này (một truy vấn gom nhóm)
+        top_artists = (
+            Artist.objects.filter(songs__genre_ref=obj)
+            .annotate(genre_songs=Count('songs'))
+            .order_by('-genre_songs', 'name')[:5]
+        )
+        return [{'name': artist.name, 'songs_count': artist.genre_songs} for artist in top_artists]
 
 class SongPlayHistorySerializer(serializers.ModelSerializer):
     song = SongSerializer(read_only=True)
@@ -660,16 +746,18 @@ class OfflineDownloadSerializer(BaseModelSerializer):
         fields = [
             'id', 'user', 'song', 'song_details', 'status', 'status_display', 
             'progress', 'local_path', 'download_time', 'expiry_time', 
-            'is_active', 'is_available'
+            'is_active', 'is_available', 'quality', 'attempts', 'bytes_done', 'bytes_total',
+            'error', 'started_at', 'finished_at'
         ]
-        read_only_fields = ['user', 'download_time', 'status_display', 'is_available']
+        read_only_fields = ['user', 'download_time', 'status_display', 'is_available', 'attempts',
+                            'bytes_done', 'bytes_total', 'error', 'started_at', 'finished_at']
         
     def create(self, validated_data):
         # Tự động gán user hiện tại khi tạo mới
         validated_data = self.ensure_user_in_validated_data(validated_data)
         return super().create(validated_data)
 
-class SongAdminSerializer(serializers.ModelSerializer):
+class SongAdminSerializer(MediaURLMixin, serializers.ModelSerializer):
     """Serializer chuyên biệt cho admin quản lý bài hát"""
     uploaded_by = UserBasicSerializer(read_only=True)
     uploaded_by_id = serializers.IntegerField(write_only=True, required=False)
@@ -682,12 +770,14 @@ class SongAdminSerializer(serializers.ModelSerializer):
     comments_count = serializers.SerializerMethodField()
     album_info = serializers.SerializerMethodField()
     genre_info = serializers.SerializerMethodField()
+    rating_average = serializers.SerializerMethodField()
     
     class Meta:
         model = Song
         fields = ('id', 'title', 'artist', 'album', 'album_info', 'genre', 'genre_info',
                  'duration', 'audio_file', 'cover_image', 'audio_file_upload', 'cover_image_upload',
                  'lyrics', 'release_date', 'likes_count', 'play_count', 'comments_count', 
+                 'rating_count', 'rating_average',
                  'is_approved', 'uploaded_by', 'uploaded_by_id', 'created_at', 
                  'download_url', 'stream_url')
         extra_kwargs = {
@@ -695,6 +785,7 @@ class SongAdminSerializer(serializers.ModelSerializer):
             'artist': {'required': True},
             'genre': {'required': True},
             'duration': {'required': False},
+            'rating_count': {'read_only': True},
         }
     
     def validate_duration(self, value):
@@ -749,47 +840,39 @@ class SongAdminSerializer(serializers.ModelSerializer):
         return value
                  
     def get_audio_file(self, obj):
-        if obj and obj.audio_file:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.audio_file.url)
-            return f"{settings.SITE_URL}{obj.audio_file.url}"
+        if obj:
+            return self.build_media_url(obj.audio_file)
         return None
         
     def get_cover_image(self, obj):
-        if obj and obj.cover_image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.cover_image.url)
-            return f"{settings.SITE_URL}{obj.cover_image.url}"
+        if obj:
+            return self.build_media_url(obj.cover_image)
         return None
         
     def get_download_url(self, obj):
         if obj and obj.audio_file:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(f'/api/v1/music/songs/{obj.id}/download/')
-            return f"{settings.SITE_URL}/api/v1/music/songs/{obj.id}/download/"
+            return self.build_api_url(f'/api/v1/music/songs/{obj.id}/download/')
         return None
         
     def get_stream_url(self, obj):
         if obj and obj.audio_file:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(f'/api/v1/music/songs/{obj.id}/stream/')
-            return f"{settings.SITE_URL}/api/v1/music/songs/{obj.id}/stream/"
+            return self.build_api_url(f'/api/v1/music/songs/{obj.id}/stream/')
         return None
         
     def get_comments_count(self, obj):
         if obj:
-            return obj.comments.count()
+            return comment_count(obj.id)
         return 0
+
+    def get_rating_average(self, obj):
+        return rating_average(obj)
         
     def get_album_info(self, obj):
         """Trả về thông tin album nếu có"""
         if obj and obj.album:
             try:
-                album = Album.objects.filter(title=obj.album).first()
+                # album_ref chưa được điền (trước khi backfill): tra theo tên như cũ
+                album = obj.album_ref or Album.objects.filter(title=obj.album).first()
                 if album:
                     return {
                         'id': album.id,
@@ -804,7 +887,7 @@ class SongAdminSerializer(serializers.ModelSerializer):
         """Trả về thông tin thể loại nếu có"""
         if obj and obj.genre:
             try:
-                genre = Genre.objects.filter(name=obj.genre).first()
+                genre = obj.genre_ref or Genre.objects.filter(name=obj.genre).first()
                 if genre:
                     return {
                         'id': genre.id,
@@ -883,18 +966,7 @@ class SongAdminSerializer(serializers.ModelSerializer):
             if audio_file_upload or cover_image_upload or (request and request.FILES):
                 song.save()
                 
-            # Cập nhật duration từ file audio nếu cần
-            if song.duration == 0 and song.audio_file and hasattr(song.audio_file, 'path') and os.path.exists(song.audio_file.path):
-                try:
-                    from tinytag import TinyTag
-                    tag = TinyTag.get(song.audio_file.path)
-                    if tag.duration:
-                        song.duration = int(tag.duration)
-                        song.save(update_fields=['duration'])
-                except Exception:
-                    # Giữ nguyên duration đã thiết lập
-                    pass
-                    
+            # Duration được cập nhật bởi ingest pipeline sau khi tạo (xem AdminSongViewSet.perform_create)
             return song
         except Exception as e:
             import logging, traceback
@@ -944,9 +1016,7 @@ class SongAdminSerializer(serializers.ModelSerializer):
             # Nếu duration = 0 và có file âm thanh, thử tính lại từ file
             if (instance.duration == 0 or not instance.duration) and instance.audio_file:
                 try:
-                    from tinytag import TinyTag
-                    tag = TinyTag.get(instance.audio_file.path)
-                    instance.duration = int(tag.duration or 0)
+                    instance.duration = read_audio_metadata(instance.audio_file.path).duration or 0
                 except Exception:
                     pass
                     
@@ -960,11 +1030,11 @@ class SongAdminSerializer(serializers.ModelSerializer):
             logger.error(traceback.format_exc())
             raise serializers.ValidationError(f"Không thể cập nhật bài hát: {str(e)}")
 
-class AdminAlbumSerializer(serializers.ModelSerializer):
+class AdminAlbumSerializer(MediaURLMixin, serializers.ModelSerializer):
     """Serializer chuyên biệt cho admin quản lý album"""
     cover_image = serializers.SerializerMethodField()
     cover_image_upload = serializers.ImageField(write_only=True, required=False)
-    songs_count = serializers.SerializerMethodField()
+    songs_count = serializers.IntegerField(source='song_count', read_only=True)
     
     class Meta:
         model = Album
@@ -975,15 +1045,9 @@ class AdminAlbumSerializer(serializers.ModelSerializer):
             'artist': {'required': False},
         }
     
-    def get_songs_count(self, obj):
-        return Song.objects.filter(album=obj.title).count()
-        
     def get_cover_image(self, obj):
-        if obj and obj.cover_image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.cover_image.url)
-            return f"{settings.SITE_URL}{obj.cover_image.url}"
+        if obj:
+            return self.build_media_url(obj.cover_image)
         return None
     
     def update(self, instance, validated_data):
@@ -1008,11 +1072,11 @@ class AdminAlbumSerializer(serializers.ModelSerializer):
         instance.save()
         return instance 
 
-class AdminArtistSerializer(serializers.ModelSerializer):
+class AdminArtistSerializer(MediaURLMixin, serializers.ModelSerializer):
     """Serializer chuyên biệt cho admin quản lý nghệ sĩ"""
     image = serializers.SerializerMethodField()
     image_upload = serializers.ImageField(write_only=True, required=False)
-    songs_count = serializers.SerializerMethodField()
+    songs_count = serializers.IntegerField(source='song_count', read_only=True)
     
     class Meta:
         model = Artist
@@ -1021,15 +1085,9 @@ class AdminArtistSerializer(serializers.ModelSerializer):
             'name': {'required': False},
         }
     
-    def get_songs_count(self, obj):
-        return Song.objects.filter(artist=obj.name).count()
-        
     def get_image(self, obj):
-        if obj and obj.image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.image.url)
-            return f"{settings.SITE_URL}{obj.image.url}"
+        if obj:
+            return self.build_media_url(obj.image)
         return None
     
     def update(self, instance, validated_data):
@@ -1054,11 +1112,11 @@ class AdminArtistSerializer(serializers.ModelSerializer):
         instance.save()
         return instance 
 
-class AdminGenreSerializer(serializers.ModelSerializer):
+class AdminGenreSerializer(MediaURLMixin, serializers.ModelSerializer):
     """Serializer chuyên biệt cho admin quản lý thể loại"""
     image = serializers.SerializerMethodField()
     image_upload = serializers.ImageField(write_only=True, required=False)
-    songs_count = serializers.SerializerMethodField()
+    songs_count = serializers.IntegerField(source='song_count', read_only=True)
     
     class Meta:
         model = Genre
@@ -1067,15 +1125,9 @@ class AdminGenreSerializer(serializers.ModelSerializer):
             'name': {'required': False},
         }
     
-    def get_songs_count(self, obj):
-        return Song.objects.filter(genre=obj.name).count()
-        
     def get_image(self, obj):
-        if obj and obj.image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.image.url)
-            return f"{settings.SITE_URL}{obj.image.url}"
+        if obj:
+            return self.build_media_url(obj.image)
         return None
     
     def update(self, instance, validated_data):
@@ -1100,7 +1152,7 @@ class AdminGenreSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
-class AdminPlaylistSerializer(serializers.ModelSerializer):
+class AdminPlaylistSerializer(MediaURLMixin, serializers.ModelSerializer):
     """Serializer chuyên biệt cho admin quản lý playlist"""
     user = UserBasicSerializer(read_only=True)
     user_id = serializers.IntegerField(write_only=True, required=False)
@@ -1126,11 +1178,8 @@ class AdminPlaylistSerializer(serializers.ModelSerializer):
         return obj.followers.count()
         
     def get_cover_image(self, obj):
-        if obj and obj.cover_image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.cover_image.url)
-            return f"{settings.SITE_URL}{obj.cover_image.url}"
+        if obj:
+            return self.build_media_url(obj.cover_image)
         return None
     
     def update(self, instance, validated_data):
@@ -1,7 +1,20 @@
 import os
-from django.db.models.signals import post_delete
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete, m2m_changed
+from django.contrib.auth import get_user_model
 from django.dispatch import receiver
-from .models import Song
+from .models import Song, Album, Artist, Genre, Playlist, OfflineDownload, Comment, Rating, CollaboratorRole, SongPlayHistory
+from .homepage import mark_homepage_stale
+from .thumbnails import generate_thumbnails_by_id, needs_thumbnails
+from .workers import run_in_background
+from .offline import release_blob
+from .catalog import link_songs_to, remove_song_counters, song_targets, sync_song_relations
+from .comments import invalidate_comment_count
+from .ratings import record_rating_deleted, record_rating_saved
+from .lyrics_search import index_song_lyrics
+from .suggest import record_change as record_suggest_change
+from .library import record_change as record_library_change
 
 
 @receiver(post_delete, sender=Song)
@@ -24,4 +37,193 @@ def delete_song_files(sender, instance, **kwargs):
             try:
                 os.remove(instance.cover_image.path)
             except (FileNotFoundError, PermissionError) as e:
-                print(f"Không thể xóa file ảnh bìa: {e}") 
\ No newline at end of file
+                print(f"Không thể xóa file ảnh bìa: {e}") 
+
+
+@receiver(post_save, sender=Song)
+def invalidate_homepage_on_song_save(sender, instance, created, update_fields=None, **kwargs):
+    """Chỉ dựng lại trang chủ khi trường hiển thị trên trang chủ đổi (không phải lượt nghe/thích)"""
+    if update_fields is not None:
+        attnames = {Song._meta.get_field(name).attname for name in update_fields}
+        changed = created or bool(attnames & set(Song.HOMEPAGE_FIELDS))
+    else:
+        changed = created or instance.homepage_values() != getattr(instance, '_homepage_values', None)
+    if changed:
+        mark_homepage_stale()
+    instance._homepage_values = instance.homepage_values()
+
+
+@receiver(post_delete, sender=Song)
+@receiver(post_save, sender=Album)
+@receiver(post_delete, sender=Album)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+@receiver(post_save, sender=Playlist)
+@receiver(post_delete, sender=Playlist)
+def invalidate_homepage(sender, **kwargs):
+    """Đánh dấu trang chủ cần dựng lại khi dữ liệu hiển thị trên trang chủ thay đổi"""
+    mark_homepage_stale()
+
+
+@receiver(m2m_changed, sender=Playlist.followers.through)
+def invalidate_homepage_on_follow(sender, action, **kwargs):
+    """Số người theo dõi playlist ảnh hưởng tới mục playlist phổ biến"""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        mark_homepage_stale()
+
+
+@receiver(post_save, sender=Song)
+@receiver(post_delete, sender=Song)
+@receiver(post_save, sender=Album)
+@receiver(post_delete, sender=Album)
+@receiver(post_save, sender=Artist)
+@receiver(post_delete, sender=Artist)
+@receiver(post_save, sender=Playlist)
+@receiver(post_delete, sender=Playlist)
+def update_suggest_index(sender, instance, **kwargs):
+    """Ghi thay đổi để chỉ mục gợi ý của các tiến trình cập nhật dần"""
+    record_suggest_change(instance)
+
+
+@receiver(m2m_changed, sender=Playlist.followers.through)
+def update_suggest_index_on_follow(sender, instance, action, reverse, **kwargs):
+    """Số người theo dõi là độ phổ biến của playlist trong gợi ý"""
+    if action in ('post_add', 'post_remove', 'post_clear') and not reverse:
+        record_suggest_change(instance)
+
+
+@receiver(post_save, sender=Song)
+def sync_catalog_relations(sender, instance, **kwargs):
+    """Cập nhật album_ref/genre_ref/artists khi chuỗi artist, album, genre của bài hát đổi"""
+    sync_song_relations(instance)
+
+
+@receiver(post_save, sender=Song)
+def reindex_song_lyrics(sender, instance, created, update_fields=None, **kwargs):
+    """Đánh chỉ mục tìm kiếm lời khi lời bài hát (Song.lyrics) đổi"""
+    if update_fields is not None and 'lyrics' not in update_fields:
+        return
+    lyrics = instance.__dict__.get('lyrics')
+    if lyrics == getattr(instance, '_loaded_lyrics', '' if created else None):
+        return
+    index_song_lyrics([instance.pk])
+    instance._loaded_lyrics = lyrics
+
+
+@receiver(pre_delete, sender=Song)
+def capture_catalog_counters(sender, instance, **kwargs):
+    """Lưu quan hệ và số liệu của bài hát trước khi liên kết nghệ sĩ bị xóa theo"""
+    counts = Song.objects.filter(pk=instance.pk).values_list('play_count', 'likes_count').first()
+    instance._catalog_counters = (song_targets(instance.pk), counts) if counts else None
+
+
+@receiver(post_delete, sender=Song)
+def remove_catalog_counters(sender, instance, **kwargs):
+    """Trừ bài hát vừa xóa khỏi số liệu của album/thể loại/nghệ sĩ"""
+    captured = getattr(instance, '_catalog_counters', None)
+    if captured:
+        targets, (play_count, likes_count) = captured
+        remove_song_counters(instance.pk, targets, play_count, likes_count)
+
+
+@receiver(post_save, sender=Album)
+@receiver(post_save, sender=Artist)
+@receiver(post_save, sender=Genre)
+def link_catalog_songs(sender, instance, created, **kwargs):
+    """Album/nghệ sĩ/thể loại mới: nối các bài hát đang mang đúng tên đó"""
+    if created:
+        link_songs_to(instance)
+
+
+@receiver(post_save, sender=Song)
+@receiver(post_save, sender=Album)
+@receiver(post_save, sender=Artist)
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Playlist)
+def schedule_thumbnails(sender, instance, **kwargs):
+    """Tạo ảnh thu nhỏ (nền) khi ảnh bìa/ảnh đại diện mới được lưu"""
+    if needs_thumbnails(instance):
+        pk = instance.pk
+        transaction.on_commit(lambda: run_in_background(generate_thumbnails_by_id, sender, pk))
+
+
+@receiver(post_delete, sender=OfflineDownload)
+def release_offline_blob(sender, instance, **kwargs):
+    """Bản tải xuống bị xóa (kể cả khi xóa bài hát/người dùng): giảm ref_count của blob"""
+    if instance.blob_id:
+        release_blob(instance.blob_id)
+
+
+@receiver(post_save, sender=Comment)
+def invalidate_comment_count_on_create(sender, instance, created, **kwargs):
+    if created:
+        invalidate_comment_count(instance.song_id)
+
+
+@receiver(post_delete, sender=Comment)
+def update_comment_counts_on_delete(sender, instance, **kwargs):
+    """Xóa số bình luận trong cache và giảm reply_count của bình luận cha"""
+    invalidate_comment_count(instance.song_id)
+    if instance.parent_id:
+        Comment.objects.filter(pk=instance.parent_id, reply_count__gt=0).update(reply_count=F('reply_count') - 1)
+
+
+@receiver(post_save, sender=Rating)
+def update_rating_stats_on_save(sender, instance, created, **kwargs):
+    """Cộng đánh giá mới (hoặc phần chênh lệch khi sửa) vào tổng hợp của bài hát"""
+    record_rating_saved(instance, created)
+
+
+@receiver(post_delete, sender=Rating)
+def update_rating_stats_on_delete(sender, instance, **kwargs):
+    record_rating_deleted(instance)
+
+
+@receiver(m2m_changed, sender=get_user_model().favorite_songs.through)
+def update_library_on_favorite(sender, instance, action, reverse, pk_set, **kwargs):
+    """Thích/bỏ thích bài hát (từ phía người dùng hoặc phía bài hát) đổi thư viện của người dùng"""
+    if not reverse:
+        if action in ('post_add', 'post_remove'):
+            for song_id in pk_set:
+                record_library_change(instance.pk, 'favorites', song_id)
+        elif action == 'post_clear':
+            record_library_change(instance.pk, 'favorites')
+    elif action in ('post_add', 'post_remove'):
+        for user_id in pk_set:
+            record_library_change(user_id, 'favorites', instance.pk)
+    elif action == 'pre_clear':
+        for user_id in instance.favorited_by.values_list('id', flat=True):
+            record_library_change(user_id, 'favorites', instance.pk)
+
+
+@receiver(pre_delete, sender=Song)
+def capture_favorited_by(sender, instance, **kwargs):
+    """Người đã thích bài hát, lấy trước khi bản ghi yêu thích bị xóa theo (không gửi m2m_changed)"""
+    instance._favorited_by_ids = list(instance.favorited_by.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Song)
+def update_library_on_song_delete(sender, instance, **kwargs):
+    for user_id in getattr(instance, '_favorited_by_ids', ()):
+        record_library_change(user_id, 'favorites', instance.pk)
+
+
+@receiver(post_save, sender=Playlist)
+@receiver(post_delete, sender=Playlist)
+def update_library_on_playlist(sender, instance, **kwargs):
+    record_library_change(instance.user_id, 'playlists', instance.pk)
+
+
+@receiver(post_save, sender=CollaboratorRole)
+@receiver(post_delete, sender=CollaboratorRole)
+def update_library_on_collaborator(sender, instance, **kwargs):
+    """Số người cộng tác hiển thị trong thư viện của chủ playlist"""
+    owner_id = Playlist.objects.filter(pk=instance.playlist_id).values_list('user_id', flat=True).first()
+    if owner_id is not None:
+        record_library_change(owner_id, 'playlists', instance.playlist_id)
+
+
+@receiver(post_save, sender=SongPlayHistory)
+def update_library_on_play(sender, instance, created, **kwargs):
+    if created:
+        record_library_change(instance.user_id, 'recent')
@@ -0,0 +1,234 @@
+"""
+Phát nhạc theo đoạn (HLS/DASH).
+
+Bài hát được chia sẵn thành các đoạn fMP4 (AAC) độ dài cố định ở nhiều mức
+bitrate (MUSIC_STREAM_VARIANTS); cùng một bộ đoạn dùng cho cả playlist HLS (m3u8)
+và manifest DASH (mpd). URL đoạn chứa `version` của gói, nên nội dung sau một
+URL không bao giờ đổi và có thể cache vĩnh viễn ở CDN/trình duyệt.
+"""
+import hashlib
+import logging
+import math
+import os
+import shutil
+import tempfile
+from xml.sax.saxutils import quoteattr
+
+from django.conf import settings
+from django.core.files import File
+
+from .models import SongStreamPackage
+from .utils import segment_audio
+from .workers import gather, run_in_process
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VARIANTS = (64, 128, 256)
+DEFAULT_SEGMENT_DURATION = 6
+
+AAC_CODEC = 'mp4a.40.2'
+# Ước lượng phần overhead của container fMP4 khi khai báo BANDWIDTH
+CONTAINER_OVERHEAD = 1.1
+
+
+def stream_variants():
+    """Các mức bitrate AAC (kbps) dùng cho HLS/DASH"""
+    return sorted(getattr(settings, 'MUSIC_STREAM_VARIANTS', DEFAULT_VARIANTS))
+
+
+def segment_duration():
+    return getattr(settings, 'MUSIC_SEGMENT_DURATION', DEFAULT_SEGMENT_DURATION)
+
+
+def variant_name(bitrate):
+    return f'{bitrate}k'
+
+
+def package_variant_task(source_path, bitrate, duration):
+    """Chia đoạn một mức bitrate (chạy trên pool tiến trình), trả về kết quả và thư mục tạm"""
+    output_dir = tempfile.mkdtemp(prefix='segments_')
+    result = segment_audio(source_path, output_dir, f'{bitrate}k', duration)
+    if not result or not result['segments']:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        raise RuntimeError(f'Không chia đoạn được bản {bitrate}k')
+    result['dir'] = output_dir
+    return result
+
+
+def submit_packaging(source_path):
+    """Gửi việc chia đoạn cho tất cả các mức bitrate lên pool cùng lúc"""
+    duration = segment_duration()
+    return gather({
+        bitrate: run_in_process(package_variant_task, source_path, bitrate, duration)
+        for bitrate in stream_variants()
+    })
+
+
+def package_version(song, bitrates, duration):
+    """Phiên bản gói: đổi khi file nguồn hoặc cấu hình chia đoạn đổi"""
+    raw = f'{song.audio_file.name}:{song.audio_file.size}:{",".join(map(str, bitrates))}:{duration}'
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def _package_files(package):
+    for variant in package.variants:
+        yield f"{package.storage_prefix}/{variant['name']}/{variant['init']}"
+        for name, _ in variant['segments']:
+            yield f"{package.storage_prefix}/{variant['name']}/{name}"
+
+
+def delete_package_files(storage, package):
+    for path in _package_files(package):
+        storage.delete(path)
+
+
+def save_package(song, futures):
+    """
+    Lưu các đoạn đã chia vào storage và cập nhật SongStreamPackage.
+
+    Trả về (package hoặc None, dict {bitrate: lỗi}).
+    """
+    results = {}
+    errors = {}
+    for bitrate, future in futures.items():
+        try:
+            results[bitrate] = future.result()
+        except Exception as e:
+            logger.error(f"Chia đoạn {bitrate}k cho bài hát {song.id} lỗi: {str(e)}")
+            errors[bitrate] = str(e)
+
+    try:
+        if not results:
+            return None, errors
+
+        duration = segment_duration()
+        version = package_version(song, sorted(results), duration)
+        source_dir = os.path.dirname(song.audio_file.name) or 'songs'
+        prefix = f'{source_dir}/segments/{song.id}/{version}'
+        storage = song.audio_file.storage
+
+        variants = []
+        for bitrate in sorted(results):
+            result = results[bitrate]
+            name = variant_name(bitrate)
+            for filename in [result['init']] + [segment for segment, _ in result['segments']]:
+                path = f'{prefix}/{name}/{filename}'
+                if storage.exists(path):
+                    storage.delete(path)
+                with open(os.path.join(result['dir'], filename), 'rb') as f:
+                    storage.save(path, File(f))
+            variants.append({
+                'name': name,
+                'bitrate': bitrate,
+                'init': result['init'],
+                'segments': [[segment, round(length, 3)] for segment, length in result['segments']],
+            })
+
+        old_package = SongStreamPackage.objects.filter(song=song).first()
+        package, _ = SongStreamPackage.objects.update_or_create(
+            song=song,
+            defaults={
+                'version': version,
+                'storage_prefix': prefix,
+                'segment_duration': duration,
+                'duration': round(sum(length for _, length in variants[0]['segments']), 3),
+                'variants': variants,
+            }
+        )
+        if old_package and old_package.storage_prefix != prefix:
+            delete_package_files(storage, old_package)
+        return package, errors
+    finally:
+        for result in results.values():
+            shutil.rmtree(result['dir'], ignore_errors=True)
+
+
+def package_song(song):
+    """Chia đoạn một bài hát và chờ đến khi xong"""
+    return save_package(song, submit_packaging(song.audio_file.path).result())
+
+
+# ---------------------------------------------------------------------------
+# Manifest
+# ---------------------------------------------------------------------------
+
+def segment_path(package, variant, filename):
+    """Đường dẫn API của một đoạn (bất biến theo version)"""
+    return f'/api/v1/music/songs/{package.song_id}/segments/{package.version}/{variant}/{filename}'
+
+
+def build_hls_master(package, playlist_url):
+    """
+    Master playlist HLS liệt kê các mức bitrate để player tự chuyển đổi.
+
+    playlist_url(variant_name) trả về URL media playlist của từng mức.
+    """
+    lines = ['#EXTM3U', '#EXT-X-VERSION:7', '#EXT-X-INDEPENDENT-SEGMENTS']
+    for variant in package.variants:
+        bandwidth = int(variant['bitrate'] * 1000 * CONTAINER_OVERHEAD)
+        lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},CODECS="{AAC_CODEC}"')
+        lines.append(playlist_url(variant['name']))
+    return '\n'.join(lines) + '\n'
+
+
+def build_hls_media(package, variant, segment_url):
+    """Media playlist HLS (VOD) của một mức bitrate"""
+    segments = variant['segments']
+    target = max(math.ceil(length) for _, length in segments)
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:7',
+        f'#EXT-X-TARGETDURATION:{target}',
+        '#EXT-X-PLAYLIST-TYPE:VOD',
+        '#EXT-X-MEDIA-SEQUENCE:0',
+        '#EXT-X-INDEPENDENT-SEGMENTS',
+        f'#EXT-X-MAP:URI="{segment_url(variant["name"], variant["init"])}"',
+    ]
+    for name, length in segments:
+        lines.append(f'#EXTINF:{length:.3f},')
+        lines.append(segment_url(variant['name'], name))
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+def _segment_timeline(segments):
+    """SegmentTimeline DASH (đơn vị ms), gộp các đoạn cùng độ dài bằng thuộc tính r"""
+    entries = []
+    for _, length in segments:
+        ms = int(round(length * 1000))
+        if entries and entries[-1][0] == ms:
+            entries[-1][1] += 1
+        else:
+            entries.append([ms, 0])
+    return ''.join(
+        f'<S d="{ms}" r="{repeat}"/>' if repeat else f'<S d="{ms}"/>'
+        for ms, repeat in entries
+    )
+
+
+def build_dash_mpd(package, segment_url):
+    """Manifest DASH (static) dùng chung các đoạn fMP4 với HLS"""
+    representations = []
+    for variant in package.variants:
+        # $Number%05d$ khớp với tên đoạn seg_00000.m4s do ffmpeg sinh ra
+        media = segment_url(variant['name'], 'seg_$Number%05d$.m4s')
+        init = segment_url(variant['name'], variant['init'])
+        representations.append(
+            f'<Representation id="{variant["name"]}" bandwidth="{int(variant["bitrate"] * 1000 * CONTAINER_OVERHEAD)}" '
+            f'codecs="{AAC_CODEC}">'
+            f'<SegmentTemplate timescale="1000" startNumber="0" '
+            f'initialization={quoteattr(init)} media={quoteattr(media)}>'
+            f'<SegmentTimeline>{_segment_timeline(variant["segments"])}</SegmentTimeline>'
+            f'</SegmentTemplate></Representation>'
+        )
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" '
+        'profiles="urn:mpeg:dash:profile:isoff-live:2011" '
+        f'mediaPresentationDuration="PT{package.duration:.3f}S" '
+        f'minBufferTime="PT{package.segment_duration:g}S">'
+        '<Period id="0" start="PT0S">'
+        '<AdaptationSet contentType="audio" mimeType="audio/mp4" segmentAlignment="true">'
+        + ''.join(representations) +
+        '</AdaptationSet></Period></MPD>\n'
+    )
@@ -0,0 +1,298 @@
+"""
+Gợi ý khi gõ (typeahead) cho bài hát, nghệ sĩ, album và playlist công khai.
+
+- Mỗi tiến trình giữ một chỉ mục trong bộ nhớ: mảng khóa đã sắp xếp, mỗi khóa là
+  tên đã bỏ dấu bắt đầu từ một từ ("anh yeu em", "yeu em", "em"). Tra cứu một
+  tiền tố là tìm kiếm nhị phân rồi duyệt đoạn khớp, không truy vấn DB.
+- Kết quả xếp theo độ phổ biến (lượt nghe, lượt thích, người theo dõi). Tiền tố
+  ngắn khớp nhiều khóa được ghi nhớ kết quả.
+- Signals ghi thay đổi (loại, id) vào bảng suggest_changes (id là số phiên bản,
+  dùng chung cho mọi tiến trình); phiên bản mới nhất được chép vào cache để tra
+  cứu không phải hỏi DB. Mỗi tiến trình áp dụng dần các thay đổi còn thiếu ở lần
+  tra cứu sau. Khi thiếu quá nhiều thay đổi hoặc chỉ mục quá cũ (lượt nghe đổi
+  bằng update() không qua signals) thì dựng lại ở nền, trong lúc đó vẫn dùng chỉ
+  mục cũ; chỉ lần tra cứu đầu tiên của tiến trình phải chờ chỉ mục được dựng.
+- Không ghi lịch sử tìm kiếm: việc đó thuộc về lượt tìm kiếm đầy đủ.
+"""
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connections, transaction
+from django.db.models import Count, F, Max
+from django.utils import timezone
+
+from .lyrics_search import WORD_RE, fold
+from .models import Album, Artist, Playlist, Song, SuggestChange
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_VERSION_KEY = 'music:suggest:version'
+MAX_LIMIT = 20
+# Đoạn khớp dài hơn ngưỡng này thì ghi nhớ kết quả của tiền tố
+MEMO_THRESHOLD = 256
+# Số thay đổi tối đa áp dụng dần; nhiều hơn thì dựng lại toàn bộ
+MAX_PENDING_CHANGES = 500
+# Thời gian giữ phiên bản mới nhất trong cache (giây), hết hạn thì đọc lại từ DB
+VERSION_CACHE_TIMEOUT = 60
+# Nhật ký thay đổi cũ hơn khoảng này bị xóa sau mỗi lần dựng lại
+CHANGE_RETENTION = timedelta(days=1)
+
+
+def normalize(text):
+    return ' '.join(WORD_RE.findall(fold(text or '')))
+
+
+def _load_songs(ids=None):
+    queryset = Song.objects.all() if ids is None else Song.objects.filter(id__in=ids)
+    for pk, title, artist, weight in queryset.values_list(
+        'id', 'title', 'artist', F('play_count') + F('likes_count') * 2
+    ).order_by():
+        yield pk, title, artist, weight
+
+
+def _load_artists(ids=None):
+    queryset = Artist.objects.all() if ids is None else Artist.objects.filter(id__in=ids)
+    for pk, name, weight in queryset.values_list('id', 'name', 'total_plays').order_by():
+        yield pk, name, '', weight
+
+
+def _load_albums(ids=None):
+    queryset = Album.objects.all() if ids is None else Album.objects.filter(id__in=ids)
+    for pk, title, artist, weight in queryset.values_list('id', 'title', 'artist', 'total_plays').order_by():
+        yield pk, title, artist, weight
+
+
+def _load_playlists(ids=None):
+    queryset = Playlist.objects.filter(is_public=True)
+    if ids is not None:
+        queryset = queryset.filter(id__in=ids)
+    rows = queryset.annotate(followers_total=Count('followers')).values_list(
+        'id', 'name', 'user__username', 'followers_total'
+    ).order_by()
+    for pk, name, owner, weight in rows:
+        yield pk, name, owner, weight
+
+
+LOADERS = {
+    'song': _load_songs,
+    'artist': _load_artists,
+    'album': _load_albums,
+    'playlist': _load_playlists,
+}
+MODEL_KINDS = {Song: 'song', Artist: 'artist', Album: 'album', Playlist: 'playlist'}
+
+
+class SuggestIndex:
+    """Chỉ mục tiền tố trong bộ nhớ (không thread-safe khi ghi, xem _lock)"""
+
+    def __init__(self):
+        # (khóa, loại, id) đã sắp xếp
+        self.keys = []
+        # (loại, id) -> (tên, mô tả, độ phổ biến)
+        self.entries = {}
+        self.memo = {}
+        self.version = 0
+        self.built_at = time.time()
+
+    def _entry_keys(self, kind, pk, label):
+        words = normalize(label).split()
+        return [(' '.join(words[i:]), kind, pk) for i in range(len(words))]
+
+    def add(self, kind, pk, label, subtitle, weight):
+        self.remove(kind, pk)
+        self.entries[(kind, pk)] = (label, subtitle, weight or 0)
+        for key in self._entry_keys(kind, pk, label):
+            insort(self.keys, key)
+            self._forget(key[0])
+
+    def remove(self, kind, pk):
+        entry = self.entries.pop((kind, pk), None)
+        if entry is None:
+            return
+        for key in self._entry_keys(kind, pk, entry[0]):
+            index = bisect_left(self.keys, key)
+            if index < len(self.keys) and self.keys[index] == key:
+                del self.keys[index]
+            self._forget(key[0])
+
+    def _forget(self, key):
+        # Xóa kết quả đã ghi nhớ của mọi tiền tố của khóa vừa đổi
+        if self.memo:
+            for length in range(1, len(key) + 1):
+                self.memo.pop(key[:length], None)
+
+    def _top(self, prefix):
+        start = bisect_left(self.keys, (prefix,))
+        matched = set()
+        for index in range(start, len(self.keys)):
+            key, kind, pk = self.keys[index]
+            if not key.startswith(prefix):
+                break
+            matched.add((kind, pk))
+        top = heapq.nsmallest(
+            MAX_LIMIT, matched,
+            key=lambda entry_id: (-self.entries[entry_id][2], len(self.entries[entry_id][0]), entry_id)
+        )
+        if len(matched) > MEMO_THRESHOLD:
+            self.memo[prefix] = top
+        return top
+
+    def warm(self, max_length=2):
+        """Ghi nhớ trước kết quả của các tiền tố rất ngắn (đoạn khớp dài nhất)"""
+        prefixes = {key[:length] for key, _, _ in self.keys for length in range(1, max_length + 1)}
+        for prefix in sorted(prefixes):
+            self._top(prefix)
+
+    def lookup(self, query, limit=10):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        # Giữ khoảng trắng cuối: "anh " chỉ khớp các khóa có từ sau "anh"
+        if query.endswith(' '):
+            prefix += ' '
+        top = self.memo.get(prefix)
+        if top is None:
+            top = self._top(prefix)
+        return [
+            {
+                'type': kind,
+                'id': pk,
+                'text': self.entries[(kind, pk)][0],
+                'subtitle': self.entries[(kind, pk)][1],
+            }
+            for kind, pk in top[:limit]
+        ]
+
+
+def current_version():
+    """Phiên bản mới nhất của nhật ký (cache, hết hạn thì đọc id lớn nhất từ DB)"""
+    version = cache.get(SUGGEST_VERSION_KEY)
+    if version is None:
+        version = SuggestChange.objects.aggregate(version=Max('id'))['version'] or 0
+        cache.set(SUGGEST_VERSION_KEY, version, VERSION_CACHE_TIMEOUT)
+    return version
+
+
+def build_index():
+    index = SuggestIndex()
+    # Đọc phiên bản trước khi nạp dữ liệu: thay đổi xảy ra trong lúc dựng được áp dụng sau
+    index.version = SuggestChange.objects.aggregate(version=Max('id'))['version'] or 0
+    keys = []
+    for kind, loader in LOADERS.items():
+        for pk, label, subtitle, weight in loader():
+            index.entries[(kind, pk)] = (label, subtitle, weight or 0)
+            keys.extend(index._entry_keys(kind, pk, label))
+    keys.sort()
+    index.keys = keys
+    index.warm()
+    return index
+
+
+_index = None
+_lock = threading.Lock()
+_rebuilding = threading.Event()
+_ready = threading.Event()
+
+
+def _rebuild_in_background():
+    global _index
+    try:
+        close_old_connections()
+        index = build_index()
+        with _lock:
+            _index = index
+        _ready.set()
+        SuggestChange.objects.filter(created_at__lt=timezone.now() - CHANGE_RETENTION).delete()
+    except Exception as e:
+        logger.error(f"Lỗi khi dựng lại chỉ mục gợi ý: {str(e)}")
+    finally:
+        if getattr(settings, 'SUGGEST_BACKGROUND_REBUILD', True):
+            connections.close_all()
+        _rebuilding.clear()
+
+
+def schedule_rebuild():
+    if _rebuilding.is_set():
+        return False
+    _rebuilding.set()
+    if not getattr(settings, 'SUGGEST_BACKGROUND_REBUILD', True):
+        _rebuild_in_background()
+        return True
+    threading.Thread(target=_rebuild_in_background, name='suggest-rebuild', daemon=True).start()
+    return True
+
+
+def _apply_changes(index, current):
+    """Áp dụng các thay đổi từ index.version tới current; False nếu phải dựng lại toàn bộ"""
+    if current - index.version > MAX_PENDING_CHANGES or time.time() - index.built_at > CHANGE_RETENTION.total_seconds():
+        return False
+    changes = SuggestChange.objects.filter(id__gt=index.version, id__lte=current).values_list('kind', 'object_id')
+    pending = {}
+    for kind, pk in changes:
+        pending.setdefault(kind, set()).add(pk)
+    for kind, ids in pending.items():
+        for pk in ids:
+            index.remove(kind, pk)
+        for pk, label, subtitle, weight in LOADERS[kind](ids):
+            index.add(kind, pk, label, subtitle, weight)
+    index.version = current
+    return True
+
+
+def get_index():
+    """
+    Chỉ mục của tiến trình, đã áp dụng các thay đổi mới nhất.
+
+    None nếu chỉ mục đầu tiên chưa dựng xong sau SUGGEST_COLD_WAIT giây.
+    """
+    with _lock:
+        index = _index
+    if index is None:
+        schedule_rebuild()
+        _ready.wait(getattr(settings, 'SUGGEST_COLD_WAIT', 5))
+        with _lock:
+            return _index
+
+    current = current_version()
+    with _lock:
+        # Chỉ mục có thể vừa được thay bởi bản dựng lại
+        index = _index
+        stale = current > index.version and not _apply_changes(index, current)
+    expired = time.time() - index.built_at > getattr(settings, 'SUGGEST_REBUILD_INTERVAL', 3600)
+    if stale or expired:
+        # Dựng lại ở nền, trong lúc đó vẫn dùng chỉ mục hiện có
+        schedule_rebuild()
+    return index
+
+
+def suggest(query, limit=10):
+    index = get_index()
+    if index is None:
+        return []
+    with _lock:
+        return index.lookup(query, min(max(limit, 1), MAX_LIMIT))
+
+
+def _log_change(kind, pk):
+    change = SuggestChange.objects.create(kind=kind, object_id=pk)
+    cache.set(SUGGEST_VERSION_KEY, change.id, VERSION_CACHE_TIMEOUT)
+
+
+def record_change(instance):
+    """Ghi thay đổi của instance vào nhật ký sau khi giao dịch commit (gọi từ signals)"""
+    kind, pk = MODEL_KINDS[type(instance)], instance.pk
+    transaction.on_commit(lambda: _log_change(kind, pk))
+
+
+def reset_index():
+    """Bỏ chỉ mục của tiến trình (dùng trong test)"""
+    global _index
+    with _lock:
+        _index = None
+    _ready.clear()
@@ -1,11 +1,40 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, RequestFactory, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from .models import Song
-from io import BytesIO
+from django.conf import settings
+from django.db import DatabaseError
+from .models import Song, Genre, Playlist, PlaylistItem, PlaylistEditHistory, PlaylistSnapshot, CollaboratorRole, IngestJob, SongRendition, SongStreamPackage, SongWaveform, Album, Artist, OfflineDownload, OfflineBlob, SongArtist, Comment, Rating, LyricLine, SearchHistory, SearchQueryStats, SongPlayHistory, SuggestChange, LibraryChange
+from .permissions import PlaylistACL, filter_accessible
+from .playlists import edit_playlist_songs, song_ids_at
+from .renditions import select_rendition
+from .audio_analysis import analyze_waveform, save_waveform, parse_loudness_summary, compute_replay_gain, save_loudness
+from array import array
+from .catalog_import import CatalogImporter
+from .catalog import backfill_catalog_relations, split_artist_names, reconcile_catalog_stats
+from .metadata import file_sha256, metadata_cache_key, read_audio_metadata, parse_audio_metadata
+from .offline import dispatch_downloads, collect_offline_blobs
+from .ratings import reconcile_song_ratings
+from .lyrics import import_lyrics, parse_lrc
+from .lyrics_search import fold, search_lyrics
+from .suggest import reset_index, suggest
+from .ingest import claim_ingest_job, run_ingest_job
+from .search import search_catalog
+from .search_log import flush_search_log, log_search, prune_search_history
+from django.core.management import call_command
+from unittest import mock
+import shutil
+from django.core.files.base import ContentFile
+from rest_framework.test import APIClient
+from .media_urls import MediaURLResolver
+from .serializers import SongBasicSerializer, AlbumSerializer
+from io import BytesIO, StringIO
+from datetime import timedelta
+from django.utils import timezone
 from PIL import Image
 from django.core.files.uploadedfile import SimpleUploadedFile
 import tempfile
+import threading
+import sys
 import os
 
 User = get_user_model()
@@ -388,3 +417,1608 @@ class AdminMediaUploadTest(TestCase):
         if self.playlist.cover_image:
             if os.path.isfile(self.playlist.cover_image.path):
                 os.remove(self.playlist.cover_image.path)
+
+
+class MediaURLResolverTest(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.song = Song(id=7, title='Test', artist='Artist', duration=120)
+        self.song.audio_file.name = 'songs/bài hát 1.mp3'
+        self.song.cover_image.name = 'covers/cover.jpg'
+
+    def test_matches_build_absolute_uri(self):
+        request = self.factory.get('/')
+        resolver = MediaURLResolver(request)
+        self.assertEqual(
+            resolver.file_url(self.song.audio_file),
+            request.build_absolute_uri(self.song.audio_file.url)
+        )
+        self.assertEqual(
+            resolver.api_url('/api/v1/music/songs/7/stream/'),
+            request.build_absolute_uri('/api/v1/music/songs/7/stream/')
+        )
+
+    def test_resolver_memoized_per_request(self):
+        request = self.factory.get('/')
+        self.assertIs(MediaURLResolver.for_request(request), MediaURLResolver.for_request(request))
+
+    def test_serializer_without_request_uses_site_url(self):
+        data = SongBasicSerializer(self.song).data
+        self.assertEqual(data['cover_image'], f"{settings.SITE_URL.rstrip('/')}/media/covers/cover.jpg")
+
+    @override_settings(MEDIA_CDN_URL='https://cdn.example.com', MEDIA_URL_SIGNING_KEY='secret')
+    def test_signed_cdn_url(self):
+        resolver = MediaURLResolver(self.factory.get('/'))
+        url = resolver.file_url(self.song.cover_image)
+        self.assertTrue(url.startswith('https://cdn.example.com/covers/cover.jpg?expires='))
+        self.assertIn('&sig=', url)
+        self.assertIsNone(resolver.file_url(Song().cover_image))
+
+
+@override_settings(HOMEPAGE_BACKGROUND_REBUILD=False)
+class HomePageCacheTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(username='homeuser', email='homeuser@example.com', password='password123')
+        Genre.objects.create(name='Pop')
+        Song.objects.create(title='Pop Song', artist='Artist', genre='Pop', duration=100,
+                            uploaded_by=self.user, play_count=10)
+        self.url = reverse('home')
+
+    def test_homepage_served_from_cache_with_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Pop', response.json()['featured_by_genre'])
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response['ETag'], etag)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_homepage_rebuilt_after_change(self):
+        etag = self.client.get(self.url)['ETag']
+        Song.objects.create(title='New Song', artist='Artist', genre='Pop', duration=100,
+                            uploaded_by=self.user, play_count=20)
+        # Request này trả bản cũ và kích hoạt dựng lại, request sau nhận bản mới
+        self.client.get(self.url)
+        response = self.client.get(self.url)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['top_songs'][0]['title'], 'New Song')
+
+
+    def test_counter_saves_do_not_mark_homepage_stale(self):
+        from django.core.cache import cache
+        from .homepage import HOMEPAGE_STALE_KEY
+        self.client.get(self.url)
+        song = Song.objects.get(title='Pop Song')
+        song.play_count += 5
+        song.save()
+        song.likes_count += 1
+        song.save(update_fields=['likes_count'])
+        self.assertFalse(cache.get(HOMEPAGE_STALE_KEY))
+
+        song.title = 'Pop Song (Remix)'
+        song.save()
+        self.assertTrue(cache.get(HOMEPAGE_STALE_KEY))
+
+    def test_cold_cache_waits_for_the_rebuilding_request(self):
+        import time
+        from django.core.cache import cache
+        from .homepage import HOMEPAGE_CACHE_KEY, HOMEPAGE_LOCK_KEY, get_homepage_document
+        # Một request khác đang giữ khóa dựng và ghi tài liệu trong lúc request này chờ
+        cache.add(HOMEPAGE_LOCK_KEY, True)
+        document = {'body': b'{}', 'etag': '"built-elsewhere"', 'built_at': time.time()}
+        with mock.patch('music.homepage.time.sleep', lambda _: cache.set(HOMEPAGE_CACHE_KEY, document)):
+            with self.assertNumQueries(0):
+                self.assertEqual(get_homepage_document()['etag'], '"built-elsewhere"')
+
+    @override_settings(DEBUG=False, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_fails_check_in_production(self):
+        from .checks import check_shared_cache
+        self.assertEqual([error.id for error in check_shared_cache(None)], ['music.E001'])
+
+class PlaylistBulkEditTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='password123')
+        self.other = User.objects.create_user(username='other', email='other@example.com', password='password123')
+        self.songs = [
+            Song.objects.create(title=f'Song {i}', artist='Artist', duration=100,
+                                audio_file=f'songs/song_{i}.mp3', uploaded_by=self.user)
+            for i in range(5)
+        ]
+        self.playlist = Playlist.objects.create(name='Mix', user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.url = f'/api/v1/music/playlists/{self.playlist.id}/edit/'
+
+    def ordered_ids(self):
+        return list(
+            PlaylistItem.objects.filter(playlist=self.playlist).order_by('position').values_list('song_id', flat=True)
+        )
+
+    def test_apply_operations_in_one_batch(self):
+        s = [song.id for song in self.songs]
+        response = self.client.post(self.url, {'operations': [
+            {'op': 'add', 'song_id': s[0]},
+            {'op': 'add', 'song_id': s[1]},
+            {'op': 'add', 'song_id': s[2]},
+            {'op': 'add', 'song_id': s[3], 'position': 0},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['version'], 1)
+        self.assertEqual(self.ordered_ids(), [s[3], s[0], s[1], s[2]])
+
+        response = self.client.post(self.url, {'version': 1, 'operations': [
+            {'op': 'remove', 'song_id': s[0]},
+            {'op': 'move', 'song_id': s[2], 'position': 0},
+            {'op': 'add', 'song_id': s[4], 'position': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['version'], 2)
+        self.assertEqual(self.ordered_ids(), [s[2], s[4], s[3], s[1]])
+        self.assertEqual(PlaylistEditHistory.objects.filter(playlist=self.playlist).count(), 2)
+
+    def test_version_conflict(self):
+        response = self.client.post(self.url, {'version': 5, 'operations': [
+            {'op': 'add', 'song_id': self.songs[0].id},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.ordered_ids(), [])
+
+    def test_unknown_song_rolls_back(self):
+        response = self.client.post(self.url, {'operations': [
+            {'op': 'add', 'song_id': self.songs[0].id},
+            {'op': 'add', 'song_id': 999999},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.ordered_ids(), [])
+        self.playlist.refresh_from_db()
+        self.assertEqual(self.playlist.version, 0)
+
+    def test_forbidden_for_non_editor(self):
+        self.client.force_authenticate(user=self.other)
+        response = self.client.post(self.url, {'operations': [
+            {'op': 'add', 'song_id': self.songs[0].id},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(PLAYLIST_SNAPSHOT_INTERVAL=2)
+class PlaylistSnapshotRestoreTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='snapadmin', email='snapadmin@example.com', password='password123')
+        self.songs = [
+            Song.objects.create(title=f'Song {i}', artist='Artist', duration=100,
+                                audio_file=f'songs/song_{i}.mp3', uploaded_by=self.admin)
+            for i in range(4)
+        ]
+        self.playlist = Playlist.objects.create(name='Collab', user=self.admin, is_collaborative=True)
+
+    def edit(self, *operations):
+        return edit_playlist_songs(self.playlist, self.admin, list(operations))
+
+    def test_snapshot_packing_roundtrip(self):
+        ids = [1, 2 ** 40, 7]
+        self.assertEqual(PlaylistSnapshot.unpack_song_ids(PlaylistSnapshot.pack_song_ids(ids)), ids)
+
+    def test_restore_to_timestamp(self):
+        from django.utils import timezone
+        s = [song.id for song in self.songs]
+        self.edit({'op': 'add', 'song_id': s[0]}, {'op': 'add', 'song_id': s[1]})
+        self.edit({'op': 'add', 'song_id': s[2], 'position': 0})
+        self.edit({'op': 'move', 'song_id': s[0], 'position': 0})
+        checkpoint = timezone.now()
+        expected = [s[0], s[2], s[1]]
+        self.edit({'op': 'remove', 'song_id': s[2]}, {'op': 'add', 'song_id': s[3]})
+
+        # Snapshot ban đầu (v0) và snapshot định kỳ ở v2, v4
+        self.assertEqual(
+            list(PlaylistSnapshot.objects.filter(playlist=self.playlist).order_by('version').values_list('version', flat=True)),
+            [0, 2, 4]
+        )
+        target, snapshot = song_ids_at(self.playlist, checkpoint)
+        self.assertEqual(snapshot.version, 2)
+        self.assertEqual(target, expected)
+
+        client = APIClient()
+        client.force_authenticate(user=self.admin)
+        response = client.post(
+            f'/api/v1/music/admin/playlists/{self.playlist.id}/restore/',
+            {'timestamp': checkpoint.isoformat()}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(PlaylistItem.objects.filter(playlist=self.playlist).order_by('position').values_list('song_id', flat=True)),
+            expected
+        )
+
+
+class PlaylistACLTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='aclowner', email='aclowner@example.com', password='password123')
+        self.editor = User.objects.create_user(username='acleditor', email='acleditor@example.com', password='password123')
+        self.stranger = User.objects.create_user(username='aclstranger', email='aclstranger@example.com', password='password123')
+        self.public = Playlist.objects.create(name='Public', user=self.owner, is_public=True)
+        self.private = Playlist.objects.create(name='Private', user=self.owner, is_public=False)
+        self.collab = [
+            Playlist.objects.create(name=f'Collab {i}', user=self.owner, is_public=False, is_collaborative=True)
+            for i in range(3)
+        ]
+        CollaboratorRole.objects.create(playlist=self.collab[0], user=self.editor, role='EDITOR')
+        CollaboratorRole.objects.create(playlist=self.collab[1], user=self.editor, role='VIEWER')
+
+    def test_roles_loaded_in_one_query(self):
+        playlists = [self.public, self.private] + self.collab
+        acl = PlaylistACL(self.editor)
+        with self.assertNumQueries(1):
+            accessible = acl.filter_accessible(playlists)
+            editable = [p for p in playlists if acl.can_edit(p)]
+        self.assertEqual(accessible, [self.public, self.collab[0], self.collab[1]])
+        self.assertEqual(editable, [self.collab[0]])
+
+    def test_filter_accessible_queryset(self):
+        ids = set(filter_accessible(self.editor, Playlist.objects.all()).values_list('id', flat=True))
+        self.assertEqual(ids, {self.public.id, self.collab[0].id, self.collab[1].id})
+        ids = set(filter_accessible(self.stranger, Playlist.objects.all()).values_list('id', flat=True))
+        self.assertEqual(ids, {self.public.id})
+
+    def test_model_methods(self):
+        self.assertTrue(self.collab[1].can_access(self.editor))
+        self.assertFalse(self.collab[1].can_edit(self.editor))
+        self.assertFalse(self.private.can_access(self.stranger))
+        self.assertTrue(self.private.can_edit(self.owner))
+
+
+@override_settings(MUSIC_TASKS_EAGER=True, MEDIA_ROOT=tempfile.mkdtemp())
+class SongIngestTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='uploader', email='uploader@example.com', password='password123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_upload_creates_job_and_song_becomes_ready(self):
+        audio = SimpleUploadedFile('track.mp3', b'ID3' + b'\x00' * 512, content_type='audio/mpeg')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/v1/music/upload/',
+                {'audio_file': audio, 'title': 'My Track', 'artist': 'Me'},
+                format='multipart'
+            )
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(response.data['is_ready'])
+        job_id = response.data['ingest_job']['id']
+
+        job = IngestJob.objects.get(id=job_id)
+        self.assertEqual(job.status, 'COMPLETED')
+        self.assertEqual(job.stages['transcode']['status'], 'SKIPPED')
+        song = job.song
+        self.assertTrue(song.is_ready)
+        self.assertEqual(song.title, 'My Track')
+
+        response = self.client.get(f'/api/v1/music/upload/jobs/{job_id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_ready'])
+
+    def test_job_is_claimed_once(self):
+        song = Song.objects.create(title='Claimed', artist='Me', duration=0, uploaded_by=self.user,
+                                   audio_file='songs/claimed.mp3', is_ready=False)
+        job = IngestJob.objects.create(song=song)
+        self.assertTrue(claim_ingest_job(job.id))
+        # Tiến trình thứ hai (lệnh run_ingest_jobs) không nhận lại job đang chạy
+        self.assertFalse(claim_ingest_job(job.id))
+        self.assertIsNone(run_ingest_job(job.id))
+        out = StringIO()
+        call_command('run_ingest_jobs', stdout=out)
+        self.assertIn('Không có job nào cần xử lý', out.getvalue())
+
+        IngestJob.objects.filter(id=job.id).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.assertTrue(claim_ingest_job(job.id, stale_before=timezone.now() - timedelta(minutes=30)))
+
+    def test_song_not_playable_until_ready(self):
+        song = Song.objects.create(title='Pending', artist='Me', duration=0, uploaded_by=self.user,
+                                   audio_file='songs/pending.mp3', is_ready=False)
+        response = self.client.get(f'/api/v1/music/songs/{song.id}/stream/')
+        self.assertEqual(response.status_code, 409)
+
+    def test_rejects_unsupported_format(self):
+        response = self.client.post(
+            '/api/v1/music/upload/',
+            {'audio_file': SimpleUploadedFile('notes.txt', b'hello')},
+            format='multipart'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class SongRenditionTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='listener', email='listener@example.com', password='password123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.song = Song.objects.create(title='Ladder', artist='Me', duration=10, uploaded_by=self.user)
+        self.song.audio_file.save('ladder.flac', ContentFile(b'original' * 100))
+        for quality, codec, bitrate in (('low', 'mp3', 64), ('medium', 'mp3', 128), ('high', 'mp3', 256), ('opus_96', 'opus', 96)):
+            rendition = SongRendition(song=self.song, quality=quality, codec=codec, bitrate=bitrate)
+            rendition.file.save(f'ladder_{quality}.{codec}', ContentFile(quality.encode() * 10), save=False)
+            rendition.file_size = rendition.file.size
+            rendition.save()
+
+    def test_select_by_quality_and_bandwidth(self):
+        self.assertIsNone(select_rendition(self.song))
+        self.assertIsNone(select_rendition(self.song, quality='original', bandwidth=50))
+        self.assertEqual(select_rendition(self.song, quality='high').quality, 'high')
+        # 80% của 200 kbps = 160 kbps -> bản 128 kbps
+        self.assertEqual(select_rendition(self.song, bandwidth=200).quality, 'medium')
+        self.assertEqual(select_rendition(self.song, bandwidth=10).quality, 'low')
+        self.assertEqual(select_rendition(self.song, bandwidth=1000, codec='opus').quality, 'opus_96')
+
+    def test_rendition_stored_next_to_original(self):
+        rendition = self.song.renditions.get(quality='low')
+        self.assertEqual(os.path.dirname(rendition.file.name), os.path.dirname(self.song.audio_file.name) + '/renditions')
+
+    def test_stream_selects_rendition(self):
+        url = f'/api/v1/music/songs/{self.song.id}/stream/'
+        response = self.client.get(url)
+        self.assertEqual(response['X-Rendition'], 'original')
+
+        response = self.client.get(url, {'quality': 'low'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Rendition'], 'low')
+        self.assertEqual(response['Content-Type'], 'audio/mpeg')
+        self.assertEqual(b''.join(response.streaming_content), b'low' * 10)
+
+        # Client Hints: Downlink tính bằng Mbps
+        response = self.client.get(url, HTTP_DOWNLINK='0.4')
+        self.assertEqual(response['X-Rendition'], 'high')
+
+        response = self.client.get(url, {'quality': 'ultra'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_missing_quality_falls_back_to_lower_rendition(self):
+        url = f'/api/v1/music/songs/{self.song.id}/stream/'
+        self.song.renditions.filter(quality='medium').delete()
+        response = self.client.get(url, {'quality': 'medium'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Rendition'], 'low')
+
+        # Không có bản nào thấp hơn: không phát file gốc thay thế
+        self.song.renditions.filter(quality='low').delete()
+        response = self.client.get(url, {'quality': 'low'})
+        self.assertEqual(response.status_code, 409)
+        self.assertNotIn('low', response.data['available'])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class SongSegmentedStreamTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='hls_user', email='hls_user@example.com', password='password123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.song = Song.objects.create(title='Segments', artist='Me', duration=14, uploaded_by=self.user)
+        self.song.audio_file.save('segments.mp3', ContentFile(b'audio' * 100))
+
+        prefix = f'songs/segments/{self.song.id}/abc123'
+        storage = self.song.audio_file.storage
+        variants = []
+        for bitrate in (64, 128):
+            name = f'{bitrate}k'
+            for filename in ('init.mp4', 'seg_00000.m4s', 'seg_00001.m4s', 'seg_00002.m4s'):
+                storage.save(f'{prefix}/{name}/{filename}', ContentFile(f'{name}/{filename}'.encode()))
+            variants.append({
+                'name': name, 'bitrate': bitrate, 'init': 'init.mp4',
+                'segments': [['seg_00000.m4s', 6.0], ['seg_00001.m4s', 6.0], ['seg_00002.m4s', 2.0]],
+            })
+        self.package = SongStreamPackage.objects.create(
+            song=self.song, version='abc123', storage_prefix=prefix,
+            segment_duration=6, duration=14.0, variants=variants
+        )
+
+    def test_hls_master_lists_variants(self):
+        response = self.client.get(f'/api/v1/music/songs/{self.song.id}/hls/master.m3u8')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.apple.mpegurl')
+        body = response.content.decode()
+        self.assertIn('BANDWIDTH=70400', body)
+        self.assertIn(f'/api/v1/music/songs/{self.song.id}/hls/128k.m3u8', body)
+
+    def test_hls_media_playlist(self):
+        response = self.client.get(f'/api/v1/music/songs/{self.song.id}/hls/64k.m3u8')
+        body = response.content.decode()
+        self.assertIn('#EXT-X-TARGETDURATION:6', body)
+        self.assertIn(f'/segments/abc123/64k/init.mp4"', body)
+        self.assertEqual(body.count('#EXTINF:'), 3)
+        self.assertTrue(body.strip().endswith('#EXT-X-ENDLIST'))
+
+        response = self.client.get(f'/api/v1/music/songs/{self.song.id}/hls/999k.m3u8')
+        self.assertEqual(response.status_code, 404)
+
+    def test_dash_manifest(self):
+        import xml.etree.ElementTree as ET
+        response = self.client.get(f'/api/v1/music/songs/{self.song.id}/dash/manifest.mpd')
+        self.assertEqual(response['Content-Type'], 'application/dash+xml')
+        ns = {'mpd': 'urn:mpeg:dash:schema:mpd:2011'}
+        root = ET.fromstring(response.content)
+        representations = root.findall('.//mpd:Representation', ns)
+        self.assertEqual([r.get('id') for r in representations], ['64k', '128k'])
+        timeline = representations[0].findall('.//mpd:S', ns)
+        self.assertEqual([(s.get('d'), s.get('r')) for s in timeline], [('6000', '1'), ('2000', None)])
+
+    def test_segment_is_immutable_and_public(self):
+        anonymous = APIClient()
+        url = f'/api/v1/music/songs/{self.song.id}/segments/abc123/128k/seg_00001.m4s'
+        response = anonymous.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'128k/seg_00001.m4s')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        response = anonymous.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # Version cũ hoặc file không thuộc gói
+        self.assertEqual(anonymous.get(url.replace('abc123', 'old999')).status_code, 404)
+        self.assertEqual(anonymous.get(url.replace('seg_00001', 'seg_00009')).status_code, 404)
+
+    def test_song_without_package(self):
+        self.package.delete()
+        response = self.client.get(f'/api/v1/music/songs/{self.song.id}/hls/master.m3u8')
+        self.assertEqual(response.status_code, 404)
+
+
+class SongWaveformTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='wave_user', email='wave_user@example.com', password='password123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.song = Song.objects.create(title='Wave', artist='Me', duration=2, uploaded_by=self.user, audio_file='songs/wave.mp3')
+        from django.core.cache import cache
+        cache.clear()
+
+    def _pcm(self):
+        # 1 giây sóng vuông biên độ 0.5 rồi 1 giây im lặng, 1000 Hz
+        samples = array('h', [16384, -16384] * 500 + [0] * 1000)
+        if sys.byteorder == 'big':
+            samples.byteswap()
+        data = samples.tobytes()
+        # Chia thành các khối lẻ để kiểm tra việc ghép khung giữa các khối
+        return [data[i:i + 333] for i in range(0, len(data), 333)]
+
+    def test_analyze_multi_resolution(self):
+        result = analyze_waveform(self._pcm(), 1000, [4, 2])
+        self.assertEqual(result['levels'], [4, 2])
+        self.assertAlmostEqual(result['duration'], 2.0)
+        self.assertEqual(list(result['peaks']), [128, 128, 0, 0, 128, 0])
+        self.assertEqual(list(result['rms']), [128, 128, 0, 0, 128, 0])
+        self.assertAlmostEqual(result['max_peak'], 0.5)
+
+    def test_endpoint_serves_cached_levels(self):
+        save_waveform(self.song, analyze_waveform(self._pcm(), 1000, [4, 2]))
+        url = f'/api/v1/music/songs/{self.song.id}/waveform/'
+
+        response = self.client.get(url, {'points': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['peaks'], [0.502, 0.0])
+
+        # Giảm từ mức 4 điểm xuống 3 điểm
+        response = self.client.get(url, {'points': 3})
+        self.assertEqual(response.data['points'], 3)
+        self.assertEqual(response.data['peaks'], [0.502, 0.502, 0.0])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'points': 3}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # Phân tích lại thì cache bị xóa
+        save_waveform(self.song, analyze_waveform(self._pcm()[:4], 1000, [4]))
+        response = self.client.get(url, {'points': 4})
+        self.assertEqual(response.data['duration'], 0.666)
+
+    def test_missing_waveform_and_bad_points(self):
+        url = f'/api/v1/music/songs/{self.song.id}/waveform/'
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url, {'points': 0}).status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/music/songs/99999/waveform/').status_code, 404)
+
+
+EBUR128_STDERR = """
+[Parsed_ebur128_1 @ 0x55d5c1c0] Summary:
+
+  Integrated loudness:
+    I:          -9.2 LUFS
+    Threshold: -19.4 LUFS
+
+  Loudness range:
+    LRA:         4.1 LU
+    Threshold: -29.3 LUFS
+    LRA low:   -11.6 LUFS
+    LRA high:   -7.5 LUFS
+
+  True peak:
+    Peak:        0.6 dBFS
+"""
+
+
+@override_settings(LOUDNESS_TARGET_LUFS=-14.0, LOUDNESS_TRUE_PEAK_CEILING=-1.0)
+class SongLoudnessTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='loud_user', email='loud_user@example.com', password='password123')
+        self.song = Song.objects.create(title='Loud', artist='Me', duration=200, uploaded_by=self.user, audio_file='songs/loud.mp3')
+
+    def test_parse_ebur128_summary(self):
+        self.assertEqual(parse_loudness_summary(EBUR128_STDERR), {
+            'integrated_lufs': -9.2, 'loudness_range': 4.1, 'true_peak_db': 0.6,
+        })
+        silent = EBUR128_STDERR.replace('-9.2 LUFS', '-70.0 LUFS').replace('0.6 dBFS', '-inf dBFS')
+        self.assertIsNone(parse_loudness_summary(silent)['true_peak_db'])
+
+    def test_replay_gain(self):
+        # Bài to: giảm về -14 LUFS
+        self.assertEqual(compute_replay_gain(-9.2, 0.6), -4.8)
+        # Bài nhỏ: tăng gain nhưng không để true peak vượt -1 dBTP
+        self.assertEqual(compute_replay_gain(-20.0, -3.0), 2.0)
+        self.assertEqual(compute_replay_gain(-20.0, -10.0), 6.0)
+        self.assertIsNone(compute_replay_gain(-70.0, None))
+
+    def test_gain_stored_and_serialized(self):
+        save_loudness(self.song, parse_loudness_summary(EBUR128_STDERR))
+        self.song.refresh_from_db()
+        self.assertEqual(self.song.replay_gain, -4.8)
+        self.assertIsNotNone(self.song.loudness_analyzed_at)
+        self.assertEqual(SongBasicSerializer(self.song).data['replay_gain'], -4.8)
+
+
+@override_settings(MUSIC_TASKS_EAGER=True, MEDIA_ROOT=tempfile.mkdtemp())
+class CatalogImportTest(TestCase):
+    def setUp(self):
+        from mutagen.id3 import ID3, TIT2, TPE1, TALB
+        self.admin = User.objects.create_user(username='importer', email='importer@example.com', password='password123')
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        frame = b'\xff\xfb\x90\x00' + b'\x00' * 413
+        files = [
+            ('nhac_tre', 'a.mp3', frame * 40 + b'1', 'Song A'),
+            ('nhac_tre', 'b.mp3', frame * 40 + b'2', 'Song B'),
+            # Cùng nội dung với a.mp3 nhưng khác tên, khác thư mục
+            ('nhac_rap', 'copy_of_a.mp3', frame * 40 + b'1', 'Song A'),
+        ]
+        for genre_dir, name, content, title in files:
+            os.makedirs(os.path.join(self.root, genre_dir), exist_ok=True)
+            path = os.path.join(self.root, genre_dir, name)
+            with open(path, 'wb') as f:
+                f.write(content)
+            tags = ID3()
+            tags.add(TIT2(encoding=3, text=title))
+            tags.add(TPE1(encoding=3, text='Catalog Artist'))
+            tags.add(TALB(encoding=3, text='Catalog Album'))
+            tags.save(path)
+
+    def test_import_dedup_and_resume(self):
+        stats = CatalogImporter(self.root, self.admin, batch_size=2).run()
+        self.assertEqual((stats.created, stats.duplicates, stats.errors), (2, 1, 0))
+        songs = Song.objects.filter(artist='Catalog Artist')
+        self.assertEqual(sorted(songs.values_list('title', flat=True)), ['Song A', 'Song B'])
+        self.assertEqual(songs.get(title='Song B').genre, 'Nhac Tre')
+        self.assertTrue(all(song.content_hash and song.audio_file for song in songs))
+        self.assertTrue(Genre.objects.filter(name='Nhac Tre').exists())
+        self.assertEqual(Artist.objects.filter(name='Catalog Artist').count(), 1)
+        self.assertEqual(Album.objects.filter(title='Catalog Album', artist='Catalog Artist').count(), 1)
+
+        # Chạy lại: mọi file đã có trong checkpoint
+        stats = CatalogImporter(self.root, self.admin).run()
+        self.assertEqual((stats.skipped, stats.processed, stats.created), (3, 0, 0))
+
+        # File thay đổi được xử lý lại; không tạo thêm Artist/Album
+        with open(os.path.join(self.root, 'nhac_tre', 'b.mp3'), 'ab') as f:
+            f.write(b'changed')
+        stats = CatalogImporter(self.root, self.admin).run()
+        self.assertEqual((stats.skipped, stats.processed, stats.created), (2, 1, 1))
+        self.assertEqual(Artist.objects.filter(name='Catalog Artist').count(), 1)
+
+    def test_failed_batch_removes_copied_files(self):
+        storage = Song._meta.get_field('audio_file').storage
+        saved = []
+        original_save = storage.save
+
+        def tracking_save(name, content, **kwargs):
+            saved.append(original_save(name, content, **kwargs))
+            return saved[-1]
+
+        with mock.patch.object(storage, 'save', tracking_save), \
+                mock.patch('music.catalog_import.link_songs', side_effect=RuntimeError('db error')):
+            with self.assertRaises(RuntimeError):
+                CatalogImporter(self.root, self.admin).run()
+        self.assertEqual(len(saved), 2)
+        self.assertFalse(any(storage.exists(name) for name in saved))
+        self.assertFalse(Song.objects.filter(artist='Catalog Artist').exists())
+
+
+class AudioMetadataTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+
+    def _mp3(self, name):
+        from mutagen.id3 import ID3, TIT2, TPE1, TALB, TCON, TDRC, USLT, APIC
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write((b'\xff\xfb\x90\x00' + b'\x00' * 413) * 380)
+        tags = ID3()
+        tags.add(TIT2(encoding=3, text='Tieu de'))
+        tags.add(TPE1(encoding=3, text='Ca si'))
+        tags.add(TALB(encoding=3, text='Album'))
+        tags.add(TCON(encoding=3, text='(17)'))
+        tags.add(TDRC(encoding=3, text='2019-05-01'))
+        tags.add(USLT(encoding=3, lang='vie', desc='', text='Loi bai hat'))
+        tags.add(APIC(encoding=3, mime='image/png', type=3, desc='', data=b'png-bytes'))
+        tags.save(path)
+        return path
+
+    def test_mp3_tags_are_normalized(self):
+        metadata = read_audio_metadata(self._mp3('a.mp3'), with_hash=True, include_cover=True)
+        self.assertEqual((metadata.title, metadata.artist, metadata.album), ('Tieu de', 'Ca si', 'Album'))
+        self.assertEqual(metadata.genre, 'Rock')
+        self.assertEqual(metadata.year, 2019)
+        self.assertEqual(metadata.duration, 9)
+        self.assertEqual(metadata.lyrics, 'Loi bai hat')
+        self.assertEqual((metadata.cover, metadata.cover_mime), (b'png-bytes', 'image/png'))
+        self.assertEqual(len(metadata.content_hash), 64)
+
+    def test_flac_vorbis_comments(self):
+        from mutagen.flac import FLAC
+        path = os.path.join(self.dir, 'b.flac')
+        # STREAMINFO: 44.1 kHz, stereo, 16 bit, 441000 mẫu (10 giây)
+        info = (44100 << 44) | (1 << 41) | (15 << 36) | 441000
+        with open(path, 'wb') as f:
+            f.write(b'fLaC' + bytes([0x80, 0, 0, 34]) + (4096).to_bytes(2, 'big') * 2
+                    + b'\x00' * 6 + info.to_bytes(8, 'big') + b'\x00' * 16)
+        audio = FLAC(path)
+        audio['title'] = 'Flac title'
+        audio['artist'] = 'Flac artist'
+        audio['date'] = '2021'
+        audio['genre'] = 'Jazz'
+        audio.save()
+
+        metadata = read_audio_metadata(path)
+        self.assertEqual((metadata.title, metadata.artist, metadata.genre), ('Flac title', 'Flac artist', 'Jazz'))
+        self.assertEqual((metadata.year, metadata.duration), (2021, 10))
+
+    def test_results_are_memoized_by_file_stat(self):
+        path = self._mp3('a.mp3')
+        with mock.patch('music.metadata.parse_audio_metadata', wraps=parse_audio_metadata) as parse, \
+                mock.patch('music.metadata.file_sha256', wraps=file_sha256) as sha256:
+            first = read_audio_metadata(path)
+            second = read_audio_metadata(path, with_hash=True)
+            third = read_audio_metadata(path, with_hash=True)
+        # Đọc lặp lại không phân tích lại, hash chỉ tính khi được yêu cầu và được cache
+        self.assertEqual(parse.call_count, 1)
+        self.assertEqual(sha256.call_count, 1)
+        self.assertIsNone(first.content_hash)
+        self.assertEqual(second, third)
+        self.assertIsNone(second.cover)
+
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+        with mock.patch('music.metadata.parse_audio_metadata', wraps=parse_audio_metadata) as parse:
+            read_audio_metadata(path)
+        self.assertEqual(parse.call_count, 1)
+
+    def test_cover_is_not_cached(self):
+        path = self._mp3('a.mp3')
+        from django.core.cache import cache
+        read_audio_metadata(path, include_cover=True)
+        stat = os.stat(path)
+        cached = cache.get(metadata_cache_key(path, stat.st_size, stat.st_mtime_ns))
+        self.assertNotIn('cover', cached)
+        self.assertEqual(cached['cover_mime'], 'image/png')
+        self.assertEqual(read_audio_metadata(path, include_cover=True).cover, b'png-bytes')
+
+
+@override_settings(MUSIC_TASKS_EAGER=True, MEDIA_ROOT=tempfile.mkdtemp(), IMAGE_THUMBNAIL_FORMATS=['webp'])
+class ThumbnailTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='thumbs', email='thumbs@example.com', password='password123')
+
+    def _jpeg(self, size=(1200, 800), color='red'):
+        buffer = BytesIO()
+        Image.new('RGB', size, color).save(buffer, format='JPEG', quality=95)
+        return buffer.getvalue()
+
+    def test_cover_upload_generates_pyramid(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            album = Album(title='Thumb Album', artist='Thumb Artist', release_date='2024-01-01')
+            album.cover_image.save('cover.jpg', ContentFile(self._jpeg()), save=False)
+            album.save()
+
+        album.refresh_from_db()
+        formats = album.cover_thumbnails['formats']
+        self.assertEqual(set(formats['webp']), {'64', '256', '640'})
+        with album.cover_image.storage.open(formats['webp']['640']) as f:
+            self.assertEqual(Image.open(f).size, (640, 427))
+        with album.cover_image.storage.open(formats['webp']['64']) as f:
+            thumb = Image.open(f)
+            self.assertEqual((thumb.format, thumb.size), ('WEBP', (64, 43)))
+
+        data = AlbumSerializer(album).data
+        self.assertTrue(data['cover_thumbnails']['webp']['256'].endswith('/256.webp'))
+
+        # Ảnh gốc đổi: không trả về ảnh thu nhỏ của ảnh cũ
+        album.cover_image.save('other.jpg', ContentFile(self._jpeg(color='blue')), save=False)
+        self.assertIsNone(AlbumSerializer(album).data['cover_thumbnails'])
+
+    def test_ingest_extracts_embedded_cover(self):
+        from mutagen.id3 import ID3, APIC
+        path = os.path.join(tempfile.mkdtemp(), 'cover.mp3')
+        with open(path, 'wb') as f:
+            f.write((b'\xff\xfb\x90\x00' + b'\x00' * 413) * 40)
+        tags = ID3()
+        tags.add(APIC(encoding=3, mime='image/jpeg', type=3, desc='', data=self._jpeg((300, 300))))
+        tags.save(path)
+
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        with open(path, 'rb') as f, self.captureOnCommitCallbacks(execute=True):
+            response = client.post(
+                '/api/v1/music/upload/',
+                {'audio_file': SimpleUploadedFile('cover.mp3', f.read(), content_type='audio/mpeg'), 'title': 'Covered', 'artist': 'Me'},
+                format='multipart'
+            )
+        self.assertEqual(response.status_code, 202)
+        song = Song.objects.get(id=response.data['id'])
+        self.assertTrue(song.cover_image.name.endswith('.jpg'))
+        # Ảnh gốc 300px: không phóng to lên 640
+        with song.cover_image.storage.open(song.cover_thumbnails['formats']['webp']['640']) as f:
+            self.assertEqual(Image.open(f).size, (300, 300))
+
+
+@override_settings(MUSIC_TASKS_EAGER=True, MEDIA_ROOT=tempfile.mkdtemp(), OFFLINE_DOWNLOAD_CHUNK_SIZE=1024,
+                   OFFLINE_DOWNLOAD_RETRY_DELAY=0, OFFLINE_DOWNLOAD_MAX_ATTEMPTS=3)
+class OfflineDownloadJobTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='offline', email='offline@example.com', password='password123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.song = Song.objects.create(title='Offline', artist='Me', duration=5, uploaded_by=self.user)
+        self.content = b'\xff\xfb\x90\x00' + os.urandom(10000)
+        self.song.audio_file.save('offline.mp3', ContentFile(self.content))
+
+    @mock.patch('music.offline.notify_user')
+    def test_request_returns_queued_and_job_copies_in_chunks(self, notify):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/api/v1/music/offline/download/', {'song_id': self.song.id})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['download']['status'], 'PENDING')
+        self.assertEqual(response.data['download']['progress'], 0)
+
+        for callback in callbacks:
+            callback()
+        download = OfflineDownload.objects.get(id=response.data['download']['id'])
+        self.assertEqual((download.status, download.progress), ('COMPLETED', 100))
+        self.assertEqual((download.bytes_done, download.bytes_total), (len(self.content), len(self.content)))
+        with open(download.local_path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        notify.assert_called_once()
+        self.assertEqual(notify.call_args[0][1], 'offline_download.completed')
+
+        response = self.client.post('/api/v1/music/offline/download/', {'song_id': self.song.id})
+        self.assertEqual(response.status_code, 200)
+
+    @mock.patch('music.offline.notify_user')
+    def test_failed_job_is_retried_then_reported(self, notify):
+        self.song.audio_file.storage.delete(self.song.audio_file.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/music/offline/download/', {'song_id': self.song.id})
+        download = OfflineDownload.objects.get(id=response.data['download']['id'])
+        self.assertEqual((download.status, download.attempts), ('FAILED', 3))
+        self.assertTrue(download.error)
+        self.assertEqual(notify.call_args[0][1], 'offline_download.failed')
+
+    def test_unknown_quality_rejected(self):
+        response = self.client.post('/api/v1/music/offline/download/', {'song_id': self.song.id, 'quality': 'ultra'})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(MUSIC_TASKS_EAGER=False, OFFLINE_DOWNLOAD_CONCURRENCY=2, OFFLINE_DOWNLOAD_PER_USER=1)
+    @mock.patch('music.offline.run_in_background')
+    def test_dispatch_respects_concurrency_limits(self, run):
+        other = User.objects.create_user(username='offline2', email='offline2@example.com', password='password123')
+        songs = [Song.objects.create(title=f'S{i}', artist='Me', duration=5, uploaded_by=self.user) for i in range(3)]
+        first = [OfflineDownload.objects.create(user=self.user, song=song) for song in songs]
+        second = OfflineDownload.objects.create(user=other, song=songs[0])
+
+        self.assertEqual(dispatch_downloads(), 2)
+        claimed = {call.args[1] for call in run.call_args_list}
+        self.assertEqual(claimed, {first[0].id, second.id})
+        # Đã đủ giới hạn: không nhận thêm job
+        self.assertEqual(dispatch_downloads(), 0)
+        self.assertEqual(OfflineDownload.objects.filter(status='PENDING').count(), 2)
+
+    @mock.patch('music.offline.notify_user')
+    def test_same_song_shares_one_blob(self, notify):
+        other = User.objects.create_user(username='offline3', email='offline3@example.com', password='password123')
+        other_client = APIClient()
+        other_client.force_authenticate(user=other)
+        ids = []
+        for client in (self.client, other_client):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = client.post('/api/v1/music/offline/download/', {'song_id': self.song.id})
+            ids.append(response.data['download']['id'])
+
+        blob = OfflineBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(blob.size, len(self.content))
+        downloads = OfflineDownload.objects.filter(id__in=ids)
+        self.assertEqual({d.blob_id for d in downloads}, {blob.id})
+        self.assertEqual(len(os.listdir(os.path.dirname(blob.file.path))), 1)
+
+        response = self.client.delete(f'/api/v1/music/offline/downloads/{ids[0]}/delete/')
+        self.assertEqual(response.status_code, 200)
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertIsNone(OfflineDownload.objects.get(id=ids[0]).blob_id)
+
+        # Còn một tham chiếu: không bị dọn
+        self.assertEqual(collect_offline_blobs(grace_minutes=0)['deleted'], 0)
+        OfflineDownload.objects.get(id=ids[1]).delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 0)
+        path = blob.file.path
+        stats = collect_offline_blobs(grace_minutes=0)
+        self.assertEqual((stats['deleted'], stats['bytes_freed']), (1, len(self.content)))
+        self.assertFalse(OfflineBlob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+    @mock.patch('music.offline.notify_user')
+    def test_manifest_lists_blobs_with_etag(self, notify):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/music/offline/download/', {'song_id': self.song.id})
+        response = self.client.get('/api/v1/music/offline/manifest/')
+        self.assertEqual(response.status_code, 200)
+        blob = OfflineBlob.objects.get()
+        self.assertEqual(len(response.data['entries']), 1)
+        entry = response.data['entries'][0]
+        self.assertEqual((entry['song_id'], entry['sha256'], entry['size']), (self.song.id, blob.sha256, blob.size))
+        self.assertTrue(entry['url'].endswith(blob.file.name))
+        self.assertEqual(response.data['total_bytes'], len(self.content))
+
+        response = self.client.get('/api/v1/music/offline/manifest/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class CatalogRelationsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='catalog', email='catalog@example.com', password='password123')
+        self.genre = Genre.objects.create(name='Ballad')
+        self.album = Album.objects.create(title='Mùa Thu', artist='Hà Anh', release_date='2020-01-01')
+        self.singer = Artist.objects.create(name='Hà Anh')
+        self.guest = Artist.objects.create(name='Minh')
+
+    def _legacy_songs(self, count):
+        # bulk_create không gửi post_save: giống dữ liệu có trước khi thêm quan hệ
+        return Song.objects.bulk_create([
+            Song(title=f'Bài {i}', artist='Hà Anh feat. Minh', album='Mùa Thu', genre='Ballad',
+                 duration=180, uploaded_by=self.user)
+            for i in range(count)
+        ])
+
+    def test_split_artist_names(self):
+        self.assertEqual(split_artist_names('A feat. B, C; A'), ['A', 'B', 'C'])
+        self.assertEqual(split_artist_names('Simon & Garfunkel'), ['Simon & Garfunkel'])
+
+    def test_backfill_links_existing_songs_in_batches(self):
+        songs = self._legacy_songs(5)
+        self.assertFalse(Song.objects.filter(album_ref__isnull=False).exists())
+
+        batches = list(backfill_catalog_relations(batch_size=2))
+        self.assertEqual([processed for _, processed, _ in batches], [2, 2, 1])
+        self.assertEqual(sum(changed for _, _, changed in batches), 5)
+        self.assertEqual(Song.objects.filter(album_ref=self.album, genre_ref=self.genre).count(), 5)
+        self.assertEqual(
+            list(SongArtist.objects.filter(song=songs[0]).values_list('artist__name', flat=True)),
+            ['Hà Anh', 'Minh']
+        )
+        # Chạy lại: không còn gì thay đổi
+        self.assertEqual(sum(changed for _, _, changed in backfill_catalog_relations()), 0)
+
+    def test_backfill_can_create_missing_entities(self):
+        Song.objects.bulk_create([
+            Song(title='Mới', artist='Lan', album='Đầu Tay', genre='Indie', duration=60, uploaded_by=self.user)
+        ])
+        list(backfill_catalog_relations(create=True))
+        song = Song.objects.get(title='Mới')
+        self.assertEqual((song.album_ref.title, song.album_ref.artist), ('Đầu Tay', 'Lan'))
+        self.assertEqual(song.genre_ref.name, 'Indie')
+        self.assertEqual([artist.name for artist in song.artists.all()], ['Lan'])
+
+    def test_saving_song_keeps_relations_in_sync(self):
+        song = Song.objects.create(title='Sync', artist='Minh', album='Mùa Thu', genre='Ballad',
+                                   duration=60, uploaded_by=self.user)
+        self.assertEqual((song.album_ref_id, song.genre_ref_id), (self.album.id, self.genre.id))
+
+        song = Song.objects.get(id=song.id)
+        song.genre = 'Rock'
+        song.save()
+        self.assertIsNone(Song.objects.get(id=song.id).genre_ref_id)
+        rock = Genre.objects.create(name='Rock')
+        self.assertEqual(Song.objects.get(id=song.id).genre_ref_id, rock.id)
+
+    def test_new_artist_links_songs_with_exact_name(self):
+        Song.objects.bulk_create([
+            Song(title='Một', artist='Lan', duration=60, uploaded_by=self.user),
+            Song(title='Hai', artist='Lan Anh', duration=60, uploaded_by=self.user),
+        ])
+        lan = Artist.objects.create(name='Lan')
+        self.assertEqual(list(lan.songs.values_list('title', flat=True)), ['Một'])
+        self.assertEqual(Artist.objects.get(id=lan.id).song_count, 1)
+
+    def test_counts_are_read_from_counter_columns(self):
+        self._legacy_songs(3)
+        list(backfill_catalog_relations())
+        Album.objects.create(title='Trống', artist='Ai Đó', release_date='2021-01-01')
+
+        with self.assertNumQueries(1):
+            data = AlbumSerializer(Album.objects.order_by('id'), many=True).data
+        self.assertEqual([album['songs_count'] for album in data], [3, 0])
+
+        client = APIClient()
+        response = client.get(f'/api/v1/music/genres/{self.genre.id}/artists/')
+        self.assertEqual(response.data, [{'name': 'Hà Anh', 'songs_count': 3}, {'name': 'Minh', 'songs_count': 3}])
+        response = client.get(f'/api/v1/music/artists/{self.guest.id}/songs/')
+        self.assertEqual(len(response.data), 3)
+
+
+class CatalogCountersTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='counters', email='counters@example.com', password='password123')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.genre = Genre.objects.create(name='Pop')
+        self.album = Album.objects.create(title='Một', artist='Lan', release_date='2020-01-01')
+        self.lan = Artist.objects.create(name='Lan')
+        self.hoa = Artist.objects.create(name='Hoa')
+        self.songs = [
+            Song.objects.create(title=f'Bài {i}', artist='Lan' if i else 'Lan, Hoa', album='Một', genre='Pop',
+                                duration=100, uploaded_by=self.user)
+            for i in range(3)
+        ]
+
+    def _refresh(self):
+        for obj in (self.genre, self.album, self.lan, self.hoa):
+            obj.refresh_from_db()
+
+    @override_settings(CATALOG_TOP_SONGS=2)
+    def test_upload_play_like_update_counters(self):
+        self._refresh()
+        self.assertEqual((self.album.song_count, self.genre.song_count, self.lan.song_count, self.hoa.song_count), (3, 3, 3, 1))
+
+        for song, plays in ((self.songs[2], 3), (self.songs[0], 1)):
+            for _ in range(plays):
+                self.assertEqual(self.client.post(f'/api/v1/music/songs/{song.id}/play/').status_code, 200)
+        self.client.post(f'/api/v1/music/songs/{self.songs[0].id}/like/')
+        self._refresh()
+        self.assertEqual((self.album.total_plays, self.lan.total_plays, self.hoa.total_plays), (4, 4, 1))
+        self.assertEqual((self.genre.total_likes, self.hoa.total_likes), (1, 1))
+        self.assertEqual(self.genre.top_song_ids, [self.songs[2].id, self.songs[0].id])
+        self.assertEqual(self.hoa.top_song_ids, [self.songs[0].id])
+
+        # Bỏ thích và đổi thể loại: số liệu chuyển theo
+        self.client.post(f'/api/v1/music/songs/{self.songs[0].id}/like/')
+        song = Song.objects.get(id=self.songs[2].id)
+        song.genre = 'Rock'
+        song.save()
+        rock = Genre.objects.create(name='Rock')
+        self._refresh()
+        rock.refresh_from_db()
+        self.assertEqual((self.genre.song_count, self.genre.total_plays, self.genre.total_likes), (2, 1, 0))
+        self.assertEqual((rock.song_count, rock.total_plays, rock.top_song_ids), (1, 3, [song.id]))
+
+        song.delete()
+        rock.refresh_from_db()
+        self.album.refresh_from_db()
+        self.assertEqual((rock.song_count, rock.total_plays, rock.top_song_ids), (0, 0, []))
+        self.assertEqual((self.album.song_count, self.album.total_plays), (2, 1))
+        self.assertEqual(reconcile_catalog_stats(), {'Album': 0, 'Artist': 0, 'Genre': 0})
+
+    def test_admin_edit_keeps_counters(self):
+        # Bản ghi được nạp trước khi có lượt nghe (như form sửa trong trang quản trị)
+        stale = [Artist.objects.get(id=self.lan.id), Album.objects.get(id=self.album.id), Genre.objects.get(id=self.genre.id)]
+        for _ in range(2):
+            self.client.post(f'/api/v1/music/songs/{self.songs[0].id}/play/')
+        stale[0].bio = 'Tiểu sử mới'
+        stale[1].description = 'Mô tả mới'
+        stale[2].description = 'Mô tả mới'
+        for obj in stale:
+            obj.save()
+
+        self._refresh()
+        self.assertEqual(self.lan.bio, 'Tiểu sử mới')
+        self.assertEqual((self.lan.total_plays, self.album.total_plays, self.genre.total_plays), (2, 2, 2))
+        self.assertEqual((self.lan.song_count, self.album.song_count, self.genre.song_count), (3, 3, 3))
+        self.assertEqual(self.lan.top_song_ids[0], self.songs[0].id)
+        self.assertEqual(reconcile_catalog_stats(dry_run=True), {'Album': 0, 'Artist': 0, 'Genre': 0})
+
+    def test_popular_artists_single_read_and_reconcile(self):
+        Song.objects.filter(id=self.songs[0].id).update(play_count=50)
+        self.assertEqual(reconcile_catalog_stats(dry_run=True)['Artist'], 2)
+        self.assertEqual(reconcile_catalog_stats(), {'Album': 1, 'Artist': 2, 'Genre': 1})
+        self.hoa.refresh_from_db()
+        self.assertEqual((self.hoa.total_plays, self.hoa.top_song_ids), (50, [self.songs[0].id]))
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/music/artists/popular/')
+        self.assertEqual([(a['name'], a['song_count'], a['play_count']) for a in response.data],
+                         [('Lan', 3, 50), ('Hoa', 1, 50)])
+
+
+class CommentTreeTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(username='commenter', email='commenter@example.com', password='password123')
+        self.song = Song.objects.create(title='Viral', artist='Ai Đó', duration=100, uploaded_by=self.user)
+        self.client = APIClient()
+        self.roots = [Comment.objects.create(user=self.user, song=self.song, content=f'Gốc {i}') for i in range(5)]
+        # Luồng của bình luận gốc mới nhất: 2 trả lời, trả lời đầu có 2 trả lời lồng nhau
+        root = self.roots[-1]
+        self.first = Comment.objects.create(user=self.user, song=self.song, content='A', parent=root)
+        self.nested = [
+            Comment.objects.create(user=self.user, song=self.song, content=f'A{i}', parent=self.first)
+            for i in range(2)
+        ]
+        self.second = Comment.objects.create(user=self.user, song=self.song, content='B', parent=root)
+
+    def test_tree_fields_are_maintained(self):
+        nested = Comment.objects.get(id=self.nested[0].id)
+        self.assertEqual((nested.root_id, nested.depth), (self.roots[-1].id, 2))
+        self.assertTrue(nested.path.startswith(Comment.objects.get(id=self.first.id).path + '.'))
+        self.assertEqual(Comment.objects.get(id=self.roots[-1].id).reply_count, 2)
+        self.nested[1].delete()
+        self.assertEqual(Comment.objects.get(id=self.first.id).reply_count, 1)
+
+    def test_page_loads_roots_and_replies_in_constant_queries(self):
+        url = f'/api/v1/music/songs/{self.song.id}/comments/?page_size=2&replies=3'
+        # Bài hát, số bình luận (cache), trang gốc, trả lời
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 9)
+        first = response.data['results'][0]
+        self.assertEqual(first['id'], self.roots[-1].id)
+        self.assertEqual(first['thread_size'], 4)
+        # Ba trả lời đầu theo thứ tự duyệt cây: A, A0, A1 (lồng trong A)
+        self.assertEqual([reply['content'] for reply in first['replies']], ['A'])
+        self.assertEqual([reply['content'] for reply in first['replies'][0]['replies']], ['A0', 'A1'])
+        self.assertTrue(first['replies_cursor'])
+        self.assertEqual(response.data['results'][1]['replies'], [])
+
+        with self.assertNumQueries(3):
+            self.client.get(url)
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([c['id'] for c in response.data['results']], [self.roots[2].id, self.roots[1].id])
+
+        response = self.client.get(
+            f'/api/v1/music/comments/{self.roots[-1].id}/replies/', {'after': first['replies_cursor']}
+        )
+        self.assertEqual([reply['content'] for reply in response.data['results']], ['B'])
+        self.assertIsNone(response.data['next_cursor'])
+
+    def test_comment_count_cache_is_invalidated(self):
+        response = self.client.get(f'/api/v1/music/songs/{self.song.id}/comments/')
+        self.assertEqual(response.data['count'], 9)
+        Comment.objects.create(user=self.user, song=self.song, content='Mới')
+        response = self.client.get(f'/api/v1/music/songs/{self.song.id}/comments/')
+        self.assertEqual(response.data['count'], 10)
+
+
+class SongRatingStatsTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.users = [
+            User.objects.create_user(username=f'rater{i}', email=f'rater{i}@example.com', password='password123')
+            for i in range(3)
+        ]
+        self.song = Song.objects.create(title='Được chấm', artist='Ai Đó', duration=100, uploaded_by=self.users[0])
+        self.other = Song.objects.create(title='Ít người chấm', artist='Ai Đó', duration=100, uploaded_by=self.users[0])
+
+    def stats(self, song):
+        song = Song.objects.get(id=song.id)
+        return song.rating_count, song.rating_sum, [getattr(song, f'rating_{i}') for i in range(1, 6)]
+
+    def test_stats_follow_insert_update_delete(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        client.post(f'/api/v1/music/songs/{self.song.id}/rate/', {'rating': 4}, format='json')
+        Rating.objects.create(user=self.users[1], song=self.song, rating=2)
+        self.assertEqual(self.stats(self.song), (2, 6, [0, 1, 0, 1, 0]))
+
+        client.post(f'/api/v1/music/songs/{self.song.id}/rate/', {'rating': 5}, format='json')
+        self.assertEqual(self.stats(self.song), (2, 7, [0, 1, 0, 0, 1]))
+
+        Rating.objects.get(user=self.users[1]).delete()
+        self.assertEqual(self.stats(self.song), (1, 5, [0, 0, 0, 0, 1]))
+
+        response = client.get(f'/api/v1/music/songs/{self.song.id}/')
+        self.assertEqual(response.data['rating_count'], 1)
+        self.assertEqual(response.data['rating_average'], 5.0)
+        self.assertEqual(response.data['rating_histogram'], {'1': 0, '2': 0, '3': 0, '4': 0, '5': 1})
+
+    def test_top_rated_uses_bayesian_average(self):
+        low = Song.objects.create(title='Bị chê', artist='Ai Đó', duration=100, uploaded_by=self.users[0])
+        for user, value in zip(self.users, (5, 5, 4)):
+            Rating.objects.create(user=user, song=self.song, rating=value)
+            Rating.objects.create(user=user, song=low, rating=1)
+        Rating.objects.create(user=self.users[0], song=self.other, rating=5)
+
+        response = APIClient().get('/api/v1/music/songs/top-rated/')
+        self.assertEqual(response.status_code, 200)
+        # Một đánh giá 5 sao không vượt được ba đánh giá trung bình 4.67
+        self.assertEqual([item['id'] for item in response.data['results']], [self.song.id, self.other.id, low.id])
+        self.assertAlmostEqual(response.data['prior_mean'], 22 / 7, places=3)
+
+        response = APIClient().get('/api/v1/music/songs/top-rated/', {'min_ratings': 2})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.song.id, low.id])
+
+    def test_full_save_keeps_concurrent_rating_updates(self):
+        stale = Song.objects.get(id=self.song.id)
+        Rating.objects.create(user=self.users[0], song=self.song, rating=4)
+        stale.title = 'Đổi tên'
+        stale.save()
+        self.assertEqual(self.stats(self.song), (1, 4, [0, 0, 0, 1, 0]))
+        self.assertEqual(Song.objects.get(id=self.song.id).title, 'Đổi tên')
+
+    def test_top_rated_filters_by_genre_relation(self):
+        pop = Genre.objects.create(name='Pop')
+        Song.objects.filter(id=self.song.id).update(genre_ref=pop, genre='pop ')
+        for song in (self.song, self.other):
+            Rating.objects.create(user=self.users[0], song=song, rating=5)
+        for genre in ('Pop', str(pop.id)):
+            response = APIClient().get('/api/v1/music/songs/top-rated/', {'genre': genre})
+            self.assertEqual([item['id'] for item in response.data['results']], [self.song.id])
+
+    def test_reconcile_fixes_drift(self):
+        Rating.objects.create(user=self.users[0], song=self.song, rating=3)
+        # queryset.update() bỏ qua signal
+        Rating.objects.filter(song=self.song).update(rating=1)
+        Song.objects.filter(id=self.other.id).update(rating_count=7)
+        self.assertEqual(reconcile_song_ratings(dry_run=True), 2)
+        self.assertEqual(reconcile_song_ratings(), 2)
+        self.assertEqual(self.stats(self.song), (1, 1, [1, 0, 0, 0, 0]))
+        self.assertEqual(self.stats(self.other), (0, 0, [0, 0, 0, 0, 0]))
+
+
+class SyncedLyricsTest(TestCase):
+    LRC = (
+        "[ar:Ai Đó]\n"
+        "[ti:Có Lời]\n"
+        "[offset:500]\n"
+        "[00:10.50]<00:10.50>Dòng <00:11.00>một\n"
+        "[00:20.00][00:40.00]Điệp khúc\n"
+        "[00:30.00]Dòng ba\n"
+    )
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(username='lyricist', email='lyricist@example.com', password='password123')
+        self.song = Song.objects.create(title='Có Lời', artist='Ai Đó', duration=100, uploaded_by=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_parse_enhanced_lrc(self):
+        tags, lines = parse_lrc(self.LRC)
+        self.assertEqual(tags['ar'], 'Ai Đó')
+        self.assertEqual([line[0] for line in lines], [10.0, 19.5, 29.5, 39.5])
+        self.assertEqual(lines[0][1], 'Dòng một')
+        self.assertEqual(lines[0][2], [[10.0, 'Dòng '], [10.5, 'một']])
+        self.assertEqual(lines[1][2], [])
+
+    def test_import_replaces_lines_in_bulk(self):
+        LyricLine.objects.create(song=self.song, timestamp=1, text='Cũ')
+        with self.assertNumQueries(8):
+            self.assertEqual(import_lyrics(self.song.id, self.LRC), 4)
+        self.assertEqual(LyricLine.objects.filter(song=self.song).count(), 4)
+        self.assertEqual(Song.objects.get(id=self.song.id).lyrics.splitlines()[0], 'Dòng một')
+        self.assertIsNone(import_lyrics(self.song.id + 100, self.LRC))
+
+    def test_lookup_returns_window_around_playhead(self):
+        import_lyrics(self.song.id, self.LRC)
+        url = f'/api/v1/music/songs/{self.song.id}/lyrics/at/'
+        response = self.client.get(url, {'t': 10.7, 'before': 0, 'after': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['index'], 0)
+        self.assertEqual(response.data['next_timestamp'], 19.5)
+        self.assertEqual([line['text'] for line in response.data['lines']], ['Dòng một', 'Điệp khúc'])
+        self.assertEqual(response.data['lines'][0]['word_index'], 1)
+
+        # Tài liệu lời đã nằm trong cache: không truy vấn DB
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'t': 31, 'before': 1, 'after': 0})
+        self.assertEqual(response.data['index'], 2)
+        self.assertEqual([line['text'] for line in response.data['lines']], ['Điệp khúc', 'Dòng ba'])
+
+        response = self.client.get(url, {'t': 5})
+        self.assertEqual(response.data['index'], -1)
+        self.assertEqual(response.data['lines'][0]['text'], 'Dòng một')
+
+        for value in ('nan', 'inf', '-Infinity', 'abc'):
+            self.assertEqual(self.client.get(url, {'t': value}).status_code, 400)
+
+        response = self.client.get(f'/api/v1/music/songs/{self.song.id}/lyrics/synced/')
+        self.assertEqual(len(response.data['lyrics']), 4)
+        self.assertEqual(response.data['lyrics'][0]['formatted_time'], '00:10.00')
+
+    def test_import_lyrics_command_matches_files(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        with open(os.path.join(root, 'bai-hat.lrc'), 'w', encoding='utf-8') as f:
+            f.write(self.LRC)
+        with open(os.path.join(root, 'Không Ai - Không Có.lrc'), 'w', encoding='utf-8') as f:
+            f.write('[00:01.00]?')
+        out = StringIO()
+        call_command('import_lyrics', root, stdout=out)
+        self.assertEqual(LyricLine.objects.filter(song=self.song).count(), 4)
+        self.assertIn('1 file không ghép được', out.getvalue())
+
+
+class LyricsSearchTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(username='searcher', email='searcher@example.com', password='password123')
+        self.synced = Song.objects.create(title='Có Thời Điểm', artist='Ai Đó', duration=100, uploaded_by=self.user)
+        import_lyrics(self.synced.id, "[00:05.00]Ngày mai em đi\n[00:12.50]Đường xa không về\n[00:20.00]Em đi đường xa")
+        self.plain = Song.objects.create(
+            title='Không Đồng Bộ', artist='Ai Đó', duration=100, uploaded_by=self.user,
+            lyrics='Một ngày nắng\nĐường về xa không em'
+        )
+
+    def test_fold_removes_vietnamese_accents(self):
+        self.assertEqual(fold('Đường Xa KHÔNG về'), 'duong xa khong ve')
+
+    def test_phrase_search_returns_line_timestamp(self):
+        hits = search_lyrics('duong xa khong')
+        self.assertEqual([(hit['song_id'], hit['line_no'], hit['timestamp']) for hit in hits], [(self.synced.id, 1, 12.5)])
+
+        # Không cần liền nhau: đủ các từ trong cùng một dòng
+        hits = search_lyrics('đường xa không', phrase=False)
+        self.assertEqual({hit['song_id'] for hit in hits}, {self.synced.id, self.plain.id})
+        self.assertEqual(search_lyrics('xa lạ'), [])
+
+    def test_common_terms_are_skipped_and_candidates_capped(self):
+        # "em" xuất hiện 3 lần, vượt ngưỡng: chỉ tìm theo "di"
+        with override_settings(LYRICS_TERM_MAX_DF=2):
+            hits = search_lyrics('em đi', phrase=False)
+            self.assertEqual([(hit['song_id'], hit['matches']) for hit in hits], [(self.synced.id, 2)])
+            with override_settings(LYRICS_SEARCH_MAX_CANDIDATES=1):
+                hits = search_lyrics('em đi', phrase=False)
+            self.assertEqual([(hit['song_id'], hit['matches']) for hit in hits], [(self.synced.id, 1)])
+            # Số lần xuất hiện đã nằm trong cache: chỉ còn truy vấn danh sách vị trí
+            with self.assertNumQueries(1):
+                search_lyrics('em đi', phrase=False)
+
+    def test_index_follows_lyrics_edits(self):
+        self.plain.lyrics = 'Hoàn toàn mới'
+        self.plain.save()
+        self.assertEqual([hit['song_id'] for hit in search_lyrics('hoan toan')], [self.plain.id])
+        self.assertEqual(search_lyrics('mot ngay nang'), [])
+
+    def test_lyrics_search_endpoint(self):
+        response = APIClient().get('/api/v1/music/search/lyrics/', {'q': 'em đi đường'})
+        self.assertEqual(response.status_code, 200)
+        result = response.data['results'][0]
+        self.assertEqual(result['song']['id'], self.synced.id)
+        self.assertEqual((result['line'], result['timestamp']), ('Em đi đường xa', 20.0))
+
+        response = APIClient().get('/api/v1/music/search/', {'q': 'nắng'})
+        self.assertEqual([item['song']['id'] for item in response.data['lyrics']], [self.plain.id])
+
+
+@override_settings(SUGGEST_BACKGROUND_REBUILD=False)
+class SuggestTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        reset_index()
+        self.addCleanup(reset_index)
+        self.user = User.objects.create_user(username='typer', email='typer@example.com', password='password123')
+        self.quiet = Song.objects.create(title='Anh Yêu Em', artist='Ca Sĩ A', duration=100, uploaded_by=self.user)
+        self.hit = Song.objects.create(
+            title='Anh Ơi Ở Lại', artist='Ca Sĩ B', duration=100, uploaded_by=self.user, play_count=500
+        )
+        self.artist = Artist.objects.create(name='Anh Tú')
+        Artist.objects.filter(id=self.artist.id).update(total_plays=100)
+        Playlist.objects.create(name='Nhạc anh em', user=self.user, is_public=True)
+        Playlist.objects.create(name='Anh riêng tư', user=self.user, is_public=False)
+
+    def test_prefix_matches_rank_by_popularity(self):
+        results = suggest('anh')
+        self.assertEqual([(r['type'], r['text']) for r in results][:3], [
+            ('song', 'Anh Ơi Ở Lại'), ('artist', 'Anh Tú'), ('song', 'Anh Yêu Em'),
+        ])
+        self.assertNotIn('Anh riêng tư', [r['text'] for r in results])
+        # Khớp cả từ giữa tên, không phân biệt dấu
+        self.assertEqual([r['text'] for r in suggest('yeu e')], ['Anh Yêu Em'])
+        self.assertEqual([r['text'] for r in suggest('anh em')], ['Nhạc anh em'])
+
+        # Chỉ mục đã dựng: tra cứu không truy vấn DB
+        with self.assertNumQueries(0):
+            suggest('an', limit=2)
+
+    def test_index_applies_changes_incrementally(self):
+        suggest('anh')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.quiet.title = 'Bài Mới'
+            self.quiet.save()
+            self.artist.delete()
+        self.assertEqual(SuggestChange.objects.count(), 2)
+        # Đọc nhật ký thay đổi, rồi nạp lại bài hát và nghệ sĩ đã đổi
+        with self.assertNumQueries(3):
+            results = suggest('anh')
+        self.assertEqual([r['text'] for r in results], ['Anh Ơi Ở Lại', 'Nhạc anh em'])
+        self.assertEqual([r['text'] for r in suggest('bai m')], ['Bài Mới'])
+
+    def test_large_gap_serves_old_index_while_rebuilding(self):
+        suggest('anh')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.quiet.title = 'Bài Mới'
+            self.quiet.save()
+        with mock.patch('music.suggest.MAX_PENDING_CHANGES', 0), \
+                mock.patch('music.suggest.schedule_rebuild') as schedule_rebuild:
+            results = suggest('anh yeu')
+        schedule_rebuild.assert_called_once_with()
+        self.assertEqual([r['text'] for r in results], ['Anh Yêu Em'])
+
+    def test_suggest_endpoint_does_not_write_history(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/v1/music/suggest/', {'q': 'anh o'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['id'], self.hit.id)
+        self.assertFalse(SearchHistory.objects.exists())
+
+
+@override_settings(MUSIC_TASKS_EAGER=True, SEARCH_LOG_BATCH_SIZE=3)
+class SearchLogTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        flush_search_log()
+        self.user = User.objects.create_user(username='logger', email='logger@example.com', password='password123')
+        self.other = User.objects.create_user(username='logger2', email='logger2@example.com', password='password123')
+
+    def test_consecutive_duplicates_are_skipped_and_buffered(self):
+        with self.assertNumQueries(0):
+            self.assertTrue(log_search(self.user, 'Sơn Tùng'))
+            self.assertFalse(log_search(self.user, '  son   tung '))
+            self.assertTrue(log_search(self.other, 'Sơn Tùng'))
+        self.assertFalse(SearchHistory.objects.exists())
+        self.assertEqual(flush_search_log(), 2)
+        self.assertEqual(SearchHistory.objects.count(), 2)
+
+    def test_batch_is_written_with_rollup(self):
+        log_search(self.user, 'Sơn Tùng')
+        log_search(self.user, 'Mưa')
+        with self.assertNumQueries(8):
+            # Lượt thứ 3 đủ lô: một INSERT lịch sử, UPDATE thống kê từng từ khóa, một INSERT thống kê (kèm savepoint)
+            log_search(self.other, 'son tung')
+        self.assertEqual(SearchHistory.objects.count(), 3)
+        stats = SearchQueryStats.objects.get(query='son tung')
+        self.assertEqual((stats.count, stats.display), (2, 'son tung'))
+
+        log_search(self.user, 'SON TUNG')
+        flush_search_log()
+        self.assertEqual(SearchQueryStats.objects.get(query='son tung').count, 3)
+
+    def test_buffered_timestamp_is_kept(self):
+        searched_at = timezone.now() - timedelta(minutes=3)
+        with mock.patch('music.search_log.timezone.now', return_value=searched_at):
+            log_search(self.user, 'Bolero')
+        flush_search_log()
+        self.assertEqual(SearchHistory.objects.get(user=self.user).timestamp, searched_at)
+
+    def test_failed_flush_requeues_entries(self):
+        log_search(self.user, 'Mưa')
+        with mock.patch('music.search_log.SearchHistory.objects.bulk_create', side_effect=DatabaseError('down')):
+            self.assertEqual(flush_search_log(), 0)
+        self.assertFalse(SearchHistory.objects.exists())
+        self.assertEqual(flush_search_log(), 1)
+        self.assertEqual(SearchHistory.objects.get().query, 'Mưa')
+
+    def test_popular_searches_endpoint(self):
+        log_search(self.user, 'Mưa')
+        log_search(self.user, 'Nắng')
+        log_search(self.other, 'mua')
+        today = timezone.localdate()
+        SearchQueryStats.objects.create(
+            query='nang', display='Nắng', day=today - timedelta(days=30), count=10
+        )
+        response = APIClient().get('/api/v1/music/search/popular/', {'days': 7})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(r['normalized'], r['count']) for r in response.data['results']], [('mua', 2), ('nang', 1)]
+        )
+        response = APIClient().get('/api/v1/music/search/popular/', {'days': 0})
+        self.assertEqual(response.data['results'][0]['query'], 'Nắng')
+        self.assertEqual(response.data['results'][0]['count'], 11)
+
+    def test_history_view_flushes_buffer(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        client.get('/api/v1/music/search/', {'q': 'ballad'})
+        response = client.get('/api/v1/music/search-history/')
+        self.assertEqual([item['query'] for item in response.data['history']], ['ballad'])
+
+        client.get('/api/v1/music/search/', {'q': 'rock'})
+        client.delete('/api/v1/music/search-history/delete/')
+        flush_search_log()
+        self.assertFalse(SearchHistory.objects.filter(user=self.user).exists())
+
+    def test_prune_in_batches(self):
+        old = timezone.now() - timedelta(days=200)
+        for query in ('a', 'b', 'c'):
+            entry = SearchHistory.objects.create(user=self.user, query=query)
+            SearchHistory.objects.filter(id=entry.id).update(timestamp=old)
+        SearchHistory.objects.create(user=self.user, query='new')
+        SearchQueryStats.objects.create(
+            query='a', display='a', day=timezone.localdate() - timedelta(days=400), count=1
+        )
+        self.assertEqual(prune_search_history(dry_run=True), (3, 1))
+        out = StringIO()
+        call_command('prune_search_history', '--batch-size', '2', stdout=out)
+        self.assertIn('3 lượt tìm kiếm', out.getvalue())
+        self.assertEqual(list(SearchHistory.objects.values_list('query', flat=True)), ['new'])
+        self.assertFalse(SearchQueryStats.objects.exists())
+
+
+@override_settings(SEARCH_COUNT_CAP=3)
+class CatalogSearchTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(username='finder', email='finder@example.com', password='password123')
+        self.songs = [
+            Song.objects.create(title=f'Mùa Thu {i}', artist='Ca Sĩ', duration=100, uploaded_by=self.user, play_count=i)
+            for i in range(5)
+        ]
+        self.album = Album.objects.create(title='Mùa Thu Hà Nội', artist='Ca Sĩ', release_date='2020-01-01')
+        self.artist = Artist.objects.create(name='Nhóm Mùa Thu')
+        for i in range(3):
+            playlist = Playlist.objects.create(name=f'Mùa Thu list {i}', user=self.user, is_public=True)
+            CollaboratorRole.objects.create(playlist=playlist, user=self.user, role='EDITOR')
+        Playlist.objects.create(name='Mùa Thu riêng', user=self.user, is_public=False)
+
+    def test_sections_are_limited_with_capped_totals(self):
+        response = APIClient().get('/api/v1/music/search/', {'q': 'mùa thu', 'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.data['songs']], [self.songs[4].id, self.songs[3].id])
+        self.assertEqual(response.data['totals']['songs'], {'count': 3, 'exact': False})
+        self.assertEqual(response.data['totals']['playlists'], {'count': 3, 'exact': True})
+        self.assertEqual(len(response.data['playlists']), 2)
+        self.assertEqual(response.data['playlists'][0]['collaborators_count'], 1)
+        self.assertEqual([item['id'] for item in response.data['albums']], [self.album.id])
+        self.assertEqual([item['id'] for item in response.data['artists']], [self.artist.id])
+
+    def test_types_and_per_section_limits(self):
+        response = APIClient().get('/api/v1/music/search/', {'q': 'mùa thu', 'types': 'songs,albums', 'songs_limit': 1})
+        self.assertEqual(set(response.data), {'songs', 'albums', 'totals'})
+        self.assertEqual(len(response.data['songs']), 1)
+
+        response = APIClient().get('/api/v1/music/search/', {'q': 'mùa thu', 'types': 'songs,users'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_results_are_cached_per_query(self):
+        client = APIClient()
+        client.get('/api/v1/music/search/', {'q': 'Mùa Thu', 'types': 'songs,playlists'})
+        # Lần sau chỉ nạp bản ghi theo id: một truy vấn mỗi mục
+        with self.assertNumQueries(2):
+            response = client.get('/api/v1/music/search/', {'q': 'mùa thu', 'types': 'songs,playlists'})
+        self.assertEqual(len(response.data['songs']), 5)
+
+
+    def test_sections_run_on_dedicated_pool(self):
+        def fake_section(section, query, limit):
+            return {'ids': [], 'count': 0, 'exact': True, 'thread': threading.current_thread().name}
+
+        # Ngoài giao dịch: các mục chạy trên pool riêng, không xếp hàng sau tác vụ nền
+        with mock.patch('music.search.search_section', side_effect=fake_section), \
+                mock.patch('music.search.connection') as connection:
+            connection.in_atomic_block = False
+            results = search_catalog('mùa thu', sections=['songs', 'albums'])
+        self.assertEqual(set(results), {'songs', 'albums'})
+        self.assertTrue(all(result['thread'].startswith('music-search') for result in results.values()))
+
+    def test_failing_section_returns_empty_result(self):
+        client = APIClient()
+        with mock.patch('music.search.search_lyrics', side_effect=DatabaseError('timeout')):
+            response = client.get('/api/v1/music/search/', {'q': 'mùa thu', 'types': 'songs,lyrics'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['lyrics'], [])
+        self.assertEqual(response.data['totals']['lyrics'], {'count': 0, 'exact': False})
+        self.assertEqual(len(response.data['songs']), 5)
+
+        # Kết quả thiếu mục không được cache; trên pool mục lỗi cũng trả về như vậy
+        with mock.patch('music.search.search_section', side_effect=RuntimeError('boom')), \
+                mock.patch('music.search.connection') as connection:
+            connection.in_atomic_block = False
+            results = search_catalog('mùa thu', sections=['songs', 'lyrics'])
+        self.assertEqual(results['lyrics'], {'ids': [], 'count': 0, 'exact': False, 'hits': []})
+        self.assertEqual(results['songs'], {'ids': [], 'count': 0, 'exact': False})
+
+class UserLibraryTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(username='collector', email='collector@example.com', password='password123')
+        self.songs = [
+            Song.objects.create(title=f'Bài {i}', artist='Ca Sĩ', duration=100, uploaded_by=self.user)
+            for i in range(3)
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.playlist = Playlist.objects.create(name='Của tôi', user=self.user)
+            self.user.favorite_songs.add(self.songs[0])
+            self.user.favorite_songs.add(self.songs[1])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_paginated_sections_from_cached_snapshot(self):
+        response = self.client.get('/api/v1/music/library/', {'page_size': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['delta'])
+        self.assertEqual(response.data['favorites']['count'], 2)
+        self.assertEqual([item['id'] for item in response.data['favorites']['results']], [self.songs[1].id])
+        self.assertEqual(response.data['playlists']['results'][0]['id'], self.playlist.id)
+
+        # Ảnh chụp đã cache: chỉ nạp bản ghi của trang theo id
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/music/library/', {'section': 'favorites', 'page': 2, 'page_size': 1})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.songs[0].id])
+        self.assertEqual(self.client.get('/api/v1/music/library/', {'section': 'recent'}).status_code, 400)
+
+    def test_delta_sync_since_version(self):
+        version = self.client.get('/api/v1/music/library/').data['version']
+        response = self.client.get('/api/v1/music/library/', {'since': version})
+        self.assertEqual(set(response.data), {'version', 'delta'})
+        playlist_id = self.playlist.id
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.favorite_songs.remove(self.songs[0])
+            self.songs[2].favorited_by.add(self.user)
+            SongPlayHistory.objects.create(user=self.user, song=self.songs[2])
+            self.playlist.delete()
+        response = self.client.get('/api/v1/music/library/', {'since': version})
+        self.assertTrue(response.data['delta'])
+        self.assertGreater(response.data['version'], version)
+        self.assertEqual([item['id'] for item in response.data['favorites']['changed']], [self.songs[2].id])
+        self.assertEqual(response.data['favorites']['removed'], [self.songs[0].id])
+        self.assertEqual(response.data['playlists'], {'changed': [], 'removed': [playlist_id]})
+        self.assertEqual([item['id'] for item in response.data['recent']], [self.songs[2].id])
+
+    def test_default_response_keeps_plain_lists(self):
+        response = self.client.get('/api/v1/music/library/')
+        self.assertEqual(set(response.data), {'playlists', 'favorites', 'recent', 'version'})
+        self.assertEqual([item['id'] for item in response.data['favorites']], [self.songs[1].id, self.songs[0].id])
+        self.assertEqual([item['id'] for item in response.data['playlists']], [self.playlist.id])
+        self.assertEqual(response.data['recent'], [])
+
+    def test_song_delete_bumps_favorites(self):
+        version = self.client.get('/api/v1/music/library/').data['version']
+        song_id = self.songs[1].id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.songs[1].delete()
+        response = self.client.get('/api/v1/music/library/', {'since': version})
+        self.assertTrue(response.data['delta'])
+        self.assertEqual(response.data['favorites'], {'changed': [], 'removed': [song_id]})
+
+    def test_pruned_change_log_falls_back_to_full_snapshot(self):
+        version = self.client.get('/api/v1/music/library/').data['version']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.favorite_songs.add(self.songs[2])
+        LibraryChange.objects.filter(id=version).delete()
+        response = self.client.get('/api/v1/music/library/', {'since': version})
+        self.assertFalse(response.data['delta'])
+        self.assertEqual(response.data['favorites']['count'], 3)
@@ -0,0 +1,189 @@
+"""
+Ảnh thu nhỏ (WebP/AVIF, 64/256/640 px) cho ảnh bìa bài hát, album, playlist và
+ảnh nghệ sĩ, thể loại.
+
+- Ảnh được thu nhỏ dần theo kiểu kim tự tháp (640 -> 256 -> 64) trên pool tiến
+  trình, mỗi kích thước lưu ở mọi định dạng Pillow hỗ trợ.
+- Tên file theo SHA-256 của ảnh gốc: các bài hát dùng chung ảnh bìa album dùng
+  chung một bộ ảnh thu nhỏ.
+- Kết quả ghi vào trường JSON <*_thumbnails> của model, kèm tên ảnh gốc; khi ảnh
+  gốc đổi, serializer bỏ qua bộ ảnh cũ cho đến khi tạo lại.
+"""
+import hashlib
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .homepage import mark_homepage_stale
+from .models import Album, Artist, Genre, Playlist, Song
+from .workers import run_in_process
+
+try:
+    from PIL import Image, ImageOps
+    Image.init()
+    PILLOW_AVAILABLE = True
+except ImportError:
+    PILLOW_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# model -> (trường ảnh gốc, trường JSON lưu ảnh thu nhỏ)
+THUMBNAIL_FIELDS = {
+    Song: ('cover_image', 'cover_thumbnails'),
+    Album: ('cover_image', 'cover_thumbnails'),
+    Playlist: ('cover_image', 'cover_thumbnails'),
+    Artist: ('image', 'image_thumbnails'),
+    Genre: ('image', 'image_thumbnails'),
+}
+
+THUMBNAIL_CONTENT_TYPES = {
+    'webp': 'image/webp',
+    'avif': 'image/avif',
+}
+
+_SAVE_OPTIONS = {
+    'webp': {'method': 4},
+    'avif': {'speed': 8},
+}
+
+
+def get_sizes():
+    return sorted(getattr(settings, 'IMAGE_THUMBNAIL_SIZES', [64, 256, 640]), reverse=True)
+
+
+def get_formats():
+    """Các định dạng được cấu hình mà Pillow ghi được"""
+    if not PILLOW_AVAILABLE:
+        return []
+    return [
+        fmt for fmt in getattr(settings, 'IMAGE_THUMBNAIL_FORMATS', ['webp'])
+        if fmt.upper() in Image.SAVE
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Tác vụ chạy trên pool tiến trình (không truy vấn DB)
+# ---------------------------------------------------------------------------
+
+def render_thumbnails_task(data, sizes, formats, quality=80):
+    """
+    Tạo ảnh thu nhỏ từ byte ảnh gốc.
+
+    Trả về {'hash': sha256 ảnh gốc, 'source_bytes': ..., 'images': {định dạng: {kích thước: byte}}}
+    """
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    images = {fmt: {} for fmt in formats}
+    current = image
+    for size in sorted(sizes, reverse=True):
+        # Thu nhỏ từ bậc lớn hơn liền trước thay vì từ ảnh gốc; không phóng to ảnh nhỏ
+        current = current.copy()
+        current.thumbnail((size, size), Image.LANCZOS, reducing_gap=3.0)
+        for fmt in formats:
+            output = io.BytesIO()
+            current.save(output, format=fmt.upper(), quality=quality, **_SAVE_OPTIONS.get(fmt, {}))
+            images[fmt][size] = output.getvalue()
+    return {
+        'hash': hashlib.sha256(data).hexdigest(),
+        'source_bytes': len(data),
+        'images': images,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Điều phối (có truy vấn DB)
+# ---------------------------------------------------------------------------
+
+def thumbnail_fields(instance):
+    return THUMBNAIL_FIELDS[type(instance)]
+
+
+def get_thumbnails(instance):
+    """{định dạng: {kích thước: tên file}} của ảnh hiện tại, None nếu chưa tạo"""
+    image_field, thumbs_field = thumbnail_fields(instance)
+    image = getattr(instance, image_field)
+    record = getattr(instance, thumbs_field) or {}
+    if not image or record.get('source') != image.name:
+        return None
+    return record.get('formats') or None
+
+
+def needs_thumbnails(instance):
+    image_field, thumbs_field = thumbnail_fields(instance)
+    image = getattr(instance, image_field)
+    if not image or not get_formats():
+        return False
+    record = getattr(instance, thumbs_field) or {}
+    if record.get('source') != image.name:
+        return True
+    wanted = {str(size) for size in get_sizes()}
+    formats = record.get('formats') or {}
+    return any(set(formats.get(fmt, {})) != wanted for fmt in get_formats())
+
+
+def submit_thumbnails(instance):
+    """Đọc ảnh gốc và gửi việc tạo ảnh thu nhỏ lên pool tiến trình, trả về Future"""
+    image_field, _ = thumbnail_fields(instance)
+    image = getattr(instance, image_field)
+    with image.storage.open(image.name, 'rb') as f:
+        data = f.read()
+    return run_in_process(
+        render_thumbnails_task, data, get_sizes(), get_formats(),
+        getattr(settings, 'IMAGE_THUMBNAIL_QUALITY', 80)
+    )
+
+
+def thumbnail_path(content_hash, size, fmt):
+    return f'thumbnails/{content_hash[:2]}/{content_hash}/{size}.{fmt}'
+
+
+def save_thumbnails(instance, source_name, result):
+    """
+    Ghi ảnh thu nhỏ vào storage và cập nhật trường JSON của instance.
+
+    Chỉ cập nhật nếu ảnh gốc vẫn là source_name (tránh ghi đè khi ảnh vừa đổi).
+    """
+    image_field, thumbs_field = thumbnail_fields(instance)
+    storage = getattr(instance, image_field).storage
+    formats = {}
+    for fmt, by_size in result['images'].items():
+        formats[fmt] = {}
+        for size, content in by_size.items():
+            name = thumbnail_path(result['hash'], size, fmt)
+            if not storage.exists(name):
+                name = storage.save(name, ContentFile(content))
+            formats[fmt][str(size)] = name
+
+    record = {'source': source_name, 'hash': result['hash'], 'formats': formats}
+    # update() thay cho save(): không kích hoạt lại signal tạo ảnh thu nhỏ
+    updated = type(instance).objects.filter(pk=instance.pk, **{image_field: source_name}).update(
+        **{thumbs_field: record}
+    )
+    if updated:
+        setattr(instance, thumbs_field, record)
+        mark_homepage_stale()
+    return record
+
+
+def generate_thumbnails(instance):
+    """Tạo ảnh thu nhỏ cho instance (chờ pool tiến trình), trả về bản ghi đã lưu"""
+    image_field, _ = thumbnail_fields(instance)
+    source_name = getattr(instance, image_field).name
+    return save_thumbnails(instance, source_name, submit_thumbnails(instance).result())
+
+
+def generate_thumbnails_by_id(model, pk):
+    """Tác vụ nền: tạo ảnh thu nhỏ nếu ảnh gốc chưa có"""
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not needs_thumbnails(instance):
+        return None
+    try:
+        return generate_thumbnails(instance)
+    except Exception as e:
+        logger.warning(f"Không tạo được ảnh thu nhỏ cho {model.__name__} #{pk}: {str(e)}")
+        return None
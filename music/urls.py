@@ -56,7 +56,11 @@ urlpatterns = [
     
     # Music player functionality
     path('upload/', views.SongUploadView.as_view(), name='song-upload'),
+    path('upload/jobs/<int:job_id>/', views.IngestJobStatusView.as_view(), name='ingest-job-status'),
     path('search/', views.SearchView.as_view(), name='search'),
+    path('search/lyrics/', views.LyricsSearchView.as_view(), name='lyrics-search'),
+    path('suggest/', views.SuggestView.as_view(), name='suggest'),
+    path('search/popular/', views.PopularSearchesView.as_view(), name='popular-searches'),
     path('trending/', views.TrendingSongsView.as_view(), name='trending'),
     path('recommended/', views.RecommendedSongsView.as_view(), name='recommended'),
     path('library/', views.UserLibraryView.as_view(), name='user-library'),
@@ -94,6 +98,7 @@ urlpatterns = [
     
     # Lyrics management
     path('songs/<int:song_id>/lyrics/synced/', views.SyncedLyricsView.as_view(), name='synced-lyrics'),
+    path('songs/<int:song_id>/lyrics/at/', views.LyricsLookupView.as_view(), name='lyrics-lookup'),
     path('play/', views.play_song, name='play_song'),
     path('search-history/', SearchHistoryView.as_view(), name='search-history'),
     path('search-history/delete/', SearchHistoryView.as_view(), name='delete-search-history'),
@@ -119,6 +124,19 @@ urlpatterns = [
     # Download song
     path('songs/<int:song_id>/download/', SongDownloadView.as_view(), name='song-download'),
     path('songs/<int:song_id>/stream/', SongStreamView.as_view(), name='song-stream'),
+    path('songs/<int:song_id>/hls/master.m3u8', views.SongHLSView.as_view(), name='song-hls-master'),
+    path('songs/<int:song_id>/hls/<str:variant>.m3u8', views.SongHLSView.as_view(), name='song-hls-variant'),
+    path('songs/<int:song_id>/dash/manifest.mpd', views.SongDASHView.as_view(), name='song-dash-manifest'),
+    path('songs/<int:song_id>/waveform/', views.SongWaveformView.as_view(), name='song-waveform'),
+    path('songs/<int:song_id>/segments/<str:version>/<str:variant>/<str:filename>',
+         views.SongSegmentView.as_view(), name='song-segment'),
+
+    # Tải xuống nghe offline (hàng đợi nền, xem music.offline)
+    path('offline/downloads/', views.OfflineDownloadListView.as_view(), name='offline-downloads'),
+    path('offline/download/', views.OfflineDownloadView.as_view(), name='offline-download'),
+    path('offline/downloads/<int:download_id>/', views.OfflineDownloadStatusView.as_view(), name='offline-download-status'),
+    path('offline/downloads/<int:download_id>/delete/', views.DeleteOfflineDownloadView.as_view(), name='offline-download-delete'),
+    path('offline/manifest/', views.OfflineManifestView.as_view(), name='offline-manifest'),
 ]
 if settings.DEBUG:
       urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -6,31 +6,16 @@ from typing import Dict, Optional, Union, List, Tuple, Any, Mapping, cast
 from django.conf import settings
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
-from .models import Song, LyricLine
-
-try:
-    import mutagen
-    from mutagen.id3 import ID3
-    from mutagen.id3._frames import TIT2, TPE1, TALB, TCON, USLT, TLEN
-    from mutagen.mp3 import MP3
-    from mutagen.flac import FLAC
-    from mutagen.mp4 import MP4
-    MUTAGEN_AVAILABLE = True
-except ImportError:
-    MUTAGEN_AVAILABLE = False
-
-try:
-    import eyed3
-    EYED3_AVAILABLE = True
-except ImportError:
-    EYED3_AVAILABLE = False
-
+from .models import Song
+from .audio_analysis import analyze_waveform_task, measure_loudness, compute_replay_gain
+from .metadata import read_audio_metadata
+from .lyrics import import_lyrics, parse_lrc
 
 def get_audio_metadata(file_path: str) -> Dict[str, Optional[Union[str, int]]]:
     """
     Trích xuất metadata từ file âm thanh
     
-    Hỗ trợ các định dạng: MP3, FLAC, M4A, OGG
+    Hỗ trợ các định dạng: MP3, FLAC, M4A, OGG (xem music.metadata)
     
     Trả về dict với các thông tin:
     - title: Tiêu đề bài hát
@@ -40,90 +25,9 @@ def get_audio_metadata(file_path: str) -> Dict[str, Optional[Union[str, int]]]:
     - duration: Thời lượng (giây)
     - lyrics: Lời bài hát (nếu có)
     - year: Năm phát hành (nếu có)
+    - content_hash: SHA-256 nội dung file
     """
-    metadata: Dict[str, Optional[Union[str, int]]] = {
-        'title': None,
-        'artist': None,
-        'album': None,
-        'genre': None,
-        'duration': None,
-        'lyrics': None,
-        'year': None
-    }
-    
-    if not os.path.exists(file_path):
-        return metadata
-    
-    file_ext = os.path.splitext(file_path)[1].lower()
-    
-    # Sử dụng mutagen nếu có
-    if MUTAGEN_AVAILABLE:
-        try:
-            if file_ext == '.mp3':
-                audio = MP3(file_path, ID3=ID3)
-                if audio.tags:
-                    metadata['title'] = str(audio.tags.get('TIT2', ''))
-                    metadata['artist'] = str(audio.tags.get('TPE1', ''))
-                    metadata['album'] = str(audio.tags.get('TALB', ''))
-                    metadata['genre'] = str(audio.tags.get('TCON', ''))
-                    if 'USLT' in audio.tags:
-                        metadata['lyrics'] = str(audio.tags['USLT'].text)
-                metadata['duration'] = int(audio.info.length)
-                
-            elif file_ext == '.flac':
-                audio = FLAC(file_path)
-                if 'title' in audio:
-                    metadata['title'] = audio['title'][0]
-                if 'artist' in audio:
-                    metadata['artist'] = audio['artist'][0]
-                if 'album' in audio:
-                    metadata['album'] = audio['album'][0]
-                if 'genre' in audio:
-                    metadata['genre'] = audio['genre'][0]
-                metadata['duration'] = int(audio.info.length)
-                
-            elif file_ext in ['.m4a', '.mp4']:
-                audio = MP4(file_path)
-                if '\xa9nam' in audio:
-                    metadata['title'] = audio['\xa9nam'][0]
-                if '\xa9ART' in audio:
-                    metadata['artist'] = audio['\xa9ART'][0]
-                if '\xa9alb' in audio:
-                    metadata['album'] = audio['\xa9alb'][0]
-                if '\xa9gen' in audio:
-                    metadata['genre'] = audio['\xa9gen'][0]
-                metadata['duration'] = int(audio.info.length)
-        except Exception as e:
-            print(f"Mutagen error: {str(e)}")
-    
-    # Sử dụng eyed3 nếu có và là file MP3
-    elif EYED3_AVAILABLE and file_ext == '.mp3':
-        try:
-            audiofile = eyed3.load(file_path)
-            if audiofile and audiofile.tag:
-                metadata['title'] = audiofile.tag.title
-                metadata['artist'] = audiofile.tag.artist
-                metadata['album'] = audiofile.tag.album
-                metadata['genre'] = audiofile.tag.genre.name if audiofile.tag.genre else None
-                for lyrics in audiofile.tag.lyrics:
-                    metadata['lyrics'] = lyrics.text
-                metadata['year'] = audiofile.tag.recording_date.year if audiofile.tag.recording_date else None
-            if audiofile and audiofile.info:
-                metadata['duration'] = int(audiofile.info.time_secs)
-        except Exception as e:
-            print(f"EyeD3 error: {str(e)}")
-    
-    # Sử dụng ffprobe như phương án dự phòng
-    if metadata['duration'] is None:
-        try:
-            cmd = ['ffprobe', '-i', file_path, '-show_entries', 'format=duration', '-v', 'quiet', '-of', 'json']
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            data = json.loads(result.stdout)
-            metadata['duration'] = int(float(data['format']['duration']))
-        except Exception as e:
-            print(f"FFprobe error: {str(e)}")
-    
-    return metadata
+    return read_audio_metadata(file_path, with_hash=True).as_dict()
 
 
 def convert_audio_format(input_file: str, output_format: str = 'mp3', bitrate: str = '192k') -> Optional[str]:
@@ -155,39 +59,66 @@ def convert_audio_format(input_file: str, output_format: str = 'mp3', bitrate: s
         return None
 
 
+def segment_audio(input_file: str, output_dir: str, bitrate: str = '128k', segment_duration: float = 6) -> Optional[Dict[str, Any]]:
+    """
+    Chia file âm thanh thành các đoạn fMP4 (AAC) độ dài cố định, dùng chung cho HLS và DASH
+
+    input_file: Đường dẫn đến file âm thanh đầu vào
+    output_dir: Thư mục chứa init.mp4, các đoạn seg_XXXXX.m4s và playlist của ffmpeg
+    bitrate: Bitrate AAC cho các đoạn
+    segment_duration: Độ dài mỗi đoạn (giây)
+
+    Trả về {'init': 'init.mp4', 'segments': [(tên file, độ dài), ...]} hoặc None nếu lỗi
+    """
+    if not os.path.exists(input_file):
+        return None
+
+    os.makedirs(output_dir, exist_ok=True)
+    playlist = os.path.join(output_dir, 'index.m3u8')
+
+    try:
+        cmd = [
+            'ffmpeg', '-v', 'error', '-nostdin', '-y', '-i', input_file,
+            '-vn', '-c:a', 'aac', '-b:a', bitrate,
+            '-f', 'hls', '-hls_time', str(segment_duration), '-hls_playlist_type', 'vod',
+            '-hls_segment_type', 'fmp4', '-hls_fmp4_init_filename', 'init.mp4',
+            '-hls_segment_filename', os.path.join(output_dir, 'seg_%05d.m4s'),
+            playlist
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"Error segmenting audio: {result.stderr.strip()[-500:]}")
+            return None
+
+        # Đọc độ dài từng đoạn từ playlist ffmpeg sinh ra
+        segments: List[Tuple[str, float]] = []
+        duration = None
+        with open(playlist, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('#EXTINF:'):
+                    duration = float(line[len('#EXTINF:'):].split(',')[0])
+                elif line and not line.startswith('#') and duration is not None:
+                    segments.append((line, duration))
+                    duration = None
+
+        return {'init': 'init.mp4', 'segments': segments}
+    except Exception as e:
+        print(f"Error segmenting audio: {str(e)}")
+        return None
+
+
 def extract_synchronized_lyrics(lyrics_text: Optional[str]) -> List[Tuple[float, str]]:
     """
     Trích xuất lời bài hát đồng bộ từ văn bản
     
-    Format hỗ trợ:
+    Format hỗ trợ (xem music.lyrics.parse_lrc):
     [00:01.00]Line 1
-    [00:05.20]Line 2
+    [00:05.20]<00:05.20>Line <00:05.80>2
     
     Trả về list của tuples (thời gian, lời)
     """
-    synced_lyrics: List[Tuple[float, str]] = []
-    
-    if not lyrics_text:
-        return synced_lyrics
-    
-    for line in lyrics_text.split('\n'):
-        line = line.strip()
-        if line and line.startswith('[') and ']' in line:
-            # Tách timestamp và lời
-            timestamp_str = line[1:line.find(']')]
-            lyric_text = line[line.find(']')+1:].strip()
-            
-            # Chuyển đổi timestamp sang giây
-            try:
-                minutes, seconds = timestamp_str.split(':')
-                time_seconds = int(minutes) * 60 + float(seconds)
-                synced_lyrics.append((time_seconds, lyric_text))
-            except:
-                continue
-    
-    # Sắp xếp theo thời gian tăng dần
-    synced_lyrics.sort(key=lambda x: x[0])
-    return synced_lyrics
+    return [(timestamp, text) for timestamp, text, _ in parse_lrc(lyrics_text)[1]]
 
 
 def import_synchronized_lyrics(song_id: int, lyrics_text: str) -> bool:
@@ -198,65 +129,31 @@ def import_synchronized_lyrics(song_id: int, lyrics_text: str) -> bool:
     lyrics_text: Văn bản lời đồng bộ
     """
     try:
-        song = Song.objects.get(id=song_id)
-        
-        # Xóa lời đồng bộ cũ nếu có
-        LyricLine.objects.filter(song=song).delete()
-        
-        # Trích xuất lời đồng bộ
-        synced_lyrics = extract_synchronized_lyrics(lyrics_text)
-        
-        # Lưu lời đồng bộ mới
-        for timestamp, text in synced_lyrics:
-            LyricLine.objects.create(
-                song=song,
-                timestamp=timestamp,
-                text=text
-            )
-        
-        # Cập nhật lời không đồng bộ
-        plain_lyrics = '\n'.join([line[1] for line in synced_lyrics])
-        song.lyrics = plain_lyrics
-        song.save(update_fields=['lyrics'])
-        
-        return True
-    except Song.DoesNotExist:
-        return False
+        return import_lyrics(song_id, lyrics_text) is not None
     except Exception as e:
         print(f"Error importing lyrics: {str(e)}")
         return False
 
 
-def normalize_audio(file_path: str, target_level: int = -16) -> Optional[str]:
+def get_loudness_data(file_path: str) -> Dict[str, Optional[float]]:
     """
-    Chuẩn hóa âm lượng của file âm thanh
+    Đo độ to của file âm thanh theo EBU R128 (không mã hóa lại, không tạo file mới)
     
-    file_path: Đường dẫn đến file âm thanh đầu vào
-    target_level: Mức âm lượng mục tiêu tính bằng dB LUFS (Loudness Units Full Scale)
+    file_path: Đường dẫn đến file âm thanh
     
-    Trả về đường dẫn đến file đã được chuẩn hóa âm lượng
+    Trả về dict với integrated_lufs, true_peak_db, loudness_range và replay_gain
+    (gain dB mà client áp dụng khi phát để đạt LOUDNESS_TARGET_LUFS)
     """
     if not os.path.exists(file_path):
-        return None
-        
-    # Tạo tên file đầu ra
-    filename = os.path.basename(file_path)
-    name, ext = os.path.splitext(filename)
-    output_file = os.path.join(tempfile.gettempdir(), f"{name}_normalized{ext}")
+        return {}
     
     try:
-        # Sử dụng ffmpeg-normalize (cần đảm bảo đã cài đặt)
-        cmd = [
-            'ffmpeg', '-i', file_path,
-            '-af', f'loudnorm=I={target_level}:LRA=11:TP=-1.5', 
-            '-y', output_file
-        ]
-        subprocess.run(cmd, capture_output=True)
-        
-        return output_file
+        loudness: Dict[str, Optional[float]] = dict(measure_loudness(file_path))
+        loudness['replay_gain'] = compute_replay_gain(loudness['integrated_lufs'], loudness['true_peak_db'])
+        return loudness
     except Exception as e:
-        print(f"Error normalizing audio: {str(e)}")
-        return None
+        print(f"Error measuring loudness: {str(e)}")
+        return {}
 
 
 def get_waveform_data(file_path: str, num_points: int = 100) -> List[float]:
@@ -266,36 +163,15 @@ def get_waveform_data(file_path: str, num_points: int = 100) -> List[float]:
     file_path: Đường dẫn đến file âm thanh
     num_points: Số điểm dữ liệu trong kết quả
     
-    Trả về list của các giá trị biên độ
+    Trả về list của các giá trị biên độ (peak, 0-1). Giải mã PCM qua pipe, không
+    dùng file tạm (xem music/audio_analysis.py).
     """
     if not os.path.exists(file_path):
         return []
     
     try:
-        # Sử dụng ffmpeg để xuất waveform dưới dạng raw
-        temp_file = os.path.join(tempfile.gettempdir(), 'waveform_data.raw')
-        cmd = [
-            'ffmpeg', '-i', file_path, '-filter_complex',
-            f'aformat=channel_layouts=mono,compand,showwavespic=s={num_points}x32:scale=sqrt',
-            '-frames:v', '1', '-y', temp_file
-        ]
-        subprocess.run(cmd, capture_output=True)
-        
-        # Đọc dữ liệu raw
-        waveform: List[float] = []
-        with open(temp_file, 'rb') as f:
-            data = f.read()
-            step = max(1, len(data) // num_points)
-            for i in range(0, len(data), step):
-                if i < len(data):
-                    value = data[i] / 255.0  # Chuẩn hóa về khoảng [0,1]
-                    waveform.append(value)
-        
-        # Đảm bảo chỉ có num_points điểm dữ liệu
-        while len(waveform) > num_points:
-            waveform.pop()
-        
-        return waveform
+        result = analyze_waveform_task(file_path, levels=[num_points])
+        return [value / 255.0 for value in result['peaks']]
     except Exception as e:
         print(f"Error generating waveform: {str(e)}")
         return []
@@ -351,8 +227,9 @@ def generate_song_recommendations(user, limit=10):
         favorite_song_ids = set(favorite_songs.all().values_list('id', flat=True))
     
     # Lấy từ khóa tìm kiếm gần đây
-    recent_searches = SearchHistory.objects.filter(user=user).order_by('-timestamp')[:10]
-    search_keywords = [search.query for search in recent_searches]
+    search_keywords = list(
+        SearchHistory.objects.filter(user=user).order_by('-timestamp').values_list('query', flat=True)[:10]
+    )
     
     # Tạo truy vấn gợi ý
     recommendations = Song.objects.exclude(id__in=recent_songs.union(favorite_song_ids))
@@ -411,70 +288,6 @@ def generate_song_recommendations(user, limit=10):
     return list(Song.objects.all().order_by('?')[:limit])
 
 
-def download_song_for_offline(song, target_dir: Optional[str] = None) -> Tuple[bool, str, Optional[str]]:
-    """
-    Tải bài hát để sử dụng offline
-    
-    song: Đối tượng Song cần tải xuống
-    target_dir: Thư mục đích để lưu trữ file (nếu None, sẽ sử dụng thư mục mặc định)
-    
-    Trả về tuple (success, message, file_path):
-    - success: Boolean chỉ ra thành công hay thất bại
-    - message: Thông báo kết quả
-    - file_path: Đường dẫn đến file đã tải xuống (hoặc None nếu thất bại)
-    """
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    logger.info(f"Bắt đầu tải xuống bài hát: {song.id} - {song.title}")
-    
-    if not song.audio_file:
-        logger.error(f"File âm thanh không tồn tại cho bài hát: {song.id}")
-        return False, "File âm thanh không tồn tại", None
-    
-    try:
-        # Kiểm tra URL file nguồn có tồn tại không
-        source_path = song.audio_file.path
-        logger.info(f"Đường dẫn nguồn: {source_path}")
-        
-        if not os.path.exists(source_path):
-            logger.error(f"File nguồn không tồn tại: {source_path}")
-            return False, f"File nguồn không tồn tại: {source_path}", None
-            
-        # Tạo tên file
-        song_filename = os.path.basename(song.audio_file.name)
-        logger.info(f"Tên file: {song_filename}")
-        
-        # Xác định thư mục đích
-        if not target_dir:
-            # Sử dụng thư mục tạm nếu không chỉ định
-            target_dir = tempfile.gettempdir()
-        
-        logger.info(f"Thư mục đích: {target_dir}")
-        
-        # Đảm bảo thư mục tồn tại
-        os.makedirs(target_dir, exist_ok=True)
-        
-        target_path = os.path.join(target_dir, song_filename)
-        logger.info(f"Đường dẫn đích: {target_path}")
-        
-        # Sao chép file
-        import shutil
-        shutil.copy2(source_path, target_path)
-        
-        # Kiểm tra file đã được tạo thành công chưa
-        if os.path.exists(target_path):
-            logger.info(f"Sao chép thành công tới: {target_path}")
-            return True, "Tải xuống thành công", target_path
-        else:
-            logger.error(f"Không thể tìm thấy file đích sau khi sao chép: {target_path}")
-            return False, "Không thể tìm thấy file sau khi sao chép", None
-            
-    except Exception as e:
-        logger.exception(f"Lỗi khi tải xuống: {str(e)}")
-        return False, f"Lỗi khi tải xuống: {str(e)}", None
-
-
 def verify_offline_song(file_path: str) -> bool:
     """
     Kiểm tra một file nhạc đã tải xuống có hợp lệ không
@@ -502,7 +315,7 @@ def verify_offline_song(file_path: str) -> bool:
         # Kiểm tra file có phải là file âm thanh hợp lệ không
         # Trong môi trường thực tế, có thể sử dụng ffprobe hoặc các thư viện như mutagen
         # Ở đây chúng ta sẽ đơn giản kiểm tra kích thước file và extension
-        valid_extensions = ['.mp3', '.wav', '.ogg', '.m4a']
+        valid_extensions = ['.mp3', '.wav', '.ogg', '.m4a', '.opus', '.flac', '.aac']
         file_ext = os.path.splitext(file_path)[1].lower()
         
         if file_ext not in valid_extensions:
@@ -1,5 +1,5 @@
 from django.shortcuts import get_object_or_404, render
-from django.http import JsonResponse, FileResponse, Http404, StreamingHttpResponse
+from django.http import JsonResponse, FileResponse, Http404, StreamingHttpResponse, HttpResponse, HttpResponseNotModified
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.views import APIView
@@ -9,72 +9,88 @@ from rest_framework.pagination import PageNumberPagination
 from .models import (
     Playlist, Song, Album, Genre, Rating, Comment, SongPlayHistory, 
     SearchHistory, Artist, Queue, QueueItem, UserStatus, LyricLine, Message, UserRecommendation,
-    CollaboratorRole, PlaylistEditHistory, OfflineDownload, UserActivity
+    CollaboratorRole, PlaylistEditHistory, OfflineDownload, UserActivity, PlaylistItem, IngestJob, SongStreamPackage, SongArtist
 )
 from .serializers import (
     PlaylistSerializer, SongSerializer, AlbumSerializer, GenreSerializer, 
-    RatingSerializer, CommentSerializer, SongPlayHistorySerializer,
+    RatingSerializer, CommentSerializer, CommentTreeSerializer, SongPlayHistorySerializer,
     SearchHistorySerializer, PlaylistDetailSerializer, SongDetailSerializer,
     AlbumDetailSerializer, GenreDetailSerializer, ArtistSerializer,
     QueueSerializer, UserStatusSerializer, LyricLineSerializer, MessageSerializer,
     UserBasicSerializer, CollaboratorRoleSerializer, CollaboratorRoleCreateSerializer,
     PlaylistEditHistorySerializer, OfflineDownloadSerializer, ArtistDetailSerializer,
-    SongAdminSerializer, AdminAlbumSerializer, AdminArtistSerializer, AdminGenreSerializer, AdminPlaylistSerializer
+    SongAdminSerializer, AdminAlbumSerializer, AdminArtistSerializer, AdminGenreSerializer, AdminPlaylistSerializer,
+    PlaylistItemSerializer, IngestJobSerializer
 )
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from django.db.models import Q, Count, Avg, Sum, F
+from django.db.models import Q, Count, Avg, Sum, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 import random
 from datetime import datetime, timedelta
 import django.utils.timezone
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.request import Request
-from .utils import get_audio_metadata, convert_audio_format, extract_synchronized_lyrics, import_synchronized_lyrics, normalize_audio, get_waveform_data, generate_song_recommendations, download_song_for_offline, verify_offline_song, get_offline_song_metadata
+from .media_urls import MediaURLResolver
+from .homepage import get_homepage_document
+from .permissions import PlaylistACL, filter_accessible
+from .ingest import start_ingest, ALLOWED_AUDIO_EXTENSIONS, METADATA_FIELDS
+from .renditions import get_ladder, parse_bandwidth, select_rendition, rendition_content_type, ORIGINAL_QUALITY, RenditionUnavailable
+from .streaming import build_hls_master, build_hls_media, build_dash_mpd, segment_path
+from .offline import enqueue_download, release_download
+from .catalog import record_like, record_play, top_songs
+from .comments import DEFAULT_REPLIES_LIMIT, comment_count, load_comment_page, load_more_replies
+from .ratings import prior_mean, prior_weight, top_rated_songs
+from .lyrics import document_line, format_lrc_time, get_lyrics_document, lyrics_window
+from .lyrics_search import attach_lyric_lines, search_lyrics
+from .suggest import suggest
+from .search import SECTIONS as SEARCH_SECTIONS, search_catalog
+from .library import SECTIONS as LIBRARY_SECTIONS, get_delta as get_library_delta, get_snapshot as get_library_snapshot
+from .search_log import discard_user_buffer, flush_search_log, log_search, popular_queries
+from .audio_analysis import get_waveform_document, waveform_payload
+from .playlists import (
+    edit_playlist_songs, restore_playlist_to, PlaylistEditError, PlaylistSongNotFound, PlaylistVersionConflict
+)
+from .utils import import_synchronized_lyrics, generate_song_recommendations
 import os
 from io import BytesIO
 from django.conf import settings
 import logging
 import mimetypes
+import hashlib
+import math
 import re
 from wsgiref.util import FileWrapper
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django.db import transaction
+from django.utils.dateparse import parse_datetime
 
 User = get_user_model()
 
 # API cho trang chủ - khám phá nhạc
 class HomePageView(APIView):
-    """API cho trang chủ - khám phá nhạc, không yêu cầu đăng nhập"""
+    """API cho trang chủ - khám phá nhạc, không yêu cầu đăng nhập
+
+    Trả về tài liệu JSON đã biên dịch sẵn trong cache (xem music/homepage.py),
+    hỗ trợ ETag/If-None-Match để client nhận 304 khi nội dung không đổi.
+    """
     permission_classes = [AllowAny]
+    # Trang chủ giống nhau cho mọi người dùng, không cần xác thực (tránh truy vấn user)
+    authentication_classes = []
     
     def get(self, request, format=None):
-        # Lấy bài hát nổi bật theo thể loại
-        genres = Genre.objects.all()[:6]  # Lấy 6 thể loại
-        featured_by_genre = {}
-        
-        for genre in genres:
-            top_songs = Song.objects.filter(genre=genre.name).order_by('-play_count')[:5]
-            featured_by_genre[genre.name] = SongSerializer(top_songs, many=True).data
-        
-        # Album mới phát hành
-        one_month_ago = datetime.now().date() - timedelta(days=30)
-        new_albums = Album.objects.filter(release_date__gte=one_month_ago).order_by('-release_date')[:8]
-        
-        # Playlist được yêu thích
-        popular_playlists = Playlist.objects.filter(is_public=True).annotate(
-            followers_count=Count('followers')
-        ).order_by('-followers_count')[:8]
-        
-        # Top bài hát được nghe nhiều
-        top_songs = Song.objects.order_by('-play_count')[:10]
-        
-        return Response({
-            'featured_by_genre': featured_by_genre,
-            'new_albums': AlbumSerializer(new_albums, many=True).data,
-            'popular_playlists': PlaylistSerializer(popular_playlists, many=True).data,
-            'top_songs': SongSerializer(top_songs, many=True).data
-        })
+        document = get_homepage_document()
+        etag = document['etag']
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+        if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(document['body'], content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = f"public, max-age={getattr(settings, 'HOMEPAGE_CLIENT_MAX_AGE', 60)}"
+        return response
 
 # Các view cơ bản
 class PublicPlaylistView(APIView):
@@ -156,7 +172,7 @@ class SongViewSet(viewsets.ModelViewSet):
         Cho phép người dùng chưa đăng nhập xem thông tin bài hát,
         nhưng chỉ người dùng đã đăng nhập mới có thể thao tác.
         """
-        if self.action in ['list', 'retrieve', 'search', 'trending']:
+        if self.action in ['list', 'retrieve', 'search', 'trending', 'top_rated', 'comments']:
             permission_classes = [AllowAny]
         else:
             permission_classes = [IsAuthenticated]
@@ -188,8 +204,7 @@ class SongViewSet(viewsets.ModelViewSet):
     def play(self, request, pk=None):
         """Ghi lại lượt phát của bài hát"""
         song = self.get_object()
-        song.play_count += 1
-        song.save()
+        record_play(song)
         
         # Lưu lịch sử phát
         SongPlayHistory.objects.create(
@@ -208,13 +223,11 @@ class SongViewSet(viewsets.ModelViewSet):
         
         if song in user.favorite_songs.all():
             user.favorite_songs.remove(song)
-            song.likes_count = max(0, song.likes_count - 1)
-            song.save()
+            record_like(song, -1)
             return Response({'status': 'unliked'})
         else:
             user.favorite_songs.add(song)
-            song.likes_count += 1
-            song.save()
+            record_like(song, 1)
             return Response({'status': 'liked'})
     
     @action(detail=False, methods=['get'], permission_classes=[AllowAny])
@@ -273,6 +286,32 @@ class SongViewSet(viewsets.ModelViewSet):
                 'results': serializer.data,
                 'note': 'Showing popular songs due to an error with trending data'
             })
+
+    @action(detail=False, methods=['get'], permission_classes=[AllowAny], url_path='top-rated')
+    def top_rated(self, request):
+        """Bài hát được đánh giá cao nhất theo trung bình Bayes (đọc các cột tổng hợp đánh giá)"""
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+            min_ratings = max(int(request.query_params.get('min_ratings', 1)), 1)
+        except ValueError:
+            return Response({'error': 'limit và min_ratings phải là số nguyên'}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = Song.objects.all()
+        genre = request.query_params.get('genre')
+        if genre:
+            # Lọc theo quan hệ thể loại (có index cùng lượt nghe), nhận id hoặc tên
+            queryset = queryset.filter(genre_ref_id=genre) if genre.isdigit() else queryset.filter(genre_ref__name=genre)
+        songs = list(top_rated_songs(queryset, min_ratings=min_ratings, limit=limit))
+
+        serializer = SongSerializer(songs, many=True, context={'request': request})
+        results = serializer.data
+        for item, song in zip(results, songs):
+            item['bayesian_rating'] = round(song.bayesian_rating, 3)
+        return Response({
+            'prior_mean': round(prior_mean(), 3),
+            'prior_weight': prior_weight(),
+            'results': results
+        })
     
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def recommended(self, request):
@@ -358,12 +397,8 @@ class SongViewSet(viewsets.ModelViewSet):
         
         serializer = self.get_serializer(songs[start:end], many=True)
         
-        # Lưu lịch sử tìm kiếm nếu đã đăng nhập
-        if request.user.is_authenticated:
-            SearchHistory.objects.create(
-                user=request.user,
-                query=query
-            )
+        # Lưu lịch sử tìm kiếm nếu đã đăng nhập (ghi theo lô, bỏ qua lượt trùng liên tiếp)
+        log_search(request.user, query)
         
         return Response({
             'total': songs.count(),
@@ -491,81 +526,100 @@ class SongViewSet(viewsets.ModelViewSet):
             'comment': serializer.data
         })
 
+    @action(detail=True, methods=['get'], permission_classes=[AllowAny])
+    def comments(self, request, pk=None):
+        """
+        Bình luận của bài hát dạng cây, phân trang theo cursor.
+
+        Tham số: cursor, page_size, replies (số trả lời tải sẵn mỗi luồng, mặc định 3)
+        """
+        song = self.get_object()
+        try:
+            replies_limit = min(max(int(request.query_params.get('replies', DEFAULT_REPLIES_LIMIT)), 0), 50)
+        except ValueError:
+            return Response({'error': 'replies phải là số nguyên'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        paginator, roots = load_comment_page(song, request, replies_limit=replies_limit)
+        serializer = CommentTreeSerializer(roots, many=True, context={'request': request})
+        return Response({
+            'count': comment_count(song.id),
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
+            'results': serializer.data
+        })
+
 class SongUploadView(APIView):
-    """Upload bài hát mới"""
+    """Upload bài hát mới
+
+    File được ghi thẳng vào storage, sau đó metadata, chuyển mã và phân tích âm
+    lượng chạy nền (xem music/ingest.py). Trả về 202 kèm ID tiến trình xử lý;
+    bài hát phát được khi các bước bắt buộc hoàn thành.
+    """
     parser_classes = (MultiPartParser, FormParser)
     permission_classes = [permissions.IsAuthenticated]
     
     def post(self, request, format=None):
         """Xử lý upload file audio"""
-        # Thêm user vào request data
-        data = request.data.copy()
-        # data['uploaded_by'] = request.user.id  # Xóa dòng này
-        
-        # Xử lý file âm thanh
         audio_file = request.FILES.get('audio_file')
-        if audio_file:
-            # Lưu file tạm để trích xuất metadata
-            temp_file_path = f"/tmp/{audio_file.name}"
-            with open(temp_file_path, 'wb+') as destination:
-                for chunk in audio_file.chunks():
-                    destination.write(chunk)
-            
-            try:
-                # Trích xuất metadata
-                metadata = get_audio_metadata(temp_file_path)
-                
-                # Chuyển đổi sang MP3 nếu không phải MP3
-                if not audio_file.name.lower().endswith('.mp3'):
-                    converted_file = convert_audio_format(temp_file_path, output_format='mp3')
-                    if converted_file:
-                        # Thay thế file gốc bằng file MP3
-                        with open(converted_file, 'rb') as f:
-                            audio_content = f.read()
-                        # Tạo tên file mới
-                        name, _ = os.path.splitext(audio_file.name)
-                        audio_file.name = f"{name}.mp3"
-                        audio_file.file = BytesIO(audio_content)
-                        audio_file.content_type = 'audio/mpeg'
-                
-                # Chuẩn hóa âm lượng nếu cần
-                # normalized_file = normalize_audio(temp_file_path)
-                # if normalized_file:
-                #     with open(normalized_file, 'rb') as f:
-                #         audio_content = f.read()
-                #     audio_file.file = BytesIO(audio_content)
-                
-                # Bổ sung metadata vào data
-                if not data.get('title') and metadata.get('title'):
-                    data['title'] = metadata['title']
-                if not data.get('artist') and metadata.get('artist'):
-                    data['artist'] = metadata['artist']
-                if not data.get('album') and metadata.get('album'):
-                    data['album'] = metadata['album']
-                if not data.get('genre') and metadata.get('genre'):
-                    data['genre'] = metadata['genre']
-                if not data.get('duration') and metadata.get('duration'):
-                    data['duration'] = metadata['duration']
-                if not data.get('lyrics') and metadata.get('lyrics'):
-                    data['lyrics'] = metadata['lyrics']
-            except Exception as e:
-                print(f"Error processing audio file: {str(e)}")
-            finally:
-                # Xóa file tạm
-                if os.path.exists(temp_file_path):
-                    os.remove(temp_file_path)
+        if not audio_file:
+            return Response(
+                {'error': 'Cần cung cấp file audio'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if os.path.splitext(audio_file.name)[1].lower() not in ALLOWED_AUDIO_EXTENSIONS:
+            return Response(
+                {'error': f"Định dạng file không được hỗ trợ. Chấp nhận: {', '.join(ALLOWED_AUDIO_EXTENSIONS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Các trường người dùng nhập sẽ không bị metadata trong file ghi đè
+        data = request.data.copy()
+        provided_fields = [field for field in METADATA_FIELDS if data.get(field)]
+
+        # Giá trị tạm cho đến khi đọc xong metadata
+        if not data.get('title'):
+            data['title'] = os.path.splitext(audio_file.name)[0][:200]
+        if not data.get('artist'):
+            data['artist'] = 'Unknown Artist'
+        if not data.get('duration'):
+            data['duration'] = 0
         
         serializer = SongSerializer(data=data, context={'request': request})
-        if serializer.is_valid():
-            # Lưu song và để serializer tự xử lý uploaded_by
-            song = serializer.save()
-            
-            # Tạo dữ liệu waveform nếu cần
-            # waveform = get_waveform_data(song.audio_file.path)
-            # save waveform data...
-            
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            song = serializer.save(is_ready=False)
+            # Ghi file theo từng chunk vào storage, không đọc toàn bộ vào bộ nhớ
+            song.audio_file.save(audio_file.name, audio_file, save=False)
+            cover_image = request.FILES.get('cover_image')
+            if cover_image:
+                song.cover_image.save(cover_image.name, cover_image, save=False)
+            song.save(update_fields=['audio_file', 'cover_image'])
+            job = start_ingest(song, request.user, provided_fields)
+
+        response_data = SongSerializer(song, context={'request': request}).data
+        response_data['ingest_job'] = {
+            'id': job.id,
+            'status': job.status,
+            'status_url': MediaURLResolver.for_request(request).api_url(
+                reverse('ingest-job-status', kwargs={'job_id': job.id})
+            ),
+        }
+        return Response(response_data, status=status.HTTP_202_ACCEPTED)
+
+class IngestJobStatusView(APIView):
+    """Trạng thái xử lý file audio sau khi upload"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, job_id, format=None):
+        job = get_object_or_404(IngestJob.objects.select_related('song'), id=job_id)
+        if job.created_by_id != request.user.id and not getattr(request.user, 'is_admin', False):
+            return Response(
+                {'error': 'Bạn không có quyền xem tiến trình này'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        return Response(IngestJobSerializer(job, context={'request': request}).data)
 
 class PlaylistViewSet(viewsets.ModelViewSet):
     """ViewSet để xử lý các thao tác CRUD với Playlist"""
@@ -587,13 +641,8 @@ class PlaylistViewSet(viewsets.ModelViewSet):
         return [permission() for permission in permission_classes]
     
     def get_queryset(self):
-        """Lọc playlist: chỉ hiển thị playlist công khai hoặc của user đang đăng nhập"""
-        user = self.request.user
-        if user.is_authenticated:
-            return Playlist.objects.filter(
-                Q(is_public=True) | Q(user=user)
-            )
-        return Playlist.objects.filter(is_public=True)
+        """Lọc playlist: chỉ hiển thị playlist công khai, của user hoặc user được mời cộng tác"""
+        return filter_accessible(self.request.user, Playlist.objects.all())
     
     def get_serializer_class(self):
         """Sử dụng serializer khác nhau tùy theo action"""
@@ -603,10 +652,10 @@ class PlaylistViewSet(viewsets.ModelViewSet):
     
     def retrieve(self, request, *args, **kwargs):
         """
-        Chỉ cho phép xem playlist private nếu là chủ sở hữu
+        Chỉ cho phép xem playlist private nếu là chủ sở hữu hoặc người cộng tác
         """
         instance = self.get_object()
-        if not instance.is_public and instance.user != request.user:
+        if not PlaylistACL.for_request(request).can_access(instance):
             return Response(
                 {'error': 'Bạn không có quyền xem playlist riêng tư này'},
                 status=status.HTTP_403_FORBIDDEN
@@ -686,38 +735,22 @@ class PlaylistViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Kiểm tra số lượng bài hát trong playlist
-        song_count = playlist.songs.count()
-        if song_count >= 1000:  # Giới hạn tối đa 1000 bài/playlist
-            return Response(
-                {'error': 'Playlist đã đạt giới hạn tối đa 1000 bài hát'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-            
         try:
-            song = Song.objects.get(id=song_id)
-            
-            # Kiểm tra bài hát đã có trong playlist chưa
-            if playlist.songs.filter(id=song_id).exists():
-                return Response(
-                    {'error': 'Bài hát đã có trong playlist'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-                
-            # Kiểm tra file audio hợp lệ
-            if not song.audio_file:
-                return Response(
-                    {'error': 'Bài hát không có file audio'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-                
-            playlist.songs.add(song)
-            return Response({'status': 'Đã thêm bài hát vào playlist'})
-        except Song.DoesNotExist:
+            result = edit_playlist_songs(playlist, request.user, [{'op': 'add', 'song_id': song_id}])
+        except PlaylistSongNotFound:
             return Response(
-                {'error': 'Không tìm thấy bài hát'}, 
+                {'error': 'Không tìm thấy bài hát hoặc bài hát không có file audio'}, 
                 status=status.HTTP_404_NOT_FOUND
             )
+        except PlaylistEditError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not result['applied']:
+            return Response(
+                {'error': 'Bài hát đã có trong playlist'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({'status': 'Đã thêm bài hát vào playlist', 'version': result['version']})
     
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def remove_song(self, request, pk=None):
@@ -739,22 +772,70 @@ class PlaylistViewSet(viewsets.ModelViewSet):
             )
             
         try:
-            song = Song.objects.get(id=song_id)
-            
-            # Kiểm tra bài hát có trong playlist không
-            if not playlist.songs.filter(id=song_id).exists():
-                return Response(
-                    {'error': 'Bài hát không có trong playlist'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-                
-            playlist.songs.remove(song)
-            return Response({'status': 'Đã xóa bài hát khỏi playlist'})
-        except Song.DoesNotExist:
+            result = edit_playlist_songs(playlist, request.user, [{'op': 'remove', 'song_id': song_id}])
+        except PlaylistEditError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not result['applied']:
             return Response(
-                {'error': 'Không tìm thấy bài hát'}, 
+                {'error': 'Bài hát không có trong playlist'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({'status': 'Đã xóa bài hát khỏi playlist', 'version': result['version']})
+
+    @action(detail=True, methods=['get'], permission_classes=[AllowAny])
+    def tracks(self, request, pk=None):
+        """Danh sách bài hát của playlist theo thứ tự"""
+        playlist = self.get_object()
+        items = PlaylistItem.objects.filter(playlist=playlist).select_related(
+            'song', 'song__uploaded_by'
+        ).order_by('position', 'id')
+
+        paginator = PageNumberPagination()
+        paginator.page_size = 50
+        result_page = paginator.paginate_queryset(items, request)
+        serializer = PlaylistItemSerializer(result_page, many=True, context={'request': request})
+        response = paginator.get_paginated_response(serializer.data)
+        response.data['version'] = playlist.version
+        return response
+
+    @action(detail=True, methods=['post'], url_path='edit', permission_classes=[IsAuthenticated], parser_classes=[JSONParser])
+    def bulk_edit(self, request, pk=None):
+        """
+        Thêm, xóa, di chuyển nhiều bài hát trong một lần gọi.
+
+        Body: {"operations": [{"op": "add"|"remove"|"move", "song_id": 1, "position": 0}, ...],
+               "version": <phiên bản client đang có, tùy chọn>}
+        """
+        playlist = get_object_or_404(Playlist, pk=pk)
+
+        if not playlist.can_edit(request.user, acl=PlaylistACL.for_request(request)):
+            return Response(
+                {'error': 'Bạn không có quyền chỉnh sửa playlist này'}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        try:
+            result = edit_playlist_songs(
+                playlist,
+                request.user,
+                request.data.get('operations'),
+                expected_version=request.data.get('version')
+            )
+        except PlaylistVersionConflict as e:
+            return Response(
+                {'error': str(e), 'version': e.current_version}, 
+                status=status.HTTP_409_CONFLICT
+            )
+        except PlaylistSongNotFound as e:
+            return Response(
+                {'error': str(e), 'song_ids': e.song_ids}, 
                 status=status.HTTP_404_NOT_FOUND
             )
+        except PlaylistEditError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(result)
     
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def update_cover_image(self, request, pk=None):
@@ -782,7 +863,7 @@ class PlaylistViewSet(viewsets.ModelViewSet):
                         return Response({
                             "id": playlist.id,
                             "name": playlist.name,
-                            "cover_image": request.build_absolute_uri(playlist.cover_image.url) if request else None,
+                            "cover_image": MediaURLResolver.for_request(request).file_url(playlist.cover_image),
                             "updated_at": playlist.updated_at
                         })
                     else:
@@ -824,7 +905,7 @@ class PlaylistViewSet(viewsets.ModelViewSet):
         return Response({
             "id": playlist.id,
             "name": playlist.name,
-            "cover_image": request.build_absolute_uri(playlist.cover_image.url) if request else None,
+            "cover_image": MediaURLResolver.for_request(request).file_url(playlist.cover_image),
             "updated_at": playlist.updated_at
         })
     
@@ -859,7 +940,7 @@ class PlaylistViewSet(viewsets.ModelViewSet):
         user = request.user
         
         # Kiểm tra quyền xem playlist
-        if not playlist.is_public and playlist.user != user:
+        if not PlaylistACL.for_request(request).can_access(playlist):
             return Response(
                 {'error': 'Bạn không có quyền xem playlist riêng tư này'}, 
                 status=status.HTTP_403_FORBIDDEN
@@ -897,7 +978,7 @@ class PlaylistViewSet(viewsets.ModelViewSet):
         playlist = self.get_object()
         
         # Kiểm tra quyền xem danh sách người theo dõi
-        if not playlist.is_public and playlist.user != request.user:
+        if not PlaylistACL.for_request(request).can_access(playlist):
             return Response(
                 {'error': 'Bạn không có quyền xem thông tin playlist riêng tư này'}, 
                 status=status.HTTP_403_FORBIDDEN
@@ -947,7 +1028,7 @@ class AlbumViewSet(viewsets.ModelViewSet):
     def songs(self, request, pk=None):
         """Lấy danh sách bài hát trong album"""
         album = self.get_object()
-        songs = Song.objects.filter(album=album.title)
+        songs = album.songs.all()
         serializer = SongSerializer(songs, many=True, context={'request': request})
         return Response(serializer.data)
     
@@ -993,7 +1074,7 @@ class GenreViewSet(viewsets.ModelViewSet):
     def songs(self, request, pk=None):
         """Lấy danh sách bài hát thuộc thể loại"""
         genre = self.get_object()
-        songs = Song.objects.filter(genre=genre.name)
+        songs = genre.songs.all()
         
         # Phân trang
         page_size = int(request.query_params.get('page_size', 20))
@@ -1015,19 +1096,15 @@ class GenreViewSet(viewsets.ModelViewSet):
         """Lấy danh sách nghệ sĩ nổi bật trong thể loại"""
         genre = self.get_object()
         
-        # Lấy nghệ sĩ nổi bật trong thể loại này
-        artists = {}
-        for song in Song.objects.filter(genre=genre.name):
-            if song.artist in artists:
-                artists[song.artist] += 1
-            else:
-                artists[song.artist] = 1
-        
-        # Sắp xếp theo số lượng bài hát
-        top_artists = sorted(artists.items(), key=lambda x: x[1], reverse=True)[:10]
+        # Lấy nghệ sĩ nổi bật trong thể loại này, sắp xếp theo số lượng bài hát
+        top_artists = (
+            Artist.objects.filter(songs__genre_ref=genre)
+            .annotate(genre_songs=Count('songs'))
+            .order_by('-genre_songs', 'name')[:10]
+        )
         
         return Response([
-            {'name': artist[0], 'songs_count': artist[1]} 
+            {'name': artist.name, 'songs_count': artist.genre_songs} 
             for artist in top_artists
         ])
     
@@ -1035,13 +1112,12 @@ class GenreViewSet(viewsets.ModelViewSet):
     def top_songs(self, request, pk=None):
         """Lấy danh sách bài hát nổi bật theo thể loại"""
         genre = self.get_object()
-        top_songs = Song.objects.filter(genre=genre.name).order_by('-play_count')[:10]
-        serializer = SongSerializer(top_songs, many=True)
+        serializer = SongSerializer(top_songs(genre, 10), many=True)
         return Response(serializer.data)
 
 class CommentViewSet(viewsets.ModelViewSet):
     """ViewSet để xử lý các thao tác CRUD với Comment"""
-    queryset = Comment.objects.all()
+    queryset = Comment.objects.select_related('user').prefetch_related('replies__user')
     serializer_class = CommentSerializer
     
     def get_permissions(self):
@@ -1049,7 +1125,7 @@ class CommentViewSet(viewsets.ModelViewSet):
         Cho phép người dùng chưa đăng nhập xem bình luận,
         nhưng chỉ người dùng đã đăng nhập mới có thể thêm, sửa, xóa bình luận.
         """
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'replies']:
             permission_classes = [AllowAny]
         else:
             permission_classes = [IsAuthenticated]
@@ -1058,6 +1134,27 @@ class CommentViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    @action(detail=True, methods=['get'])
+    def replies(self, request, pk=None):
+        """
+        Xem thêm trả lời của một bình luận (cả các trả lời lồng nhau bên dưới).
+
+        Tham số: after (replies_cursor/next_cursor lần trước), limit
+        """
+        comment = self.get_object()
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        except ValueError:
+            return Response({'error': 'limit phải là số nguyên'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        replies, next_cursor = load_more_replies(comment, after=request.query_params.get('after', ''), limit=limit)
+        serializer = CommentTreeSerializer(replies, many=True, context={'request': request})
+        return Response({
+            'root_id': comment.root_id or comment.id,
+            'next_cursor': next_cursor,
+            'results': serializer.data
+        })
+
 class RatingViewSet(viewsets.ModelViewSet):
     """ViewSet để xử lý các thao tác CRUD với Rating"""
     queryset = Rating.objects.all()
@@ -1068,40 +1165,86 @@ class RatingViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
 class UserLibraryView(APIView):
-    """Lấy thư viện nhạc của người dùng"""
+    """
+    Thư viện nhạc của người dùng: playlist, bài hát yêu thích và nghe gần đây.
+
+    - Không tham số: danh sách đầy đủ của từng mục (như trước) kèm 'version'.
+    - page_size=N: trang đầu của từng mục kèm 'count'.
+    - section=playlists|favorites&page=N: một trang của một mục.
+    - since=<version>: chỉ các mục đã đổi từ phiên bản đó ('delta' = True), hoặc
+      trang đầu của từng mục ('delta' = False) nếu không đồng bộ từng phần được.
+    """
     permission_classes = [permissions.IsAuthenticated]
+    paged_sections = ('playlists', 'favorites')
     
     def get(self, request, format=None):
         """Lấy thư viện nhạc của người dùng, bao gồm playlist, bài hát yêu thích và gần đây đã nghe"""
-        # Lấy playlist của người dùng
-        playlists = Playlist.objects.filter(user=request.user)
-        playlist_serializer = PlaylistSerializer(playlists, many=True)
-        
-        # Lấy bài hát yêu thích
-        user = request.user
-        favorites = user.favorite_songs.all()
-        favorites_serializer = SongSerializer(favorites, many=True)
-        
-        # Lấy lịch sử nghe nhạc gần đây
-        history = SongPlayHistory.objects.filter(
-            user=request.user
-        ).order_by('-played_at').select_related('song')[:10]
-        
-        recent_songs = []
-        seen_song_ids = set()
-        
-        for item in history:
-            if item.song.id not in seen_song_ids:
-                recent_songs.append(item.song)
-                seen_song_ids.add(item.song.id)
-        
-        recent_serializer = SongSerializer(recent_songs, many=True)
+        try:
+            page_size = min(max(int(request.query_params.get('page_size', getattr(settings, 'LIBRARY_PAGE_SIZE', 50))), 1), 200)
+            page = max(int(request.query_params.get('page', 1)), 1)
+            since = request.query_params.get('since')
+            since = int(since) if since not in (None, '') else None
+        except ValueError:
+            return Response({'error': 'page, page_size và since phải là số nguyên'}, status=status.HTTP_400_BAD_REQUEST)
+        section = request.query_params.get('section')
+        if section is not None and section not in self.paged_sections:
+            return Response({'error': 'section phải là playlists hoặc favorites'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        snapshot = get_library_snapshot(request.user.id)
+        version = snapshot['version']
+        if section is not None:
+            ids = snapshot[section]
+            return Response({
+                'version': version,
+                'section': section,
+                'page': page,
+                'page_size': page_size,
+                'count': len(ids),
+                'results': self._serialize(section, ids[(page - 1) * page_size:page * page_size]),
+            })
         
-        return Response({
-            'playlists': playlist_serializer.data,
-            'favorites': favorites_serializer.data,
-            'recent': recent_serializer.data
-        })
+        if since is None and 'page_size' not in request.query_params:
+            # Dạng cũ: danh sách đầy đủ, client cũ vẫn đọc được
+            data = {name: self._serialize(name, snapshot[name]) for name in LIBRARY_SECTIONS}
+            data['version'] = version
+            return Response(data)
+
+        if since is not None:
+            if since == version:
+                return Response({'version': version, 'delta': True})
+            delta = get_library_delta(request.user.id, since, snapshot)
+            if delta is not None:
+                data = {'version': version, 'delta': True}
+                for name in self.paged_sections:
+                    data[name] = {
+                        'changed': self._serialize(name, delta[name]['changed']),
+                        'removed': delta[name]['removed'],
+                    }
+                if 'recent' in delta:
+                    data['recent'] = self._serialize('recent', delta['recent'])
+                return Response(data)
+        
+        data = {'version': version, 'delta': False, 'page_size': page_size}
+        for name in self.paged_sections:
+            data[name] = {'count': len(snapshot[name]), 'results': self._serialize(name, snapshot[name][:page_size])}
+        data['recent'] = self._serialize('recent', snapshot['recent'])
+        return Response(data)
+
+    def _serialize(self, section, ids):
+        """Nạp bản ghi theo id (một truy vấn) và serialize theo đúng thứ tự ids"""
+        if not ids:
+            return []
+        if section == 'playlists':
+            objects = Playlist.objects.filter(id__in=ids).select_related('user').annotate(
+                collaborators_total=Count('collaborators', distinct=True)
+            )
+            serializer_class = PlaylistSerializer
+        else:
+            objects = Song.objects.filter(id__in=ids).select_related('uploaded_by')
+            serializer_class = SongSerializer
+        by_id = {obj.id: obj for obj in objects}
+        ordered = [by_id[pk] for pk in ids if pk in by_id]
+        return serializer_class(ordered, many=True, context={'request': self.request}).data
 
 class TrendingSongsView(APIView):
     """Lấy bài hát xu hướng"""
@@ -1149,49 +1292,143 @@ class RecommendedSongsView(APIView):
         return Response(serializer.data)
 
 class SearchView(APIView):
-    """Tìm kiếm bài hát, album, artist, playlist"""
+    """
+    Tìm kiếm tổng hợp bài hát, nghệ sĩ, album, playlist và lời bài hát.
+
+    Tham số: q, types (danh sách mục, mặc định tất cả), limit (số kết quả mỗi mục),
+    <mục>_limit (ghi đè cho từng mục). 'totals' là số kết quả ước lượng của từng
+    mục, 'exact' = False khi vượt ngưỡng đếm SEARCH_COUNT_CAP.
+    """
     permission_classes = [AllowAny]
     
     def get(self, request, format=None):
         query = request.query_params.get('q', '')
-        if not query:
+        if not query.strip():
             return Response({'error': 'Search query is required'}, status=status.HTTP_400_BAD_REQUEST)
+        types = request.query_params.get('types')
+        sections = [section.strip() for section in types.split(',')] if types else list(SEARCH_SECTIONS)
+        unknown = [section for section in sections if section not in SEARCH_SECTIONS]
+        if unknown:
+            return Response({'error': f'Loại không hợp lệ: {", ".join(unknown)}'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            default_limit = int(request.query_params.get('limit', getattr(settings, 'SEARCH_SECTION_LIMIT', 10)))
+            limits = {
+                section: int(request.query_params.get(f'{section}_limit', default_limit)) for section in sections
+            }
+        except ValueError:
+            return Response({'error': 'limit phải là số nguyên'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Tìm bài hát
-        songs = Song.objects.filter(
-            Q(title__icontains=query) | 
-            Q(artist__icontains=query) | 
-            Q(album__icontains=query)
-        )
-        song_serializer = SongSerializer(songs, many=True)
-        
-        # Tìm playlist (chỉ playlist công khai)
-        playlists = Playlist.objects.filter(
-            Q(name__icontains=query) | 
-            Q(description__icontains=query),
-            is_public=True
-        )
-        playlist_serializer = PlaylistSerializer(playlists, many=True)
-        
-        # Tìm album
-        albums = Album.objects.filter(
-            Q(title__icontains=query) | 
-            Q(artist__icontains=query)
-        )
-        album_serializer = AlbumSerializer(albums, many=True)
-        
-        # Lưu lịch sử tìm kiếm chỉ khi đã đăng nhập
-        if request.user.is_authenticated:
-            SearchHistory.objects.create(
-                user=request.user,
-                query=query
+        # Tìm mọi mục cùng lúc với giới hạn lớn nhất, cắt theo giới hạn của từng mục khi serialize
+        found = search_catalog(query, sections, max(limits.values()))
+        context = {'request': request}
+        data = {}
+        totals = {}
+        for section in sections:
+            result = found.get(section, {'ids': [], 'count': 0, 'exact': True})
+            ids = result['ids'][:max(limits[section], 0)]
+            if section == 'lyrics':
+                hits = [hit for hit in result.get('hits', []) if hit['song_id'] in ids]
+                data[section] = lyrics_hits_payload(hits, request)
+            else:
+                data[section] = self._serialize(section, ids, context)
+            totals[section] = {'count': result['count'], 'exact': result['exact']}
+        data['totals'] = totals
+        
+        # Lưu lịch sử tìm kiếm chỉ khi đã đăng nhập (ghi theo lô, bỏ qua lượt trùng liên tiếp)
+        log_search(request.user, query)
+        
+        return Response(data)
+
+    def _serialize(self, section, ids, context):
+        """Nạp bản ghi theo id (một truy vấn mỗi mục) và serialize theo đúng thứ tự ids"""
+        if not ids:
+            return []
+        if section == 'songs':
+            objects = Song.objects.filter(id__in=ids).select_related('uploaded_by')
+            serializer_class = SongSerializer
+        elif section == 'artists':
+            objects = Artist.objects.filter(id__in=ids)
+            serializer_class = ArtistSerializer
+        elif section == 'albums':
+            objects = Album.objects.filter(id__in=ids)
+            serializer_class = AlbumSerializer
+        else:
+            objects = Playlist.objects.filter(id__in=ids, is_public=True).select_related('user').annotate(
+                collaborators_total=Count('collaborators', distinct=True)
             )
-        
-        return Response({
-            'songs': song_serializer.data,
-            'playlists': playlist_serializer.data,
-            'albums': album_serializer.data
-        })
+            serializer_class = PlaylistSerializer
+        by_id = {obj.id: obj for obj in objects}
+        ordered = [by_id[pk] for pk in ids if pk in by_id]
+        return serializer_class(ordered, many=True, context=context).data
+
+
+class SuggestView(APIView):
+    """Gợi ý khi gõ: bài hát, nghệ sĩ, album, playlist theo tiền tố (không ghi lịch sử tìm kiếm)"""
+    permission_classes = [AllowAny]
+
+    def get(self, request, format=None):
+        query = request.query_params.get('q', '')
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            return Response({'error': 'limit phải là số nguyên'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'query': query, 'results': suggest(query, limit)})
+
+
+class PopularSearchesView(APIView):
+    """Từ khóa được tìm nhiều nhất trong N ngày gần đây (từ bảng thống kê search_query_stats)"""
+    permission_classes = [AllowAny]
+
+    def get(self, request, format=None):
+        try:
+            days = int(request.query_params.get('days', 7))
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+        except ValueError:
+            return Response({'error': 'days và limit phải là số nguyên'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'days': days, 'results': popular_queries(days=max(days, 0), limit=limit)})
+
+
+def lyrics_search_results(query, phrase=True, limit=20, request=None):
+    """Kết quả tìm theo lời: bài hát kèm dòng lời khớp và thời điểm để tua tới"""
+    return lyrics_hits_payload(search_lyrics(query, phrase=phrase, limit=limit), request)
+
+
+def lyrics_hits_payload(hits, request=None):
+    """Serialize kết quả của search_lyrics (bài hát, dòng lời khớp, thời điểm)"""
+    songs = list(Song.objects.filter(id__in=[hit['song_id'] for hit in hits]).select_related('uploaded_by'))
+    attach_lyric_lines(hits, songs)
+    serialized = {
+        item['id']: item
+        for item in SongSerializer(songs, many=True, context={'request': request}).data
+    }
+    return [
+        {
+            'song': serialized[hit['song_id']],
+            'line': hit['line'],
+            'line_no': hit['line_no'],
+            'timestamp': hit['timestamp'],
+            'matches': hit['matches'],
+        }
+        for hit in hits if hit['song_id'] in serialized
+    ]
+
+
+class LyricsSearchView(APIView):
+    """Tìm bài hát từ một câu trong lời (không phân biệt dấu)"""
+    permission_classes = [AllowAny]
+
+    def get(self, request, format=None):
+        query = request.query_params.get('q', '')
+        if not query.strip():
+            return Response({'error': 'Search query is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        except ValueError:
+            return Response({'error': 'limit phải là số nguyên'}, status=status.HTTP_400_BAD_REQUEST)
+        # phrase=0: chỉ cần đủ các từ trong cùng một dòng, không cần liền nhau
+        phrase = request.query_params.get('phrase', '1').lower() not in ('0', 'false', 'no')
+        results = lyrics_search_results(query, phrase=phrase, limit=limit, request=request)
+        return Response({'query': query, 'phrase': phrase, 'results': results})
 
 # Thêm endpoint để xử lý lời bài hát đồng bộ
 class SyncedLyricsView(APIView):
@@ -1220,19 +1457,18 @@ class SyncedLyricsView(APIView):
             return Response({'error': 'Song not found'}, status=status.HTTP_404_NOT_FOUND)
     
     def get(self, request, song_id, format=None):
-        """Lấy lời bài hát đồng bộ"""
+        """Lấy lời bài hát đồng bộ (từ tài liệu lời trong cache)"""
         try:
-            song = Song.objects.get(id=song_id)
-            lyric_lines = song.lyric_lines.all()  # type: ignore
+            song = Song.objects.only('id', 'title').get(id=song_id)
+            document = get_lyrics_document(song_id)
             
             # Format lời đồng bộ
             lyrics = []
-            for line in lyric_lines:
-                lyrics.append({
-                    'timestamp': line.timestamp,
-                    'formatted_time': line.format_timestamp(),
-                    'text': line.text
-                })
+            for index in range(len(document['t'])):
+                line = document_line(document, index)
+                del line['index']
+                line['formatted_time'] = format_lrc_time(line['timestamp'])
+                lyrics.append(line)
             
             return Response({
                 'song_id': song_id,
@@ -1242,6 +1478,29 @@ class SyncedLyricsView(APIView):
         except Song.DoesNotExist:
             return Response({'error': 'Song not found'}, status=status.HTTP_404_NOT_FOUND)
 
+
+class LyricsLookupView(APIView):
+    """Dòng lời đang hiển thị tại một thời điểm phát, kèm vài dòng xung quanh"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, song_id, format=None):
+        try:
+            position = float(request.query_params.get('t', 0))
+            before = min(max(int(request.query_params.get('before', 1)), 0), 20)
+            after = min(max(int(request.query_params.get('after', 3)), 0), 50)
+            if not math.isfinite(position):
+                raise ValueError(position)
+        except ValueError:
+            return Response({'error': 't phải là số giây, before/after là số nguyên'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        document = get_lyrics_document(song_id)
+        if not document['t'] and not Song.objects.filter(id=song_id).exists():
+            return Response({'error': 'Song not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        window = lyrics_window(document, position, before=before, after=after)
+        return Response({'song_id': song_id, 'position': position, **window})
+
 # Admin Statistics and Analytics
 class AdminStatisticsView(APIView):
     """View hiển thị thống kê tổng quan cho admin"""
@@ -1511,7 +1770,7 @@ class ArtistViewSet(viewsets.ReadOnlyModelViewSet):
     def songs(self, request, pk=None):
         """Lấy danh sách bài hát của nghệ sĩ"""
         artist = self.get_object()
-        songs = Song.objects.filter(artist=artist.name)
+        songs = artist.songs.all()
         serializer = SongSerializer(songs, many=True)
         return Response(serializer.data)
     
@@ -1526,45 +1785,16 @@ class ArtistViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=False, methods=['get'], permission_classes=[AllowAny])
     def popular(self, request):
         """Lấy danh sách nghệ sĩ phổ biến dựa trên số lượng bài hát và số lượt nghe"""
-        # Lấy số lượng bài hát theo nghệ sĩ
-        artists = Artist.objects.all()
-        
-        # Dictionary để lưu số lượng bài hát và lượt nghe cho mỗi nghệ sĩ
-        artists_data = []
-        
-        for artist in artists:
-            songs = Song.objects.filter(artist=artist.name)
-            song_count = songs.count()
-            play_count = songs.aggregate(total_plays=Sum('play_count'))['total_plays'] or 0
-            
-            artist_info = {
-                'artist': artist,
-                'song_count': song_count,
-                'play_count': play_count
-            }
-            artists_data.append(artist_info)
-        
-        # Sắp xếp theo số lượt nghe (nếu bằng nhau thì sắp theo số bài hát)
-        sorted_artists = sorted(
-            artists_data, 
-            key=lambda x: (x['play_count'], x['song_count']), 
-            reverse=True
-        )
-        
-        # Giới hạn số lượng trả về
+        # Đọc thẳng các cột tổng hợp (chỉ mục artist_popularity_idx)
         limit = int(request.query_params.get('limit', 10))
-        popular_artists = sorted_artists[:limit]
+        popular_artists = Artist.objects.order_by('-total_plays', '-song_count', 'id')[:limit]
         
         # Trả về dữ liệu với thông tin bổ sung
         result = []
-        for artist_info in popular_artists:
-            # Tạo dữ liệu artist dưới dạng dict
-            artist_data = ArtistSerializer(artist_info['artist']).data
-            # Chuyển OrderedDict hoặc đối tượng khác thành dict tiêu chuẩn
-            artist_data = dict(artist_data)
-            # Thêm thông tin bổ sung vào dict
-            artist_data['song_count'] = artist_info['song_count']
-            artist_data['play_count'] = artist_info['play_count']
+        for artist in popular_artists:
+            artist_data = dict(ArtistSerializer(artist).data)
+            artist_data['song_count'] = artist.song_count
+            artist_data['play_count'] = artist.total_plays
             result.append(artist_data)
             
         return Response(result)
@@ -2024,6 +2254,8 @@ class SearchHistoryView(APIView):
     
     def get(self, request, format=None):
         user = request.user
+        # Ghi các lượt tìm còn trong bộ đệm để lịch sử đầy đủ
+        flush_search_log()
         
         # Lấy lịch sử tìm kiếm
         history = SearchHistory.objects.filter(user=user).order_by('-timestamp')
@@ -2046,6 +2278,7 @@ class SearchHistoryView(APIView):
     def delete(self, request, format=None):
         """Xóa lịch sử tìm kiếm"""
         user = request.user
+        discard_user_buffer(user.pk)
         SearchHistory.objects.filter(user=user).delete()
         return Response({'status': 'Đã xóa lịch sử tìm kiếm'}, status=status.HTTP_204_NO_CONTENT)
 
@@ -2344,20 +2577,29 @@ class AdminPlaylistEditHistoryView(generics.ListAPIView):
         return context
 
 class AdminRestorePlaylistView(APIView):
-    """API để admin khôi phục playlist về một phiên bản trước đó"""
+    """API để admin khôi phục playlist về một phiên bản trước đó
+
+    - history_id: hoàn tác một bản ghi lịch sử (UPDATE_INFO, ADD_SONG, REMOVE_SONG)
+    - timestamp: khôi phục danh sách bài hát về thời điểm bất kỳ (ISO 8601) từ snapshot gần nhất
+    """
     permission_classes = [IsAdminUser]
     
     def post(self, request, playlist_id):
-        # Lấy ID của bản ghi lịch sử cần khôi phục
+        # Lấy ID của bản ghi lịch sử hoặc thời điểm cần khôi phục
         history_id = request.data.get('history_id')
-        if not history_id:
+        timestamp = request.data.get('timestamp')
+        if not history_id and not timestamp:
             return Response(
-                {"error": "Cần cung cấp ID của bản ghi lịch sử để khôi phục"},
+                {"error": "Cần cung cấp ID của bản ghi lịch sử hoặc thời điểm (timestamp) để khôi phục"},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         try:
             playlist = Playlist.objects.get(id=playlist_id, is_collaborative=True)
+
+            if timestamp:
+                return self.restore_to_timestamp(request, playlist, timestamp)
+
             history_entry = PlaylistEditHistory.objects.get(id=history_id, playlist=playlist)
             
             # Xử lý khôi phục dựa trên loại hành động
@@ -2385,25 +2627,18 @@ class AdminRestorePlaylistView(APIView):
             elif history_entry.action in ['ADD_SONG', 'REMOVE_SONG']:
                 # Khôi phục bài hát nếu có
                 if history_entry.related_song:
-                    if history_entry.action == 'ADD_SONG':
-                        # Nếu trước đó là thêm bài hát, giờ ta xóa nó
-                        playlist.songs.remove(history_entry.related_song)
-                    else:
-                        # Nếu trước đó là xóa bài hát, giờ ta thêm lại
-                        playlist.songs.add(history_entry.related_song)
-                        
-                    PlaylistEditHistory.log_action(
-                        playlist=playlist,
-                        user=request.user,
-                        action='RESTORE',
-                        details={
-                            'restored_from': history_id,
-                            'admin_action': True
-                        },
-                        related_song=history_entry.related_song
+                    # Thêm bài hát thì giờ xóa đi, xóa bài hát thì giờ thêm lại
+                    op = 'remove' if history_entry.action == 'ADD_SONG' else 'add'
+                    result = edit_playlist_songs(
+                        playlist,
+                        request.user,
+                        [{'op': op, 'song_id': history_entry.related_song_id}],
+                        details={'restored_from': history_id, 'admin_action': True},
+                        require_audio=False,
+                        action='RESTORE'
                     )
                     
-                    return Response({"status": "Đã khôi phục bài hát thành công"})
+                    return Response({"status": "Đã khôi phục bài hát thành công", "version": result['version']})
             
             # Các trường hợp không hỗ trợ khôi phục
             return Response(
@@ -2420,6 +2655,26 @@ class AdminRestorePlaylistView(APIView):
                 {"error": "Không tìm thấy bản ghi lịch sử"},
                 status=status.HTTP_404_NOT_FOUND
             )
+        except PlaylistEditError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    def restore_to_timestamp(self, request, playlist, timestamp):
+        """Khôi phục danh sách bài hát về thời điểm timestamp"""
+        restore_at = parse_datetime(str(timestamp))
+        if restore_at is None:
+            return Response(
+                {"error": "Định dạng thời điểm không hợp lệ (sử dụng ISO 8601)"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if django.utils.timezone.is_naive(restore_at):
+            restore_at = django.utils.timezone.make_aware(restore_at)
+
+        result = restore_playlist_to(playlist, request.user, restore_at, details={'admin_action': True})
+        return Response({
+            "status": "Đã khôi phục playlist về thời điểm yêu cầu",
+            "version": result['version'],
+            "songs_count": result['songs_count']
+        })
 
 class AdminTopSongsReportView(APIView):
     """API hiển thị báo cáo chi tiết về top bài hát cho admin"""
@@ -2588,6 +2843,10 @@ class OfflineDownloadView(APIView):
         except Song.DoesNotExist:
             return Response({'error': 'Bài hát không tồn tại'}, status=status.HTTP_404_NOT_FOUND)
             
+        quality = request.data.get('quality') or ''
+        if quality and quality not in {entry[0] for entry in get_ladder()}:
+            return Response({'error': f'Mức chất lượng không hợp lệ: {quality}'}, status=status.HTTP_400_BAD_REQUEST)
+
         # Kiểm tra xem đã tải xuống trước đó chưa
         download, created = OfflineDownload.objects.get_or_create(
             user=request.user,
@@ -2596,89 +2855,38 @@ class OfflineDownloadView(APIView):
                 'status': 'PENDING',
                 'progress': 0,
                 'is_active': True,
+                'quality': quality,
                 'expiry_time': django.utils.timezone.now() + timedelta(days=30)  # Mặc định 30 ngày
             }
         )
         
-        if not created:
-            # Nếu đã tồn tại, cập nhật trạng thái
-            if download.status in ['FAILED', 'EXPIRED']:
-                download.status = 'PENDING'
-                download.progress = 0
-                download.is_active = True
-                download.expiry_time = django.utils.timezone.now() + timedelta(days=30)
-                download.save()
-                
-            # Trả về thông báo khác nhau tùy theo trạng thái
-            if download.status == 'PENDING':
-                message = 'Bài hát đã được thêm vào hàng đợi tải xuống'
-            elif download.status == 'DOWNLOADING':
-                message = f'Bài hát đang được tải xuống ({download.progress}%)'
-            elif download.status == 'COMPLETED':
-                message = 'Bài hát đã được tải xuống trước đó'
-            else:
-                message = f'Trạng thái tải xuống: {download.get_status_display()}'
-        else:
+        queued = created
+        if not created and (
+            download.status in ['FAILED', 'EXPIRED'] or not download.is_active
+            or (download.status == 'COMPLETED' and download.quality != quality)
+        ):
+            # Tải lại: bản cũ lỗi, hết hạn, đã xóa hoặc đổi mức chất lượng
+            download.expiry_time = django.utils.timezone.now() + timedelta(days=30)
+            queued = True
+
+        if queued:
+            # Job chạy nền (music.offline), request trả về ngay với trạng thái PENDING
+            enqueue_download(download, quality)
             message = 'Đã thêm vào hàng đợi tải xuống'
-            
-            # Đây là nơi bạn sẽ gọi task async để tải xuống (ví dụ: Celery)
-            # Trong ví dụ này, chúng ta sẽ giả lập việc tải xuống ngay lập tức
-            self._process_download(download)
+        elif download.status == 'PENDING':
+            message = 'Bài hát đã được thêm vào hàng đợi tải xuống'
+        elif download.status == 'DOWNLOADING':
+            message = f'Bài hát đang được tải xuống ({download.progress}%)'
+        elif download.status == 'COMPLETED':
+            message = 'Bài hát đã được tải xuống trước đó'
+        else:
+            message = f'Trạng thái tải xuống: {download.get_status_display()}'
                 
         serializer = OfflineDownloadSerializer(download)
-        return Response({
-            'message': message,
-            'download': serializer.data
-        })
-        
-    def _process_download(self, download):
-        """Xử lý tải xuống (trong thực tế nên được xử lý bởi một task background)"""
-        import logging
-        logger = logging.getLogger(__name__)
-        
-        try:
-            # Cập nhật trạng thái
-            download.status = 'DOWNLOADING'
-            download.progress = 0
-            download.save()
-            
-            # Tạo thư mục lưu trữ cục bộ
-            target_dir = os.path.join(settings.MEDIA_ROOT, f'offline/{download.user.id}')
-            if not os.path.exists(target_dir):
-                logger.info(f"Tạo thư mục lưu trữ cục bộ: {target_dir}")
-                os.makedirs(target_dir, exist_ok=True)
-                
-            logger.info(f"Bắt đầu tải xuống bài hát ID: {download.song.id} - {download.song.title}")
-            
-            # Tải xuống bài hát sử dụng utility function
-            success, message, file_path = download_song_for_offline(download.song, target_dir)
-            logger.info(f"Kết quả tải xuống: success={success}, message={message}, file_path={file_path}")
-            
-            # Cập nhật trạng thái
-            if success and file_path:
-                # Kiểm tra file tải xuống có hợp lệ không
-                if os.path.exists(file_path) and verify_offline_song(file_path):
-                    download.status = 'COMPLETED'
-                    download.progress = 100
-                    download.local_path = file_path
-                    logger.info(f"Tải xuống hoàn tất: {file_path}")
-                else:
-                    download.status = 'FAILED'
-                    download.progress = 0
-                    download.local_path = None
-                    logger.error(f"File tải xuống không hợp lệ hoặc không tồn tại: {file_path}")
-            else:
-                download.status = 'FAILED'
-                download.progress = 0
-                logger.error(f"Tải xuống thất bại: {message}")
-                
-            download.save()
-            
-        except Exception as e:
-            download.status = 'FAILED'
-            download.save()
-            logger.exception(f"Lỗi khi tải xuống bài hát ID {download.song.id}: {str(e)}")
-            print(f"Lỗi khi tải xuống: {str(e)}")
+        return Response(
+            {'message': message, 'download': serializer.data},
+            status=status.HTTP_200_OK if download.status == 'COMPLETED' else status.HTTP_202_ACCEPTED
+        )
     
 class DeleteOfflineDownloadView(APIView):
     """API để xóa bài hát đã tải xuống offline"""
@@ -2691,10 +2899,10 @@ class DeleteOfflineDownloadView(APIView):
         except OfflineDownload.DoesNotExist:
             return Response({'error': 'Không tìm thấy bài hát đã tải xuống'}, status=status.HTTP_404_NOT_FOUND)
             
-        # Trong thực tế, bạn sẽ xóa file khỏi bộ nhớ cục bộ ở đây
-        # Nhưng trong ví dụ này, chúng ta chỉ cập nhật trạng thái
+        # Bỏ tham chiếu tới blob dùng chung; blob được dọn khi không còn ai tham chiếu
         download.is_active = False
-        download.save()
+        download.save(update_fields=['is_active', 'updated_at'])
+        release_download(download)
         
         return Response({'message': 'Đã xóa bài hát khỏi danh sách tải xuống offline'})
     
@@ -2712,6 +2920,61 @@ class OfflineDownloadStatusView(APIView):
         serializer = OfflineDownloadSerializer(download)
         return Response(serializer.data)
 
+class OfflineManifestView(APIView):
+    """
+    Danh sách file cần có trên thiết bị để nghe offline.
+
+    Mỗi mục gồm SHA-256 và URL của blob dùng chung: client so sánh hash với các
+    file đã có để chỉ tải phần thiếu. Hỗ trợ ETag/If-None-Match.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        now = django.utils.timezone.now()
+        downloads = (
+            OfflineDownload.objects.filter(user=request.user, status='COMPLETED', is_active=True, blob__isnull=False)
+            .filter(Q(expiry_time__isnull=True) | Q(expiry_time__gt=now))
+            .select_related('song', 'blob')
+            .order_by('id')
+        )
+        resolver = MediaURLResolver.for_request(request)
+        entries = []
+        for download in downloads:
+            song, blob = download.song, download.blob
+            entries.append({
+                'download_id': download.id,
+                'song_id': song.id,
+                'title': song.title,
+                'artist': song.artist,
+                'album': song.album,
+                'duration': song.duration,
+                'quality': download.quality or ORIGINAL_QUALITY,
+                'sha256': blob.sha256,
+                'size': blob.size,
+                'content_type': blob.content_type,
+                'url': resolver.file_url(blob.file),
+                'cover_image': resolver.file_url(song.cover_image),
+                'expiry_time': download.expiry_time,
+            })
+
+        version = hashlib.sha1(
+            '|'.join(f"{e['download_id']}:{e['sha256']}:{e['expiry_time']}" for e in entries).encode()
+        ).hexdigest()
+        etag = f'"{version[:16]}"'
+        if etag in [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+        response = Response({
+            'version': version,
+            'generated_at': now,
+            'total_bytes': sum(e['size'] for e in entries),
+            'entries': entries,
+        })
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
 class FavoriteSongsView(APIView):
     """Quản lý danh sách bài hát yêu thích"""
     permission_classes = [IsAuthenticated]
@@ -2739,8 +3002,7 @@ class FavoriteSongsView(APIView):
             return Response({'error': 'Bài hát đã có trong danh sách yêu thích'}, status=status.HTTP_400_BAD_REQUEST)
             
         user.favorite_songs.add(song)
-        song.likes_count += 1
-        song.save()
+        record_like(song, 1)
         
         # Lưu hoạt động yêu thích
         UserActivity.objects.create(
@@ -2767,8 +3029,7 @@ class FavoriteSongsView(APIView):
             return Response({'error': 'Bài hát không có trong danh sách yêu thích'}, status=status.HTTP_400_BAD_REQUEST)
             
         user.favorite_songs.remove(song)
-        song.likes_count = max(0, song.likes_count - 1)
-        song.save()
+        record_like(song, -1)
         
         return Response({'status': 'success'}, status=status.HTTP_200_OK)
 
@@ -2783,6 +3044,13 @@ class SongDownloadView(APIView):
         # Kiểm tra quyền truy cập
         if not song.audio_file:
             return Response({'error': 'File âm thanh không tồn tại'}, status=status.HTTP_404_NOT_FOUND)
+
+        # Bài hát chưa xử lý xong các bước bắt buộc
+        if not song.is_ready:
+            return Response(
+                {'error': 'Bài hát đang được xử lý, vui lòng thử lại sau', 'is_ready': False},
+                status=status.HTTP_409_CONFLICT
+            )
         
         # Lấy đường dẫn file vật lý
         file_path = song.audio_file.path
@@ -2870,6 +3138,10 @@ class SongDownloadView(APIView):
 class SongStreamView(APIView):
     """API phát nhạc trực tuyến với hỗ trợ Range requests"""
     permission_classes = [permissions.IsAuthenticated]
+
+    @staticmethod
+    def allowed_qualities():
+        return [ORIGINAL_QUALITY] + [quality for quality, _, _ in get_ladder()]
     
     def get(self, request, song_id, format=None):
         # Lấy bài hát theo ID
@@ -2878,18 +3150,48 @@ class SongStreamView(APIView):
         # Kiểm tra quyền truy cập
         if not song.audio_file:
             return Response({'error': 'File âm thanh không tồn tại'}, status=status.HTTP_404_NOT_FOUND)
+
+        # Bài hát chưa xử lý xong các bước bắt buộc
+        if not song.is_ready:
+            return Response(
+                {'error': 'Bài hát đang được xử lý, vui lòng thử lại sau', 'is_ready': False},
+                status=status.HTTP_409_CONFLICT
+            )
         
+        # Chọn bản chuyển mã theo chất lượng yêu cầu hoặc băng thông của client
+        quality = request.query_params.get('quality')
+        if quality and quality not in self.allowed_qualities():
+            return Response(
+                {'error': f'Chất lượng không hợp lệ. Hỗ trợ: {", ".join(self.allowed_qualities())}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            rendition = select_rendition(
+                song,
+                quality=quality,
+                bandwidth=parse_bandwidth(request),
+                codec=request.query_params.get('codec')
+            )
+        except RenditionUnavailable as e:
+            return Response(
+                {'error': str(e), 'available': [ORIGINAL_QUALITY] + list(song.renditions.values_list('quality', flat=True))},
+                status=status.HTTP_409_CONFLICT
+            )
+
         # Lấy đường dẫn file vật lý
-        file_path = song.audio_file.path
+        if rendition is not None:
+            file_path = rendition.file.path
+            content_type = rendition_content_type(rendition)
+        else:
+            file_path = song.audio_file.path
+            # Xác định MIME type
+            content_type, encoding = mimetypes.guess_type(file_path)
+            if content_type is None:
+                content_type = 'application/octet-stream'
         
         if not os.path.exists(file_path):
             return Response({'error': 'File âm thanh không tồn tại'}, status=status.HTTP_404_NOT_FOUND)
         
-        # Xác định MIME type
-        content_type, encoding = mimetypes.guess_type(file_path)
-        if content_type is None:
-            content_type = 'application/octet-stream'
-        
         # Lấy kích thước file
         file_size = os.path.getsize(file_path)
         
@@ -2933,12 +3235,151 @@ class SongStreamView(APIView):
             response['Content-Length'] = file_size
             response['Accept-Ranges'] = 'bytes'
         
+        response['X-Rendition'] = rendition.quality if rendition is not None else ORIGINAL_QUALITY
+        response['Vary'] = 'Downlink'
+
         # Thống kê
         # song.play_count = F('play_count') + 1
         # song.save(update_fields=['play_count'])
         
         return response
 
+class SongStreamManifestMixin:
+    """Lấy gói HLS/DASH của bài hát, trả về (package, lỗi Response)"""
+
+    def get_package(self, song_id):
+        song = get_object_or_404(Song, id=song_id)
+        if not song.is_ready:
+            return None, Response(
+                {'error': 'Bài hát đang được xử lý, vui lòng thử lại sau', 'is_ready': False},
+                status=status.HTTP_409_CONFLICT
+            )
+        package = SongStreamPackage.objects.filter(song=song).first()
+        if package is None:
+            return None, Response(
+                {'error': 'Bài hát chưa được chia đoạn cho HLS/DASH, hãy dùng API stream'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return package, None
+
+    def manifest_response(self, request, package, body, content_type):
+        etag = f'"{package.version}-{hashlib.sha1(body.encode()).hexdigest()[:8]}"'
+        if etag in [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type=content_type)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=60'
+        return response
+
+    def segment_url_builder(self, request, package):
+        resolver = MediaURLResolver.for_request(request)
+        return lambda variant, filename: resolver.api_url(segment_path(package, variant, filename))
+
+
+class SongHLSView(SongStreamManifestMixin, APIView):
+    """Playlist HLS: master (không truyền variant) hoặc media playlist của một mức bitrate"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, song_id, variant=None, format=None):
+        package, error = self.get_package(song_id)
+        if error:
+            return error
+
+        resolver = MediaURLResolver.for_request(request)
+        if variant is None:
+            body = build_hls_master(
+                package,
+                lambda name: resolver.api_url(f'/api/v1/music/songs/{song_id}/hls/{name}.m3u8')
+            )
+        else:
+            variant_data = package.get_variant(variant)
+            if variant_data is None:
+                return Response({'error': 'Không tìm thấy mức bitrate'}, status=status.HTTP_404_NOT_FOUND)
+            body = build_hls_media(package, variant_data, self.segment_url_builder(request, package))
+        return self.manifest_response(request, package, body, 'application/vnd.apple.mpegurl')
+
+
+class SongDASHView(SongStreamManifestMixin, APIView):
+    """Manifest DASH (mpd) của bài hát"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, song_id, format=None):
+        package, error = self.get_package(song_id)
+        if error:
+            return error
+        body = build_dash_mpd(package, self.segment_url_builder(request, package))
+        return self.manifest_response(request, package, body, 'application/dash+xml')
+
+
+class SongSegmentView(APIView):
+    """Một đoạn fMP4 của bài hát
+
+    URL chứa version của gói nên nội dung không bao giờ đổi: trả về
+    Cache-Control immutable để CDN/trình duyệt cache vĩnh viễn. Không xác thực để
+    mọi người dùng dùng chung một bản cache; URL chỉ có trong manifest (đã xác thực).
+    """
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def get(self, request, song_id, version, variant, filename, format=None):
+        package = SongStreamPackage.objects.filter(song_id=song_id, version=version).first()
+        variant_data = package.get_variant(variant) if package else None
+        if variant_data is None or (
+            filename != variant_data['init'] and filename not in {name for name, _ in variant_data['segments']}
+        ):
+            return Response({'error': 'Không tìm thấy đoạn'}, status=status.HTTP_404_NOT_FOUND)
+
+        etag = f'"{version}-{variant}-{filename}"'
+        if etag in [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+            response = HttpResponseNotModified()
+        else:
+            storage = Song._meta.get_field('audio_file').storage
+            path = f'{package.storage_prefix}/{variant}/{filename}'
+            if not storage.exists(path):
+                return Response({'error': 'Không tìm thấy đoạn'}, status=status.HTTP_404_NOT_FOUND)
+            response = FileResponse(storage.open(path, 'rb'), content_type='audio/mp4')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+        response['Access-Control-Allow-Origin'] = '*'
+        return response
+
+class SongWaveformView(APIView):
+    """Waveform tính sẵn của bài hát (peak và RMS theo đoạn, giá trị 0-1)
+
+    Tham số `points`: số điểm mong muốn (mặc định 512). Dữ liệu lấy từ cache,
+    hỗ trợ ETag/If-None-Match.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    MAX_POINTS = 4096
+
+    def get(self, request, song_id, format=None):
+        try:
+            points = int(request.query_params.get('points', 512))
+        except ValueError:
+            points = 0
+        if not 1 <= points <= self.MAX_POINTS:
+            return Response(
+                {'error': f'points phải nằm trong khoảng 1-{self.MAX_POINTS}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        document = get_waveform_document(song_id)
+        if document is None:
+            get_object_or_404(Song, id=song_id)
+            return Response({'error': 'Bài hát chưa có dữ liệu waveform'}, status=status.HTTP_404_NOT_FOUND)
+
+        etag = f'"{document["etag"]}-{points}"'
+        if etag in [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]:
+            response = HttpResponseNotModified()
+        else:
+            payload = waveform_payload(document, points)
+            payload['song_id'] = song_id
+            response = Response(payload)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=86400'
+        return response
+
 # Admin API ViewSets
 class AdminSongViewSet(viewsets.ModelViewSet):
     """ViewSet để quản lý bài hát dành riêng cho admin"""
@@ -2948,7 +3389,7 @@ class AdminSongViewSet(viewsets.ModelViewSet):
     parser_classes = (MultiPartParser, FormParser)
     filter_backends = [SearchFilter, OrderingFilter, DjangoFilterBackend]
     search_fields = ['title', 'artist__name', 'album__title']
-    ordering_fields = ['title', 'play_count', 'release_date', 'created_at', 'likes_count']
+    ordering_fields = ['title', 'play_count', 'release_date', 'created_at', 'likes_count', 'rating_count']
     filterset_fields = ['artist', 'genre', 'album', 'is_approved']
     pagination_class = PageNumberPagination
     
@@ -3006,32 +3447,11 @@ class AdminSongViewSet(viewsets.ModelViewSet):
                 # Nếu đã có thông tin uploaded_by, không thêm lại
                 instance = serializer.save()
             
-            # Xử lý duration từ file audio nếu có
+            # Metadata (duration, ...) và chuyển mã được xử lý nền qua ingest pipeline
             updated_fields = []
-            
-            # Nếu duration không được đặt hoặc là 0, và có file audio, thử tính
-            if (not instance.duration or instance.duration == 0) and instance.audio_file:
-                try:
-                    # Đảm bảo file đã được lưu trên đĩa
-                    if hasattr(instance.audio_file, 'path') and os.path.exists(instance.audio_file.path):
-                        from tinytag import TinyTag
-                        tag = TinyTag.get(instance.audio_file.path)
-                        if tag.duration:
-                            instance.duration = int(tag.duration)
-                        else:
-                            # Nếu không lấy được từ tag, đặt giá trị mặc định
-                            instance.duration = 180  # 3 phút mặc định
-                        updated_fields.append('duration')
-                except Exception as e:
-                    # Log lỗi nhưng không cần raise exception
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.warning(f"Không thể tính duration: {str(e)}")
-                    
-                    # Đặt giá trị mặc định nếu không lấy được
-                    if not instance.duration or instance.duration == 0:
-                        instance.duration = 180  # 3 phút mặc định
-                        updated_fields.append('duration')
+            if instance.audio_file:
+                provided_fields = [field for field in METADATA_FIELDS if self.request.data.get(field)]
+                start_ingest(instance, self.request.user, provided_fields)
             elif not instance.duration or instance.duration == 0:
                 # Nếu không có file audio và duration = 0, đặt giá trị mặc định
                 instance.duration = 180  # 3 phút mặc định
@@ -3189,7 +3609,7 @@ class AdminArtistViewSet(viewsets.ModelViewSet):
     def songs(self, request, pk=None):
         """Lấy danh sách bài hát của nghệ sĩ"""
         artist = self.get_object()
-        songs = Song.objects.filter(artist=artist.name)
+        songs = artist.songs.all()
         serializer = SongSerializer(songs, many=True)
         return Response(serializer.data)
     
@@ -3283,7 +3703,7 @@ class AdminAlbumViewSet(viewsets.ModelViewSet):
     def songs(self, request, pk=None):
         """Lấy danh sách bài hát trong album"""
         album = self.get_object()
-        songs = Song.objects.filter(album=album.title)
+        songs = album.songs.all()
         
         page = self.paginate_queryset(songs)
         if page is not None:
@@ -3309,6 +3729,8 @@ class AdminAlbumViewSet(viewsets.ModelViewSet):
             song = Song.objects.get(id=song_id)
             song.album = album.title
             song.save()
+            # Trường hợp nhiều album cùng tên: giữ đúng album được chọn
+            Song.objects.filter(id=song.id).update(album_ref=album)
             return Response({'status': f'Đã thêm bài hát "{song.title}" vào album'})
         except Song.DoesNotExist:
             return Response(
@@ -3330,7 +3752,7 @@ class AdminAlbumViewSet(viewsets.ModelViewSet):
         
         try:
             song = Song.objects.get(id=song_id)
-            song.album = album.title
+            song.album = ''
             song.save()
             return Response({'status': f'Đã xóa bài hát "{song.title}" khỏi album'})
         except Song.DoesNotExist:
@@ -3396,7 +3818,7 @@ class AdminGenreViewSet(viewsets.ModelViewSet):
     def songs(self, request, pk=None):
         """Lấy danh sách bài hát thuộc thể loại"""
         genre = self.get_object()
-        songs = Song.objects.filter(genre=genre.name)
+        songs = genre.songs.all()
         
         # Phân trang
         paginator = PageNumberPagination()
@@ -3425,28 +3847,27 @@ class AdminGenreViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """Thống kê theo thể loại: số lượng bài hát, lượt nghe, số nghệ sĩ"""
-        genres = Genre.objects.all()
-        result = []
+        # Số bài hát và lượt nghe đọc từ cột tổng hợp; số nghệ sĩ tính bằng truy vấn con
+        artists_count = (
+            SongArtist.objects.filter(song__genre_ref=OuterRef('pk'))
+            .values('song__genre_ref')
+            .annotate(total=Count('artist', distinct=True))
+            .values('total')
+        )
+        genres = Genre.objects.annotate(
+            artists_count=Coalesce(Subquery(artists_count), 0),
+        ).order_by('id')
         
-        for genre in genres:
-            songs = Song.objects.filter(genre=genre.name)
-            songs_count = songs.count()
-            
-            # Số lượt nghe
-            play_count = songs.aggregate(total=Sum('play_count'))['total'] or 0
-            
-            # Số nghệ sĩ
-            artists = set()
-            for song in songs:
-                artists.add(song.artist)
-            
-            result.append({
+        result = [
+            {
                 'id': genre.id,
                 'name': genre.name,
-                'songs_count': songs_count,
-                'play_count': play_count,
-                'artists_count': len(artists)
-            })
+                'songs_count': genre.song_count,
+                'play_count': genre.total_plays,
+                'artists_count': genre.artists_count
+            }
+            for genre in genres
+        ]
         
         return Response(result)
 
@@ -3508,7 +3929,7 @@ class AdminPlaylistViewSet(viewsets.ModelViewSet):
     def songs(self, request, pk=None):
         """Lấy danh sách bài hát trong playlist"""
         playlist = self.get_object()
-        songs = playlist.songs.all()
+        songs = Song.objects.filter(playlist_items__playlist=playlist).order_by('playlist_items__position', 'playlist_items__id')
         
         paginator = PageNumberPagination()
         paginator.page_size = 20
@@ -3530,24 +3951,19 @@ class AdminPlaylistViewSet(viewsets.ModelViewSet):
             )
         
         try:
-            song = Song.objects.get(id=song_id)
-            playlist.songs.add(song)
-            
-            # Ghi log hành động
-            PlaylistEditHistory.log_action(
-                playlist=playlist,
-                user=request.user,
-                action='ADD_SONG',
-                details={'admin_action': True},
-                related_song=song
+            result = edit_playlist_songs(
+                playlist, request.user, [{'op': 'add', 'song_id': song_id}],
+                details={'admin_action': True}, require_audio=False
             )
-            
-            return Response({'status': f'Đã thêm bài hát "{song.title}" vào playlist'})
-        except Song.DoesNotExist:
+        except PlaylistSongNotFound:
             return Response(
                 {'error': 'Không tìm thấy bài hát'}, 
                 status=status.HTTP_404_NOT_FOUND
             )
+        except PlaylistEditError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({'status': 'Đã thêm bài hát vào playlist', 'version': result['version']})
     
     @action(detail=True, methods=['post'])
     def remove_song(self, request, pk=None):
@@ -3562,30 +3978,19 @@ class AdminPlaylistViewSet(viewsets.ModelViewSet):
             )
         
         try:
-            song = Song.objects.get(id=song_id)
-            if song in playlist.songs.all():
-                playlist.songs.remove(song)
-                
-                # Ghi log hành động
-                PlaylistEditHistory.log_action(
-                    playlist=playlist,
-                    user=request.user,
-                    action='REMOVE_SONG',
-                    details={'admin_action': True},
-                    related_song=song
-                )
-                
-                return Response({'status': f'Đã xóa bài hát "{song.title}" khỏi playlist'})
-            else:
-                return Response(
-                    {'error': 'Bài hát không nằm trong playlist'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-        except Song.DoesNotExist:
+            result = edit_playlist_songs(
+                playlist, request.user, [{'op': 'remove', 'song_id': song_id}],
+                details={'admin_action': True}
+            )
+        except PlaylistEditError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not result['applied']:
             return Response(
-                {'error': 'Không tìm thấy bài hát'}, 
-                status=status.HTTP_404_NOT_FOUND
+                {'error': 'Bài hát không nằm trong playlist'}, 
+                status=status.HTTP_400_BAD_REQUEST
             )
+        return Response({'status': 'Đã xóa bài hát khỏi playlist', 'version': result['version']})
     
     @action(detail=True, methods=['post'])
     def upload_cover(self, request, pk=None):
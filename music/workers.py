@@ -0,0 +1,139 @@
+"""
+Pool tiến trình và pool luồng dùng chung cho các tác vụ nền của app music.
+
+- Pool tiến trình: chạy các tác vụ nặng CPU/ffmpeg (phân tích, chuyển mã, ...).
+  Tác vụ phải là hàm cấp module, nhận/trả dữ liệu picklable và KHÔNG truy vấn DB.
+- Pool luồng: điều phối công việc và ghi kết quả vào DB; kết nối DB của luồng
+  được đóng sau mỗi tác vụ.
+
+Đặt MUSIC_TASKS_EAGER = True (ví dụ trong test) để chạy mọi tác vụ ngay tại chỗ.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_process_pool = None
+_thread_pool = None
+
+
+def _init_process_worker(settings_module):
+    """Khởi tạo Django trong tiến trình con (start method 'spawn')"""
+    if settings_module:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+def is_eager():
+    return bool(getattr(settings, 'MUSIC_TASKS_EAGER', False))
+
+
+def get_process_pool():
+    global _process_pool
+    with _lock:
+        if _process_pool is None:
+            max_workers = getattr(settings, 'MUSIC_WORKER_PROCESSES', None) or os.cpu_count() or 2
+            start_method = getattr(settings, 'MUSIC_WORKER_START_METHOD', 'spawn')
+            _process_pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context(start_method),
+                initializer=_init_process_worker,
+                initargs=(os.environ.get('DJANGO_SETTINGS_MODULE'),),
+            )
+        return _process_pool
+
+
+def get_thread_pool():
+    global _thread_pool
+    with _lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'MUSIC_WORKER_THREADS', 4),
+                thread_name_prefix='music-worker',
+            )
+        return _thread_pool
+
+
+def _completed_future(fn, *args, **kwargs):
+    future = Future()
+    try:
+        future.set_result(fn(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def run_in_process(fn, *args, **kwargs):
+    """Chạy tác vụ nặng trên pool tiến trình, trả về Future"""
+    if is_eager():
+        return _completed_future(fn, *args, **kwargs)
+    return get_process_pool().submit(fn, *args, **kwargs)
+
+
+def map_in_processes(fn, iterable, chunksize=1):
+    """Áp dụng fn cho từng phần tử trên pool tiến trình (giữ thứ tự), trả về iterator kết quả"""
+    if is_eager():
+        return map(fn, iterable)
+    return get_process_pool().map(fn, iterable, chunksize=chunksize)
+
+
+def _run_with_db_cleanup(fn, *args, **kwargs):
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        logger.exception(f"Lỗi trong tác vụ nền {getattr(fn, '__name__', fn)}")
+        raise
+    finally:
+        connections.close_all()
+
+
+def run_in_background(fn, *args, **kwargs):
+    """Chạy tác vụ điều phối (có truy vấn DB) trên pool luồng, trả về Future"""
+    if is_eager():
+        return _completed_future(fn, *args, **kwargs)
+    return get_thread_pool().submit(_run_with_db_cleanup, fn, *args, **kwargs)
+
+
+def gather(futures):
+    """Gộp dict {khóa: Future} thành một Future, hoàn thành khi tất cả đã xong.
+
+    Kết quả là chính dict ban đầu để bên gọi tự xử lý lỗi của từng phần.
+    """
+    combined = Future()
+    if not futures:
+        combined.set_result(futures)
+        return combined
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def _done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        combined.set_result(futures)
+
+    for future in futures.values():
+        future.add_done_callback(_done)
+    return combined
+
+
+def shutdown(wait=True):
+    """Dừng các pool (dùng khi kết thúc lệnh quản trị)"""
+    global _process_pool, _thread_pool
+    with _lock:
+        if _thread_pool is not None:
+            _thread_pool.shutdown(wait=wait)
+            _thread_pool = None
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=wait)
+            _process_pool = None